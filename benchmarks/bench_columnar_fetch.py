@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark: đọc đề tài từ SQL theo dòng (fetch_latest + TopicRecord mỗi dòng) so với theo cột
+(fetch_latest_columns + ghép text theo cột), dùng SQLite làm nguồn thay thế.
+Chỉ đo phần đọc dữ liệu + chuẩn bị text/metadata (phần embedding giống nhau ở cả hai đường).
+Sử dụng: python benchmarks/bench_columnar_fetch.py [số_đề_tài]
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+
+# Thêm thư mục gốc vào path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FIELD_WORDS = 120  # mỗi trường dài ~120 từ -> text ghép dài vài nghìn ký tự
+
+
+def build_source(path: str, n: int) -> None:
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE topics (Id INTEGER PRIMARY KEY);
+        CREATE TABLE topic_versions (
+            Id INTEGER PRIMARY KEY, TopicId INTEGER NOT NULL, VersionNumber INTEGER NOT NULL,
+            IsActive INTEGER NOT NULL DEFAULT 1, Title TEXT, Description TEXT, Objectives TEXT,
+            Methodology TEXT, ExpectedOutcomes TEXT, Requirements TEXT);
+    """)
+    body = " ".join(["nghiên cứu ứng dụng học máy"] * (FIELD_WORDS // 5))
+    conn.executemany("INSERT INTO topics (Id) VALUES (?)", [(i,) for i in range(1, n + 1)])
+    conn.executemany(
+        "INSERT INTO topic_versions (TopicId, VersionNumber, Title, Description, Objectives, Methodology, "
+        "ExpectedOutcomes, Requirements) VALUES (?, 1, ?, ?, ?, ?, ?, ?)",
+        [(i, f"Đề tài {i}", body, body, body, body, body) for i in range(1, n + 1)],
+    )
+    conn.commit()
+    conn.close()
+
+
+def row_wise(repo):
+    from dupliapp.services.topic_service import TopicsService
+    texts, metas = [], []
+    for r in repo.fetch_latest():
+        text = r.text()
+        meta = r.to_meta()
+        meta["ContentHash"] = TopicsService.content_hash(text)
+        texts.append(text)
+        metas.append(meta)
+    return len(texts)
+
+
+def columnar(repo):
+    from dupliapp.services.topic_service import TopicsService, TEXT_COLUMNS
+    from dupliapp.utils.columnar import to_pylist
+    count = 0
+    for batch in repo.fetch_latest_columns():
+        texts = TopicsService.compose_topic_texts(batch)
+        keys = ("TopicId", "TopicVersionId") + TEXT_COLUMNS
+        metas = [dict(zip(keys, row)) for row in zip(*(to_pylist(batch[k]) for k in keys))]
+        for meta, text in zip(metas, texts):
+            meta["ContentHash"] = TopicsService.content_hash(text)
+        count += len(texts)
+    return count
+
+
+def arrow_compose(repo):
+    # Mô phỏng đầu ra của arrow-odbc: các cột đã là pyarrow.Array trước khi ghép text
+    import pyarrow as pa
+    from dupliapp.services.topic_service import TopicsService
+    batches = [{k: pa.array(v) for k, v in b.items()} for b in repo.fetch_latest_columns()]
+    start = time.perf_counter()
+    count = sum(len(TopicsService.compose_topic_texts(b)) for b in batches)
+    return count, time.perf_counter() - start
+
+
+def timed(fn, repo, rounds=3):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        n = fn(repo)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return n, best
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    folder = tempfile.mkdtemp()
+    path = os.path.join(folder, "topics.db")
+    print(f"🔧 Tạo nguồn SQLite với {n} đề tài...")
+    build_source(path, n)
+
+    os.environ["TOPIC_SOURCE"] = "sqlite"
+    os.environ["TOPIC_SQLITE_PATH"] = path
+    from dupliapp.repositories.topic_repository import get_topic_repository
+    repo = get_topic_repository()
+
+    rows, row_time = timed(row_wise, repo)
+    cols, col_time = timed(columnar, repo)
+    print(f"📄 Theo dòng : {rows} đề tài trong {row_time:.3f}s ({rows / row_time:,.0f} đề tài/s)")
+    print(f"📊 Theo cột  : {cols} đề tài trong {col_time:.3f}s ({cols / col_time:,.0f} đề tài/s)")
+    print(f"⚡ Nhanh hơn  : x{row_time / col_time:.2f}")
+
+    try:
+        count, compose_time = arrow_compose(repo)
+        print(f"🏹 Ghép text bằng pyarrow.compute: {count} đề tài trong {compose_time:.3f}s")
+    except ImportError:
+        print("ℹ️ pyarrow chưa được cài - bỏ qua phép đo Arrow")
+
+
+if __name__ == "__main__":
+    main()
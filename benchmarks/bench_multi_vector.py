@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark: một vector mỗi đề tài (text ghép của compose_topic_text) so với đa vector theo trường/đoạn
+(MULTI_VECTOR_ENABLED) qua TopicsService: chi phí lập chỉ mục, chi phí cập nhật một trường và độ trễ
+tìm kiếm. Không cần model embedding: dùng embedding băm bag-of-words và đếm số text/số từ đã gửi
+vào hàm embed - thời gian chạy model thật tỉ lệ với số từ (trong giới hạn độ dài tối đa của model).
+Sử dụng: python benchmarks/bench_multi_vector.py [số_đề_tài] [số_từ_mỗi_trường] [số_query]
+"""
+
+import os
+import sys
+import time
+import zlib
+import tempfile
+
+import numpy as np
+
+# Thêm thư mục gốc vào path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORDS = ("hệ thống quản lý dữ liệu học máy mô hình đánh giá ứng dụng web thiết kế phân tích dự báo "
+         "nhận dạng tiếng nói hình ảnh y tế giáo dục thư viện mạng cảm biến tối ưu").split()
+
+DIM = 256
+CALLS = {"texts": 0, "words": 0}
+
+
+def hashed_embed(texts):
+    CALLS["texts"] += len(texts)
+    out = np.zeros((len(texts), DIM), dtype=np.float32)
+    for i, text in enumerate(texts):
+        tokens = text.split()
+        CALLS["words"] += len(tokens)
+        for token in tokens:
+            out[i, zlib.crc32(token.encode("utf-8")) % DIM] += 1.0
+    norms = np.linalg.norm(out, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return out / norms
+
+
+def make_topics(rng, n: int, words: int):
+    def field(k):
+        return " ".join(rng.choice(WORDS, size=k))
+    return [{
+        "topicId": i, "topicVersionId": i, "title": field(10), "description": field(words * 3),
+        "objectives": field(words), "methodology": field(words), "expectedOutcomes": field(words),
+        "requirements": field(words),
+    } for i in range(n)]
+
+
+def build(folder: str, name: str, multi: bool, topics):
+    from dupliapp.config import settings
+    from dupliapp.services.topic_service import TopicsService
+    settings.CHROMA_MODE = "local"
+    settings.CHROMA_DIR = os.path.join(folder, name)
+    settings.MULTI_VECTOR_ENABLED = multi
+    svc = TopicsService()
+    CALLS.update(texts=0, words=0)
+    start = time.perf_counter()
+    for i in range(0, len(topics), 256):
+        svc.upsert_many(topics[i:i + 256])
+    elapsed = time.perf_counter() - start
+    print(f"   lập chỉ mục: {elapsed:.2f}s, embed {CALLS['texts']:,} text / {CALLS['words']:,} từ")
+    return svc
+
+
+def update_one_field(svc, topics, m: int):
+    CALLS.update(texts=0, words=0)
+    edited = [{**t, "objectives": t["objectives"] + " cập nhật"} for t in topics[:m]]
+    start = time.perf_counter()
+    svc.upsert_many(edited)
+    elapsed = time.perf_counter() - start
+    print(f"   sửa objectives của {m} đề tài: {elapsed:.2f}s, embed {CALLS['texts']:,} text / {CALLS['words']:,} từ")
+    return CALLS["words"]
+
+
+def measure(svc, queries, top_k: int) -> np.ndarray:
+    svc.search(queries[0], top_k, 0.7)
+    times = []
+    for q in queries:
+        start = time.perf_counter()
+        svc.search(q, top_k, 0.7)
+        times.append((time.perf_counter() - start) * 1000)
+    times = np.array(times)
+    print(f"   tìm kiếm: trung bình {times.mean():.2f} ms, p50 {np.percentile(times, 50):.2f} ms, "
+          f"p95 {np.percentile(times, 95):.2f} ms")
+    return times
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    words = int(sys.argv[2]) if len(sys.argv) > 2 else 80
+    m = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+    rng = np.random.default_rng(42)
+    folder = tempfile.mkdtemp()
+
+    import dupliapp.services.topic_service as topic_service
+    topic_service.embed_texts = hashed_embed
+    topics = make_topics(rng, n, words)
+    queries = [{k: v for k, v in t.items() if k not in ("topicId", "topicVersionId")}
+               for t in make_topics(rng, m, words)]
+
+    print(f"🔧 {n} đề tài, ~{words} từ mỗi trường ({words * 3} từ description), {m} query")
+    print("📄 Một vector (text ghép)")
+    single = build(folder, "single", False, topics)
+    single_words = update_one_field(single, topics, m)
+    single_times = measure(single, queries, 10)
+
+    print("🧩 Đa vector (theo trường/đoạn)")
+    multi = build(folder, "multi", True, topics)
+    multi_words = update_one_field(multi, topics, m)
+    multi_times = measure(multi, queries, 10)
+
+    print(f"✏️  Cập nhật một trường: embed ít hơn x{single_words / max(multi_words, 1):.1f} số từ")
+    print(f"⏱️  Độ trễ tìm kiếm đa vector / một vector: x{multi_times.mean() / single_times.mean():.2f} (trung bình)")
+
+
+if __name__ == "__main__":
+    main()
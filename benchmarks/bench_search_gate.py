@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark: độ trễ kiểm tra trùng lặp đầy đủ (TopicsService.search_vector: topK hit kèm metadata,
+tạo dict hit và sắp xếp) so với chế độ cổng (TopicsService.gate_vector: 1 kết quả, chỉ distance).
+Dùng vector ngẫu nhiên đã chuẩn hóa và metadata có đủ các trường nội dung như dữ liệu thật, không
+cần model embedding (thời gian embed query như nhau ở cả hai chế độ nên được loại khỏi phép đo).
+Sử dụng: python benchmarks/bench_search_gate.py [số_đề_tài] [số_chiều] [số_query] [topK]
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+import numpy as np
+
+# Thêm thư mục gốc vào path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_embeddings(rng, n: int, dim: int) -> np.ndarray:
+    embs = rng.standard_normal((n, dim), dtype=np.float32)
+    return embs / np.linalg.norm(embs, axis=1, keepdims=True)
+
+
+def build_service(folder: str, embs: np.ndarray):
+    from dupliapp.config import settings
+    from dupliapp.services.topic_service import TopicsService
+    settings.CHROMA_MODE = "local"
+    settings.CHROMA_DIR = os.path.join(folder, "chroma")
+    svc = TopicsService()
+    n = len(embs)
+    text = " ".join(["nội dung"] * 60)
+    metas = [{
+        "TopicId": i, "TopicVersionId": i, "Title": f"Đề tài số {i}",
+        "Description": text, "Objectives": text, "Methodology": text,
+        "ExpectedOutcomes": text, "Requirements": text,
+    } for i in range(n)]
+    svc.repo.upsert([f"tv:{i}" for i in range(n)], embs, metas, [text] * n)
+    return svc
+
+
+def measure(label: str, fn, queries: np.ndarray) -> np.ndarray:
+    # Chạy 1 lần làm nóng rồi đo từng query
+    fn(queries[0])
+    times = []
+    for q in queries:
+        start = time.perf_counter()
+        fn(q)
+        times.append((time.perf_counter() - start) * 1000)
+    times = np.array(times)
+    print(f"{label}: trung bình {times.mean():.2f} ms, p50 {np.percentile(times, 50):.2f} ms, "
+          f"p95 {np.percentile(times, 95):.2f} ms")
+    return times
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    dim = int(sys.argv[2]) if len(sys.argv) > 2 else 384
+    m = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+    top_k = int(sys.argv[4]) if len(sys.argv) > 4 else 10
+    rng = np.random.default_rng(42)
+    folder = tempfile.mkdtemp()
+
+    print(f"🔧 Nạp {n} đề tài ({dim} chiều) vào ChromaDB local...")
+    svc = build_service(folder, make_embeddings(rng, n, dim))
+    queries = make_embeddings(rng, m, dim)
+
+    full = measure(f"📋 Tìm kiếm đầy đủ (topK={top_k})", lambda q: svc.search_vector(q, top_k, 0.7), queries)
+    gate = measure("🚦 Chế độ cổng           ", lambda q: svc.gate_vector(q, 0.7), queries)
+
+    # Hai chế độ phải cho cùng quyết định
+    agree = all(svc.search_vector(q, top_k, 0.7)["passed"] == svc.gate_vector(q, 0.7)["passed"] for q in queries)
+    print(f"⚡ Nhanh hơn: x{full.mean() / gate.mean():.2f} (trung bình), x{np.percentile(full, 95) / np.percentile(gate, 95):.2f} (p95)")
+    print(f"✅ Cùng quyết định passed: {agree}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark: bộ nhớ giữ một lô đề tài đọc từ SQL ở dạng dict theo dòng (dòng SQL PascalCase +
+item camelCase, như đường lập chỉ mục cũ) so với TopicRecord dùng __slots__ (fetch_latest hiện tại).
+Đo bằng tracemalloc: bộ nhớ còn giữ sau khi đọc xong và bộ nhớ đỉnh trong lúc đọc.
+Phần text giống nhau ở cả hai cách nên chênh lệch chủ yếu đến từ cấu trúc chứa (dict/key so với slots);
+trường càng ngắn thì tỉ lệ tiết kiệm càng lớn.
+Sử dụng: python benchmarks/bench_topic_records.py [số_đề_tài] [số_từ_mỗi_trường]
+"""
+
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+
+# Thêm thư mục gốc vào path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bench_columnar_fetch
+
+
+def dict_rows(repo):
+    # Đường cũ: mỗi dòng một dict PascalCase, rồi thêm một dict camelCase cho upsert_many
+    from dupliapp.utils.topic_record import SQL_COLUMNS, ITEM_KEYS
+    with repo.pool.connection() as conn:
+        cur = conn.cursor()
+        cur.execute(repo._render("", "t.Id ASC", False), repo._params((), None))
+        cols = [d[0] for d in cur.description]
+        rows = [dict(zip(cols, r)) for r in cur.fetchall()]
+    items = [{k: r.get(c, "") for k, c in zip(ITEM_KEYS, SQL_COLUMNS)} for r in rows]
+    return rows, items
+
+
+def records(repo):
+    return repo.fetch_latest()
+
+
+def measure(label: str, fn, repo, n: int) -> float:
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn(repo)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    print(f"{label}: {elapsed:.3f}s, giữ lại {current / 1024 / 1024:,.1f} MiB "
+          f"({current / n:,.0f} B/đề tài), đỉnh {peak / 1024 / 1024:,.1f} MiB")
+    return current
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    bench_columnar_fetch.FIELD_WORDS = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    folder = tempfile.mkdtemp()
+    path = os.path.join(folder, "topics.db")
+    print(f"🔧 Tạo nguồn SQLite với {n} đề tài (~{bench_columnar_fetch.FIELD_WORDS} từ mỗi trường)...")
+    bench_columnar_fetch.build_source(path, n)
+
+    os.environ["TOPIC_SOURCE"] = "sqlite"
+    os.environ["TOPIC_SQLITE_PATH"] = path
+    from dupliapp.repositories.topic_repository import get_topic_repository
+    repo = get_topic_repository()
+
+    as_dicts = measure("📄 Dict theo dòng  ", dict_rows, repo, n)
+    as_records = measure("📦 TopicRecord     ", records, repo, n)
+    print(f"💾 Tiết kiệm: {(as_dicts - as_records) / 1024 / 1024:,.1f} MiB (x{as_dicts / max(as_records, 1):.2f})")
+
+
+if __name__ == "__main__":
+    main()
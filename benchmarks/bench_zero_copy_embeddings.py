@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark: ghi embeddings vào ChromaDB dạng list float Python (.tolist()) so với mảng NumPy
+float32 liền khối (đường hiện tại của TopicsService._write).
+Đo thời gian và bộ nhớ cấp phát đỉnh bằng tracemalloc, không cần model embedding
+(dùng vector ngẫu nhiên đã chuẩn hóa).
+Sử dụng: python benchmarks/bench_zero_copy_embeddings.py [số_vector] [số_chiều]
+"""
+
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+# Thêm thư mục gốc vào path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_embeddings(n: int, dim: int) -> np.ndarray:
+    rng = np.random.default_rng(42)
+    embs = rng.standard_normal((n, dim), dtype=np.float32)
+    return embs / np.linalg.norm(embs, axis=1, keepdims=True)
+
+
+def new_repo(folder: str, name: str):
+    from dupliapp.config import settings
+    from dupliapp.repositories.chroma_repository import ChromaTopicsRepository
+    settings.CHROMA_MODE = "local"
+    settings.CHROMA_DIR = os.path.join(folder, name)
+    return ChromaTopicsRepository()
+
+
+def measure(label: str, write):
+    tracemalloc.start()
+    start = time.perf_counter()
+    write()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label}: {elapsed:.3f}s, cấp phát đỉnh {peak / 1024 / 1024:,.1f} MiB")
+    return elapsed, peak
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    dim = int(sys.argv[2]) if len(sys.argv) > 2 else 768
+    folder = tempfile.mkdtemp()
+    embs = make_embeddings(n, dim)
+    ids = [f"tv:{i}" for i in range(n)]
+    metas = [{"TopicId": str(i), "TopicVersionId": str(i)} for i in range(n)]
+    docs = [f"Đề tài {i}" for i in range(n)]
+    print(f"🔧 {n} vector x {dim} chiều (float32, {embs.nbytes / 1024 / 1024:,.1f} MiB)")
+
+    # Chỉ chuyển đổi: số đối tượng float Python được tạo bởi .tolist()
+    measure("🐍 Chỉ .tolist()        ", lambda: embs.tolist())
+
+    lists_repo = new_repo(folder, "lists")
+    arrays_repo = new_repo(folder, "arrays")
+    t_lw, p_lw = measure("📄 .tolist() + upsert    ", lambda: lists_repo.upsert(ids, embs.tolist(), metas, docs))
+    t_aw, p_aw = measure("📦 ndarray + upsert      ", lambda: arrays_repo.upsert(ids, embs, metas, docs))
+
+    print(f"⚡ Nhanh hơn  : x{t_lw / t_aw:.2f}")
+    print(f"💾 Bộ nhớ đỉnh: giảm {(p_lw - p_aw) / 1024 / 1024:,.1f} MiB (x{p_lw / max(p_aw, 1):.2f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -28,6 +28,12 @@ class Settings:
     # Thư mục lưu trữ dữ liệu ChromaDB local (vector database)
     CHROMA_DIR: str = os.getenv("CHROMA_DIR", "./chroma_data")
     
+    # Giới hạn thêm kích thước mỗi lần ghi vào ChromaDB (0 = dùng giới hạn của client)
+    CHROMA_MAX_BATCH_SIZE: int = int(os.getenv("CHROMA_MAX_BATCH_SIZE", "0"))
+    
+    # Số lô được ghi song song khi dùng ChromaDB Cloud (local mode luôn ghi tuần tự)
+    CHROMA_UPSERT_CONCURRENCY: int = int(os.getenv("CHROMA_UPSERT_CONCURRENCY", "1"))
+    
     # Cấu hình ChromaDB Cloud
     CHROMA_CLOUD_HOST: str = os.getenv("CHROMA_CLOUD_HOST", "")
     CHROMA_CLOUD_PORT: int = int(os.getenv("CHROMA_CLOUD_PORT", "443"))
@@ -57,5 +63,144 @@ class Settings:
     # Số lượng kết quả tương tự tối đa trả về khi tìm kiếm
     TOPK: int = int(os.getenv("TOPK", "3"))
 
+    # Pool kết nối SQL dùng chung: số kết nối tối đa, tuổi thọ tối đa của một kết nối (giây),
+    # thời gian chờ lấy kết nối khi pool đầy, và thời gian nhàn rỗi trước khi kiểm tra SELECT 1
+    SQL_POOL_SIZE: int = int(os.getenv("SQL_POOL_SIZE", "5"))
+    SQL_POOL_MAX_LIFETIME_SECONDS: float = float(os.getenv("SQL_POOL_MAX_LIFETIME_SECONDS", "1800"))
+    SQL_POOL_ACQUIRE_TIMEOUT_SECONDS: float = float(os.getenv("SQL_POOL_ACQUIRE_TIMEOUT_SECONDS", "30"))
+    SQL_POOL_HEALTH_CHECK_SECONDS: float = float(os.getenv("SQL_POOL_HEALTH_CHECK_SECONDS", "30"))
+    
+    # Thời gian tối đa (giây) cho mỗi câu truy vấn SQL
+    SQL_QUERY_TIMEOUT_SECONDS: int = int(os.getenv("SQL_QUERY_TIMEOUT_SECONDS", "120"))
+    
+    # Đọc dữ liệu SQL theo lô dạng cột khi xây dựng lại chỉ mục (/index/topics)
+    SQL_COLUMNAR_FETCH: bool = os.getenv("SQL_COLUMNAR_FETCH", "false").lower() == "true"
+    # Dùng arrow-odbc (nếu đã cài) để đọc Arrow record batch thay cho pyodbc
+    SQL_ARROW_FETCH: bool = os.getenv("SQL_ARROW_FETCH", "true").lower() == "true"
+    # Số dòng mỗi lô khi đọc dạng cột
+    SQL_FETCH_BATCH_SIZE: int = int(os.getenv("SQL_FETCH_BATCH_SIZE", "2000"))
+    # Kích thước tối đa (ký tự) của cột văn bản NVARCHAR(MAX) khi đọc bằng arrow-odbc
+    SQL_ARROW_MAX_TEXT_SIZE: int = int(os.getenv("SQL_ARROW_MAX_TEXT_SIZE", "65536"))
+    
+    # Nguồn dữ liệu đề tài: "mssql" (SQL Server qua pyodbc) hoặc "sqlite" (bản thay thế cục bộ, dùng cho test)
+    TOPIC_SOURCE: str = os.getenv("TOPIC_SOURCE", "mssql")
+    
+    # Đường dẫn file SQLite chứa bảng topics/topic_versions khi TOPIC_SOURCE=sqlite
+    TOPIC_SQLITE_PATH: str = os.getenv("TOPIC_SQLITE_PATH", "./topics.db")
+    
+    # File SQLite cục bộ lưu trạng thái lập chỉ mục (watermark đồng bộ, ...)
+    STATE_DB_PATH: str = os.getenv("STATE_DB_PATH", "./index_state.db")
+    
+    # Thời gian chờ tối đa (giây) các khóa liên process đặt cạnh STATE_DB_PATH (vd. khóa ghi chỉ mục)
+    STATE_LOCK_TIMEOUT_SECONDS: float = float(os.getenv("STATE_LOCK_TIMEOUT_SECONDS", "60"))
+    
+    # Chu kỳ (giây) của poller đồng bộ tăng dần chạy trong tiến trình; 0 = tắt
+    SYNC_INTERVAL_SECONDS: int = int(os.getenv("SYNC_INTERVAL_SECONDS", "0"))
+    
+    # Số phiên bản đề tài tối đa đọc và embed trong mỗi lượt đồng bộ tăng dần
+    SYNC_BATCH_SIZE: int = int(os.getenv("SYNC_BATCH_SIZE", "500"))
+    # Số TopicVersionId dưới watermark được quét lại mỗi lượt đồng bộ: phiên bản có Id nhỏ hơn nhưng
+    # commit muộn hơn watermark (transaction dài) vẫn được ghi nếu còn thiếu trong ChromaDB
+    SYNC_SAFETY_WINDOW: int = int(os.getenv("SYNC_SAFETY_WINDOW", "1000"))
+    
+    # Số đề tài mỗi trang khi xây dựng lại toàn bộ chỉ mục có checkpoint
+    REINDEX_PAGE_SIZE: int = int(os.getenv("REINDEX_PAGE_SIZE", "500"))
+    
+    # Số worker thread chạy job lập chỉ mục nền; 0 = không chạy job trong tiến trình này
+    JOB_WORKERS: int = int(os.getenv("JOB_WORKERS", "1"))
+    
+    # Chu kỳ (giây) worker kiểm tra hàng đợi job (job mới gửi qua API được chạy ngay)
+    JOB_POLL_SECONDS: float = float(os.getenv("JOB_POLL_SECONDS", "5"))
+    
+    # Job "running" không cập nhật tiến độ quá số giây này được coi là bị gián đoạn và chạy lại
+    JOB_STALE_SECONDS: float = float(os.getenv("JOB_STALE_SECONDS", "600"))
+    
+    # Lập chỉ mục song song: số phân vùng TopicId mặc định, thời hạn lease (giây, được gia hạn
+    # sau mỗi trang) và số lần thử lại một phân vùng bị lỗi trước khi đánh dấu failed
+    PARTITION_COUNT: int = int(os.getenv("PARTITION_COUNT", "8"))
+    PARTITION_LEASE_SECONDS: float = float(os.getenv("PARTITION_LEASE_SECONDS", "300"))
+    PARTITION_MAX_ATTEMPTS: int = int(os.getenv("PARTITION_MAX_ATTEMPTS", "3"))
+    
+    # Ghi trễ (write-behind) cho /topics/upsert: xác nhận sau khi ghi log, gom nhóm ghi vào ChromaDB
+    # theo số lượng (MAX_BATCH) hoặc thời gian chờ (MAX_DELAY_MS)
+    WRITE_BEHIND_ENABLED: bool = os.getenv("WRITE_BEHIND_ENABLED", "false").lower() == "true"
+    WRITE_BEHIND_LOG_PATH: str = os.getenv("WRITE_BEHIND_LOG_PATH", "./write_behind.log")
+    WRITE_BEHIND_MAX_BATCH: int = int(os.getenv("WRITE_BEHIND_MAX_BATCH", "64"))
+    WRITE_BEHIND_MAX_DELAY_MS: int = int(os.getenv("WRITE_BEHIND_MAX_DELAY_MS", "200"))
+    # Số lần ghi lỗi tối đa của một đề tài trước khi chuyển vào file dead-letter (<log>.dead)
+    WRITE_BEHIND_MAX_ATTEMPTS: int = int(os.getenv("WRITE_BEHIND_MAX_ATTEMPTS", "5"))
+    # Thời gian chờ tối đa (giây) khi client yêu cầu chờ đề tài được ghi (?wait=true)
+    WRITE_BEHIND_WAIT_TIMEOUT_SECONDS: float = float(os.getenv("WRITE_BEHIND_WAIT_TIMEOUT_SECONDS", "30"))
+    
+    # Số đề tài embed/ghi mỗi lô khi nhận bulk-upsert dạng NDJSON (stream)
+    BULK_UPSERT_CHUNK_SIZE: int = int(os.getenv("BULK_UPSERT_CHUNK_SIZE", "256"))
+    
+    # Compaction sau khi xóa: ngưỡng tỉ lệ tombstone (số đã xóa / (còn sống + đã xóa)),
+    # tự xếp job compaction khi vượt ngưỡng (mặc định tắt), số bản ghi chép mỗi trang khi xây dựng lại collection
+    COMPACTION_TOMBSTONE_RATIO: float = float(os.getenv("COMPACTION_TOMBSTONE_RATIO", "0.2"))
+    COMPACTION_AUTO: bool = os.getenv("COMPACTION_AUTO", "false").lower() == "true"
+    COMPACTION_PAGE_SIZE: int = int(os.getenv("COMPACTION_PAGE_SIZE", "1000"))
+    
+    # Đồ thị kNN đã tính sẵn (láng giềng gần nhất của mỗi đề tài), cập nhật khi upsert/xóa:
+    # số láng giềng lưu mỗi đề tài, số kết quả lấy dư để bù các phiên bản cùng TopicId,
+    # số đề tài mỗi trang khi xây dựng lại toàn bộ đồ thị
+    KNN_GRAPH_ENABLED: bool = os.getenv("KNN_GRAPH_ENABLED", "false").lower() == "true"
+    KNN_K: int = int(os.getenv("KNN_K", "10"))
+    KNN_OVERFETCH: int = int(os.getenv("KNN_OVERFETCH", "5"))
+    KNN_PAGE_SIZE: int = int(os.getenv("KNN_PAGE_SIZE", "500"))
+    
+    # Tìm kiếm theo khoảng ("range": true): số ứng viên ban đầu (nhân đôi mỗi vòng) và số kết quả tối đa
+    RANGE_SEARCH_INITIAL_K: int = int(os.getenv("RANGE_SEARCH_INITIAL_K", "10"))
+    RANGE_SEARCH_MAX_K: int = int(os.getenv("RANGE_SEARCH_MAX_K", "200"))
+    
+    # Chỉ mục bitmap metadata trong bộ nhớ cho metadataFilter: các key được chỉ mục (phân cách dấu phẩy,
+    # rỗng = tắt) và số ứng viên tối đa để chấm điểm chính xác thay vì query HNSW có lọc
+    METADATA_INDEX_KEYS: str = os.getenv("METADATA_INDEX_KEYS", "")
+    METADATA_EXACT_MAX_CANDIDATES: int = int(os.getenv("METADATA_EXACT_MAX_CANDIDATES", "2000"))
+    # Số lần ghi gần nhất giữ trong nhật ký thay đổi (STATE_DB_PATH) để chỉ mục trong bộ nhớ của mọi process
+    # đọc bù; process tụt lại xa hơn sẽ dựng lại chỉ mục từ ChromaDB
+    INDEX_CHANGE_LOG_RETENTION: int = int(os.getenv("INDEX_CHANGE_LOG_RETENTION", "1000"))
+    
+    # Đường tắt từ vựng trước khi embed: hash text chuẩn hóa (bản sao y hệt) và MinHash/LSH trên shingle
+    # ký tự (gần y hệt, Jaccard ước lượng >= LEXICAL_JACCARD_THRESHOLD; không phụ thuộc threshold cosine của request)
+    LEXICAL_FAST_PATH: bool = os.getenv("LEXICAL_FAST_PATH", "false").lower() == "true"
+    LEXICAL_JACCARD_THRESHOLD: float = float(os.getenv("LEXICAL_JACCARD_THRESHOLD", "0.9"))
+    LEXICAL_MINHASH_PERM: int = int(os.getenv("LEXICAL_MINHASH_PERM", "64"))
+    LEXICAL_LSH_BANDS: int = int(os.getenv("LEXICAL_LSH_BANDS", "16"))
+    LEXICAL_SHINGLE_SIZE: int = int(os.getenv("LEXICAL_SHINGLE_SIZE", "5"))
+    
+    # Chỉ mục BM25 trên title/description: sinh thêm ứng viên cho tìm kiếm lai (BM25 + ANN, chấm lại
+    # bằng vector đã lưu) và là đường tìm kiếm dự phòng khi model embedding quá tải
+    BM25_ENABLED: bool = os.getenv("BM25_ENABLED", "false").lower() == "true"
+    BM25_K1: float = float(os.getenv("BM25_K1", "1.2"))
+    BM25_B: float = float(os.getenv("BM25_B", "0.75"))
+    BM25_CANDIDATES: int = int(os.getenv("BM25_CANDIDATES", "50"))
+    # Term có mặt trong hơn tỉ lệ này số đề tài không được chấm điểm (áp dụng từ 100 đề tài)
+    BM25_MAX_DF_RATIO: float = float(os.getenv("BM25_MAX_DF_RATIO", "0.2"))
+    HYBRID_ANN_CANDIDATES: int = int(os.getenv("HYBRID_ANN_CANDIDATES", "20"))
+    # Tìm kiếm lai là mặc định của /topics/search khi bật BM25 (false: chỉ dùng khi gửi "hybrid": true;
+    # BM25_ENABLED một mình chỉ thêm đường dự phòng)
+    HYBRID_SEARCH_DEFAULT: bool = os.getenv("HYBRID_SEARCH_DEFAULT", "false").lower() == "true"
+    # Số lời gọi embedding truy vấn chạy đồng thời tối đa (0 = không giới hạn) và thời gian chờ
+    # trước khi chuyển sang tìm kiếm chỉ bằng BM25
+    EMBED_MAX_CONCURRENCY: int = int(os.getenv("EMBED_MAX_CONCURRENCY", "0"))
+    EMBED_QUEUE_TIMEOUT_MS: int = int(os.getenv("EMBED_QUEUE_TIMEOUT_MS", "200"))
+    
+    # Embedding đa vector: mỗi trường (mỗi đoạn tối đa MULTI_VECTOR_CHUNK_WORDS từ) một vector trong
+    # collection riêng, chỉ embed lại đoạn có nội dung đổi; trọng số trường khi gộp ("Trường:trọng_số",
+    # trọng số 0 = bỏ trường), số đoạn gần nhất mỗi đoạn query dùng để chọn ứng viên và số đề tài
+    # ứng viên tối đa được chấm điểm theo trường
+    MULTI_VECTOR_ENABLED: bool = os.getenv("MULTI_VECTOR_ENABLED", "false").lower() == "true"
+    MULTI_VECTOR_WEIGHTS: str = os.getenv(
+        "MULTI_VECTOR_WEIGHTS",
+        "Title:2,Description:1.5,Objectives:1,Methodology:1,ExpectedOutcomes:0.5,Requirements:0.5",
+    )
+    MULTI_VECTOR_CHUNK_WORDS: int = int(os.getenv("MULTI_VECTOR_CHUNK_WORDS", "150"))
+    MULTI_VECTOR_CANDIDATES: int = int(os.getenv("MULTI_VECTOR_CANDIDATES", "20"))
+    MULTI_VECTOR_RESCORE_TOPICS: int = int(os.getenv("MULTI_VECTOR_RESCORE_TOPICS", "20"))
+    
+    # /topics/check-and-upsert: thời gian chờ tối đa khóa kiểm tra + ghi (giây)
+    CHECK_AND_UPSERT_LOCK_TIMEOUT_SECONDS: float = float(os.getenv("CHECK_AND_UPSERT_LOCK_TIMEOUT_SECONDS", "30"))
+
 # Tạo instance settings để sử dụng trong toàn bộ ứng dụng
 settings = Settings()
@@ -0,0 +1,117 @@
+﻿# -*- coding: utf-8 -*-
+"""
+Lập chỉ mục offline từ dòng lệnh (không cần chạy Flask server)
+
+Ví dụ:
+    python -m dupliapp.index topics.jsonl --batch-size 256 --workers 2
+    python -m dupliapp.index topics.csv.gz
+    python -m dupliapp.index topics.parquet --format parquet
+    python -m dupliapp.index sql --workers 4 --partitions 16
+    python -m dupliapp.index knn
+
+Lệnh ghi thẳng vào ChromaDB, không qua server: chỉ mục trong bộ nhớ của server đang chạy (metadata,
+lexical, BM25) không được cập nhật trực tiếp mà đọc lại các đề tài đã đổi từ nhật ký thay đổi dùng chung
+ở truy vấn kế tiếp.
+"""
+from typing import Any, Dict, List, Optional
+import argparse
+import json
+import sys
+from dupliapp.config import settings
+from dupliapp.services.bulk_index_service import BulkIndexService
+from dupliapp.services.knn_service import KnnGraphService
+from dupliapp.utils.topic_files import FILE_FORMATS
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m dupliapp.index",
+        description="Bulk-load topics into the vector store from a JSONL/CSV/Parquet file or the SQL source.",
+        epilog="Writes go straight to ChromaDB, bypassing a running server: its in-memory metadata/lexical/BM25 "
+               "indexes pick the changes up from the shared change log on their next query.",
+    )
+    parser.add_argument("source", help='Path to a .jsonl/.csv/.parquet file (optionally .gz), "sql", '
+                                       'or "knn" to only rebuild the nearest-neighbor graph')
+    parser.add_argument("--format", choices=FILE_FORMATS, help="File format (default: detected from the extension)")
+    parser.add_argument("--batch-size", type=int, default=settings.REINDEX_PAGE_SIZE,
+                        help="Topics embedded and upserted per batch (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Batches embedded/upserted in parallel; for sql, partition workers (default: %(default)s)")
+    parser.add_argument("--partitions", type=int, default=None,
+                        help="TopicId partitions for a parallel sql run (default: PARTITION_COUNT)")
+    parser.add_argument("--limit", type=int, default=None, help="Only index the first N topics (sql source)")
+    parser.add_argument("--force", action="store_true",
+                        help="Re-embed every topic, including unchanged ones (e.g. after changing the embedding model)")
+    parser.add_argument("--knn", action="store_true", help="Rebuild the nearest-neighbor graph after indexing")
+    parser.add_argument("--json", action="store_true", help="Print the final report as JSON")
+    parser.add_argument("--quiet", action="store_true", help="Do not print per-batch progress")
+    return parser
+
+def format_report(report: Dict[str, Any]) -> str:
+    # Báo cáo thông lượng cuối cùng dạng bảng ngắn
+    lines = [
+        f"Source       : {report['source']}",
+        f"Read         : {report['read']}",
+        f"Upserted     : {report['upserted']}",
+        f"Embedded     : {report['embedded']}",
+        f"Skipped      : {report['skipped']}",
+        f"Batches      : {report['batches']}",
+        f"Errors       : {len(report['errors'])}",
+        f"Elapsed      : {report['elapsedSeconds']:.2f}s (read {report['readSeconds']:.2f}s, write {report['writeSeconds']:.2f}s)",
+        f"Throughput   : {report['throughput'] or 0:.1f} topics/s",
+    ]
+    for e in report["errors"]:
+        where = "read" if e.get("stage") == "read" else "batch"
+        lines.append(f"  {where} {e.get('batch', e.get('partition'))}: {e['error']}")
+    return "\n".join(lines)
+
+def format_knn_report(report: Dict[str, Any]) -> str:
+    return "\n".join([
+        f"kNN topics   : {report['processed']}",
+        f"kNN edges    : {report['edges']} (k={report['k']})",
+        f"kNN elapsed  : {report['elapsedSeconds']:.2f}s",
+    ])
+
+def _print_knn_progress(processed: int, total: int) -> None:
+    print(f"knn: {processed}/{total} topics", file=sys.stderr)
+
+def _print_progress(event: Dict[str, Any]) -> None:
+    if "partitions" in event:
+        # Tiến độ của lần chạy song song theo phân vùng
+        print(f"[{event['percent']:6.2f}%] {event['processed']}/{event['total']} topics, "
+              f"{event['partitions']['done']}/{event['partitions']['total']} partitions", file=sys.stderr)
+    else:
+        processed = event.get("processed", event.get("read"))
+        print(f"batch {event['batch']}: {processed} topics read, {event.get('embedded', 0)} embedded"
+              + (f" (error: {event['error']})" if event.get("error") else ""), file=sys.stderr)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    on_knn = None if args.quiet else _print_knn_progress
+
+    if args.source.lower() == "knn":
+        # Chỉ xây dựng lại đồ thị kNN từ các vector đã có (không đọc nguồn, không embed)
+        knn = KnnGraphService().rebuild(page_size=args.batch_size, on_progress=on_knn)
+        print(json.dumps(knn, ensure_ascii=False, indent=2) if args.json else format_knn_report(knn))
+        return 0
+
+    svc = BulkIndexService(batch_size=args.batch_size, workers=args.workers, force=args.force)
+    on_batch = None if args.quiet else _print_progress
+
+    if args.source.lower() == "sql":
+        report = svc.index_sql(limit=args.limit, partitions=args.partitions, on_batch=on_batch)
+    else:
+        report = svc.index_file(args.source, fmt=args.format, on_batch=on_batch)
+
+    if args.knn:
+        report["knn"] = KnnGraphService().rebuild(page_size=args.batch_size, on_progress=on_knn)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print(format_report(report))
+        if "knn" in report:
+            print(format_knn_report(report["knn"]))
+    return 1 if report["errors"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,6 +10,8 @@ from dupliapp.routes.health import bp as health_bp
 from dupliapp.routes.chroma import bp as chroma_bp
 from dupliapp.routes.topics import bp as topics_bp
 from dupliapp.routes.index import bp as index_bp
+from dupliapp.services.sync_poller import start_sync_poller
+from dupliapp.services.job_service import start_job_worker
 
 def create_app() -> Flask:
     """
@@ -117,4 +119,11 @@ def create_app() -> Flask:
     app.register_blueprint(topics_bp)    # Routes quản lý đề tài
     app.register_blueprint(index_bp)     # Routes xây dựng chỉ mục
     
+    # Khởi động poller đồng bộ tăng dần nếu được bật (SYNC_INTERVAL_SECONDS > 0)
+    start_sync_poller()
+    
+    # Khởi động worker chạy job lập chỉ mục nền (JOB_WORKERS > 0)
+    # Job còn dở từ lần chạy trước được nhận lại và tiếp tục từ checkpoint
+    start_job_worker()
+    
     return app
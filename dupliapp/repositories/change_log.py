@@ -0,0 +1,83 @@
+﻿# -*- coding: utf-8 -*-
+# Nhật ký thay đổi của collection đề tài trong STATE_DB_PATH: chỉ mục trong bộ nhớ của mọi process đọc bù từ đây
+from typing import Dict, List, Optional, Tuple
+import json
+import os
+import sqlite3
+import threading
+import time
+from dupliapp.config import settings
+
+class IndexChangeLog:
+    """
+    Danh sách ID vector đã được ghi/xóa, đánh số thế hệ tăng dần (generation)
+
+    Mỗi lần ghi của TopicsService (upsert, cập nhật metadata, xóa) thêm một dòng sau khi đã ghi vào
+    ChromaDB. Chỉ mục trong bộ nhớ (metadata, lexical, BM25) nhớ thế hệ đã phản ánh; khi thế hệ mới nhất
+    lớn hơn, chúng đọc lại từ ChromaDB đúng các ID đã đổi (kể cả thay đổi do process khác, CLI offline
+    hay worker ghi trễ). Chỉ giữ INDEX_CHANGE_LOG_RETENTION dòng gần nhất; chỉ mục tụt lại xa hơn phải
+    dựng lại toàn bộ.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or settings.STATE_DB_PATH
+        folder = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(folder, exist_ok=True)
+
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self.conn:
+            # AUTOINCREMENT: thế hệ không bao giờ bị dùng lại sau khi dòng cũ bị xóa
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS index_changes ("
+                " generation INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " ids TEXT NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+
+    def append(self, ids: List[str]) -> int:
+        # Ghi một thay đổi, trả về thế hệ của nó
+        retention = max(1, settings.INDEX_CHANGE_LOG_RETENTION)
+        with self._lock, self.conn:
+            cur = self.conn.execute("INSERT INTO index_changes (ids, created_at) VALUES (?, ?)",
+                                    (json.dumps(list(ids)), time.time()))
+            generation = cur.lastrowid
+            self.conn.execute("DELETE FROM index_changes WHERE generation <= ?", (generation - retention,))
+        return generation
+
+    def latest(self) -> int:
+        # Thế hệ mới nhất (0 nếu chưa có thay đổi nào)
+        with self._lock:
+            row = self.conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'index_changes'").fetchone()
+        return row[0] if row else 0
+
+    def since(self, generation: int) -> Optional[Tuple[int, List[str]]]:
+        """
+        Các ID đã đổi sau thế hệ generation
+
+        Returns:
+            (thế hệ mới nhất, danh sách ID không trùng), None nếu các dòng cần đọc đã bị xóa
+        """
+        with self._lock:
+            oldest = self.conn.execute("SELECT MIN(generation) FROM index_changes").fetchone()[0]
+            rows = self.conn.execute(
+                "SELECT generation, ids FROM index_changes WHERE generation > ? ORDER BY generation",
+                (generation,)).fetchall()
+        if oldest is not None and generation < oldest - 1:
+            return None
+        if not rows:
+            return generation, []
+        ids = list(dict.fromkeys(i for _, raw in rows for i in json.loads(raw)))
+        return rows[-1][0], ids
+
+_logs: Dict[str, IndexChangeLog] = {}
+_logs_lock = threading.Lock()
+
+def get_change_log() -> IndexChangeLog:
+    # Một kết nối cho mỗi file trạng thái (được đọc ở mỗi lần tìm kiếm dùng chỉ mục trong bộ nhớ)
+    path = os.path.abspath(settings.STATE_DB_PATH)
+    with _logs_lock:
+        log = _logs.get(path)
+        if log is None:
+            log = _logs[path] = IndexChangeLog(path)
+        return log
@@ -5,10 +5,19 @@ ChromaDB là một cơ sở dữ liệu vector mã nguồn mở, được sử d
 các vector embeddings của đề tài nghiên cứu.
 Hỗ trợ cả ChromaDB local và ChromaDB cloud.
 """
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple, Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
 import os
+import sqlite3
+import time
+import numpy as np
 import chromadb
 from dupliapp.config import settings
+from dupliapp.repositories.state_repository import IndexStateRepository
+from dupliapp.repositories.state_lock import index_write_lock
+
+# Kích thước lô mặc định khi client không cho biết giới hạn (giá trị của Chroma local với SQLite)
+DEFAULT_MAX_BATCH_SIZE = 5461
 
 class ChromaTopicsRepository:
     """
@@ -42,9 +51,15 @@ class ChromaTopicsRepository:
         else:
             self._init_local_client()
             
-        # Lấy hoặc tạo collection
+        # Lấy hoặc tạo collection (collection đang dùng được đọc từ con trỏ trong STATE_DB_PATH)
+        self._col = None
+        self._col_name: Optional[str] = None
+        self._state: Optional[IndexStateRepository] = None
         self._get_or_create_collection()
 
+        # Kích thước lô ghi tối đa, được hỏi từ client ở lần ghi đầu tiên
+        self._max_batch_size: Optional[int] = None
+
     def _init_local_client(self):
         """Khởi tạo ChromaDB local client"""
         # Tạo thư mục lưu trữ ChromaDB nếu chưa tồn tại
@@ -97,48 +112,391 @@ class ChromaTopicsRepository:
         self.mode = "cloud"
 
     def _get_or_create_collection(self):
-        """Lấy collection hiện có hoặc tạo mới"""
+        """Lấy collection đang dùng hoặc tạo mới"""
+        name = self.active_collection()
         try:
             # Thử lấy collection hiện có
-            self.col = self.client.get_collection(self.COLLECTION)
+            col = self.client.get_collection(name)
         except Exception:
+            if name != self.COLLECTION:
+                # Con trỏ trỏ tới collection không còn tồn tại: không tạo collection rỗng thay thế
+                raise RuntimeError(f"Active collection '{name}' not found")
             # Nếu collection chưa tồn tại, tạo mới với cấu hình cosine similarity
             # hnsw:space="cosine" sử dụng thuật toán HNSW với cosine distance
-            self.col = self.client.create_collection(
+            col = self.client.create_collection(
                 name=self.COLLECTION, 
                 metadata={"hnsw:space": "cosine"}
             )
+        self._col, self._col_name = col, name
+
+    def _pointer_key(self) -> str:
+        # Key con trỏ collection đang dùng, riêng cho từng ChromaDB (thư mục local hoặc host cloud)
+        location = settings.CHROMA_CLOUD_HOST if self.mode == "cloud" else os.path.abspath(settings.CHROMA_DIR)
+        return f"chroma:active:{self.mode}:{location}:{self.COLLECTION}"
+
+    def _rebuild_key(self) -> str:
+        # Key đánh dấu rebuild (compaction) đang chép collection này
+        return self._pointer_key().replace("chroma:active:", "chroma:rebuilding:", 1)
+
+    def rebuild_active(self) -> bool:
+        # True khi có rebuild đang chép collection (ở process bất kỳ dùng chung STATE_DB_PATH):
+        # chỉ khi đó lần ghi mới cần giữ khóa ghi chỉ mục
+        state = self._state_repo()
+        return bool(state is not None and state.get(self._rebuild_key()))
+
+    def _state_repo(self, create: bool = False) -> Optional[IndexStateRepository]:
+        # Không tạo file trạng thái chỉ để đọc con trỏ (chưa có file = chưa compaction lần nào)
+        if self._state is None or self._state.path != settings.STATE_DB_PATH:
+            if not create and not os.path.exists(settings.STATE_DB_PATH):
+                return None
+            self._state = IndexStateRepository()
+        return self._state
+
+    def active_collection(self) -> str:
+        """
+        Tên collection đang dùng: COLLECTION, hoặc collection mới nhất do rebuild tạo ra
+
+        Con trỏ nằm trong STATE_DB_PATH nên mọi instance repository (và mọi process dùng chung file
+        trạng thái) chuyển sang collection mới ngay sau khi rebuild đổi con trỏ.
+        """
+        state = self._state_repo()
+        return (state.get(self._pointer_key()) if state is not None else None) or self.COLLECTION
+
+    @property
+    def col(self):
+        # Collection đang dùng; mở lại khi con trỏ đã đổi (rebuild ở instance/process khác)
+        if self._col is None or self.active_collection() != self._col_name:
+            self._get_or_create_collection()
+        return self._col
+
+    @col.setter
+    def col(self, value):
+        # Gán collection cho collection đang dùng hiện tại (vd. thay bằng mock)
+        self._col, self._col_name = value, self.active_collection()
+
+    def max_batch_size(self) -> int:
+        """
+        Số bản ghi tối đa cho một lần ghi vào ChromaDB
+        
+        Lấy từ client.get_max_batch_size() (giới hạn của server/SQLite) và giới hạn thêm
+        bởi CHROMA_MAX_BATCH_SIZE nếu được cấu hình (vd: để giữ body HTTP nhỏ ở cloud mode)
+        """
+        if self._max_batch_size is None:
+            try:
+                discovered = int(self.client.get_max_batch_size())
+            except Exception:
+                discovered = DEFAULT_MAX_BATCH_SIZE
+            configured = settings.CHROMA_MAX_BATCH_SIZE
+            self._max_batch_size = max(1, min(discovered, configured) if configured > 0 else discovered)
+        return self._max_batch_size
 
-    def upsert(self, ids: List[str], embeddings: List[List[float]], 
-               metadatas: List[Dict[str, Any]], documents: List[str]):
+    def _chunks(self, n: int) -> List[Tuple[int, int]]:
+        # Chia [0, n) thành các khoảng liên tiếp không vượt quá max_batch_size
+        size = self.max_batch_size()
+        return [(start, min(start + size, n)) for start in range(0, n, size)]
+
+    def upsert(self, ids: List[str], embeddings: np.ndarray, 
+               metadatas: List[Dict[str, Any]], documents: List[str]) -> Dict[str, Any]:
         """
         Thêm hoặc cập nhật vector embeddings vào ChromaDB
         
         Args:
             ids: Danh sách ID duy nhất cho mỗi vector (format: "tv:TopicVersionId")
-            embeddings: Danh sách vector embeddings (numpy arrays)
+            embeddings: Ma trận embeddings (numpy array 2 chiều, mỗi dòng một vector) - được
+                        chuyển nguyên dạng mảng cho Chroma, không đổi thành list float Python
             metadatas: Danh sách metadata cho mỗi vector (thông tin đề tài)
             documents: Danh sách text gốc được sử dụng để tạo embeddings
             
+        Returns:
+            Dict chứa thời gian ghi từng lô (chunks), tổng thời gian (totalMs) và maxBatchSize
+            
         Chức năng:
         - Nếu ID đã tồn tại: cập nhật vector và metadata
         - Nếu ID chưa tồn tại: thêm mới vector
-        - Hỗ trợ batch operations để tối ưu hiệu suất
+        - Tự chia thành các lô không vượt quá max_batch_size() nên nhận được danh sách lớn tùy ý
+        - Cloud mode: ghi song song tối đa CHROMA_UPSERT_CONCURRENCY lô
         """
-        self.col.upsert(
-            ids=ids, 
-            embeddings=embeddings, 
-            metadatas=metadatas, 
-            documents=documents
-        )
+        started = time.perf_counter()
+        chunks = self._chunks(len(ids))
+
+        def write(no: int, start: int, end: int) -> Dict[str, Any]:
+            t0 = time.perf_counter()
+            self.col.upsert(
+                ids=ids[start:end], 
+                embeddings=embeddings[start:end], 
+                metadatas=metadatas[start:end], 
+                documents=documents[start:end]
+            )
+            return {"chunk": no, "size": end - start, "ms": round((time.perf_counter() - t0) * 1000, 2)}
+
+        # Local mode ghi vào cùng một file SQLite nên ghi song song không nhanh hơn
+        workers = settings.CHROMA_UPSERT_CONCURRENCY if self.mode == "cloud" else 1
+        if workers > 1 and len(chunks) > 1:
+            with ThreadPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+                timings = list(pool.map(lambda c: write(c[0], *c[1]), enumerate(chunks, 1)))
+        else:
+            timings = [write(no, start, end) for no, (start, end) in enumerate(chunks, 1)]
+
+        return {
+            "chunks": timings,
+            "totalMs": round((time.perf_counter() - started) * 1000, 2),
+            "maxBatchSize": self.max_batch_size(),
+        }
+
+    def get_metadatas(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Lấy metadata đã lưu của nhiều vector theo ID trong một lần gọi
+        
+        Args:
+            ids: Danh sách ID cần lấy
+            
+        Returns:
+            Dict ánh xạ ID -> metadata, chỉ chứa các ID đã tồn tại
+        """
+        out: Dict[str, Dict[str, Any]] = {}
+        for start, end in self._chunks(len(ids)):
+            res = self.col.get(ids=ids[start:end], include=["metadatas"])
+            out.update({i: (m or {}) for i, m in zip(res.get("ids") or [], res.get("metadatas") or [])})
+        return out
+
+    def get_documents(self, ids: List[str]) -> Dict[str, str]:
+        # Document (text đã ghép) đã lưu của nhiều vector theo ID, chỉ chứa các ID đã tồn tại
+        out: Dict[str, str] = {}
+        for start, end in self._chunks(len(ids)):
+            res = self.col.get(ids=ids[start:end], include=["documents"])
+            out.update({i: (d or "") for i, d in zip(res.get("ids") or [], res.get("documents") or [])})
+        return out
+
+    def existing_ids(self, ids: List[str]) -> List[str]:
+        """
+        Lọc ra các ID đang có trong collection (không đọc embedding/metadata/document)
+        """
+        found: List[str] = []
+        for start, end in self._chunks(len(ids)):
+            res = self.col.get(ids=ids[start:end], include=[])
+            found.extend(res.get("ids") or [])
+        return found
+
+    def update_metadatas(self, ids: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        """
+        Cập nhật chỉ metadata của các ID đã tồn tại, giữ nguyên vector và document
+        
+        Args:
+            ids: Danh sách ID cần cập nhật
+            metadatas: Metadata mới cho từng ID - được gộp vào metadata hiện có
+                       (key có giá trị None bị xóa khỏi metadata)
+        """
+        for start, end in self._chunks(len(ids)):
+            self.col.update(ids=ids[start:end], metadatas=metadatas[start:end])
+
+    @staticmethod
+    def topic_id_filters(topic_ids: List[Any]) -> List[Dict[str, Any]]:
+        # TopicId được lưu dạng số (từ SQL) hoặc chuỗi (từ API) -> lọc cả hai kiểu
+        # $in của Chroma yêu cầu các giá trị cùng kiểu nên mỗi kiểu một điều kiện
+        ints, strs = set(), set()
+        for v in topic_ids:
+            if isinstance(v, int) and not isinstance(v, bool):
+                ints.add(v)
+                strs.add(str(v))
+            elif isinstance(v, str):
+                strs.add(v)
+                if v.isdigit():
+                    ints.add(int(v))
+            else:
+                raise ValueError(f"Invalid topicId: {v!r}")
+        return [{"TopicId": {"$in": sorted(group)}} for group in (ints, strs) if group]
+
+    @classmethod
+    def exclude_topic_where(cls, topic_id: Any) -> Dict[str, Any]:
+        # Điều kiện loại mọi phiên bản của topic_id ở cả dạng số và chuỗi ($ne chỉ loại đúng một kiểu)
+        conditions = [{"TopicId": {"$nin": f["TopicId"]["$in"]}} for f in cls.topic_id_filters([topic_id])]
+        return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+    def ids_where(self, where: Dict[str, Any]) -> List[str]:
+        """
+        Lấy tất cả ID có metadata khớp điều kiện where (đọc theo trang, không đọc embedding)
+        """
+        found: List[str] = []
+        size = self.max_batch_size()
+        while True:
+            res = self.col.get(where=where, include=[], limit=size, offset=len(found))
+            page = res.get("ids") or []
+            found.extend(page)
+            if len(page) < size:
+                return found
+
+    def records_where(self, where: Dict[str, Any]) -> Tuple[List[str], List[Dict[str, Any]], np.ndarray]:
+        """
+        ID, metadata và embedding (ma trận float32) của mọi bản ghi khớp điều kiện where, đọc theo trang
+        """
+        ids: List[str] = []
+        metas: List[Dict[str, Any]] = []
+        embs: List[np.ndarray] = []
+        size = self.max_batch_size()
+        while True:
+            res = self.col.get(where=where, include=["metadatas", "embeddings"], limit=size, offset=len(ids))
+            page = res.get("ids") or []
+            ids.extend(page)
+            metas.extend(m or {} for m in (res.get("metadatas") or []))
+            if page:
+                embs.append(np.asarray(res["embeddings"], dtype=np.float32))
+            if len(page) < size:
+                return ids, metas, (np.concatenate(embs) if embs else np.zeros((0, 0), dtype=np.float32))
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None) -> int:
+        """
+        Xóa vector theo danh sách ID hoặc theo điều kiện metadata
+        
+        Args:
+            ids: Danh sách ID cần xóa (ID không tồn tại được bỏ qua)
+            where: Điều kiện lọc metadata (dùng khi không truyền ids)
+            
+        Returns:
+            Số vector thực sự bị xóa
+        """
+        targets = self.existing_ids(ids) if ids is not None else self.ids_where(where or {})
+        for start, end in self._chunks(len(targets)):
+            self.col.delete(ids=targets[start:end])
+        return len(targets)
+
+    def rebuild(self, page_size: int, on_progress: Optional[Callable[[int], None]] = None) -> int:
+        """
+        Xây dựng lại collection: chép mọi bản ghi còn sống sang collection thế hệ mới rồi đổi con trỏ
+
+        Chỉ mục HNSW mới không còn các phần tử đã xóa (tombstone). Collection cũ vẫn phục vụ đọc/ghi
+        trong lúc chép và chỉ bị xóa sau khi con trỏ (STATE_DB_PATH) đã trỏ sang collection mới.
+        - Chép theo trang, chỉ chép ID chưa có trong collection mới: lần rebuild bị dừng giữa chừng
+          được tiếp tục thay vì chép lại từ đầu
+        - Bước cuối giữ khóa ghi chỉ mục độc quyền: so metadata hai collection, chép lại bản ghi được
+          thêm/sửa và xóa bản ghi đã bị xóa trong lúc chép, rồi mới đổi con trỏ
 
-    def query(self, query_embedding: List[float], n_results: int, 
+        Returns:
+            Số bản ghi trong collection mới
+        """
+        source_name = self._col_name or self.active_collection()
+        source = self.col
+        target_name = self._next_generation(source_name)
+        try:
+            # Tiếp tục lần rebuild trước bị dừng giữa chừng
+            target = self.client.get_collection(target_name)
+        except Exception:
+            target = self.client.create_collection(name=target_name, metadata={"hnsw:space": "cosine"})
+
+        # Từ đây các lần ghi giữ khóa ghi chung (xem rebuild_active); process bị dừng giữa chừng để lại
+        # cờ -> lần ghi tiếp tục giữ khóa (chậm hơn nhưng an toàn) tới lần rebuild sau
+        state = self._state_repo(create=True)
+        state.set(self._rebuild_key(), time.time())
+        try:
+            scanned = 0
+            while True:
+                ids = source.get(limit=page_size, offset=scanned, include=[]).get("ids") or []
+                present = set(target.get(ids=ids, include=[]).get("ids") or []) if ids else set()
+                self._copy(source, target, [i for i in ids if i not in present])
+                scanned += len(ids)
+                if on_progress is not None:
+                    on_progress(scanned)
+                if len(ids) < page_size:
+                    break
+
+            with index_write_lock(exclusive=True):
+                # Chép bù thay đổi trong lúc chép: không lần ghi nào chạy song song ở bước này
+                live = self._all_metadatas(source, page_size)
+                copied = self._all_metadatas(target, page_size)
+                stale = [i for i in copied if i not in live]
+                for start in range(0, len(stale), self.max_batch_size()):
+                    target.delete(ids=stale[start:start + self.max_batch_size()])
+                self._copy(source, target, [i for i, m in live.items() if copied.get(i) != m])
+
+                state.set(self._pointer_key(), target_name)
+                self._col, self._col_name = target, target_name
+        finally:
+            state.delete(self._rebuild_key())
+        self.client.delete_collection(source_name)
+        return target.count()
+
+    def _next_generation(self, name: str) -> str:
+        # topics_v1 -> topics_v1__g1 -> topics_v1__g2 ...
+        _, _, gen = name.partition("__g")
+        return f"{self.COLLECTION}__g{int(gen) + 1 if gen.isdigit() else 1}"
+
+    def _copy(self, source: Any, target: Any, ids: List[str]) -> int:
+        # Chép nguyên bản ghi (vector, metadata, document) theo ID, không embed lại
+        for start, end in self._chunks(len(ids)):
+            res = source.get(ids=ids[start:end], include=["embeddings", "metadatas", "documents"])
+            if res.get("ids"):
+                target.upsert(ids=res["ids"], embeddings=res["embeddings"],
+                              metadatas=res["metadatas"], documents=res["documents"])
+        return len(ids)
+
+    @staticmethod
+    def _all_metadatas(col: Any, page_size: int) -> Dict[str, Dict[str, Any]]:
+        out: Dict[str, Dict[str, Any]] = {}
+        while True:
+            res = col.get(limit=page_size, offset=len(out), include=["metadatas"])
+            ids = res.get("ids") or []
+            out.update(zip(ids, ((m or {}) for m in res.get("metadatas") or [])))
+            if len(ids) < page_size:
+                return out
+
+    def vacuum(self) -> bool:
+        """
+        Thu hồi dung lượng trống của file SQLite của ChromaDB local (VACUUM)
+        
+        Returns:
+            True nếu đã chạy VACUUM (cloud mode do server tự quản lý nên trả về False)
+        """
+        path = os.path.join(settings.CHROMA_DIR, "chroma.sqlite3")
+        if self.mode != "local" or not os.path.exists(path):
+            return False
+        conn = sqlite3.connect(path, timeout=30)
+        try:
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+        return True
+
+    def disk_usage(self) -> Optional[int]:
+        """
+        Tổng dung lượng (byte) thư mục CHROMA_DIR; None ở cloud mode
+        """
+        if self.mode != "local":
+            return None
+        total = 0
+        for folder, _, files in os.walk(settings.CHROMA_DIR):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(folder, name))
+                except OSError:
+                    pass
+        return total
+
+    def get_embeddings(self, ids: List[str]) -> Dict[str, np.ndarray]:
+        """
+        Lấy vector embedding đã lưu của nhiều ID trong một lần gọi
+        
+        Args:
+            ids: Danh sách ID cần lấy
+            
+        Returns:
+            Dict ánh xạ ID -> embedding (một dòng float32 của mảng NumPy, không sao chép
+            thành list float Python), chỉ chứa các ID đã tồn tại
+        """
+        out: Dict[str, np.ndarray] = {}
+        for start, end in self._chunks(len(ids)):
+            res = self.col.get(ids=ids[start:end], include=["embeddings"])
+            embs = res.get("embeddings")
+            if embs is not None and len(embs):
+                embs = np.asarray(embs, dtype=np.float32)
+                out.update(zip(res.get("ids") or [], embs))
+        return out
+
+    def query(self, query_embedding: np.ndarray, n_results: int, 
               where: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         Tìm kiếm vector tương tự dựa trên query embedding
         
         Args:
-            query_embedding: Vector embedding của query cần tìm kiếm
+            query_embedding: Vector embedding của query cần tìm kiếm (numpy array 1 chiều)
             n_results: Số lượng kết quả tương tự nhất cần trả về
             where: Điều kiện lọc kết quả theo metadata (tùy chọn)
             
@@ -175,6 +533,93 @@ class ChromaTopicsRepository:
                 
         return out
 
+    def query_distances(self, query_embedding: np.ndarray, n_results: int,
+                        where: Optional[Dict[str, Any]] = None) -> Tuple[List[str], List[float]]:
+        """
+        ID và khoảng cách của n_results vector gần nhất (chỉ yêu cầu distances, không đọc
+        metadata/document)
+        
+        Returns:
+            (ids, distances) sắp xếp theo khoảng cách tăng dần; ít hơn n_results nếu collection
+            (hoặc tập khớp where) không đủ vector
+        """
+        res = self.col.query(
+            query_embeddings=[query_embedding],
+            n_results=n_results,
+            where=where,
+            include=["distances"],
+        )
+        ids = (res.get("ids") or [[]])[0] if res else []
+        dists = (res.get("distances") or [[]])[0] if res else []
+        return list(ids), [float(d) for d in dists]
+
+    def nearest_distance(self, query_embedding: np.ndarray,
+                         where: Optional[Dict[str, Any]] = None) -> Optional[float]:
+        """
+        Khoảng cách tới vector gần nhất, None nếu không có vector nào khớp
+        """
+        _, dists = self.query_distances(query_embedding, 1, where=where)
+        return dists[0] if dists else None
+
+    def query_many(self, query_embeddings: np.ndarray, n_results: int,
+                   where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        Tìm kiếm vector tương tự cho nhiều query embedding trong một lần gọi
+        
+        Args:
+            query_embeddings: Ma trận query (numpy array 2 chiều, mỗi dòng một vector)
+            n_results: Số lượng kết quả mỗi query
+            where: Điều kiện lọc metadata áp dụng cho mọi query (tùy chọn)
+            
+        Returns:
+            Danh sách theo thứ tự query, mỗi phần tử chứa ids, metadatas, distances
+        """
+        out: List[Dict[str, Any]] = []
+        for start, end in self._chunks(len(query_embeddings)):
+            res = self.col.query(
+                query_embeddings=query_embeddings[start:end],
+                n_results=n_results,
+                where=where,
+                include=["metadatas", "distances"],
+            )
+            for ids, metas, dists in zip(res.get("ids") or [], res.get("metadatas") or [],
+                                         res.get("distances") or []):
+                out.append({"ids": list(ids), "metadatas": list(metas), "distances": list(dists)})
+        return out
+
+    def _pages(self, page_size: int, include: List[str]) -> Iterator[Dict[str, Any]]:
+        # Duyệt toàn bộ collection theo trang (limit/offset), bỏ qua trang rỗng
+        offset = 0
+        while True:
+            res = self.col.get(limit=page_size, offset=offset, include=include)
+            ids = res.get("ids") or []
+            if ids:
+                yield res
+            offset += len(ids)
+            if len(ids) < page_size:
+                return
+
+    def iter_ids(self, page_size: int) -> Iterator[List[str]]:
+        """
+        Duyệt tất cả ID trong collection theo trang (không đọc embedding/metadata/document)
+        """
+        for res in self._pages(page_size, []):
+            yield res["ids"]
+
+    def iter_metadatas(self, page_size: int) -> Iterator[Tuple[List[str], List[Dict[str, Any]]]]:
+        """
+        Duyệt (ids, metadatas) của toàn bộ collection theo trang (không đọc embedding/document)
+        """
+        for res in self._pages(page_size, ["metadatas"]):
+            yield res["ids"], [m or {} for m in res.get("metadatas") or []]
+
+    def iter_documents(self, page_size: int) -> Iterator[Tuple[List[str], List[str]]]:
+        """
+        Duyệt (ids, documents) - text đã ghép của từng đề tài - theo trang (không đọc embedding/metadata)
+        """
+        for res in self._pages(page_size, ["documents"]):
+            yield res["ids"], [d or "" for d in res.get("documents") or []]
+
     def count(self) -> int:
         """
         Đếm tổng số vector trong collection hiện tại
@@ -232,7 +677,7 @@ class ChromaTopicsRepository:
             # Thông tin cơ bản
             base_info = {
                 "mode": self.mode,
-                "activeCollection": self.COLLECTION,
+                "activeCollection": self.active_collection(),
                 "activeCount": self.count(),
                 "collections": collections
             }
@@ -250,3 +695,14 @@ class ChromaTopicsRepository:
         except Exception as e:
             # Trả về thông báo lỗi nếu có vấn đề
             return {"error": str(e), "mode": self.mode}
+
+
+class ChromaFieldVectorsRepository(ChromaTopicsRepository):
+    """
+    Vector theo từng trường (và từng đoạn của trường dài) của đề tài - MULTI_VECTOR_ENABLED
+
+    Collection riêng, mỗi bản ghi có ID "tvf:<TopicVersionId>:<Field>:<đoạn>" và metadata ParentId
+    (ID của đề tài trong collection chính), Field, Chunk, ContentHash của đoạn text.
+    """
+
+    COLLECTION = "topic_fields_v1"
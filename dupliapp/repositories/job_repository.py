@@ -0,0 +1,191 @@
+﻿# -*- coding: utf-8 -*-
+# Repository lưu trạng thái các job lập chỉ mục chạy nền trong file SQLite cục bộ
+from typing import Any, Callable, Dict, List, Optional
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dupliapp.config import settings
+
+# Các trạng thái của job
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+# Các cột được phép cập nhật qua update()
+_UPDATABLE = {"status", "processed", "total", "embedded", "error", "result",
+              "started_at", "finished_at", "heartbeat_at", "base_processed"}
+
+class JobRepository:
+    """
+    Bảng index_jobs trong STATE_DB_PATH
+
+    Trạng thái job được lưu bền vững nên vẫn còn sau khi khởi động lại tiến trình;
+    việc nhận job (claim) là nguyên tử nên nhiều tiến trình có thể dùng chung một file.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or settings.STATE_DB_PATH
+        folder = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(folder, exist_ok=True)
+
+        # isolation_level=None: tự quản lý giao dịch (BEGIN IMMEDIATE khi claim job)
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS index_jobs ("
+                " id TEXT PRIMARY KEY,"
+                " kind TEXT NOT NULL,"
+                " status TEXT NOT NULL,"
+                " params TEXT NOT NULL,"
+                " processed INTEGER NOT NULL DEFAULT 0,"
+                " base_processed INTEGER NOT NULL DEFAULT 0,"
+                " total INTEGER,"
+                " embedded INTEGER NOT NULL DEFAULT 0,"
+                " error TEXT,"
+                " result TEXT,"
+                " cancel_requested INTEGER NOT NULL DEFAULT 0,"
+                " created_at REAL NOT NULL,"
+                " started_at REAL,"
+                " finished_at REAL,"
+                " heartbeat_at REAL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS ix_index_jobs_status ON index_jobs (status, created_at)")
+
+    @staticmethod
+    def _to_dict(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"] or "{}")
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        return job
+
+    def create(self, kind: str, params: Dict[str, Any], unique: bool = False) -> Dict[str, Any]:
+        # unique=True: nếu đã có job cùng loại đang chờ/chạy thì trả về job đó thay vì tạo mới
+        # (kiểm tra và tạo trong cùng một giao dịch nên hai process không cùng tạo được)
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = None
+                if unique:
+                    row = self.conn.execute(
+                        "SELECT id FROM index_jobs WHERE kind = ? AND status IN (?, ?) ORDER BY created_at LIMIT 1",
+                        (kind, QUEUED, RUNNING)).fetchone()
+                if row is None:
+                    self.conn.execute(
+                        "INSERT INTO index_jobs (id, kind, status, params, created_at) VALUES (?, ?, ?, ?, ?)",
+                        (job_id, kind, QUEUED, json.dumps(params), time.time()),
+                    )
+                else:
+                    job_id = row["id"]
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return self.get(job_id)
+
+    def merge_queued(self, kind: str, params: Dict[str, Any],
+                     merge: Callable[[Dict[str, Any], Dict[str, Any]], Dict[str, Any]]) -> Dict[str, Any]:
+        # Gộp params vào job cùng loại còn đang chờ (chưa được worker nhận) bằng merge(cũ, mới);
+        # chưa có job chờ thì tạo mới. Đọc và ghi trong cùng một giao dịch nên không mất lần gộp nào
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    "SELECT id, params FROM index_jobs WHERE kind = ? AND status = ? ORDER BY created_at LIMIT 1",
+                    (kind, QUEUED)).fetchone()
+                if row is None:
+                    job_id = uuid.uuid4().hex
+                    self.conn.execute(
+                        "INSERT INTO index_jobs (id, kind, status, params, created_at) VALUES (?, ?, ?, ?, ?)",
+                        (job_id, kind, QUEUED, json.dumps(params), time.time()),
+                    )
+                else:
+                    job_id = row["id"]
+                    merged = merge(json.loads(row["params"] or "{}"), params)
+                    self.conn.execute("UPDATE index_jobs SET params = ? WHERE id = ?", (json.dumps(merged), job_id))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self.conn.execute("SELECT * FROM index_jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row)
+
+    def list(self, limit: int = 20) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT * FROM index_jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        return [self._to_dict(r) for r in rows]
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        unknown = set(fields) - _UPDATABLE
+        if unknown:
+            raise ValueError(f"Unknown job fields: {sorted(unknown)}")
+        if "result" in fields and fields["result"] is not None:
+            fields["result"] = json.dumps(fields["result"])
+        assignments = ", ".join(f"{k} = ?" for k in fields)
+        with self._lock:
+            self.conn.execute(f"UPDATE index_jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def claim_next(self) -> Optional[Dict[str, Any]]:
+        # Nhận job đang chờ lâu nhất một cách nguyên tử (chỉ một worker/tiến trình nhận được)
+        now = time.time()
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    "SELECT id FROM index_jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)).fetchone()
+                if row is None:
+                    self.conn.execute("COMMIT")
+                    return None
+                self.conn.execute(
+                    "UPDATE index_jobs SET status = ?, started_at = ?, heartbeat_at = ?, base_processed = processed "
+                    "WHERE id = ?", (RUNNING, now, now, row["id"]))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return self.get(row["id"])
+
+    def request_cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        # Job đang chờ bị hủy ngay; job đang chạy được đánh dấu để worker dừng sau trang hiện tại
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                "UPDATE index_jobs SET status = ?, cancel_requested = 1, finished_at = ? WHERE id = ? AND status = ?",
+                (CANCELLED, now, job_id, QUEUED))
+            self.conn.execute(
+                "UPDATE index_jobs SET cancel_requested = 1 WHERE id = ? AND status = ?", (job_id, RUNNING))
+        return self.get(job_id)
+
+    def is_cancel_requested(self, job_id: str) -> bool:
+        with self._lock:
+            row = self.conn.execute("SELECT cancel_requested FROM index_jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row["cancel_requested"])
+
+    def requeue_stale(self, stale_after: float) -> int:
+        # Job "running" không có heartbeat quá stale_after giây (tiến trình bị dừng/crash) -> chờ chạy lại
+        cutoff = time.time() - stale_after
+        with self._lock:
+            # Job đã được yêu cầu hủy thì không chạy lại
+            self.conn.execute(
+                "UPDATE index_jobs SET status = ?, finished_at = ? "
+                "WHERE status = ? AND cancel_requested = 1 AND COALESCE(heartbeat_at, 0) < ?",
+                (CANCELLED, time.time(), RUNNING, cutoff))
+            cur = self.conn.execute(
+                "UPDATE index_jobs SET status = ? WHERE status = ? AND COALESCE(heartbeat_at, 0) < ?",
+                (QUEUED, RUNNING, cutoff))
+        return cur.rowcount
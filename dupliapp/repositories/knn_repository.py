@@ -0,0 +1,176 @@
+﻿# -*- coding: utf-8 -*-
+# Repository đồ thị k láng giềng gần nhất (kNN) đã tính sẵn của các đề tài trong chỉ mục
+from typing import Any, Dict, List, Optional, Sequence
+import json
+import os
+import sqlite3
+import threading
+import time
+from dupliapp.config import settings
+
+class KnnGraphRepository:
+    """
+    Bảng knn_nodes / knn_edges trong STATE_DB_PATH
+
+    Mỗi đề tài (node, theo ID "tv:TopicVersionId" của ChromaDB) có tối đa k cạnh tới các đề tài
+    gần nhất, kèm similarity và thông tin hiển thị (TopicId, TopicVersionId, Title) của láng giềng
+    để tra cứu không cần đọc lại ChromaDB. Chỉ mục theo cột neighbor cho phép tìm các node đang trỏ
+    tới một đề tài (láng giềng ngược) khi đề tài đó được cập nhật hoặc bị xóa.
+    TopicId/TopicVersionId được lưu dạng JSON để giữ nguyên kiểu số/chuỗi.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or settings.STATE_DB_PATH
+        folder = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(folder, exist_ok=True)
+
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS knn_nodes ("
+                " node TEXT PRIMARY KEY,"
+                " topic_id TEXT,"
+                " topic_version_id TEXT,"
+                " title TEXT,"
+                " updated_at REAL NOT NULL)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS knn_edges ("
+                " node TEXT NOT NULL,"
+                " neighbor TEXT NOT NULL,"
+                " similarity REAL NOT NULL,"
+                " topic_id TEXT,"
+                " topic_version_id TEXT,"
+                " title TEXT,"
+                " PRIMARY KEY (node, neighbor))"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS ix_knn_edges_neighbor ON knn_edges (neighbor)")
+
+    @staticmethod
+    def _placeholders(values: Sequence[Any]) -> str:
+        return ",".join("?" * len(values))
+
+    @staticmethod
+    def _hit(row: sqlite3.Row) -> Dict[str, Any]:
+        # Cùng dạng hit với TopicsService.search/similar
+        return {
+            "topicId": json.loads(row["topic_id"]),
+            "topicVersionId": json.loads(row["topic_version_id"]),
+            "title": row["title"] or "",
+            "similarity": row["similarity"],
+        }
+
+    def set_neighbors(self, nodes: Dict[str, Dict[str, Any]]) -> None:
+        """
+        Ghi đè danh sách láng giềng của các node
+
+        Args:
+            nodes: Dict ID -> {"topicId", "topicVersionId", "title", "hits": [...]}; mỗi hit có
+                   "id" của láng giềng cùng các key của hit tìm kiếm
+        """
+        now = time.time()
+        with self._lock, self.conn:
+            for node, info in nodes.items():
+                self.conn.execute("DELETE FROM knn_edges WHERE node = ?", (node,))
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO knn_nodes (node, topic_id, topic_version_id, title, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (node, json.dumps(info["topicId"]), json.dumps(info["topicVersionId"]), info["title"], now))
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO knn_edges (node, neighbor, similarity, topic_id, topic_version_id, title) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(node, h["id"], h["similarity"], json.dumps(h["topicId"]),
+                      json.dumps(h["topicVersionId"]), h["title"]) for h in info["hits"]])
+
+    def offer(self, edges: List[Dict[str, Any]], k: int) -> int:
+        """
+        Đề xuất cạnh node -> neighbor (cập nhật láng giềng ngược khi có đề tài mới)
+
+        Cạnh chỉ được giữ nếu node đã có trong đồ thị và neighbor lọt vào top k của node.
+
+        Returns:
+            Số node có danh sách láng giềng thay đổi
+        """
+        changed = 0
+        with self._lock, self.conn:
+            for e in edges:
+                if self.conn.execute("SELECT 1 FROM knn_nodes WHERE node = ?", (e["node"],)).fetchone() is None:
+                    continue
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO knn_edges (node, neighbor, similarity, topic_id, topic_version_id, title) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (e["node"], e["id"], e["similarity"], json.dumps(e["topicId"]),
+                     json.dumps(e["topicVersionId"]), e["title"]))
+                # Cắt về k cạnh có similarity cao nhất
+                self.conn.execute(
+                    "DELETE FROM knn_edges WHERE node = ? AND neighbor NOT IN ("
+                    " SELECT neighbor FROM knn_edges WHERE node = ? ORDER BY similarity DESC, neighbor LIMIT ?)",
+                    (e["node"], e["node"], k))
+                # Cạnh mới bị cắt ngay thì danh sách không đổi
+                if self.conn.execute("SELECT 1 FROM knn_edges WHERE node = ? AND neighbor = ?",
+                                     (e["node"], e["id"])).fetchone() is not None:
+                    changed += 1
+        return changed
+
+    def neighbors(self, nodes: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Đọc láng giềng đã tính sẵn của nhiều node (một truy vấn theo chỉ mục khóa chính)
+
+        Returns:
+            Dict ID -> {"topicId", "topicVersionId", "title", "hits", "updatedAt"}, chỉ chứa các node
+            đã có trong đồ thị; hits sắp xếp theo similarity giảm dần
+        """
+        if not nodes:
+            return {}
+        with self._lock:
+            heads = self.conn.execute(
+                f"SELECT * FROM knn_nodes WHERE node IN ({self._placeholders(nodes)})", nodes).fetchall()
+            rows = self.conn.execute(
+                f"SELECT * FROM knn_edges WHERE node IN ({self._placeholders(nodes)}) "
+                "ORDER BY node, similarity DESC, neighbor", nodes).fetchall()
+        out = {
+            h["node"]: {
+                "topicId": json.loads(h["topic_id"]),
+                "topicVersionId": json.loads(h["topic_version_id"]),
+                "title": h["title"] or "",
+                "hits": [],
+                "updatedAt": h["updated_at"],
+            } for h in heads
+        }
+        for r in rows:
+            if r["node"] in out:
+                out[r["node"]]["hits"].append(self._hit(r))
+        return out
+
+    def referrers(self, neighbors: List[str]) -> List[str]:
+        # Các node đang có một trong các đề tài này trong danh sách láng giềng (láng giềng ngược)
+        if not neighbors:
+            return []
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT DISTINCT node FROM knn_edges WHERE neighbor IN ({self._placeholders(neighbors)})",
+                neighbors).fetchall()
+        return sorted(r["node"] for r in rows)
+
+    def remove(self, nodes: List[str]) -> None:
+        # Xóa node cùng mọi cạnh đi ra và đi vào node
+        if not nodes:
+            return
+        marks = self._placeholders(nodes)
+        with self._lock, self.conn:
+            self.conn.execute(f"DELETE FROM knn_nodes WHERE node IN ({marks})", nodes)
+            self.conn.execute(f"DELETE FROM knn_edges WHERE node IN ({marks}) OR neighbor IN ({marks})",
+                              [*nodes, *nodes])
+
+    def clear(self) -> None:
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM knn_edges")
+            self.conn.execute("DELETE FROM knn_nodes")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            nodes, updated = self.conn.execute("SELECT COUNT(*), MAX(updated_at) FROM knn_nodes").fetchone()
+            edges = self.conn.execute("SELECT COUNT(*) FROM knn_edges").fetchone()[0]
+        return {"nodes": nodes, "edges": edges, "lastUpdatedAt": updated}
@@ -0,0 +1,169 @@
+﻿# -*- coding: utf-8 -*-
+# Repository bảng lease phân vùng cho lập chỉ mục song song (nhiều tiến trình / nhiều máy)
+from typing import Any, Dict, List, Optional
+import os
+import sqlite3
+import threading
+import time
+from dupliapp.config import settings
+
+# Trạng thái của một phân vùng
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+class PartitionRepository:
+    """
+    Bảng index_partition_runs / index_partitions trong STATE_DB_PATH
+
+    Mỗi lần chạy chia không gian TopicId thành các phân vùng; worker nhận (lease) một phân vùng
+    trong lease_seconds giây và gia hạn sau mỗi trang đã ghi. Worker bị crash không gia hạn nữa,
+    lease hết hạn và phân vùng được worker khác nhận lại, tiếp tục từ last_topic_id.
+    Khi chạy trên nhiều máy, STATE_DB_PATH phải là file dùng chung giữa các máy.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or settings.STATE_DB_PATH
+        folder = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(folder, exist_ok=True)
+
+        # isolation_level=None: tự quản lý giao dịch (BEGIN IMMEDIATE khi nhận phân vùng)
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS index_partition_runs ("
+                " run_id TEXT PRIMARY KEY,"
+                " status TEXT NOT NULL,"
+                " page_size INTEGER NOT NULL,"
+                " start_watermark INTEGER,"
+                " force INTEGER NOT NULL DEFAULT 0,"
+                " created_at REAL NOT NULL,"
+                " finished_at REAL)"
+            )
+            # Bảng tạo trước khi có cột force (embed lại cả đề tài không đổi)
+            columns = {r["name"] for r in self.conn.execute("PRAGMA table_info(index_partition_runs)")}
+            if "force" not in columns:
+                self.conn.execute("ALTER TABLE index_partition_runs ADD COLUMN force INTEGER NOT NULL DEFAULT 0")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS index_partitions ("
+                " run_id TEXT NOT NULL,"
+                " partition_no INTEGER NOT NULL,"
+                " from_topic_id INTEGER NOT NULL,"
+                " to_topic_id INTEGER NOT NULL,"
+                " topic_count INTEGER NOT NULL,"
+                " status TEXT NOT NULL,"
+                " owner TEXT,"
+                " lease_expires_at REAL,"
+                " last_topic_id INTEGER,"
+                " processed INTEGER NOT NULL DEFAULT 0,"
+                " embedded INTEGER NOT NULL DEFAULT 0,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " error TEXT,"
+                " started_at REAL,"
+                " updated_at REAL,"
+                " finished_at REAL,"
+                " PRIMARY KEY (run_id, partition_no))"
+            )
+
+    def create_run(self, run_id: str, page_size: int, start_watermark: Optional[int],
+                   bounds: List[Dict[str, Any]], force: bool = False) -> None:
+        now = time.time()
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute(
+                    "INSERT INTO index_partition_runs (run_id, status, page_size, start_watermark, force, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)", (run_id, "running", page_size, start_watermark, int(force), now))
+                self.conn.executemany(
+                    "INSERT INTO index_partitions (run_id, partition_no, from_topic_id, to_topic_id, topic_count, status) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(run_id, i, b["fromTopicId"], b["toTopicId"], b["topicCount"], PENDING)
+                     for i, b in enumerate(bounds)])
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def get_run(self, run_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self.conn.execute("SELECT * FROM index_partition_runs WHERE run_id = ?", (run_id,)).fetchone()
+        return dict(row) if row else None
+
+    def latest_run_id(self) -> Optional[str]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT run_id FROM index_partition_runs ORDER BY created_at DESC LIMIT 1").fetchone()
+        return row["run_id"] if row else None
+
+    def finish_run(self, run_id: str, status: str) -> bool:
+        # Chỉ một worker/coordinator chuyển được lần chạy sang trạng thái kết thúc
+        with self._lock:
+            cur = self.conn.execute(
+                "UPDATE index_partition_runs SET status = ?, finished_at = ? WHERE run_id = ? AND status = 'running'",
+                (status, time.time(), run_id))
+        return cur.rowcount == 1
+
+    def partitions(self, run_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT * FROM index_partitions WHERE run_id = ? ORDER BY partition_no", (run_id,)).fetchall()
+        return [dict(r) for r in rows]
+
+    def claim(self, run_id: str, owner: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        # Nhận nguyên tử phân vùng đang chờ hoặc có lease đã hết hạn (worker trước bị dừng)
+        now = time.time()
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    "SELECT partition_no FROM index_partitions WHERE run_id = ? "
+                    "AND (status = ? OR (status = ? AND lease_expires_at < ?)) "
+                    "ORDER BY partition_no LIMIT 1", (run_id, PENDING, LEASED, now)).fetchone()
+                if row is None:
+                    self.conn.execute("COMMIT")
+                    return None
+                self.conn.execute(
+                    "UPDATE index_partitions SET status = ?, owner = ?, lease_expires_at = ?, attempts = attempts + 1, "
+                    "started_at = COALESCE(started_at, ?), updated_at = ? WHERE run_id = ? AND partition_no = ?",
+                    (LEASED, owner, now + lease_seconds, now, now, run_id, row["partition_no"]))
+                claimed = self.conn.execute(
+                    "SELECT * FROM index_partitions WHERE run_id = ? AND partition_no = ?",
+                    (run_id, row["partition_no"])).fetchone()
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return dict(claimed)
+
+    def renew(self, run_id: str, partition_no: int, owner: str, lease_seconds: float,
+              last_topic_id: int, processed: int, embedded: int) -> bool:
+        # Lưu tiến độ trang vừa ghi và gia hạn lease; False nếu lease đã bị worker khác nhận lại
+        now = time.time()
+        with self._lock:
+            cur = self.conn.execute(
+                "UPDATE index_partitions SET lease_expires_at = ?, last_topic_id = ?, processed = ?, embedded = ?, "
+                "updated_at = ? WHERE run_id = ? AND partition_no = ? AND owner = ? AND status = ?",
+                (now + lease_seconds, last_topic_id, processed, embedded, now, run_id, partition_no, owner, LEASED))
+        return cur.rowcount == 1
+
+    def complete(self, run_id: str, partition_no: int, owner: str) -> bool:
+        now = time.time()
+        with self._lock:
+            cur = self.conn.execute(
+                "UPDATE index_partitions SET status = ?, lease_expires_at = NULL, updated_at = ?, finished_at = ? "
+                "WHERE run_id = ? AND partition_no = ? AND owner = ? AND status = ?",
+                (DONE, now, now, run_id, partition_no, owner, LEASED))
+        return cur.rowcount == 1
+
+    def fail(self, run_id: str, partition_no: int, owner: str, error: str, max_attempts: int) -> None:
+        # Trả phân vùng lỗi về hàng đợi để thử lại; quá max_attempts lần thì đánh dấu failed
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                "UPDATE index_partitions SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+                "owner = NULL, lease_expires_at = NULL, error = ?, updated_at = ? "
+                "WHERE run_id = ? AND partition_no = ? AND owner = ? AND status = ?",
+                (max_attempts, FAILED, PENDING, error, now, run_id, partition_no, owner, LEASED))
@@ -0,0 +1,187 @@
+﻿# -*- coding: utf-8 -*-
+# Pool kết nối SQL dùng chung cho mọi đường đọc dữ liệu đề tài (SQL Server qua pyodbc hoặc SQLite)
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from contextlib import contextmanager
+import atexit
+import threading
+import time
+from dupliapp.config import settings
+
+class PoolTimeoutError(RuntimeError):
+    """Không lấy được kết nối trong thời gian chờ cho phép (pool đã đầy)"""
+
+class ConnectionPool:
+    """
+    Pool kết nối có giới hạn, tái sử dụng kết nối giữa các request
+
+    Chức năng:
+    - Tối đa max_size kết nối mở cùng lúc; request vượt quá sẽ chờ tới acquire_timeout
+    - Kết nối sống quá max_lifetime giây bị đóng và tạo lại (tránh kết nối "già")
+    - Kết nối nhàn rỗi lâu hơn health_check_after giây được kiểm tra bằng SELECT 1
+      trước khi trao cho người dùng; kết nối hỏng bị loại bỏ
+    - Kết nối luôn được trả lại pool (hoặc đóng nếu hỏng) khi ra khỏi context manager
+    """
+
+    def __init__(self, connect: Callable[[], Any], max_size: int = 5, max_lifetime: float = 1800.0,
+                 acquire_timeout: float = 30.0, health_check_after: float = 30.0):
+        self._connect = connect
+        self.max_size = max(1, int(max_size))
+        self.max_lifetime = max_lifetime
+        self.acquire_timeout = acquire_timeout
+        self.health_check_after = health_check_after
+
+        self._cond = threading.Condition()
+        # Mỗi phần tử: (connection, thời điểm tạo, thời điểm trả lại pool)
+        self._idle: List[Tuple[Any, float, float]] = []
+        self._created_at: Dict[int, float] = {}
+        self._size = 0
+        self._closed = False
+        self.created = 0
+        self.discarded = 0
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.max_lifetime > 0 and now - created_at >= self.max_lifetime
+
+    @staticmethod
+    def _is_healthy(conn: Any) -> bool:
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchall()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn: Any) -> None:
+        # Đóng kết nối và giải phóng một chỗ trong pool
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._created_at.pop(id(conn), None)
+            self._size -= 1
+            self.discarded += 1
+            self._cond.notify()
+
+    def acquire(self, timeout: Optional[float] = None) -> Any:
+        # Lấy một kết nối: ưu tiên kết nối nhàn rỗi, tạo mới nếu còn chỗ, ngược lại chờ
+        timeout = self.acquire_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError("Connection pool is closed")
+                candidate = None
+                if self._idle:
+                    candidate = self._idle.pop()
+                elif self._size < self.max_size:
+                    # Giữ chỗ trước rồi mới mở kết nối bên ngoài lock
+                    self._size += 1
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeoutError(f"No SQL connection available after {timeout}s (pool size {self.max_size})")
+                    self._cond.wait(remaining)
+                    continue
+
+            if candidate is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._created_at[id(conn)] = time.monotonic()
+                    self.created += 1
+                return conn
+
+            conn, created_at, released_at = candidate
+            now = time.monotonic()
+            if self._expired(created_at, now):
+                self._discard(conn)
+                continue
+            if now - released_at >= self.health_check_after and not self._is_healthy(conn):
+                self._discard(conn)
+                continue
+            return conn
+
+    def release(self, conn: Any, broken: bool = False) -> None:
+        # Trả kết nối về pool; kết nối hỏng hoặc quá tuổi thọ bị đóng
+        with self._cond:
+            created_at = self._created_at.get(id(conn), 0.0)
+            closed = self._closed
+        now = time.monotonic()
+        if broken or closed or self._expired(created_at, now):
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, created_at, now))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None) -> Iterator[Any]:
+        # Context manager: luôn trả kết nối lại pool kể cả khi truy vấn lỗi
+        conn = self.acquire(timeout)
+        broken = False
+        try:
+            yield conn
+        except Exception:
+            # Hủy giao dịch dở dang; nếu rollback cũng lỗi thì kết nối coi như hỏng
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+            raise
+        finally:
+            self.release(conn, broken=broken)
+
+    def close(self) -> None:
+        # Đóng tất cả kết nối nhàn rỗi; kết nối đang dùng sẽ bị đóng khi được trả lại
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn, _, _ in idle:
+            self._discard(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "inUse": self._size - len(self._idle),
+                "maxSize": self.max_size,
+                "created": self.created,
+                "discarded": self.discarded,
+            }
+
+# Các pool dùng chung trong tiến trình, mỗi nguồn dữ liệu (key) một pool
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+def get_pool(key: str, connect: Callable[[], Any]) -> ConnectionPool:
+    # Lấy pool theo key (vd: chuỗi kết nối), tạo mới với cấu hình SQL_POOL_* nếu chưa có
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(
+                connect,
+                max_size=settings.SQL_POOL_SIZE,
+                max_lifetime=settings.SQL_POOL_MAX_LIFETIME_SECONDS,
+                acquire_timeout=settings.SQL_POOL_ACQUIRE_TIMEOUT_SECONDS,
+                health_check_after=settings.SQL_POOL_HEALTH_CHECK_SECONDS,
+            )
+            _pools[key] = pool
+        return pool
+
+def close_all_pools() -> None:
+    # Đóng mọi pool (gọi khi tắt ứng dụng)
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+atexit.register(close_all_pools)
@@ -0,0 +1,43 @@
+﻿# -*- coding: utf-8 -*-
+# Khóa dùng chung giữa các thread và các process trên cùng máy, dựa trên file SQLite cạnh STATE_DB_PATH
+from contextlib import contextmanager
+from typing import ContextManager, Iterator, Optional
+import os
+import sqlite3
+from dupliapp.config import settings
+
+@contextmanager
+def state_lock(name: str, shared: bool = False, timeout: Optional[float] = None) -> Iterator[None]:
+    """
+    Khóa đọc/ghi liên process theo tên
+
+    Mỗi khóa là một file SQLite riêng "<STATE_DB_PATH>.<name>-lock". shared=True mở transaction đọc
+    (khóa SHARED - nhiều người giữ cùng lúc), shared=False mở transaction EXCLUSIVE (chờ mọi người
+    giữ SHARED nhả ra và chặn người mới). Hết timeout (giây) mà chưa lấy được khóa -> TimeoutError.
+    """
+    path = f"{settings.STATE_DB_PATH}.{name}-lock"
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=timeout if timeout is not None else settings.STATE_LOCK_TIMEOUT_SECONDS,
+                           isolation_level=None, check_same_thread=False)
+    try:
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS lock (id INTEGER)")
+            if shared:
+                conn.execute("BEGIN")
+                # Khóa SHARED chỉ được lấy khi transaction đọc dữ liệu
+                conn.execute("SELECT COUNT(*) FROM lock").fetchone()
+            else:
+                conn.execute("BEGIN EXCLUSIVE")
+        except sqlite3.OperationalError as e:
+            raise TimeoutError(f"Lock '{name}' busy: {e}") from e
+        try:
+            yield
+        finally:
+            conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+def index_write_lock(exclusive: bool = False) -> ContextManager[None]:
+    # Khóa ghi chỉ mục: mọi lần ghi vào collection đề tài giữ khóa chung (shared); compaction giữ khóa
+    # độc quyền ở bước chép bù + đổi collection để không lần ghi nào bị mất giữa hai collection
+    return state_lock("index-write", shared=not exclusive)
@@ -0,0 +1,72 @@
+﻿# -*- coding: utf-8 -*-
+# Repository lưu trạng thái lập chỉ mục (watermark đồng bộ, ...) trong file SQLite cục bộ
+from typing import Any, Optional
+import json
+import os
+import sqlite3
+import threading
+import time
+from dupliapp.config import settings
+
+class IndexStateRepository:
+    """
+    Kho key/value nhỏ lưu trạng thái lập chỉ mục giữa các lần chạy
+
+    Giá trị được lưu dưới dạng JSON trong bảng index_state của file STATE_DB_PATH.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or settings.STATE_DB_PATH
+        # Tạo thư mục chứa file trạng thái nếu chưa tồn tại
+        folder = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(folder, exist_ok=True)
+
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS index_state ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            # Bộ đếm số nguyên cộng dồn nguyên tử giữa nhiều process (vd: số tombstone)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS index_counters ("
+                " key TEXT PRIMARY KEY,"
+                " value INTEGER NOT NULL)"
+            )
+
+    def get(self, key: str, default: Any = None) -> Any:
+        # Đọc giá trị theo key, trả về default nếu chưa có
+        with self._lock:
+            row = self.conn.execute("SELECT value FROM index_state WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, key: str, value: Any) -> None:
+        # Ghi (hoặc ghi đè) giá trị theo key
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO index_state (key, value, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+                (key, json.dumps(value), time.time()),
+            )
+
+    def counter(self, key: str) -> int:
+        # Giá trị bộ đếm, 0 nếu chưa có
+        with self._lock:
+            row = self.conn.execute("SELECT value FROM index_counters WHERE key = ?", (key,)).fetchone()
+        return int(row[0]) if row else 0
+
+    def increment(self, key: str, delta: int) -> None:
+        # Cộng delta trong một câu lệnh (value = value + ?) nên lần cộng đồng thời của process khác không bị mất
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO index_counters (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = value + excluded.value",
+                (key, delta),
+            )
+
+    def delete(self, key: str) -> None:
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM index_state WHERE key = ?", (key,))
@@ -1,54 +1,238 @@
 ﻿# -*- coding: utf-8 -*-
-# Repository đọc dữ liệu topic từ SQL Server bằng pyodbc
-from typing import List, Dict, Any, Optional
-import pyodbc
+# Repository đọc dữ liệu topic từ SQL Server bằng pyodbc (hoặc SQLite làm bản thay thế cục bộ)
+from typing import List, Dict, Any, Iterator, Optional, Sequence
+import sqlite3
 from dupliapp.config import settings
+from dupliapp.repositories.sql_pool import ConnectionPool, get_pool
+from dupliapp.utils.topic_record import SQL_COLUMNS, TopicRecord
+
+try:
+    import pyodbc
+except ImportError:
+    # pyodbc (hoặc unixODBC) không có sẵn - vẫn dùng được nguồn SQLite
+    pyodbc = None
+
+try:
+    # Đọc kết quả ODBC trực tiếp thành Arrow record batch (tùy chọn)
+    from arrow_odbc import read_arrow_batches_from_odbc
+except ImportError:
+    read_arrow_batches_from_odbc = None
 
 # SQL query để lấy phiên bản mới nhất của các đề tài
 # Sử dụng CTE (Common Table Expression) để lấy version mới nhất cho mỗi TopicId
+# Các placeholder {schema}, {nolock}, {top_clause}, {limit_clause} phụ thuộc vào loại CSDL
 SQL = r"""
 WITH latest AS (
     SELECT *, ROW_NUMBER() OVER (PARTITION BY TopicId ORDER BY VersionNumber DESC) AS rn
-    FROM dbo.topic_versions WITH (NOLOCK)
+    FROM {schema}topic_versions{nolock}
     WHERE IsActive = 1
 )
 SELECT {top_clause}
     t.Id AS TopicId,
-    l.Id AS TopicVersionId, 
+    l.Id AS TopicVersionId,
     l.Title, l.Description, l.Objectives, l.Methodology, l.ExpectedOutcomes, l.Requirements
-FROM dbo.topics t WITH (NOLOCK)
+FROM {schema}topics t{nolock}
 JOIN latest l ON l.TopicId = t.Id AND l.rn = 1
-ORDER BY t.Id ASC
+{where_clause}
+ORDER BY {order_by}
+{limit_clause}
+"""
+
+# Thống kê nguồn: số đề tài có phiên bản đang hoạt động và TopicVersionId lớn nhất
+STATS_SQL = r"""
+SELECT COUNT(DISTINCT v.TopicId) AS TopicCount, MAX(v.Id) AS MaxTopicVersionId
+FROM {schema}topic_versions v{nolock}
+JOIN {schema}topics t{nolock} ON t.Id = v.TopicId
+WHERE v.IsActive = 1
 """
 
-class MsSqlTopicRepository:
+# Chia các đề tài có phiên bản đang hoạt động thành ? khoảng TopicId liên tiếp có số lượng gần bằng nhau
+PARTITION_SQL = r"""
+SELECT Bucket, MIN(TopicId) AS FromTopicId, MAX(TopicId) AS ToTopicId, COUNT(*) AS TopicCount
+FROM (
+    SELECT t.Id AS TopicId, NTILE(?) OVER (ORDER BY t.Id) AS Bucket
+    FROM {schema}topics t{nolock}
+    WHERE EXISTS (SELECT 1 FROM {schema}topic_versions v{nolock} WHERE v.TopicId = t.Id AND v.IsActive = 1)
+) b
+GROUP BY Bucket
+ORDER BY Bucket
+"""
+
+class SqlTopicRepository:
+    # Lớp cơ sở: sinh câu SQL theo cú pháp của từng loại CSDL và chuyển kết quả thành dict
+    SCHEMA = ""
+    NOLOCK = ""
+
+    # Pool kết nối dùng chung giữa các instance có cùng nguồn dữ liệu
+    pool: ConnectionPool
+
+    def _render(self, where_clause: str, order_by: str, limited: bool, nolock: bool = True) -> str:
+        return SQL.format(
+            schema=self.SCHEMA,
+            nolock=self.NOLOCK if nolock else "",
+            top_clause="",
+            limit_clause="LIMIT ?" if limited else "",
+            where_clause=where_clause,
+            order_by=order_by,
+        )
+
+    def _params(self, where_params: Sequence[Any], limit: Optional[int]) -> tuple:
+        # LIMIT nằm cuối câu lệnh nên tham số limit đứng sau tham số WHERE
+        return tuple(where_params) + ((limit,) if limit else ())
+
+    def _query(self, where_clause: str = "", where_params: Sequence[Any] = (),
+               order_by: str = "t.Id ASC", limit: Optional[int] = None, nolock: bool = True) -> List[TopicRecord]:
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(self._render(where_clause, order_by, bool(limit), nolock=nolock),
+                        self._params(where_params, limit))
+
+            # Lấy vị trí các cột từ cursor.description (dùng chung cho pyodbc.Row và tuple của sqlite3)
+            # rồi tạo TopicRecord gọn thay vì một dict cho mỗi dòng
+            cols = [d[0] for d in cur.description]
+            positions = [cols.index(c) for c in SQL_COLUMNS]
+            return [TopicRecord(*[r[i] for i in positions]) for r in cur.fetchall()]
+
+    def fetch_latest(self, limit: Optional[int] = None) -> List[TopicRecord]:
+        # Lấy phiên bản mới nhất của các đề tài
+        return self._query(limit=limit)
+
+    def fetch_latest_columns(self, limit: Optional[int] = None,
+                             batch_size: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        # Đọc phiên bản mới nhất theo lô ở dạng cột (tên cột -> list giá trị)
+        # Không tạo dict cho từng dòng; mỗi lô có thể được embed ngay khi đọc xong
+        batch_size = batch_size or settings.SQL_FETCH_BATCH_SIZE
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(self._render("", "t.Id ASC", bool(limit)), self._params((), limit))
+            cols = [d[0] for d in cur.description]
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield dict(zip(cols, map(list, zip(*rows))))
+
+    def fetch_changed_since(self, watermark: int, limit: Optional[int] = None) -> List[TopicRecord]:
+        # Lấy phiên bản mới nhất của các đề tài có TopicVersionId > watermark
+        # Sắp xếp theo TopicVersionId để watermark tăng dần đúng thứ tự khi đọc theo lô
+        # Không dùng NOLOCK: đọc bẩn có thể trả về phiên bản của transaction sau đó bị rollback, hoặc
+        # bỏ sót dòng bị di chuyển khi tách trang - watermark sẽ vượt qua dòng đó mãi mãi
+        return self._query(
+            where_clause="WHERE l.Id > ?",
+            where_params=(watermark,),
+            order_by="l.Id ASC",
+            limit=limit,
+            nolock=False,
+        )
+
+    def fetch_page(self, after_topic_id: Optional[int], page_size: int,
+                   min_topic_id: Optional[int] = None, max_topic_id: Optional[int] = None) -> List[TopicRecord]:
+        # Phân trang keyset theo TopicId: trang tiếp theo bắt đầu sau TopicId cuối của trang trước
+        # Không dùng OFFSET nên chi phí mỗi trang không tăng theo vị trí trang
+        # min_topic_id/max_topic_id giới hạn trang trong một phân vùng TopicId (lập chỉ mục song song)
+        conditions, params = [], []
+        if after_topic_id is not None:
+            conditions.append("l.TopicId > ?")
+            params.append(after_topic_id)
+        if min_topic_id is not None:
+            conditions.append("l.TopicId >= ?")
+            params.append(min_topic_id)
+        if max_topic_id is not None:
+            conditions.append("l.TopicId <= ?")
+            params.append(max_topic_id)
+        return self._query(
+            where_clause="WHERE " + " AND ".join(conditions) if conditions else "",
+            where_params=params,
+            order_by="t.Id ASC",
+            limit=page_size,
+        )
+
+    def partition_bounds(self, partitions: int) -> List[Dict[str, Any]]:
+        # Khoảng TopicId [fromTopicId, toTopicId] của từng phân vùng (số đề tài mỗi phân vùng gần bằng nhau)
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(PARTITION_SQL.format(schema=self.SCHEMA, nolock=self.NOLOCK), (partitions,))
+            rows = cur.fetchall()
+        return [{"fromTopicId": r[1], "toTopicId": r[2], "topicCount": int(r[3])} for r in rows]
+
+    def source_stats(self) -> Dict[str, Any]:
+        # Tổng số đề tài (dùng để tính % tiến độ) và TopicVersionId lớn nhất hiện có
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(STATS_SQL.format(schema=self.SCHEMA, nolock=self.NOLOCK))
+            row = cur.fetchone()
+        return {"topicCount": int(row[0] or 0), "maxTopicVersionId": row[1]}
+
+class MsSqlTopicRepository(SqlTopicRepository):
+    SCHEMA = "dbo."
+    NOLOCK = " WITH (NOLOCK)"
+
     def __init__(self):
         # Kiểm tra và thiết lập kết nối SQL Server
         if not settings.SQLSERVER_CONN:
             raise RuntimeError("SQLSERVER_CONN env var is not set")
-        self.conn = pyodbc.connect(settings.SQLSERVER_CONN)
-
-    def fetch_latest(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
-        # Lấy phiên bản mới nhất của các đề tài từ SQL Server
-        cur = self.conn.cursor()
-        
-        # Thêm TOP clause nếu có limit
-        top_clause = "TOP (?)" if limit else ""
-        cur.execute(SQL.format(top_clause=top_clause), (limit,) if limit else ())
-        
-        rows = cur.fetchall()
-        out: List[Dict[str, Any]] = []
-        
-        # Chuyển đổi kết quả thành list of dictionaries
-        for r in rows:
-            out.append({
-                "TopicId": r.TopicId,
-                "TopicVersionId": r.TopicVersionId,
-                "Title": r.Title,
-                "Description": r.Description,
-                "Objectives": r.Objectives,
-                "Methodology": r.Methodology,
-                "ExpectedOutcomes": r.ExpectedOutcomes,
-                "Requirements": r.Requirements,
-            })
-        return out
+        if pyodbc is None:
+            raise RuntimeError("pyodbc is not available; install pyodbc and an ODBC driver")
+        # Dùng lại kết nối từ pool thay vì mở kết nối mới (login/TLS) cho mỗi lần gọi
+        self.pool = get_pool(f"mssql:{settings.SQLSERVER_CONN}", self._connect)
+
+    @staticmethod
+    def _connect() -> Any:
+        conn = pyodbc.connect(settings.SQLSERVER_CONN)
+        # Giới hạn thời gian chạy của mỗi câu truy vấn (giây)
+        conn.timeout = settings.SQL_QUERY_TIMEOUT_SECONDS
+        return conn
+
+    def _render(self, where_clause: str, order_by: str, limited: bool, nolock: bool = True) -> str:
+        # SQL Server dùng TOP (?) thay cho LIMIT
+        return SQL.format(
+            schema=self.SCHEMA,
+            nolock=self.NOLOCK if nolock else "",
+            top_clause="TOP (?)" if limited else "",
+            limit_clause="",
+            where_clause=where_clause,
+            order_by=order_by,
+        )
+
+    def _params(self, where_params: Sequence[Any], limit: Optional[int]) -> tuple:
+        # TOP (?) nằm trước WHERE nên tham số limit đứng đầu
+        return ((limit,) if limit else ()) + tuple(where_params)
+
+    def fetch_latest_columns(self, limit: Optional[int] = None,
+                             batch_size: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        # Ưu tiên đọc Arrow record batch qua arrow-odbc (không tạo pyodbc.Row cho từng dòng)
+        # Nếu arrow-odbc không có sẵn hoặc bị tắt thì dùng đường pyodbc fetchmany
+        if read_arrow_batches_from_odbc is None or not settings.SQL_ARROW_FETCH:
+            yield from super().fetch_latest_columns(limit=limit, batch_size=batch_size)
+            return
+
+        # arrow-odbc tự quản lý kết nối ODBC riêng nên không đi qua pool
+        reader = read_arrow_batches_from_odbc(
+            query=self._render("", "t.Id ASC", bool(limit)),
+            connection_string=settings.SQLSERVER_CONN,
+            batch_size=batch_size or settings.SQL_FETCH_BATCH_SIZE,
+            parameters=[str(limit)] if limit else None,
+            max_text_size=settings.SQL_ARROW_MAX_TEXT_SIZE,
+        )
+        for batch in reader:
+            yield {name: batch.column(i) for i, name in enumerate(batch.schema.names)}
+
+class SqliteTopicRepository(SqlTopicRepository):
+    # Bản thay thế cục bộ với cùng lược đồ bảng topics/topic_versions (không có schema dbo)
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or settings.TOPIC_SQLITE_PATH
+        self.pool = get_pool(f"sqlite:{self.path}", self._connect)
+
+    def _connect(self) -> sqlite3.Connection:
+        # timeout của sqlite3 là thời gian chờ khóa; kết nối được pool trao giữa các thread
+        return sqlite3.connect(self.path, timeout=settings.SQL_QUERY_TIMEOUT_SECONDS, check_same_thread=False)
+
+def get_topic_repository() -> SqlTopicRepository:
+    # Chọn repository theo cấu hình TOPIC_SOURCE
+    source = (settings.TOPIC_SOURCE or "mssql").strip().lower()
+    if source == "sqlite":
+        return SqliteTopicRepository()
+    if source == "mssql":
+        return MsSqlTopicRepository()
+    raise ValueError(f"Unsupported topic source: {settings.TOPIC_SOURCE}")
@@ -80,3 +80,81 @@ def stats():
     # Lấy thống kê chi tiết về cơ sở dữ liệu vector ChromaDB
     svc = TopicsService()
     return jsonify(svc.chroma_stats())
+
+@bp.get("/metadata-index")
+@swag_from({
+    'tags': ['Chroma'],
+    'summary': 'Thống kê chỉ mục bitmap metadata',
+    'description': 'Các key metadata được chỉ mục (METADATA_INDEX_KEYS), số vector, số giá trị khác nhau mỗi key và số lần tìm kiếm có metadataFilter theo từng chiến lược: exact (chấm điểm chính xác tập ứng viên nhỏ), ann (query HNSW có lọc), empty (không có ứng viên).',
+    'responses': {
+        200: {
+            'description': 'Lấy thống kê thành công',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'enabled': {'type': 'boolean', 'example': True},
+                    'keys': {'type': 'array', 'items': {'type': 'string'}, 'example': ['faculty', 'year']},
+                    'documents': {'type': 'integer', 'example': 1500},
+                    'values': {'type': 'object', 'example': {'faculty': 12, 'year': 6}},
+                    'searches': {'type': 'object', 'example': {'exact': 120, 'ann': 8, 'empty': 2}},
+                    'exactMaxCandidates': {'type': 'integer', 'example': 2000}
+                }
+            }
+        }
+    }
+})
+def metadata_index_stats():
+    return jsonify(TopicsService().metadata_index_stats())
+
+@bp.get("/lexical-index")
+@swag_from({
+    'tags': ['Chroma'],
+    'summary': 'Thống kê đường tắt từ vựng',
+    'description': 'Chỉ mục hash text chuẩn hóa và MinHash/LSH dùng để trả lời /topics/search cho bản sao (gần) y hệt trước khi chạy model embedding (LEXICAL_FAST_PATH), kèm tỉ lệ request được trả lời theo cách này.',
+    'responses': {
+        200: {
+            'description': 'Lấy thống kê thành công',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'enabled': {'type': 'boolean', 'example': True},
+                    'documents': {'type': 'integer', 'example': 1500},
+                    'distinctTexts': {'type': 'integer', 'example': 1480},
+                    'requests': {'type': 'integer', 'description': 'Số request /topics/search', 'example': 1000},
+                    'answeredExact': {'type': 'integer', 'example': 120},
+                    'answeredMinhash': {'type': 'integer', 'example': 45},
+                    'fastPathShare': {'type': 'number', 'format': 'float', 'description': 'Tỉ lệ request trả lời không cần embedding', 'example': 0.165},
+                    'jaccardThreshold': {'type': 'number', 'format': 'float', 'example': 0.9}
+                }
+            }
+        }
+    }
+})
+def lexical_index_stats():
+    return jsonify(TopicsService().lexical_index_stats())
+
+@bp.get("/bm25-index")
+@swag_from({
+    'tags': ['Chroma'],
+    'summary': 'Thống kê chỉ mục BM25',
+    'description': 'Chỉ mục đảo BM25 trên title/description (âm tiết bỏ dấu và cặp âm tiết) dùng để sinh thêm ứng viên cho tìm kiếm lai và làm đường tìm kiếm dự phòng khi model embedding quá tải (BM25_ENABLED), kèm số lần tìm kiếm theo từng cách.',
+    'responses': {
+        200: {
+            'description': 'Lấy thống kê thành công',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'enabled': {'type': 'boolean', 'example': True},
+                    'built': {'type': 'boolean', 'example': True},
+                    'documents': {'type': 'integer', 'example': 1500},
+                    'terms': {'type': 'integer', 'example': 9200},
+                    'postings': {'type': 'integer', 'example': 41000},
+                    'avgDocLength': {'type': 'number', 'format': 'float', 'example': 27.4},
+                    'searches': {'type': 'object', 'example': {'hybrid': 950, 'degraded': 12}}
+                }
+            }
+        }
+    }
+})
+def bm25_index_stats():
+    return jsonify(TopicsService().bm25_index_stats())
@@ -38,7 +38,7 @@ def root():
 	return jsonify({
 		"service": "duplicate-service-flask",
 		"version": "2.0.0",
-		"docs": ["/apidocs", "/health", "/chroma/stats", "/topics/search", "/topics/upsert", "/topics/bulk-upsert", "/index/topics"],
+		"docs": ["/apidocs", "/health", "/chroma/stats", "/topics/search", "/topics/upsert", "/topics/check-and-upsert", "/topics/bulk-upsert", "/topics/metadata", "/topics/delete", "/topics/neighbors", "/index/topics", "/index/sync", "/index/jobs", "/index/partitions", "/index/compact", "/index/knn"],
 		"embeddingType": embedding_type,
 		"embeddingModel": embedding_model,
 	})
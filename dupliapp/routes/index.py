@@ -1,17 +1,64 @@
 ﻿# -*- coding: utf-8 -*-
 # Route xây dựng lại index từ SQL Server (tùy chọn)
-from flask import Blueprint, request, jsonify
+from typing import Any, Dict, Iterator, Optional
+import json
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from flasgger import swag_from
 from dupliapp.services.index_service import IndexService
+from dupliapp.services.compaction_service import CompactionService
+from dupliapp.services.job_service import get_job_service, JOB_KIND_COMPACT, JOB_KIND_KNN
+from dupliapp.services.knn_service import KnnGraphService
+from dupliapp.services.partition_service import PartitionService
 
 # Tạo blueprint cho routes xây dựng chỉ mục
 bp = Blueprint("index", __name__, url_prefix="/index")
 
+# Schema job lập chỉ mục dùng chung cho các endpoint /index/jobs
+INDEX_JOB_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'jobId': {'type': 'string', 'description': 'Định danh job', 'example': '9b1deb4d3b7d4bad9bdd2b0d7b3dcb6d'},
+        'kind': {'type': 'string', 'description': 'Loại job', 'example': 'reindex'},
+        'status': {'type': 'string', 'description': 'queued | running | completed | failed | cancelled', 'example': 'running'},
+        'params': {'type': 'object', 'description': 'Tham số của job (limit, pageSize)'},
+        'processed': {'type': 'integer', 'description': 'Số đề tài đã xử lý', 'example': 1200},
+        'total': {'type': 'integer', 'description': 'Tổng số đề tài cần xử lý', 'example': 5000},
+        'embedded': {'type': 'integer', 'description': 'Số đề tài được tạo embedding mới', 'example': 800},
+        'percent': {'type': 'number', 'format': 'float', 'description': 'Phần trăm hoàn thành', 'example': 24.0},
+        'throughput': {'type': 'number', 'format': 'float', 'description': 'Số đề tài xử lý mỗi giây trong lần chạy hiện tại', 'example': 85.3},
+        'error': {'type': 'string', 'description': 'Thông báo lỗi nếu job thất bại', 'example': None},
+        'result': {'type': 'object', 'description': 'Checkpoint cuối cùng khi job kết thúc'},
+        'cancelRequested': {'type': 'boolean', 'description': 'Đã có yêu cầu hủy job', 'example': False},
+        'createdAt': {'type': 'number', 'description': 'Thời điểm tạo (epoch giây)'},
+        'startedAt': {'type': 'number', 'description': 'Thời điểm bắt đầu chạy (epoch giây)'},
+        'finishedAt': {'type': 'number', 'description': 'Thời điểm kết thúc (epoch giây)'}
+    }
+}
+
+JOB_NOT_FOUND_RESPONSE = {
+    'description': 'Không tìm thấy job',
+    'schema': {
+        'type': 'object',
+        'properties': {
+            'error': {'type': 'string', 'example': 'Job not found'}
+        }
+    }
+}
+
+def _ndjson(events: Iterator[Dict[str, Any]]) -> Iterator[str]:
+    # Chuyển các sự kiện thành NDJSON; lỗi giữa chừng được gửi thành dòng "error"
+    # vì status code đã được gửi đi cùng dòng đầu tiên
+    try:
+        for event in events:
+            yield json.dumps(event, ensure_ascii=False, default=str) + "\n"
+    except Exception as e:
+        yield json.dumps({"type": "error", "error": str(e)}, ensure_ascii=False) + "\n"
+
 @bp.post("/topics")
 @swag_from({
     'tags': ['Chỉ Mục'],
     'summary': 'Xây dựng lại chỉ mục đề tài từ SQL Server',
-    'description': 'Xây dựng lại chỉ mục vector bằng cách lấy đề tài từ SQL Server và tạo embeddings. Hữu ích cho thiết lập ban đầu hoặc đồng bộ hóa dữ liệu.',
+    'description': 'Xây dựng lại chỉ mục vector bằng cách lấy đề tài từ SQL Server và tạo embeddings. Mặc định yêu cầu được đưa vào hàng đợi và chạy nền: API trả về ngay jobId, theo dõi tiến độ qua GET /index/jobs/{jobId}. Gửi "wait": true để chạy đồng bộ và nhận bản tóm tắt (số lượng, thời gian, lỗi), hoặc "stream": true để nhận tiến độ từng lô dạng NDJSON (application/x-ndjson) trong khi đang lập chỉ mục.',
     'parameters': [
         {
             'name': 'body',
@@ -24,14 +71,48 @@ bp = Blueprint("index", __name__, url_prefix="/index")
                         'type': 'integer',
                         'description': 'Số lượng đề tài tối đa để lập chỉ mục (tùy chọn, lập chỉ mục tất cả nếu không được chỉ định)',
                         'example': 1000
+                    },
+                    'pageSize': {
+                        'type': 'integer',
+                        'description': 'Số đề tài mỗi trang khi chạy nền (mặc định REINDEX_PAGE_SIZE)',
+                        'example': 500
+                    },
+                    'wait': {
+                        'type': 'boolean',
+                        'description': 'true: chạy đồng bộ và trả kết quả; false (mặc định): tạo job chạy nền',
+                        'default': False
+                    },
+                    'stream': {
+                        'type': 'boolean',
+                        'description': 'true: chạy đồng bộ và stream mỗi lô một dòng JSON, dòng cuối có "type": "summary"',
+                        'default': False
+                    },
+                    'batchSize': {
+                        'type': 'integer',
+                        'description': 'Số đề tài đọc và ghi mỗi lô khi chạy đồng bộ (mặc định SQL_FETCH_BATCH_SIZE)',
+                        'example': 2000
+                    },
+                    'includeTopics': {
+                        'type': 'boolean',
+                        'description': 'Kèm danh sách đề tài đã lập chỉ mục trong kết quả (mặc định false, chỉ trả về tóm tắt)',
+                        'default': False
+                    },
+                    'force': {
+                        'type': 'boolean',
+                        'description': 'Embed lại mọi đề tài kể cả đề tài có nội dung không đổi (vd. sau khi đổi model embedding)',
+                        'default': False
                     }
                 }
             }
         }
     ],
     'responses': {
+        202: {
+            'description': 'Đã tạo job lập chỉ mục chạy nền',
+            'schema': INDEX_JOB_SCHEMA
+        },
         200: {
-            'description': 'Xây dựng lại chỉ mục hoàn thành thành công',
+            'description': 'Xây dựng lại chỉ mục hoàn thành (khi wait = true); khi stream = true mỗi dòng NDJSON là một sự kiện "batch", dòng cuối là "summary" cùng cấu trúc này',
             'schema': {
                 'type': 'object',
                 'properties': {
@@ -40,14 +121,54 @@ bp = Blueprint("index", __name__, url_prefix="/index")
                         'description': 'Số lượng đề tài được lập chỉ mục thành công',
                         'example': 1500
                     },
+                    'embedded': {
+                        'type': 'integer',
+                        'description': 'Số đề tài được tạo embedding mới',
+                        'example': 120
+                    },
+                    'skipped': {
+                        'type': 'integer',
+                        'description': 'Số đề tài có nội dung không đổi nên bỏ qua embedding',
+                        'example': 1380
+                    },
                     'total_topics': {
                         'type': 'integer',
                         'description': 'Tổng số đề tài được xử lý',
                         'example': 1500
                     },
+                    'batches': {
+                        'type': 'integer',
+                        'description': 'Số lô đã xử lý',
+                        'example': 1
+                    },
+                    'errors': {
+                        'type': 'array',
+                        'description': 'Các lô ghi thất bại (các lô khác vẫn được ghi)',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'batch': {'type': 'integer', 'example': 3},
+                                'firstTopicId': {'type': 'integer', 'example': 4001},
+                                'lastTopicId': {'type': 'integer', 'example': 6000},
+                                'error': {'type': 'string', 'example': 'Embedding service unavailable'}
+                            }
+                        }
+                    },
+                    'timings': {
+                        'type': 'object',
+                        'description': 'Thời gian đọc SQL, ghi vector database và tổng (ms)',
+                        'properties': {
+                            'fetchMs': {'type': 'number', 'example': 850.2},
+                            'writeMs': {'type': 'number', 'example': 42010.7},
+                            'totalMs': {'type': 'number', 'example': 42900.4},
+                            'chromaWriteMs': {'type': 'number', 'description': 'Tổng thời gian ghi ChromaDB (ms, tổng các lô max-batch-size)', 'example': 38120.5},
+                            'chromaChunks': {'type': 'integer', 'description': 'Số lô ghi ChromaDB', 'example': 42},
+                            'slowestChunkMs': {'type': 'number', 'description': 'Thời gian ghi của lô ChromaDB chậm nhất (ms)', 'example': 1210.4}
+                        }
+                    },
                     'topics': {
                         'type': 'array',
-                        'description': 'Danh sách các đề tài đã được thêm vào ChromaDB',
+                        'description': 'Danh sách các đề tài đã được thêm vào ChromaDB (chỉ khi includeTopics = true)',
                         'items': {
                             'type': 'object',
                             'properties': {
@@ -107,6 +228,480 @@ def index_topics():
     # Hữu ích cho thiết lập ban đầu hoặc đồng bộ hóa dữ liệu
     body = request.get_json(silent=True) or {}
     limit = body.get("limit")
+    force = bool(body.get("force"))
+    if body.get("stream"):
+        # Mỗi lô ghi xong được gửi ngay cho client dưới dạng một dòng JSON
+        svc = IndexService()
+        events = svc.iter_build_from_sql(limit=limit, batch_size=body.get("batchSize"),
+                                         include_topics=bool(body.get("includeTopics")), force=force)
+        return Response(stream_with_context(_ndjson(events)), mimetype="application/x-ndjson")
+    if body.get("wait"):
+        svc = IndexService()
+        result = svc.build_from_sql(limit=limit, batch_size=body.get("batchSize"),
+                                    include_topics=bool(body.get("includeTopics")), force=force)
+        return jsonify(result)
+
+    # Chạy nền: request HTTP không bị giữ trong suốt quá trình embed toàn bộ đề tài
+    job = get_job_service().submit(params={"limit": limit, "pageSize": body.get("pageSize"), "force": force})
+    return jsonify(job), 202
+
+@bp.post("/sync")
+@swag_from({
+    'tags': ['Chỉ Mục'],
+    'summary': 'Đồng bộ tăng dần đề tài từ SQL Server',
+    'description': 'Chỉ đọc và tạo embeddings cho các phiên bản đề tài có TopicVersionId lớn hơn watermark của lần đồng bộ trước, sau đó lưu watermark mới. SYNC_SAFETY_WINDOW phiên bản dưới watermark được quét lại để ghi phiên bản commit muộn còn thiếu; phiên bản cũ của đề tài vừa đồng bộ bị xóa khỏi chỉ mục. Chỉ một lượt đồng bộ chạy tại một thời điểm (kể cả poller).',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': False,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'batchSize': {
+                        'type': 'integer',
+                        'description': 'Số phiên bản đề tài đọc và embed mỗi lô (mặc định SYNC_BATCH_SIZE)',
+                        'example': 500
+                    }
+                }
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Đồng bộ tăng dần hoàn thành thành công',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'synced': {'type': 'integer', 'description': 'Số đề tài được cập nhật', 'example': 12},
+                    'embedded': {'type': 'integer', 'description': 'Số đề tài được tạo embedding mới', 'example': 10},
+                    'skipped': {'type': 'integer', 'description': 'Số đề tài có nội dung không đổi nên bỏ qua embedding', 'example': 2},
+                    'batches': {'type': 'integer', 'description': 'Số lô đã xử lý', 'example': 1},
+                    'fromWatermark': {'type': 'integer', 'description': 'Watermark trước khi đồng bộ', 'example': 1500},
+                    'watermark': {'type': 'integer', 'description': 'Watermark sau khi đồng bộ', 'example': 1512},
+                    'recovered': {'type': 'integer', 'description': 'Số phiên bản dưới watermark (commit muộn) được ghi bù', 'example': 0},
+                    'superseded': {'type': 'integer', 'description': 'Số phiên bản cũ bị xóa khỏi chỉ mục', 'example': 3},
+                    'chromaWriteMs': {'type': 'number', 'description': 'Tổng thời gian ghi ChromaDB (ms, tổng các lô max-batch-size)', 'example': 38120.5},
+                    'chromaChunks': {'type': 'integer', 'description': 'Số lô ghi ChromaDB', 'example': 42},
+                    'slowestChunkMs': {'type': 'number', 'description': 'Thời gian ghi của lô ChromaDB chậm nhất (ms)', 'example': 1210.4}
+                }
+            }
+        },
+        409: {'description': 'Một lượt đồng bộ khác đang chạy quá STATE_LOCK_TIMEOUT_SECONDS'},
+        500: {
+            'description': 'Lỗi máy chủ nội bộ trong quá trình đồng bộ',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string', 'example': 'Kết nối cơ sở dữ liệu thất bại'}
+                }
+            }
+        }
+    }
+})
+def sync_topics():
+    # Đồng bộ tăng dần: chi phí tỉ lệ với số thay đổi kể từ lần đồng bộ trước
+    body = request.get_json(silent=True) or {}
+    svc = IndexService()
+    try:
+        result = svc.sync_incremental(batch_size=body.get("batchSize"))
+    except TimeoutError as e:
+        # Lượt đồng bộ khác (poller hoặc process khác) đang giữ khóa "sync"
+        return jsonify({"error": str(e)}), 409
+    return jsonify(result)
+
+# Schema tiến độ dùng chung cho POST/GET /index/reindex
+REINDEX_PROGRESS_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'runId': {'type': 'string', 'description': 'Định danh lần xây dựng lại', 'example': '3f2b9c...'},
+        'status': {'type': 'string', 'description': 'running | completed | none', 'example': 'running'},
+        'lastTopicId': {'type': 'integer', 'description': 'TopicId cuối cùng đã ghi (checkpoint)', 'example': 1200},
+        'processed': {'type': 'integer', 'description': 'Số đề tài đã xử lý', 'example': 1200},
+        'embedded': {'type': 'integer', 'description': 'Số đề tài được tạo embedding mới', 'example': 800},
+        'total': {'type': 'integer', 'description': 'Tổng số đề tài tại thời điểm bắt đầu', 'example': 5000},
+        'chromaWriteMs': {'type': 'number', 'description': 'Tổng thời gian ghi ChromaDB (ms, tổng các lô max-batch-size)', 'example': 38120.5},
+        'chromaChunks': {'type': 'integer', 'description': 'Số lô ghi ChromaDB', 'example': 42},
+        'slowestChunkMs': {'type': 'number', 'description': 'Thời gian ghi của lô ChromaDB chậm nhất (ms)', 'example': 1210.4},
+        'percent': {'type': 'number', 'format': 'float', 'description': 'Phần trăm hoàn thành', 'example': 24.0}
+    }
+}
+
+@bp.post("/reindex")
+@swag_from({
+    'tags': ['Chỉ Mục'],
+    'summary': 'Xây dựng lại toàn bộ chỉ mục có checkpoint',
+    'description': 'Duyệt đề tài theo từng trang keyset (TopicId tăng dần), lưu checkpoint sau mỗi trang đã ghi. Nếu lần chạy trước bị dừng giữa chừng, lần chạy sau sẽ tiếp tục từ checkpoint.',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': False,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'pageSize': {
+                        'type': 'integer',
+                        'description': 'Số đề tài mỗi trang (mặc định REINDEX_PAGE_SIZE)',
+                        'example': 500
+                    },
+                    'resume': {
+                        'type': 'boolean',
+                        'description': 'Tiếp tục từ checkpoint của lần chạy dở dang (mặc định true)',
+                        'default': True
+                    },
+                    'force': {
+                        'type': 'boolean',
+                        'description': 'Embed lại mọi đề tài kể cả đề tài có nội dung không đổi (vd. sau khi đổi model embedding)',
+                        'default': False
+                    }
+                }
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Xây dựng lại chỉ mục hoàn thành',
+            'schema': REINDEX_PROGRESS_SCHEMA
+        }
+    }
+})
+def reindex():
+    # Xây dựng lại toàn bộ chỉ mục, tiếp tục được sau khi bị gián đoạn
+    body = request.get_json(silent=True) or {}
     svc = IndexService()
-    result = svc.build_from_sql(limit=limit)
+    result = svc.reindex(page_size=body.get("pageSize"), resume=body.get("resume", True),
+                         force=bool(body.get("force")))
     return jsonify(result)
+
+@bp.get("/reindex")
+@swag_from({
+    'tags': ['Chỉ Mục'],
+    'summary': 'Tiến độ xây dựng lại chỉ mục',
+    'description': 'Trả về checkpoint và phần trăm hoàn thành của lần xây dựng lại gần nhất, kể cả khi đang chạy.',
+    'responses': {
+        200: {
+            'description': 'Lấy tiến độ thành công',
+            'schema': REINDEX_PROGRESS_SCHEMA
+        }
+    }
+})
+def reindex_progress():
+    svc = IndexService()
+    return jsonify(svc.reindex_progress())
+
+@bp.get("/jobs")
+@swag_from({
+    'tags': ['Chỉ Mục'],
+    'summary': 'Danh sách job lập chỉ mục',
+    'description': 'Trả về các job lập chỉ mục gần nhất (mới nhất trước), gồm cả job đã hoàn thành trước khi khởi động lại dịch vụ.',
+    'parameters': [
+        {
+            'name': 'limit',
+            'in': 'query',
+            'type': 'integer',
+            'required': False,
+            'default': 20,
+            'description': 'Số job tối đa trả về'
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Lấy danh sách job thành công',
+            'schema': {'type': 'array', 'items': INDEX_JOB_SCHEMA}
+        }
+    }
+})
+def list_jobs():
+    limit = request.args.get("limit", default=20, type=int)
+    return jsonify(get_job_service().list(limit))
+
+@bp.get("/jobs/<job_id>")
+@swag_from({
+    'tags': ['Chỉ Mục'],
+    'summary': 'Trạng thái job lập chỉ mục',
+    'description': 'Trả về trạng thái, tiến độ (processed/total, %), tốc độ xử lý và lỗi (nếu có) của một job.',
+    'parameters': [
+        {'name': 'job_id', 'in': 'path', 'type': 'string', 'required': True, 'description': 'Định danh job'}
+    ],
+    'responses': {
+        200: {'description': 'Lấy trạng thái job thành công', 'schema': INDEX_JOB_SCHEMA},
+        404: JOB_NOT_FOUND_RESPONSE
+    }
+})
+def get_job(job_id: str):
+    job = get_job_service().get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+@bp.delete("/jobs/<job_id>")
+@swag_from({
+    'tags': ['Chỉ Mục'],
+    'summary': 'Hủy job lập chỉ mục',
+    'description': 'Job đang chờ bị hủy ngay; job đang chạy dừng sau trang hiện tại (các trang đã ghi được giữ nguyên).',
+    'parameters': [
+        {'name': 'job_id', 'in': 'path', 'type': 'string', 'required': True, 'description': 'Định danh job'}
+    ],
+    'responses': {
+        200: {'description': 'Đã ghi nhận yêu cầu hủy', 'schema': INDEX_JOB_SCHEMA},
+        404: JOB_NOT_FOUND_RESPONSE
+    }
+})
+def cancel_job(job_id: str):
+    job = get_job_service().cancel(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+# Trạng thái compaction: số vector, tombstone và dung lượng trên đĩa
+COMPACTION_STATUS_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'count': {'type': 'integer', 'description': 'Số vector còn sống', 'example': 1500},
+        'deletedSinceCompaction': {'type': 'integer', 'description': 'Số vector đã xóa kể từ lần compaction gần nhất', 'example': 500},
+        'tombstoneRatio': {'type': 'number', 'format': 'float', 'example': 0.25},
+        'threshold': {'type': 'number', 'format': 'float', 'description': 'COMPACTION_TOMBSTONE_RATIO', 'example': 0.2},
+        'needsCompaction': {'type': 'boolean', 'example': True},
+        'diskBytes': {'type': 'integer', 'description': 'Dung lượng CHROMA_DIR (null ở cloud mode)', 'example': 24830128},
+        'lastCompaction': {'type': 'object', 'description': 'Kết quả lần compaction gần nhất'}
+    }
+}
+
+@bp.post("/compact")
+@swag_from({
+    'tags': ['Chỉ Mục'],
+    'summary': 'Compaction chỉ mục vector',
+    'description': 'Chép các vector còn sống sang collection mới (chỉ mục HNSW không còn phần tử đã xóa), thay thế collection cũ và VACUUM file SQLite. Mặc định chỉ chạy khi tỉ lệ tombstone vượt ngưỡng (force=true để luôn chạy) và chạy nền như một job (202); "wait": true để chạy đồng bộ và nhận số liệu trước/sau. Nên chạy khi ít ghi.',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': False,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'force': {'type': 'boolean', 'description': 'Chạy kể cả khi chưa vượt ngưỡng', 'default': False},
+                    'wait': {'type': 'boolean', 'description': 'Chạy đồng bộ thay vì tạo job nền', 'default': False},
+                    'pageSize': {'type': 'integer', 'description': 'Số bản ghi chép mỗi trang (mặc định COMPACTION_PAGE_SIZE)', 'example': 1000}
+                }
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Compaction hoàn thành (hoặc bỏ qua vì chưa vượt ngưỡng)',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'status': {'type': 'string', 'description': 'completed | skipped', 'example': 'completed'},
+                    'processed': {'type': 'integer', 'description': 'Số vector đã chép', 'example': 1500},
+                    'reclaimedBytes': {'type': 'integer', 'example': 12585640},
+                    'elapsedSeconds': {'type': 'number', 'example': 2.41},
+                    'before': COMPACTION_STATUS_SCHEMA,
+                    'after': COMPACTION_STATUS_SCHEMA
+                }
+            }
+        },
+        202: {'description': 'Job compaction đã được tạo', 'schema': INDEX_JOB_SCHEMA}
+    }
+})
+def compact():
+    body = request.get_json(silent=True) or {}
+    if body.get("wait"):
+        result = CompactionService().compact(force=bool(body.get("force")), page_size=body.get("pageSize"))
+        return jsonify(result)
+    params = {k: body[k] for k in ("force", "pageSize") if body.get(k) is not None}
+    job = get_job_service().submit(JOB_KIND_COMPACT, params)
+    return jsonify(job), 202
+
+@bp.get("/compact")
+@swag_from({
+    'tags': ['Chỉ Mục'],
+    'summary': 'Trạng thái tombstone và dung lượng chỉ mục',
+    'description': 'Số vector còn sống, số vector đã xóa kể từ lần compaction gần nhất, tỉ lệ tombstone so với ngưỡng và dung lượng trên đĩa.',
+    'responses': {
+        200: {'description': 'Lấy trạng thái thành công', 'schema': COMPACTION_STATUS_SCHEMA}
+    }
+})
+def compaction_status():
+    return jsonify(CompactionService().status())
+
+# Trạng thái đồ thị kNN đã tính sẵn
+KNN_STATUS_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'enabled': {'type': 'boolean', 'description': 'KNN_GRAPH_ENABLED - cập nhật đồ thị khi upsert/xóa', 'example': True},
+        'k': {'type': 'integer', 'description': 'Số láng giềng lưu mỗi đề tài (KNN_K)', 'example': 10},
+        'count': {'type': 'integer', 'description': 'Số vector trong chỉ mục', 'example': 1500},
+        'nodes': {'type': 'integer', 'description': 'Số đề tài đã có láng giềng trong đồ thị', 'example': 1500},
+        'edges': {'type': 'integer', 'example': 15000},
+        'lastUpdatedAt': {'type': 'number', 'description': 'Lần cập nhật gần nhất (epoch giây)'}
+    }
+}
+
+@bp.post("/knn")
+@swag_from({
+    'tags': ['Chỉ Mục'],
+    'summary': 'Xây dựng lại đồ thị kNN',
+    'description': 'Tính lại láng giềng gần nhất của mọi đề tài từ vector đã lưu (không chạy model embedding). Dùng cho lần đầu bật KNN_GRAPH_ENABLED hoặc sau khi lập chỉ mục hàng loạt. Mặc định chạy nền như một job (202); "wait": true để chạy đồng bộ.',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': False,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'wait': {'type': 'boolean', 'description': 'Chạy đồng bộ thay vì tạo job nền', 'default': False},
+                    'pageSize': {'type': 'integer', 'description': 'Số đề tài mỗi trang (mặc định KNN_PAGE_SIZE)', 'example': 500}
+                }
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Xây dựng lại hoàn thành',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'status': {'type': 'string', 'example': 'completed'},
+                    'processed': {'type': 'integer', 'example': 1500},
+                    'k': {'type': 'integer', 'example': 10},
+                    'edges': {'type': 'integer', 'example': 15000},
+                    'elapsedSeconds': {'type': 'number', 'example': 3.2}
+                }
+            }
+        },
+        202: {'description': 'Job xây dựng lại đã được tạo', 'schema': INDEX_JOB_SCHEMA}
+    }
+})
+def rebuild_knn():
+    body = request.get_json(silent=True) or {}
+    if body.get("wait"):
+        return jsonify(KnnGraphService().rebuild(page_size=body.get("pageSize")))
+    params = {k: body[k] for k in ("pageSize",) if body.get(k) is not None}
+    job = get_job_service().submit(JOB_KIND_KNN, params)
+    return jsonify(job), 202
+
+@bp.get("/knn")
+@swag_from({
+    'tags': ['Chỉ Mục'],
+    'summary': 'Trạng thái đồ thị kNN',
+    'description': 'Số đề tài và số cạnh trong đồ thị láng giềng đã tính sẵn so với số vector trong chỉ mục.',
+    'responses': {
+        200: {'description': 'Lấy trạng thái thành công', 'schema': KNN_STATUS_SCHEMA}
+    }
+})
+def knn_status():
+    return jsonify(KnnGraphService().status())
+
+# Schema tiến độ lập chỉ mục song song theo phân vùng
+PARTITION_PROGRESS_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'runId': {'type': 'string', 'description': 'Định danh lần chạy', 'example': '5c8e0f...'},
+        'status': {'type': 'string', 'description': 'running | completed | failed | none', 'example': 'running'},
+        'partitions': {
+            'type': 'object',
+            'description': 'Số phân vùng theo trạng thái',
+            'properties': {
+                'total': {'type': 'integer', 'example': 8},
+                'pending': {'type': 'integer', 'example': 3},
+                'leased': {'type': 'integer', 'example': 4},
+                'done': {'type': 'integer', 'example': 1},
+                'failed': {'type': 'integer', 'example': 0}
+            }
+        },
+        'processed': {'type': 'integer', 'description': 'Số đề tài đã xử lý', 'example': 12000},
+        'embedded': {'type': 'integer', 'description': 'Số đề tài được tạo embedding mới', 'example': 12000},
+        'total': {'type': 'integer', 'description': 'Tổng số đề tài', 'example': 80000},
+        'percent': {'type': 'number', 'format': 'float', 'example': 15.0},
+        'throughput': {'type': 'number', 'format': 'float', 'description': 'Số đề tài mỗi giây (toàn bộ worker)', 'example': 410.5},
+        'workers': {'type': 'array', 'items': {'type': 'string'}, 'description': 'Worker đang giữ lease'},
+        'errors': {'type': 'array', 'items': {'type': 'object'}, 'description': 'Lỗi gần nhất của từng phân vùng'},
+        'items': {'type': 'array', 'items': {'type': 'object'}, 'description': 'Tiến độ từng phân vùng'}
+    }
+}
+
+@bp.post("/partitions")
+@swag_from({
+    'tags': ['Chỉ Mục'],
+    'summary': 'Lập chỉ mục lại song song theo phân vùng',
+    'description': 'Chia đề tài thành các khoảng TopicId có số lượng gần bằng nhau và khởi động worker trên máy hiện tại. Worker trên máy khác (dùng chung STATE_DB_PATH) tham gia qua POST /index/partitions/{runId}/workers. Phân vùng của worker bị dừng được nhận lại khi lease hết hạn.',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': False,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'partitions': {'type': 'integer', 'description': 'Số phân vùng (mặc định PARTITION_COUNT)', 'example': 8},
+                    'workers': {'type': 'integer', 'description': 'Số worker khởi động trên máy này', 'example': 4},
+                    'pageSize': {'type': 'integer', 'description': 'Số đề tài mỗi trang (mặc định REINDEX_PAGE_SIZE)', 'example': 500},
+                    'force': {'type': 'boolean', 'description': 'Embed lại mọi đề tài kể cả đề tài có nội dung không đổi (vd. sau khi đổi model embedding)', 'default': False}
+                }
+            }
+        }
+    ],
+    'responses': {
+        202: {'description': 'Đã lập kế hoạch và khởi động worker', 'schema': PARTITION_PROGRESS_SCHEMA}
+    }
+})
+def start_partitioned_reindex():
+    body = request.get_json(silent=True) or {}
+    svc = PartitionService()
+    progress = svc.plan(partitions=body.get("partitions"), page_size=body.get("pageSize"),
+                        force=bool(body.get("force")))
+    svc.start_workers(progress["runId"], int(body.get("workers", 1)))
+    return jsonify(progress), 202
+
+@bp.post("/partitions/<run_id>/workers")
+@swag_from({
+    'tags': ['Chỉ Mục'],
+    'summary': 'Thêm worker cho lần lập chỉ mục song song',
+    'description': 'Khởi động thêm worker trên máy hiện tại để nhận các phân vùng còn lại của lần chạy.',
+    'parameters': [
+        {'name': 'run_id', 'in': 'path', 'type': 'string', 'required': True, 'description': 'Định danh lần chạy'},
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': False,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'workers': {'type': 'integer', 'description': 'Số worker khởi động trên máy này', 'example': 4}
+                }
+            }
+        }
+    ],
+    'responses': {
+        202: {'description': 'Đã khởi động worker', 'schema': PARTITION_PROGRESS_SCHEMA},
+        404: {'description': 'Không tìm thấy lần chạy'}
+    }
+})
+def add_partition_workers(run_id: str):
+    body = request.get_json(silent=True) or {}
+    svc = PartitionService()
+    progress = svc.progress(run_id)
+    if progress["status"] == "none":
+        return jsonify({"error": "Run not found"}), 404
+    svc.start_workers(run_id, int(body.get("workers", 1)))
+    return jsonify(progress), 202
+
+@bp.get("/partitions")
+@bp.get("/partitions/<run_id>")
+@swag_from({
+    'tags': ['Chỉ Mục'],
+    'summary': 'Tiến độ lập chỉ mục song song',
+    'description': 'Tổng hợp tiến độ của mọi phân vùng (mặc định lần chạy gần nhất).',
+    'parameters': [
+        {'name': 'run_id', 'in': 'path', 'type': 'string', 'required': False, 'description': 'Định danh lần chạy'}
+    ],
+    'responses': {
+        200: {'description': 'Lấy tiến độ thành công', 'schema': PARTITION_PROGRESS_SCHEMA}
+    }
+})
+def partition_progress(run_id: Optional[str] = None):
+    return jsonify(PartitionService().progress(run_id))
@@ -1,19 +1,33 @@
 ﻿# -*- coding: utf-8 -*-
-# Các route thao tác Topic trong Chroma: upsert/bulk-upsert/search
+# Các route thao tác Topic trong Chroma: upsert/check-and-upsert/bulk-upsert/metadata/delete/search/similar/neighbors
 from flask import Blueprint, request, jsonify
 from flasgger import swag_from
 from dupliapp.config import settings
 from dupliapp.services.topic_service import TopicsService
+from dupliapp.services.knn_service import KnnGraphService
+from dupliapp.services.write_behind import get_write_behind
+from dupliapp.utils.topic_files import iter_ndjson_batches
 
 # Tạo blueprint cho routes quản lý đề tài
 bp = Blueprint("topics", __name__, url_prefix="/topics")
 
+# Content-Type được coi là NDJSON (mỗi dòng một đề tài) ở /topics/bulk-upsert
+NDJSON_MIMETYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl", "application/x-jsonlines")
+
 @bp.post("/upsert")
 @swag_from({
     'tags': ['Đề Tài'],
     'summary': 'Thêm hoặc cập nhật một đề tài',
-    'description': 'Thêm hoặc cập nhật một đề tài nghiên cứu với vector embeddings',
+    'description': 'Thêm hoặc cập nhật một đề tài nghiên cứu với vector embeddings. Khi bật WRITE_BEHIND_ENABLED, đề tài được ghi vào log bền vững và xác nhận ngay (202), sau đó được gom nhóm ghi vào ChromaDB; dùng ?wait=true để chờ tới khi đề tài tìm kiếm được.',
     'parameters': [
+        {
+            'name': 'wait',
+            'in': 'query',
+            'type': 'boolean',
+            'required': False,
+            'default': False,
+            'description': 'Chế độ ghi trễ: chờ tới khi đề tài đã được ghi vào ChromaDB'
+        },
         {
             'name': 'body',
             'in': 'body',
@@ -77,7 +91,25 @@ bp = Blueprint("topics", __name__, url_prefix="/topics")
             'schema': {
                 'type': 'object',
                 'properties': {
-                    'upserted': {'type': 'integer', 'example': 1}
+                    'upserted': {'type': 'integer', 'example': 1},
+                    'embedded': {'type': 'integer', 'description': 'Số đề tài được tạo embedding mới', 'example': 1},
+                    'skipped': {'type': 'integer', 'description': 'Số đề tài có nội dung không đổi nên bỏ qua embedding', 'example': 0},
+                    'chromaWrite': {
+                        'type': 'object',
+                        'description': 'Chỉ khi có ghi vào ChromaDB: thời gian ghi từng lô (không vượt quá maxBatchSize) và tổng (ms)',
+                        'example': {'chunks': [{'chunk': 1, 'size': 1, 'ms': 12.4}], 'totalMs': 12.6, 'maxBatchSize': 5461}
+                    }
+                }
+            }
+        },
+        202: {
+            'description': 'Chế độ ghi trễ: đề tài đã được ghi vào log, sẽ được ghi vào ChromaDB theo lô',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'queued': {'type': 'integer', 'example': 1},
+                    'seq': {'type': 'integer', 'description': 'Số thứ tự trong log ghi trễ', 'example': 1042},
+                    'visible': {'type': 'boolean', 'description': 'Đề tài đã được ghi vào ChromaDB', 'example': False}
                 }
             }
         },
@@ -95,16 +127,101 @@ bp = Blueprint("topics", __name__, url_prefix="/topics")
 def upsert():
     # Thêm hoặc cập nhật một đề tài với vector embedding
     data = request.get_json(force=True)
+    buffer = get_write_behind()
+    if buffer is not None:
+        # Ghi trễ: kiểm tra dữ liệu trước khi xác nhận để lô ghi sau này không bị lỗi
+        TopicsService.validate_item(data)
+        seq = buffer.enqueue(data)
+        if request.args.get("wait", "false").lower() == "true":
+            visible = buffer.wait_visible(seq, timeout=settings.WRITE_BEHIND_WAIT_TIMEOUT_SECONDS)
+            return jsonify({"queued": 1, "seq": seq, "visible": visible}), 200 if visible else 202
+        return jsonify({"queued": 1, "seq": seq, "visible": False}), 202
+
     svc = TopicsService()
-    svc.upsert_one(data)
-    return jsonify({"upserted": 1})
+    res = svc.upsert_one(data)
+    return jsonify(res)
+
+@bp.post("/check-and-upsert")
+@swag_from({
+    'tags': ['Đề Tài'],
+    'summary': 'Kiểm tra trùng lặp và đăng ký đề tài trong một lần gọi',
+    'description': 'Thay cho /topics/search rồi /topics/upsert: nội dung chỉ được embed một lần, kiểm tra trùng lặp (bỏ qua các phiên bản cùng topicId) và chỉ ghi vào ChromaDB nếu không trùng. Kiểm tra và ghi được khóa độc quyền nên hai đề tài tương tự gửi đồng thời không thể cùng được đăng ký. Luôn ghi trực tiếp (không qua WRITE_BEHIND_ENABLED).',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'required': ['topicId', 'topicVersionId'],
+                'properties': {
+                    'topicId': {'type': 'string', 'example': 'T001'},
+                    'topicVersionId': {'type': 'string', 'example': 'TV001'},
+                    'title': {'type': 'string', 'example': 'Ứng Dụng Machine Learning Trong Y Tế'},
+                    'description': {'type': 'string', 'example': 'Nghiên cứu về việc áp dụng kỹ thuật ML để cải thiện kết quả y tế'},
+                    'objectives': {'type': 'string', 'example': 'Phát triển các mô hình ML để dự đoán bệnh tật'},
+                    'methodology': {'type': 'string', 'example': 'Học có giám sát với dữ liệu y tế'},
+                    'expectedOutcomes': {'type': 'string', 'example': 'Cải thiện độ chính xác dự đoán bệnh tật'},
+                    'requirements': {'type': 'string', 'example': 'Python, TensorFlow, dữ liệu y tế'},
+                    'metadata': {'type': 'object', 'example': {'category': 'AI'}},
+                    'topK': {'type': 'integer', 'description': 'Số kết quả tương tự trả về', 'example': 5},
+                    'threshold': {'type': 'number', 'format': 'float', 'description': 'Ngưỡng similarity để coi là trùng lặp', 'example': 0.8}
+                }
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Không trùng lặp - đề tài đã được ghi',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'passed': {'type': 'boolean', 'example': True},
+                    'hits': {'type': 'array', 'items': {'type': 'object'}},
+                    'suggestions': {'type': 'array', 'items': {'type': 'object'}},
+                    'threshold': {'type': 'number', 'format': 'float', 'example': 0.8},
+                    'write': {
+                        'type': 'object',
+                        'description': 'Kết quả ghi như /topics/upsert',
+                        'example': {'upserted': 1, 'embedded': 1, 'skipped': 0}
+                    }
+                }
+            }
+        },
+        409: {'description': 'Trùng lặp - đề tài không được ghi (passed=false, write=null, hits là các đề tài trùng)'},
+        400: {'description': 'Yêu cầu không hợp lệ - thiếu trường bắt buộc hoặc nội dung rỗng'},
+        503: {'description': 'Hết thời gian chờ khóa kiểm tra + ghi (CHECK_AND_UPSERT_LOCK_TIMEOUT_SECONDS)'}
+    }
+})
+def check_and_upsert():
+    # Kiểm tra trùng lặp + ghi đề tài với một lần embed
+    data = request.get_json(force=True)
+    try:
+        res = TopicsService().check_and_upsert(
+            data,
+            top_k=data.get("topK") or settings.TOPK,
+            threshold=data.get("threshold") or settings.THRESHOLD,
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except TimeoutError as e:
+        return jsonify({"error": str(e)}), 503
+    return jsonify(res), 200 if res["passed"] else 409
 
 @bp.post("/bulk-upsert")
 @swag_from({
     'tags': ['Đề Tài'],
     'summary': 'Thêm hoặc cập nhật nhiều đề tài',
-    'description': 'Thêm hoặc cập nhật nhiều đề tài nghiên cứu với vector embeddings trong một thao tác',
+    'description': 'Thêm hoặc cập nhật nhiều đề tài nghiên cứu với vector embeddings trong một thao tác. Với Content-Type application/x-ndjson (mỗi dòng một đề tài, có thể nén với Content-Encoding: gzip), request được đọc dần và embed/ghi theo từng lô chunkSize đề tài; kết quả trả về theo từng lô.',
+    'consumes': ['application/json', 'application/x-ndjson'],
     'parameters': [
+        {
+            'name': 'chunkSize',
+            'in': 'query',
+            'type': 'integer',
+            'required': False,
+            'description': 'NDJSON: số đề tài embed/ghi mỗi lô (mặc định BULK_UPSERT_CHUNK_SIZE)'
+        },
         {
             'name': 'body',
             'in': 'body',
@@ -177,7 +294,27 @@ def upsert():
             'schema': {
                 'type': 'object',
                 'properties': {
-                    'upserted': {'type': 'integer', 'example': 5}
+                    'upserted': {'type': 'integer', 'example': 5},
+                    'embedded': {'type': 'integer', 'description': 'Số đề tài được tạo embedding mới', 'example': 3},
+                    'skipped': {'type': 'integer', 'description': 'Số đề tài có nội dung không đổi nên bỏ qua embedding', 'example': 2},
+                    'received': {'type': 'integer', 'description': 'NDJSON: số đề tài đã đọc', 'example': 5},
+                    'failedChunks': {'type': 'integer', 'description': 'NDJSON: số lô lỗi', 'example': 0},
+                    'chunks': {
+                        'type': 'array',
+                        'description': 'NDJSON: kết quả từng lô',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'chunk': {'type': 'integer', 'example': 1},
+                                'items': {'type': 'integer', 'example': 256},
+                                'upserted': {'type': 'integer', 'example': 256},
+                                'embedded': {'type': 'integer', 'example': 200},
+                                'skipped': {'type': 'integer', 'example': 56},
+                                'chromaWrite': {'type': 'object', 'description': 'Thời gian ghi ChromaDB theo lô của lô này', 'example': {'chunks': [{'chunk': 1, 'size': 256, 'ms': 180.2}], 'totalMs': 180.9, 'maxBatchSize': 5461}},
+                                'error': {'type': 'string', 'example': None}
+                            }
+                        }
+                    }
                 }
             }
         },
@@ -194,11 +331,208 @@ def upsert():
 })
 def bulk_upsert():
     # Thêm hoặc cập nhật nhiều đề tài cùng lúc (hiệu quả hơn)
+    if request.mimetype in NDJSON_MIMETYPES:
+        # Đọc body dần theo dòng thay vì parse toàn bộ JSON; mỗi lô được ghi rồi giải phóng
+        chunk_size = request.args.get("chunkSize", default=settings.BULK_UPSERT_CHUNK_SIZE, type=int)
+        compressed = request.headers.get("Content-Encoding", "").lower() == "gzip"
+        svc = TopicsService()
+        res = svc.upsert_chunks(iter_ndjson_batches(request.stream, max(1, chunk_size), compressed=compressed))
+        return jsonify(res)
+
     data = request.get_json(force=True)
     items = data.get("items") if isinstance(data, dict) else data
     svc = TopicsService()
-    n = svc.upsert_many(items)
-    return jsonify({"upserted": n})
+    res = svc.upsert_many(items)
+    return jsonify(res)
+
+@bp.patch("/metadata")
+@swag_from({
+    'tags': ['Đề Tài'],
+    'summary': 'Cập nhật metadata đề tài (không embed lại)',
+    'description': 'Cập nhật chỉ metadata bổ sung (trạng thái, giảng viên hướng dẫn, khoa...) của một hoặc nhiều phiên bản đề tài. Vector và nội dung giữ nguyên nên không tốn chi phí chạy model embedding. Metadata mới được gộp vào metadata hiện có; key có giá trị null bị xóa. Không sửa được các key nội dung (Title, Description...), TopicId, TopicVersionId, ContentHash - dùng /topics/upsert cho các thay đổi đó.',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'items': {
+                        'type': 'array',
+                        'description': 'Metadata riêng cho từng phiên bản đề tài',
+                        'items': {
+                            'type': 'object',
+                            'required': ['topicVersionId', 'metadata'],
+                            'properties': {
+                                'topicVersionId': {'type': 'string', 'example': 'TV001'},
+                                'metadata': {'type': 'object', 'example': {'status': 'approved'}}
+                            }
+                        }
+                    },
+                    'topicVersionId': {
+                        'type': 'string',
+                        'description': 'Một phiên bản đề tài (dùng cùng metadata)',
+                        'example': 'TV001'
+                    },
+                    'topicVersionIds': {
+                        'type': 'array',
+                        'items': {'type': 'string'},
+                        'description': 'Nhiều phiên bản đề tài nhận cùng một metadata',
+                        'example': ['TV001', 'TV002']
+                    },
+                    'metadata': {
+                        'type': 'object',
+                        'description': 'Metadata cần cập nhật (dùng với topicVersionId/topicVersionIds)',
+                        'example': {'status': 'approved', 'supervisor': 'TS. Nguyễn Văn A'}
+                    }
+                }
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Cập nhật metadata thành công',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'updated': {'type': 'integer', 'example': 2},
+                    'notFound': {
+                        'type': 'array',
+                        'items': {'type': 'string'},
+                        'description': 'TopicVersionId không có trong chỉ mục',
+                        'example': []
+                    }
+                }
+            }
+        },
+        400: {
+            'description': 'Yêu cầu không hợp lệ',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string', 'example': "Metadata keys cannot be patched: ['Title']"}
+                }
+            }
+        }
+    }
+})
+def patch_metadata():
+    # Cập nhật metadata cho một/nhiều phiên bản đề tài mà không embed lại
+    data = request.get_json(force=True)
+    if isinstance(data, dict) and "items" not in data:
+        # Cùng một metadata cho một hoặc nhiều TopicVersionId
+        version_ids = data.get("topicVersionIds")
+        if version_ids is None and "topicVersionId" in data:
+            version_ids = [data["topicVersionId"]]
+        if version_ids is not None and (not isinstance(version_ids, list) or not version_ids):
+            # Chuỗi "TV1" sẽ bị duyệt thành từng ký tự -> từ chối như /topics/neighbors
+            return jsonify({"error": "Provide a non-empty 'topicVersionIds' array"}), 400
+        items = [{"topicVersionId": v, "metadata": data.get("metadata")} for v in version_ids or []]
+    else:
+        items = data.get("items") if isinstance(data, dict) else data
+
+    try:
+        res = TopicsService().update_metadata(items)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(res)
+
+# Kết quả xóa đề tài dùng chung cho POST /topics/delete và DELETE /topics/{topicVersionId}
+DELETE_RESULT_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'deleted': {'type': 'integer', 'description': 'Số vector đã xóa', 'example': 3},
+        'count': {'type': 'integer', 'description': 'Số vector còn lại trong chỉ mục', 'example': 1497},
+        'tombstoneRatio': {'type': 'number', 'format': 'float', 'description': 'Tỉ lệ vector đã xóa kể từ lần compaction gần nhất', 'example': 0.05},
+        'compactionJobId': {'type': 'string', 'description': 'Job compaction được xếp hàng khi tỉ lệ vượt ngưỡng (null nếu không)', 'example': None}
+    }
+}
+
+@bp.post("/delete")
+@swag_from({
+    'tags': ['Đề Tài'],
+    'summary': 'Xóa nhiều đề tài khỏi chỉ mục',
+    'description': 'Xóa đề tài bị rút hoặc bị từ chối theo đúng một trong ba cách: danh sách TopicVersionId, danh sách TopicId (mọi phiên bản) hoặc điều kiện metadata (where). Khi tỉ lệ vector đã xóa vượt COMPACTION_TOMBSTONE_RATIO, job compaction được xếp hàng tự động (COMPACTION_AUTO).',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'topicVersionIds': {
+                        'type': 'array',
+                        'items': {'type': 'string'},
+                        'example': ['TV001', 'TV002']
+                    },
+                    'topicIds': {
+                        'type': 'array',
+                        'items': {'type': 'string'},
+                        'example': ['T001']
+                    },
+                    'where': {
+                        'type': 'object',
+                        'description': 'Điều kiện lọc metadata theo cú pháp ChromaDB',
+                        'example': {'status': 'rejected'}
+                    }
+                }
+            }
+        }
+    ],
+    'responses': {
+        200: {'description': 'Xóa thành công', 'schema': DELETE_RESULT_SCHEMA},
+        400: {
+            'description': 'Yêu cầu không hợp lệ',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string', 'example': "Provide exactly one of 'topicVersionIds', 'topicIds' or 'where'"}
+                }
+            }
+        }
+    }
+})
+def delete_topics():
+    # Xóa nhiều đề tài theo TopicVersionId, TopicId hoặc điều kiện metadata
+    data = request.get_json(force=True) or {}
+    try:
+        res = TopicsService().delete_topics(
+            topic_version_ids=data.get("topicVersionIds"),
+            topic_ids=data.get("topicIds"),
+            where=data.get("where"),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(res)
+
+@bp.delete("/<topic_version_id>")
+@swag_from({
+    'tags': ['Đề Tài'],
+    'summary': 'Xóa một phiên bản đề tài',
+    'description': 'Xóa một phiên bản đề tài khỏi chỉ mục; 404 nếu không có trong chỉ mục.',
+    'parameters': [
+        {'name': 'topic_version_id', 'in': 'path', 'type': 'string', 'required': True, 'description': 'TopicVersionId cần xóa'}
+    ],
+    'responses': {
+        200: {'description': 'Xóa thành công', 'schema': DELETE_RESULT_SCHEMA},
+        404: {
+            'description': 'Không tìm thấy đề tài trong chỉ mục',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string', 'example': 'Topic version not found'}
+                }
+            }
+        }
+    }
+})
+def delete_topic(topic_version_id: str):
+    res = TopicsService().delete_topics(topic_version_ids=[topic_version_id])
+    if res["deleted"] == 0:
+        return jsonify({"error": "Topic version not found"}), 404
+    return jsonify(res)
 
 @bp.post("/search")
 @swag_from({
@@ -265,6 +599,36 @@ def bulk_upsert():
                         'type': 'object',
                         'description': 'Lọc kết quả theo siêu dữ liệu',
                         'example': {'category': 'AI'}
+                    },
+                    'gate': {
+                        'type': 'boolean',
+                        'description': 'Chế độ cổng: chỉ query đề tài gần nhất (chỉ lấy distance) và trả về passed + similarity, không có hits/suggestions',
+                        'default': False
+                    },
+                    'range': {
+                        'type': 'boolean',
+                        'description': 'Tìm kiếm theo khoảng: hits gồm mọi đề tài có similarity >= threshold (bỏ qua topK), số ứng viên tăng dần tới RANGE_SEARCH_MAX_K',
+                        'default': False
+                    },
+                    'maxResults': {
+                        'type': 'integer',
+                        'description': 'Chỉ với range: số kết quả tối đa (không vượt quá RANGE_SEARCH_MAX_K)',
+                        'example': 50
+                    },
+                    'hybrid': {
+                        'type': 'boolean',
+                        'description': 'Khi BM25_ENABLED: hợp ứng viên BM25 và ANN rồi chấm lại bằng vector đã lưu (mặc định theo HYBRID_SEARCH_DEFAULT, false để chỉ dùng ANN)',
+                        'default': False
+                    },
+                    'degraded': {
+                        'type': 'boolean',
+                        'description': 'Khi BM25_ENABLED: chỉ tìm bằng BM25, không chạy model embedding (cũng được dùng tự động khi model quá tải hoặc lỗi)',
+                        'default': False
+                    },
+                    'multiVector': {
+                        'type': 'boolean',
+                        'description': 'Khi MULTI_VECTOR_ENABLED: so từng trường của query với cùng trường của đề tài đã lưu ("text" tự do được so với mọi trường) và gộp theo MULTI_VECTOR_WEIGHTS (false để dùng vector đề tài)',
+                        'default': True
                     }
                 }
             }
@@ -281,6 +645,44 @@ def bulk_upsert():
                         'description': 'True nếu không tìm thấy trùng lặp trên ngưỡng',
                         'example': True
                     },
+                    'similarity': {
+                        'type': 'number',
+                        'format': 'float',
+                        'description': 'Chỉ ở chế độ cổng: similarity của đề tài gần nhất (null nếu chỉ mục rỗng)',
+                        'example': 0.62
+                    },
+                    'fastPath': {
+                        'type': 'string',
+                        'description': 'Chỉ khi LEXICAL_FAST_PATH trả lời mà không query ANN: exact (text chuẩn hóa trùng hẳn; similarity là cosine thật - 1.0 với text giống hệt, khác hoa/thường hoặc dấu câu thì embed query một lần) hoặc minhash (gần y hệt, similarity null, Jaccard ước lượng ở jaccard). Chỉ trả lời khi điểm >= threshold, ngược lại tìm kiếm như bình thường',
+                        'example': 'exact'
+                    },
+                    'jaccard': {
+                        'type': 'number',
+                        'format': 'float',
+                        'description': 'Chỉ ở chế độ cổng khi LEXICAL_FAST_PATH trả lời: Jaccard ước lượng của đề tài gần nhất',
+                        'example': 0.94
+                    },
+                    'degraded': {
+                        'type': 'boolean',
+                        'description': 'Chỉ khi tìm bằng BM25 (không có embedding truy vấn): luôn true; hits xếp theo điểm bm25, similarity là null, passed so lexical với threshold',
+                        'example': True
+                    },
+                    'lexical': {
+                        'type': 'number',
+                        'format': 'float',
+                        'description': 'Chỉ ở chế độ cổng khi degraded: cosine tần suất term (title/description) của đề tài gần nhất về từ ngữ',
+                        'example': 0.81
+                    },
+                    'candidates': {
+                        'type': 'integer',
+                        'description': 'Chỉ với tìm kiếm lai: số ứng viên (ANN + BM25) được chấm lại bằng vector đã lưu',
+                        'example': 58
+                    },
+                    'truncated': {
+                        'type': 'boolean',
+                        'description': 'Chỉ với range: đã chạm số kết quả tối đa trong khi vẫn còn đề tài >= threshold',
+                        'example': False
+                    },
                     'hits': {
                         'type': 'array',
                         'items': {
@@ -289,7 +691,11 @@ def bulk_upsert():
                                 'topicId': {'type': 'string', 'example': 'T001'},
                                 'topicVersionId': {'type': 'string', 'example': 'TV001'},
                                 'title': {'type': 'string', 'example': 'Machine Learning Trong Y Tế'},
-                                'similarity': {'type': 'number', 'format': 'float', 'example': 0.85}
+                                'similarity': {'type': 'number', 'format': 'float', 'example': 0.85},
+                                'jaccard': {'type': 'number', 'format': 'float', 'description': 'Chỉ khi LEXICAL_FAST_PATH trả lời: Jaccard ước lượng (1.0 với bản sao y hệt)', 'example': 0.94},
+                                'lexical': {'type': 'number', 'format': 'float', 'description': 'Chỉ khi degraded: cosine tần suất term của title/description', 'example': 0.81},
+                                'bm25': {'type': 'number', 'format': 'float', 'description': 'Chỉ khi degraded: điểm BM25', 'example': 12.4},
+                                'fields': {'type': 'object', 'description': 'Chỉ ở chế độ đa vector: similarity theo trường', 'example': {'Title': 0.91, 'Description': 0.8}}
                             }
                         }
                     },
@@ -335,3 +741,207 @@ def search():
         threshold=data.get("threshold") or settings.THRESHOLD,
     )
     return jsonify(res)
+
+@bp.get("/<topic_version_id>/similar")
+@swag_from({
+    'tags': ['Đề Tài'],
+    'summary': 'Đề tài tương tự một đề tài đã có',
+    'description': 'Dùng vector đã lưu của đề tài để tìm các đề tài tương tự mà không cần gửi lại nội dung hay chạy model embedding. Kết quả không gồm chính đề tài đó và các phiên bản khác của cùng TopicId.',
+    'parameters': [
+        {'name': 'topic_version_id', 'in': 'path', 'type': 'string', 'required': True, 'description': 'TopicVersionId của đề tài'},
+        {'name': 'topK', 'in': 'query', 'type': 'integer', 'required': False, 'description': 'Số kết quả (mặc định TOPK)'},
+        {'name': 'threshold', 'in': 'query', 'type': 'number', 'required': False, 'description': 'Ngưỡng trùng lặp (mặc định THRESHOLD)'}
+    ],
+    'responses': {
+        200: {
+            'description': 'Tìm kiếm thành công',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'topicId': {'type': 'string', 'example': 'T001'},
+                    'topicVersionId': {'type': 'string', 'example': 'TV001'},
+                    'title': {'type': 'string', 'example': 'Machine Learning Trong Y Tế'},
+                    'hits': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'topicId': {'type': 'string', 'example': 'T002'},
+                                'topicVersionId': {'type': 'string', 'example': 'TV007'},
+                                'title': {'type': 'string', 'example': 'Học Máy Trong Chẩn Đoán Y Khoa'},
+                                'similarity': {'type': 'number', 'format': 'float', 'example': 0.83}
+                            }
+                        }
+                    },
+                    'duplicates': {'type': 'array', 'items': {'type': 'object'}, 'description': 'Các hit có similarity >= threshold'},
+                    'threshold': {'type': 'number', 'format': 'float', 'example': 0.7}
+                }
+            }
+        },
+        404: {
+            'description': 'Đề tài không có trong chỉ mục',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string', 'example': 'Topic version not found'}
+                }
+            }
+        }
+    }
+})
+def similar_topics(topic_version_id: str):
+    # Đề tài tương tự dựa trên vector đã lưu (không embed lại)
+    svc = TopicsService()
+    res = svc.similar(
+        topic_version_id,
+        top_k=request.args.get("topK", default=settings.TOPK, type=int),
+        threshold=request.args.get("threshold", default=settings.THRESHOLD, type=float),
+    )
+    if res is None:
+        return jsonify({"error": "Topic version not found"}), 404
+    return jsonify(res)
+
+# Láng giềng đã tính sẵn của một đề tài (cùng dạng kết quả với /topics/{topicVersionId}/similar)
+NEIGHBORS_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'topicId': {'type': 'string', 'example': 'T001'},
+        'topicVersionId': {'type': 'string', 'example': 'TV001'},
+        'title': {'type': 'string', 'example': 'Machine Learning Trong Y Tế'},
+        'hits': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'topicId': {'type': 'string', 'example': 'T002'},
+                    'topicVersionId': {'type': 'string', 'example': 'TV007'},
+                    'title': {'type': 'string', 'example': 'Học Máy Trong Chẩn Đoán Y Khoa'},
+                    'similarity': {'type': 'number', 'format': 'float', 'example': 0.83}
+                }
+            }
+        },
+        'duplicates': {'type': 'array', 'items': {'type': 'object'}, 'description': 'Các hit có similarity >= threshold'},
+        'threshold': {'type': 'number', 'format': 'float', 'example': 0.7},
+        'cached': {'type': 'boolean', 'description': 'true nếu đọc từ đồ thị, false nếu vừa được tính (chưa có trong đồ thị)', 'example': True}
+    }
+}
+
+@bp.get("/<topic_version_id>/neighbors")
+@swag_from({
+    'tags': ['Đề Tài'],
+    'summary': 'Đề tài gần nhất (đồ thị kNN đã tính sẵn)',
+    'description': 'Đọc láng giềng gần nhất đã được tính khi đề tài được upsert (KNN_GRAPH_ENABLED) - không query ChromaDB. Đề tài chưa có trong đồ thị được tính ngay từ vector đã lưu nhưng không ghi vào đồ thị (đồ thị được cập nhật bởi job knn-update sau upsert/xóa). topK không vượt quá KNN_K.',
+    'parameters': [
+        {'name': 'topic_version_id', 'in': 'path', 'type': 'string', 'required': True, 'description': 'TopicVersionId của đề tài'},
+        {'name': 'topK', 'in': 'query', 'type': 'integer', 'required': False, 'description': 'Số láng giềng (mặc định KNN_K)'},
+        {'name': 'threshold', 'in': 'query', 'type': 'number', 'required': False, 'description': 'Ngưỡng trùng lặp (mặc định THRESHOLD)'}
+    ],
+    'responses': {
+        200: {'description': 'Lấy láng giềng thành công', 'schema': NEIGHBORS_SCHEMA},
+        404: {
+            'description': 'Đề tài không có trong chỉ mục',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string', 'example': 'Topic version not found'}
+                }
+            }
+        }
+    }
+})
+def topic_neighbors(topic_version_id: str):
+    res = KnnGraphService().neighbors(
+        [topic_version_id],
+        top_k=request.args.get("topK", default=settings.KNN_K, type=int),
+        threshold=request.args.get("threshold", default=settings.THRESHOLD, type=float),
+    )
+    if not res["items"]:
+        return jsonify({"error": "Topic version not found"}), 404
+    return jsonify(res["items"][0])
+
+@bp.post("/neighbors")
+@swag_from({
+    'tags': ['Đề Tài'],
+    'summary': 'Đề tài gần nhất của nhiều đề tài',
+    'description': 'Láng giềng đã tính sẵn của cả một danh sách đề tài (vd: một trang trên dashboard) trong một lần đọc đồ thị kNN.',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'required': ['topicVersionIds'],
+                'properties': {
+                    'topicVersionIds': {'type': 'array', 'items': {'type': 'string'}, 'example': ['TV001', 'TV002']},
+                    'topK': {'type': 'integer', 'description': 'Số láng giềng mỗi đề tài (mặc định KNN_K)', 'example': 5},
+                    'threshold': {'type': 'number', 'format': 'float', 'example': 0.7}
+                }
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Lấy láng giềng thành công',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'items': {'type': 'array', 'items': NEIGHBORS_SCHEMA},
+                    'notFound': {'type': 'array', 'items': {'type': 'string'}, 'example': ['TV404']}
+                }
+            }
+        },
+        400: {
+            'description': 'Yêu cầu không hợp lệ',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string', 'example': "Provide a non-empty 'topicVersionIds' array"}
+                }
+            }
+        }
+    }
+})
+def topics_neighbors():
+    data = request.get_json(force=True) or {}
+    ids = data.get("topicVersionIds")
+    if not isinstance(ids, list) or not ids:
+        return jsonify({"error": "Provide a non-empty 'topicVersionIds' array"}), 400
+    res = KnnGraphService().neighbors(
+        ids,
+        top_k=data.get("topK") or settings.KNN_K,
+        threshold=data.get("threshold") or settings.THRESHOLD,
+    )
+    return jsonify(res)
+
+@bp.get("/write-behind")
+@swag_from({
+    'tags': ['Đề Tài'],
+    'summary': 'Trạng thái bộ đệm ghi trễ',
+    'description': 'Số đề tài đang chờ ghi, seq đã commit và lỗi ghi gần nhất của bộ đệm ghi trễ (WRITE_BEHIND_ENABLED).',
+    'responses': {
+        200: {
+            'description': 'Lấy trạng thái thành công',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'enabled': {'type': 'boolean', 'example': True},
+                    'pending': {'type': 'integer', 'description': 'Số đề tài đang chờ ghi', 'example': 12},
+                    'lastSeq': {'type': 'integer', 'example': 1042},
+                    'committedSeq': {'type': 'integer', 'example': 1030},
+                    'flushes': {'type': 'integer', 'description': 'Số lô đã ghi', 'example': 57},
+                    'flushedItems': {'type': 'integer', 'example': 1030},
+                    'retrying': {'type': 'integer', 'description': 'Số đề tài đã ghi lỗi và đang chờ thử lại', 'example': 1},
+                    'deadLettered': {'type': 'integer', 'description': 'Số đề tài lỗi quá WRITE_BEHIND_MAX_ATTEMPTS lần, đã chuyển vào <logPath>.dead', 'example': 0},
+                    'logPath': {'type': 'string', 'description': 'Log của process này (mỗi process giữ riêng một log)', 'example': './write_behind.log'},
+                    'lastError': {'type': 'string', 'example': None}
+                }
+            }
+        }
+    }
+})
+def write_behind_stats():
+    buffer = get_write_behind()
+    if buffer is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **buffer.stats()})
@@ -0,0 +1,203 @@
+﻿# -*- coding: utf-8 -*-
+# Chỉ mục đảo BM25 trong bộ nhớ tiến trình trên title/description - sinh ứng viên cho tìm kiếm lai
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from collections import Counter
+import heapq
+import math
+import threading
+from dupliapp.config import settings
+from dupliapp.utils.text_normalize import search_terms
+from dupliapp.services.index_changes import ChangeTrackedIndex
+
+# Các trường metadata được đưa vào chỉ mục từ khóa
+BM25_FIELDS = ("Title", "Description")
+# Dưới số đề tài này không bỏ term phổ biến (duyệt toàn bộ posting list vẫn rẻ)
+DF_CUTOFF_MIN_DOCS = 100
+
+def bm25_text(meta: Dict[str, Any]) -> str:
+    # Text được chỉ mục của một đề tài (từ metadata ChromaDB)
+    return " ".join(str(meta.get(f) or "") for f in BM25_FIELDS)
+
+def term_cosine(a: str, b: str) -> float:
+    # Cosine giữa vector tần suất term (search_terms) của hai text, trong [0, 1]
+    ta, tb = Counter(search_terms(a)), Counter(search_terms(b))
+    if not ta or not tb:
+        return 0.0
+    dot = sum(n * tb.get(t, 0) for t, n in ta.items())
+    norm = math.sqrt(sum(n * n for n in ta.values())) * math.sqrt(sum(n * n for n in tb.values()))
+    return dot / norm
+
+class Bm25Index(ChangeTrackedIndex):
+    """
+    Chỉ mục đảo BM25 của title + description
+
+    Term là âm tiết đã bỏ dấu và cặp âm tiết liền nhau (search_terms). Mỗi đề tài được gán một slot
+    số nguyên; posting list của một term là dict slot -> tần suất, nên thêm/xóa một đề tài chỉ chạm
+    các term của đề tài đó. Slot của đề tài đã xóa được dùng lại.
+    Term xuất hiện trong hơn max_df_ratio số đề tài (âm tiết phổ biến như "và", "hệ", "thống") bị bỏ
+    khi chấm điểm: idf của chúng gần 0 nhưng posting list dài gần bằng chỉ mục, nên chấm điểm chúng
+    biến mỗi truy vấn thành một lần duyệt toàn bộ.
+    Chỉ mục được dựng từ metadata trong ChromaDB, cập nhật khi đề tài được embed/xóa và đọc bù các lần
+    ghi của process khác qua nhật ký thay đổi (ChangeTrackedIndex).
+    """
+
+    def __init__(self, k1: float, b: float, max_df_ratio: float = 1.0):
+        super().__init__()
+        self.k1 = k1
+        self.b = b
+        self.max_df_ratio = max_df_ratio
+        self.skipped_terms = 0
+        self.built = False
+        self._lock = threading.RLock()
+        self._reset()
+        self.counters = {"hybrid": 0, "degraded": 0}
+
+    def _reset(self) -> None:
+        self._slots: Dict[str, int] = {}
+        self._ids: List[Optional[str]] = []
+        self._free: List[int] = []
+        self._terms: List[Dict[str, int]] = []
+        self._lengths: List[int] = []
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._total_len = 0
+
+    def _unindex(self, slot: int) -> None:
+        for term in self._terms[slot]:
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.pop(slot, None)
+                if not posting:
+                    del self._postings[term]
+        self._total_len -= self._lengths[slot]
+        self._terms[slot] = {}
+        self._lengths[slot] = 0
+
+    def add(self, ids: Iterable[str], texts: Iterable[str]) -> None:
+        # Thêm hoặc thay text được chỉ mục của các ID
+        with self._lock:
+            for id_, text in zip(ids, texts):
+                slot = self._slots.get(id_)
+                if slot is None:
+                    if self._free:
+                        slot = self._free.pop()
+                        self._ids[slot] = id_
+                    else:
+                        slot = len(self._ids)
+                        self._ids.append(id_)
+                        self._terms.append({})
+                        self._lengths.append(0)
+                    self._slots[id_] = slot
+                else:
+                    self._unindex(slot)
+                tf = dict(Counter(search_terms(text)))
+                for term, n in tf.items():
+                    self._postings.setdefault(term, {})[slot] = n
+                self._terms[slot] = tf
+                self._lengths[slot] = sum(tf.values())
+                self._total_len += self._lengths[slot]
+
+    def remove(self, ids: Iterable[str]) -> None:
+        with self._lock:
+            for id_ in ids:
+                slot = self._slots.pop(id_, None)
+                if slot is None:
+                    continue
+                self._unindex(slot)
+                self._ids[slot] = None
+                self._free.append(slot)
+
+    def search(self, text: str, n: int) -> List[Tuple[str, float]]:
+        """
+        n đề tài có điểm BM25 cao nhất với text
+
+        Returns:
+            [(id, score), ...] sắp xếp theo điểm giảm dần; chỉ gồm đề tài có ít nhất một term chung
+        """
+        terms = set(search_terms(text))
+        with self._lock:
+            docs = len(self._slots)
+            if not docs or not terms:
+                return []
+            avgdl = self._total_len / docs
+            max_df = self.max_df_ratio * docs if docs >= DF_CUTOFF_MIN_DOCS else docs
+            scores: Dict[int, float] = {}
+            for term in terms:
+                posting = self._postings.get(term)
+                if not posting:
+                    continue
+                df = len(posting)
+                if df > max_df:
+                    self.skipped_terms += 1
+                    continue
+                idf = math.log(1.0 + (docs - df + 0.5) / (df + 0.5))
+                for slot, tf in posting.items():
+                    norm = tf + self.k1 * (1.0 - self.b + self.b * self._lengths[slot] / avgdl)
+                    scores[slot] = scores.get(slot, 0.0) + idf * tf * (self.k1 + 1.0) / norm
+            top = heapq.nlargest(n, scores.items(), key=lambda t: (t[1], -t[0]))
+            return [(self._ids[slot], score) for slot, score in top]
+
+    def record(self, mode: str) -> None:
+        with self._lock:
+            self.counters[mode] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            docs = len(self._slots)
+            return {
+                "built": self.built,
+                "documents": docs,
+                "terms": len(self._postings),
+                "postings": sum(len(p) for p in self._postings.values()),
+                "avgDocLength": round(self._total_len / docs, 2) if docs else 0.0,
+                "maxDfRatio": self.max_df_ratio,
+                "skippedTerms": self.skipped_terms,
+                "searches": dict(self.counters),
+                "generation": self.generation,
+            }
+
+    def _load(self, repo: Any, page_size: int = 1000) -> None:
+        # Dựng lại toàn bộ từ metadata (Title, Description) đang có trong ChromaDB
+        with self._lock:
+            self._reset()
+            for ids, metas in repo.iter_metadatas(page_size):
+                self.add(ids, [bm25_text(m) for m in metas])
+            self.built = True
+
+    def _reload(self, repo: Any, ids: List[str]) -> None:
+        metas = repo.get_metadatas(ids)
+        with self._lock:
+            self.remove([i for i in ids if i not in metas])
+            self.add(list(metas), [bm25_text(m) for m in metas.values()])
+
+_index: Optional[Bm25Index] = None
+_index_source: Optional[Tuple[Any, ...]] = None
+_index_lock = threading.Lock()
+
+def _source() -> Tuple[Any, ...]:
+    return (settings.BM25_K1, settings.BM25_B, settings.BM25_MAX_DF_RATIO,
+            settings.CHROMA_MODE, settings.CHROMA_DIR, settings.CHROMA_CLOUD_HOST)
+
+def current_bm25_index() -> Optional[Bm25Index]:
+    # Chỉ mục đã được dựng (không dựng mới) - dùng ở đường ghi
+    if not settings.BM25_ENABLED:
+        return None
+    with _index_lock:
+        if _index is not None and _index_source == _source():
+            return _index
+    return None
+
+def get_bm25_index(repo: Any) -> Optional[Bm25Index]:
+    # Chỉ mục của tiến trình, None nếu BM25_ENABLED tắt; dựng từ ChromaDB ở lần gọi đầu và đọc bù
+    # các lần ghi của process khác
+    global _index, _index_source
+    if not settings.BM25_ENABLED:
+        return None
+    source = _source()
+    with _index_lock:
+        if _index is None or _index_source != source:
+            index = Bm25Index(settings.BM25_K1, settings.BM25_B, settings.BM25_MAX_DF_RATIO)
+            index.build(repo)
+            _index, _index_source = index, source
+        index = _index
+    index.sync(repo)
+    return index
@@ -0,0 +1,136 @@
+﻿# -*- coding: utf-8 -*-
+# Service lập chỉ mục offline: nạp đề tài từ file hoặc SQL thẳng vào vector database (không qua Flask)
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import time
+from dupliapp.config import settings
+from dupliapp.services.index_service import IndexService
+from dupliapp.services.partition_service import PartitionService
+from dupliapp.services.topic_service import TopicsService
+from dupliapp.utils.topic_files import iter_topic_batches
+
+class BulkIndexService:
+    """
+    Nạp đề tài theo lô vào vector database và trả về báo cáo thông lượng
+
+    - Mỗi lô được embed và upsert một lần (giống /topics/bulk-upsert nhưng không có chi phí HTTP/JSON)
+    - workers > 1: nhiều lô được embed/ghi song song, số lô đang xử lý bị giới hạn
+      (2 x workers) nên bộ nhớ không tăng theo kích thước file
+    - Lô lỗi được ghi vào báo cáo, các lô khác vẫn tiếp tục
+    - Lỗi đọc nguồn (JSON/NDJSON hỏng, file cụt...) dừng việc đọc nhưng các lô đã đọc vẫn được ghi;
+      lỗi được ghi vào báo cáo với "stage": "read"
+    - force=True: embed lại cả đề tài có nội dung không đổi (vd. sau khi đổi model embedding)
+    """
+
+    def __init__(self, batch_size: Optional[int] = None, workers: int = 1, force: bool = False):
+        self.batch_size = batch_size or settings.REINDEX_PAGE_SIZE
+        self.workers = max(1, int(workers))
+        self.force = force
+
+    @staticmethod
+    def _report(source: str, read: int, totals: Dict[str, int], batches: int, errors: List[Dict[str, Any]],
+                started: float, read_seconds: float, write_seconds: float) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - started
+        return {
+            "source": source,
+            "read": read,
+            "upserted": totals["upserted"],
+            "embedded": totals["embedded"],
+            "skipped": totals["skipped"],
+            "batches": batches,
+            "errors": errors,
+            "elapsedSeconds": round(elapsed, 3),
+            "readSeconds": round(read_seconds, 3),
+            "writeSeconds": round(write_seconds, 3),
+            "throughput": round(read / elapsed, 2) if elapsed > 0 else None,
+        }
+
+    def index_batches(self, batches: Iterable[List[Dict[str, Any]]], source: str = "",
+                      on_batch: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        started = time.perf_counter()
+        svc = TopicsService()
+        totals = {"upserted": 0, "embedded": 0, "skipped": 0}
+        errors: List[Dict[str, Any]] = []
+        read = 0
+        batch_no = 0
+        read_seconds = 0.0
+        write_seconds = 0.0
+
+        def write(no: int, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+            t0 = time.perf_counter()
+            try:
+                stats, error = svc.upsert_many(items, force=self.force), None
+            except Exception as e:
+                stats, error = None, str(e)
+            return {"batch": no, "size": len(items), "stats": stats, "error": error,
+                    "seconds": time.perf_counter() - t0}
+
+        def collect(done: Dict[str, Any]) -> None:
+            nonlocal write_seconds
+            write_seconds += done["seconds"]
+            if done["error"] is not None:
+                errors.append({"batch": done["batch"], "size": done["size"], "error": done["error"]})
+            else:
+                for k in totals:
+                    totals[k] += done["stats"][k]
+            if on_batch is not None:
+                on_batch({"batch": done["batch"], "read": read, **totals, "error": done["error"]})
+
+        source_iter = iter(batches)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending: set = set()
+            while True:
+                t0 = time.perf_counter()
+                try:
+                    items = next(source_iter, None)
+                except Exception as e:
+                    # Không đọc tiếp được nguồn sau lỗi -> dừng đọc, chờ các lô đã gửi rồi trả báo cáo một phần
+                    errors.append({"batch": batch_no + 1, "size": 0, "stage": "read", "error": str(e)})
+                    items = None
+                read_seconds += time.perf_counter() - t0
+                if items is None:
+                    break
+                batch_no += 1
+                read += len(items)
+                if self.workers == 1:
+                    collect(write(batch_no, items))
+                    continue
+
+                pending.add(pool.submit(write, batch_no, items))
+                # Giới hạn số lô đang chờ ghi để bộ nhớ không phụ thuộc kích thước nguồn
+                if len(pending) >= 2 * self.workers:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for f in finished:
+                        collect(f.result())
+            for f in pending:
+                collect(f.result())
+
+        errors.sort(key=lambda e: e["batch"])
+        return self._report(source, read, totals, batch_no, errors, started, read_seconds, write_seconds)
+
+    def index_file(self, path: str, fmt: Optional[str] = None,
+                   on_batch: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        # Nạp đề tài từ file JSONL/CSV/Parquet (có thể nén .gz với JSONL/CSV)
+        return self.index_batches(iter_topic_batches(path, self.batch_size, fmt), source=path, on_batch=on_batch)
+
+    def index_sql(self, limit: Optional[int] = None, partitions: Optional[int] = None,
+                  on_batch: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        # Nạp đề tài từ nguồn SQL đã cấu hình (TOPIC_SOURCE)
+        # workers > 1 dùng lập chỉ mục song song theo phân vùng TopicId
+        started = time.perf_counter()
+        if self.workers > 1 and not limit:
+            progress = PartitionService().run(partitions=partitions, workers=self.workers,
+                                              page_size=self.batch_size, on_progress=on_batch, force=self.force)
+            totals = {"upserted": progress["processed"], "embedded": progress["embedded"],
+                      "skipped": progress["processed"] - progress["embedded"]}
+            return self._report("sql", progress["processed"], totals, progress["partitions"]["total"],
+                                progress["errors"], started, 0.0, 0.0)
+
+        summary: Dict[str, Any] = {}
+        for event in IndexService().iter_build_from_sql(limit=limit, batch_size=self.batch_size, force=self.force):
+            summary = event
+            if event["type"] == "batch" and on_batch is not None:
+                on_batch(event)
+        totals = {"upserted": summary["indexed"], "embedded": summary["embedded"], "skipped": summary["skipped"]}
+        return self._report("sql", summary["total_topics"], totals, summary["batches"], summary["errors"],
+                            started, summary["timings"]["fetchMs"] / 1000, summary["timings"]["writeMs"] / 1000)
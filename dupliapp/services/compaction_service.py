@@ -0,0 +1,99 @@
+﻿# -*- coding: utf-8 -*-
+# Service theo dõi tỉ lệ tombstone sau khi xóa đề tài và compaction (xây dựng lại + VACUUM) chỉ mục
+from typing import Any, Callable, Dict, Optional
+import time
+from dupliapp.config import settings
+from dupliapp.repositories.chroma_repository import ChromaTopicsRepository
+from dupliapp.repositories.state_repository import IndexStateRepository
+from dupliapp.services.job_service import get_job_service, JOB_KIND_COMPACT
+
+# Key lưu kết quả lần compaction gần nhất và bộ đếm số vector đã xóa kể từ lần đó
+TOMBSTONE_KEY = "compaction:tombstones"
+TOMBSTONE_COUNT_KEY = "compaction:deleted"
+
+class CompactionService:
+    """
+    Compaction chỉ mục vector sau các lần xóa
+
+    Xóa trong ChromaDB chỉ đánh dấu phần tử trong chỉ mục HNSW và để lại trang trống trong SQLite,
+    nên dữ liệu đã xóa vẫn chiếm bộ nhớ và thời gian tìm kiếm. Service đếm số vector đã xóa
+    (tombstone) kể từ lần compaction gần nhất; khi tỉ lệ tombstone vượt COMPACTION_TOMBSTONE_RATIO,
+    collection được chép sang collection mới (chỉ mục HNSW sạch) và file SQLite được VACUUM.
+    Tự xếp job compaction sau khi xóa chỉ khi bật COMPACTION_AUTO.
+    """
+
+    def __init__(self, repo: Optional[ChromaTopicsRepository] = None,
+                 state: Optional[IndexStateRepository] = None):
+        self.repo = repo or ChromaTopicsRepository()
+        self.state = state or IndexStateRepository()
+
+    def _tombstones(self) -> Dict[str, Any]:
+        last = (self.state.get(TOMBSTONE_KEY) or {}).get("lastCompaction")
+        return {"deleted": self.state.counter(TOMBSTONE_COUNT_KEY), "lastCompaction": last}
+
+    def record_deletes(self, deleted: int) -> None:
+        # Gọi sau mỗi lần xóa để cộng dồn số tombstone (cộng nguyên tử, an toàn giữa nhiều process)
+        if deleted <= 0:
+            return
+        self.state.increment(TOMBSTONE_COUNT_KEY, deleted)
+
+    def status(self) -> Dict[str, Any]:
+        # Số vector còn sống, tombstone, tỉ lệ tombstone và dung lượng trên đĩa
+        tombstones = self._tombstones()
+        count = self.repo.count()
+        deleted = tombstones["deleted"]
+        ratio = deleted / (count + deleted) if count + deleted else 0.0
+        return {
+            "count": count,
+            "deletedSinceCompaction": deleted,
+            "tombstoneRatio": round(ratio, 4),
+            "threshold": settings.COMPACTION_TOMBSTONE_RATIO,
+            "needsCompaction": deleted > 0 and ratio >= settings.COMPACTION_TOMBSTONE_RATIO,
+            "diskBytes": self.repo.disk_usage(),
+            "lastCompaction": tombstones["lastCompaction"],
+        }
+
+    def compact(self, force: bool = False, page_size: Optional[int] = None,
+                on_progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, Any]:
+        # Xây dựng lại collection và VACUUM; bỏ qua nếu tỉ lệ tombstone chưa tới ngưỡng (trừ khi force)
+        # Ghi trong lúc chép được chép bù dưới khóa ghi độc quyền trước khi đổi collection
+        # (xem ChromaTopicsRepository.rebuild); lần ghi trong bước đó chờ tới khi đổi xong
+        before = self.status()
+        if not force and not before["needsCompaction"]:
+            return {"status": "skipped", "before": before, "after": before,
+                    "processed": 0, "total": before["count"], "embedded": 0}
+
+        started = time.perf_counter()
+        total = before["count"]
+        copied = self.repo.rebuild(
+            page_size or settings.COMPACTION_PAGE_SIZE,
+            on_progress=(lambda n: on_progress(n, total)) if on_progress is not None else None,
+        )
+        vacuumed = self.repo.vacuum()
+
+        result = {
+            "status": "completed",
+            "processed": copied,
+            "total": total,
+            "embedded": 0,
+            "vacuumed": vacuumed,
+            "elapsedSeconds": round(time.perf_counter() - started, 3),
+            "finishedAt": time.time(),
+        }
+        # Chỉ trừ số tombstone đã có trước khi chép: lần xóa trong lúc chép vẫn để lại tombstone
+        # trong collection mới nên vẫn được tính
+        self.state.increment(TOMBSTONE_COUNT_KEY, -before["deletedSinceCompaction"])
+        self.state.set(TOMBSTONE_KEY, {"lastCompaction": result})
+        after = self.status()
+        if before["diskBytes"] is not None and after["diskBytes"] is not None:
+            result["reclaimedBytes"] = before["diskBytes"] - after["diskBytes"]
+        return {**result, "before": before, "after": after}
+
+    def schedule_if_needed(self, status: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        # Đưa job compaction vào hàng đợi nền khi vượt ngưỡng (COMPACTION_AUTO); trả về jobId
+        if not settings.COMPACTION_AUTO or settings.JOB_WORKERS <= 0:
+            return None
+        if not (status or self.status())["needsCompaction"]:
+            return None
+        # Không xếp thêm job nếu đã có job compaction đang chờ/chạy (kiểm tra trong SQL, không theo trang list)
+        return get_job_service().submit(JOB_KIND_COMPACT, {}, unique=True)["jobId"]
@@ -0,0 +1,216 @@
+﻿# -*- coding: utf-8 -*-
+# Service embedding đa vector: mỗi trường (và mỗi đoạn của trường dài) một vector, gộp có trọng số khi truy vấn
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import hashlib
+import numpy as np
+from dupliapp.config import settings
+from dupliapp.repositories.chroma_repository import ChromaFieldVectorsRepository
+from dupliapp.utils.embeddings import embedding_model_id
+from dupliapp.utils.topic_record import SQL_COLUMNS, ITEM_KEYS
+
+# Các trường nội dung (tên cột SQL / key metadata) và key tương ứng trong JSON của API
+FIELD_COLUMNS = SQL_COLUMNS[2:]
+FIELD_ITEM_KEYS = dict(zip(FIELD_COLUMNS, ITEM_KEYS[2:]))
+
+# Trường của query tự do ("text"): so với mọi trường của đề tài
+ANY_FIELD = "*"
+
+def field_weights() -> Dict[str, float]:
+    # Trọng số từng trường từ MULTI_VECTOR_WEIGHTS ("Title:2,Description:1.5,..."); trường không khai
+    # báo có trọng số 1, trọng số <= 0 = không embed trường đó
+    weights = {f: 1.0 for f in FIELD_COLUMNS}
+    for part in settings.MULTI_VECTOR_WEIGHTS.split(","):
+        name, sep, value = part.partition(":")
+        if not sep or name.strip() not in weights:
+            continue
+        try:
+            weights[name.strip()] = float(value)
+        except ValueError:
+            print(f"⚠️ Warning: invalid MULTI_VECTOR_WEIGHTS entry '{part.strip()}', using 1.0")
+    return {f: w for f, w in weights.items() if w > 0}
+
+def chunk_text(text: Optional[str], words: int) -> List[str]:
+    # Cắt text thành các đoạn tối đa `words` từ để không bị model cắt cụt ở độ dài tối đa
+    tokens = str(text or "").split()
+    size = max(words, 1)
+    return [" ".join(tokens[i:i + size]) for i in range(0, len(tokens), size)]
+
+def _unit(vec: np.ndarray) -> np.ndarray:
+    norm = float(np.linalg.norm(vec))
+    return vec / norm if norm else vec
+
+class FieldVectorService:
+    """
+    Vector theo trường của đề tài, lưu trong collection riêng (ChromaFieldVectorsRepository)
+
+    Text ghép của compose_topic_text bị model cắt ở độ dài tối đa và sửa một trường là phải embed lại
+    toàn bộ. Ở chế độ đa vector mỗi đoạn (tối đa MULTI_VECTOR_CHUNK_WORDS từ) của mỗi trường được
+    embed riêng và lưu kèm hash nội dung, nên khi upsert chỉ các đoạn có nội dung đổi được embed lại.
+    Vector của đề tài trong collection chính là tổng có trọng số (MULTI_VECTOR_WEIGHTS) của vector
+    trung bình mỗi trường, tính lại từ các vector đã lưu mà không chạy thêm model.
+    """
+
+    def __init__(self, embed: Callable[[List[str]], np.ndarray],
+                 repo: Optional[ChromaFieldVectorsRepository] = None):
+        self.embed = embed
+        self.repo = repo or ChromaFieldVectorsRepository()
+        self.weights = field_weights()
+        self.chunk_words = settings.MULTI_VECTOR_CHUNK_WORDS
+
+    @staticmethod
+    def _hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    @property
+    def marker(self) -> str:
+        # Dấu cấu hình vector theo trường (trọng số + MULTI_VECTOR_CHUNK_WORDS), lưu trong metadata đề tài:
+        # đề tài thiếu dấu hoặc dấu khác (ghi khi tắt đa vector, đổi cấu hình) phải được embed lại
+        weights = ",".join(f"{f}:{w:g}" for f, w in sorted(self.weights.items()))
+        return self._hash(f"{weights};{self.chunk_words}")[:16]
+
+    def _chunks(self, parent: str, meta: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any], str]]:
+        # (ID, metadata, text) của mọi đoạn của một đề tài
+        version = parent[3:] if parent.startswith("tv:") else parent
+        model = embedding_model_id()
+        out = []
+        for field in self.weights:
+            for no, text in enumerate(chunk_text(meta.get(field), self.chunk_words)):
+                out.append((f"tvf:{version}:{field}:{no}", {
+                    "ParentId": parent,
+                    "TopicId": meta.get("TopicId"),
+                    "Field": field,
+                    "Chunk": no,
+                    "ContentHash": self._hash(text),
+                    "EmbeddingModel": model,
+                }, text))
+        return out
+
+    def _stored_ids(self, parents: List[str]) -> List[str]:
+        return self.repo.ids_where({"ParentId": {"$in": parents}}) if parents else []
+
+    def aggregate(self, fields: Dict[str, List[np.ndarray]]) -> Optional[np.ndarray]:
+        # Vector đề tài: tổng có trọng số của vector trung bình mỗi trường, chuẩn hóa về độ dài 1
+        parts = [self.weights.get(f, 1.0) * _unit(np.mean(vecs, axis=0)) for f, vecs in fields.items() if vecs]
+        if not parts:
+            return None
+        return _unit(np.sum(parts, axis=0)).astype(np.float32)
+
+    def sync(self, ids: List[str], metas: List[Dict[str, Any]], texts: Sequence[str],
+             known: Optional[Dict[str, np.ndarray]] = None, force: bool = False) -> Tuple[np.ndarray, int]:
+        """
+        Đồng bộ vector theo trường của các đề tài có nội dung thay đổi
+
+        known: embedding đã tính sẵn theo text đoạn (vd. từ query kiểm tra trùng lặp) - không embed lại
+        force: embed lại mọi đoạn, kể cả đoạn có hash và model không đổi
+
+        Returns:
+            (vector gộp của từng đề tài theo thứ tự ids, số đoạn đã ghi mới). Đề tài không có trường
+            nào được embed (mọi trường rỗng hoặc trọng số 0) dùng embedding của text ghép.
+        """
+        desired = [self._chunks(id_, meta) for id_, meta in zip(ids, metas)]
+        wanted = {cid: (meta, text) for chunks in desired for cid, meta, text in chunks}
+        stored_ids = self._stored_ids(list(ids))
+        existing = self.repo.get_metadatas(stored_ids)
+
+        stale = [cid for cid in stored_ids if cid not in wanted]
+        if stale:
+            self.repo.delete(ids=stale)
+        changed = [cid for cid, (meta, _) in wanted.items()
+                   if force or any((existing.get(cid) or {}).get(k) != meta[k]
+                                   for k in ("ContentHash", "EmbeddingModel"))]
+        vectors: Dict[str, np.ndarray] = {}
+        if changed:
+            known = known or {}
+            missing = list(dict.fromkeys(wanted[cid][1] for cid in changed if wanted[cid][1] not in known))
+            if missing:
+                known = {**known, **dict(zip(missing, self.embed(missing)))}
+            embs = np.stack([known[wanted[cid][1]] for cid in changed]).astype(np.float32)
+            self.repo.upsert(ids=changed, embeddings=embs,
+                             metadatas=[wanted[cid][0] for cid in changed],
+                             documents=[wanted[cid][1] for cid in changed])
+            vectors.update(zip(changed, embs))
+        reused = [cid for cid in wanted if cid not in vectors]
+        if reused:
+            vectors.update(self.repo.get_embeddings(reused))
+
+        out: List[Optional[np.ndarray]] = []
+        for chunks in desired:
+            fields: Dict[str, List[np.ndarray]] = {}
+            for cid, meta, _ in chunks:
+                if cid in vectors:
+                    fields.setdefault(meta["Field"], []).append(vectors[cid])
+            out.append(self.aggregate(fields))
+        missing = [i for i, v in enumerate(out) if v is None]
+        if missing:
+            for i, vec in zip(missing, self.embed([texts[i] for i in missing])):
+                out[i] = vec
+        return np.stack(out).astype(np.float32), len(changed)
+
+    def remove(self, ids: List[str]) -> int:
+        # Xóa mọi vector theo trường của các đề tài
+        stored = self._stored_ids(ids)
+        return self.repo.delete(ids=stored) if stored else 0
+
+    def query_parts(self, data: Dict[str, Any]) -> List[Tuple[str, str]]:
+        # (trường, đoạn text) của query: "text" tự do được so với mọi trường (ANY_FIELD),
+        # còn query theo trường chỉ so với cùng trường đó của đề tài đã lưu
+        if data.get("text"):
+            return [(ANY_FIELD, c) for c in chunk_text(data["text"], self.chunk_words)]
+        return [(field, c) for field in self.weights
+                for c in chunk_text(data.get(FIELD_ITEM_KEYS[field]), self.chunk_words)]
+
+    def score(self, parts: List[Tuple[str, str]], embs: np.ndarray, top_k: int,
+              exclude_topic_id: Any = None) -> List[Tuple[str, float, Dict[str, float]]]:
+        """
+        Xếp hạng đề tài theo similarity gộp có trọng số
+
+        Ứng viên là đề tài có đoạn nằm trong MULTI_VECTOR_CANDIDATES đoạn gần nhất của một đoạn query;
+        chỉ tối đa max(top_k, MULTI_VECTOR_RESCORE_TOPICS) đề tài có đoạn gần nhất được chấm điểm.
+        exclude_topic_id: bỏ qua các phiên bản của TopicId này (so sánh dạng chuỗi).
+        Với mỗi ứng viên, similarity của một trường là cosine lớn nhất giữa vector query của trường
+        (trung bình các đoạn query) và từng đoạn đã lưu của trường đó hoặc trung bình của chúng (trường
+        giống hệt cho 1.0 dù bị cắt thành nhiều đoạn); similarity của đề tài là trung bình có trọng số
+        trên các trường có ở cả query và đề tài.
+
+        Returns:
+            [(ParentId, similarity, {trường: similarity}), ...] top_k theo similarity giảm dần
+        """
+        grouped: Dict[str, List[np.ndarray]] = {}
+        for (field, _), vec in zip(parts, embs):
+            grouped.setdefault(field, []).append(vec)
+        queries = {f: _unit(np.mean(v, axis=0)) for f, v in grouped.items()}
+
+        nearest: Dict[str, float] = {}
+        for res in self.repo.query_many(np.asarray(embs, dtype=np.float32), settings.MULTI_VECTOR_CANDIDATES):
+            for meta, dist in zip(res["metadatas"], res["distances"]):
+                m = meta or {}
+                parent = m.get("ParentId")
+                if exclude_topic_id is not None and str(m.get("TopicId")) == str(exclude_topic_id):
+                    continue
+                if parent and dist < nearest.get(parent, float("inf")):
+                    nearest[parent] = dist
+        limit = max(top_k, settings.MULTI_VECTOR_RESCORE_TOPICS)
+        parents = sorted(nearest, key=nearest.get)[:limit]
+        stored: Dict[Tuple[str, str], List[np.ndarray]] = {}
+        if parents:
+            _, metas, vectors = self.repo.records_where({"ParentId": {"$in": parents}})
+            for meta, vec in zip(metas, vectors):
+                m = meta or {}
+                stored.setdefault((m.get("ParentId"), m.get("Field")), []).append(vec)
+
+        best: Dict[str, Dict[str, float]] = {}
+        for (parent, field), vecs in stored.items():
+            q = queries.get(field, queries.get(ANY_FIELD))
+            if q is None:
+                continue
+            options = [_unit(v) for v in vecs] + ([_unit(np.mean(vecs, axis=0))] if len(vecs) > 1 else [])
+            cos = max(float(np.dot(v, q)) for v in options)
+            best.setdefault(parent, {})[field] = 1.0 - (1.0 - cos) / 2.0
+
+        ranked = []
+        for parent, fields in best.items():
+            total = sum(self.weights.get(f, 1.0) for f in fields)
+            sim = sum(self.weights.get(f, 1.0) * s for f, s in fields.items()) / total
+            ranked.append((parent, round(sim, 4), {f: round(s, 4) for f, s in fields.items()}))
+        ranked.sort(key=lambda t: t[1], reverse=True)
+        return ranked[:top_k]
@@ -0,0 +1,63 @@
+﻿# -*- coding: utf-8 -*-
+# Đồng bộ chỉ mục trong bộ nhớ tiến trình với nhật ký thay đổi dùng chung (IndexChangeLog)
+from abc import ABC, abstractmethod
+from typing import Any, List, Optional
+import threading
+from dupliapp.repositories.change_log import get_change_log
+
+# Số ID đọc lại từ ChromaDB mỗi lần khi đồng bộ
+RELOAD_PAGE_SIZE = 1000
+
+class ChangeTrackedIndex(ABC):
+    """
+    Lớp cơ sở cho chỉ mục trong bộ nhớ được dựng từ ChromaDB
+
+    generation là thế hệ nhật ký thay đổi mà chỉ mục đã phản ánh. Trước khi trả lời truy vấn, sync()
+    so với thế hệ mới nhất trong STATE_DB_PATH: chậm hơn thì đọc lại từ ChromaDB đúng các ID đã đổi,
+    nhật ký không còn đủ dòng (hoặc file trạng thái đã bị tạo lại) thì dựng lại toàn bộ.
+    Lớp con cài đặt _load(repo) (dựng toàn bộ) và _reload(repo, ids) (còn trong ChromaDB -> cập nhật,
+    không còn -> gỡ khỏi chỉ mục).
+    """
+
+    def __init__(self):
+        self.generation: Optional[int] = None
+        self._sync_lock = threading.Lock()
+
+    @abstractmethod
+    def _load(self, repo: Any) -> None:
+        # Dựng lại toàn bộ chỉ mục từ ChromaDB
+        ...
+
+    @abstractmethod
+    def _reload(self, repo: Any, ids: List[str]) -> None:
+        # Đọc lại các ID đã đổi: còn trong ChromaDB -> cập nhật, không còn -> gỡ khỏi chỉ mục
+        ...
+
+    def build(self, repo: Any) -> None:
+        # Thế hệ được đọc trước khi quét: thay đổi ghi trong lúc quét sẽ được đọc lại ở lần sync sau
+        generation = get_change_log().latest()
+        self._load(repo)
+        self.generation = generation
+
+    def applied(self, generation: int) -> None:
+        # Lần ghi của chính tiến trình này đã được cập nhật vào chỉ mục trước khi ghi nhật ký
+        # Không khóa: nếu chạy đua với sync() thì chỉ dẫn tới việc đọc lại thừa vài ID ở lần sau
+        if self.generation == generation - 1:
+            self.generation = generation
+
+    def sync(self, repo: Any) -> None:
+        log = get_change_log()
+        if self.generation == log.latest():
+            return
+        with self._sync_lock:
+            latest = log.latest()
+            if self.generation == latest:
+                return
+            changes = log.since(self.generation) if self.generation is not None and self.generation < latest else None
+            if changes is None:
+                self.build(repo)
+                return
+            generation, ids = changes
+            for start in range(0, len(ids), RELOAD_PAGE_SIZE):
+                self._reload(repo, ids[start:start + RELOAD_PAGE_SIZE])
+            self.generation = generation
@@ -1,49 +1,311 @@
 ﻿# -*- coding: utf-8 -*-
 # Service xây dựng lại index từ SQL Server (tùy chọn)
-from typing import Optional, Dict, Any, List
-from dupliapp.repositories.topic_repository import MsSqlTopicRepository
+from typing import Optional, Dict, Any, List, Callable, Iterator
+import time
+import uuid
+from dupliapp.config import settings
+from dupliapp.repositories.topic_repository import get_topic_repository
+from dupliapp.repositories.state_repository import IndexStateRepository
+from dupliapp.repositories.state_lock import state_lock
 from dupliapp.services.topic_service import TopicsService
+from dupliapp.utils.columnar import to_pylist
+from dupliapp.utils.topic_record import TopicRecord
+
+# Key lưu TopicVersionId lớn nhất đã được đồng bộ vào vector database
+WATERMARK_KEY = "sync:watermark"
+
+# Key lưu checkpoint của lần xây dựng lại toàn bộ chỉ mục gần nhất
+REINDEX_CHECKPOINT_KEY = "reindex:checkpoint"
+
+def _add_chroma_write(totals: Dict[str, Any], stats: Optional[Dict[str, Any]]) -> None:
+    # Cộng dồn thời gian ghi ChromaDB theo lô ("chromaWrite" trong kết quả ghi của TopicsService):
+    # tổng thời gian, số lô và lô chậm nhất
+    write = (stats or {}).get("chromaWrite")
+    if not write:
+        return
+    totals["chromaWriteMs"] = round(totals.get("chromaWriteMs", 0.0) + write["totalMs"], 2)
+    totals["chromaChunks"] = totals.get("chromaChunks", 0) + len(write["chunks"])
+    totals["slowestChunkMs"] = max([totals.get("slowestChunkMs", 0.0)] + [c["ms"] for c in write["chunks"]])
 
 class IndexService:
-    def build_from_sql(self, limit: Optional[int] = None) -> Dict[str, Any]:
+    @staticmethod
+    def _summarize_topics(records: List[TopicRecord]) -> List[Dict[str, Any]]:
+        # Danh sách đề tài rút gọn (chỉ trả về khi client yêu cầu includeTopics)
+        return [r.summary() for r in records]
+
+    def iter_build_from_sql(self, limit: Optional[int] = None, batch_size: Optional[int] = None,
+                            include_topics: bool = False, force: bool = False) -> Iterator[Dict[str, Any]]:
+        # Xây dựng lại chỉ mục theo từng lô đọc bằng cursor (fetchmany/Arrow), mỗi lô được ghi ngay
+        # Sinh ra một sự kiện "batch" sau mỗi lô và một sự kiện "summary" ở cuối,
+        # nên cả server lẫn client không phải giữ toàn bộ danh sách đề tài trong bộ nhớ
+        # force=True: embed lại mọi đề tài, kể cả đề tài có nội dung không đổi
+        started = time.perf_counter()
+        repo = get_topic_repository()
+        svc = TopicsService()
+        totals = {"upserted": 0, "embedded": 0, "skipped": 0}
+        errors: List[Dict[str, Any]] = []
+        topics: List[Dict[str, Any]] = []
+        processed = 0
+        batches = 0
+        max_version_id = None
+        fetch_seconds = 0.0
+        write_seconds = 0.0
+        chroma: Dict[str, Any] = {"chromaWriteMs": 0.0, "chromaChunks": 0, "slowestChunkMs": 0.0}
+
+        source = repo.fetch_latest_columns(limit=limit, batch_size=batch_size)
+        while True:
+            t0 = time.perf_counter()
+            batch = next(source, None)
+            fetch_seconds += time.perf_counter() - t0
+            if batch is None:
+                break
+
+            batches += 1
+            version_ids = to_pylist(batch["TopicVersionId"])
+            records = None
+            if include_topics or not settings.SQL_COLUMNAR_FETCH:
+                records = TopicRecord.from_columns(batch)
+
+            t0 = time.perf_counter()
+            try:
+                # Đề tài không đổi nội dung sẽ không bị embed lại (trừ khi force)
+                if settings.SQL_COLUMNAR_FETCH:
+                    stats = svc.upsert_columns(batch, force=force)
+                else:
+                    stats = svc.upsert_records(records, force=force)
+            except Exception as e:
+                # Lỗi của một lô không dừng cả quá trình; lô lỗi được liệt kê trong kết quả
+                stats = None
+                topic_ids = to_pylist(batch["TopicId"])
+                errors.append({
+                    "batch": batches,
+                    "firstTopicId": topic_ids[0] if topic_ids else None,
+                    "lastTopicId": topic_ids[-1] if topic_ids else None,
+                    "error": str(e),
+                })
+            write_seconds += time.perf_counter() - t0
+
+            processed += len(version_ids)
+            if stats is not None:
+                for k in totals:
+                    totals[k] += stats[k]
+                _add_chroma_write(chroma, stats)
+            if include_topics:
+                topics.extend(self._summarize_topics(records))
+            if version_ids:
+                batch_max = max(version_ids)
+                max_version_id = batch_max if max_version_id is None else max(max_version_id, batch_max)
+
+            yield {
+                "type": "batch",
+                "batch": batches,
+                "size": len(version_ids),
+                "processed": processed,
+                "indexed": totals["upserted"],
+                "embedded": totals["embedded"],
+                "skipped": totals["skipped"],
+                "error": errors[-1]["error"] if stats is None else None,
+                # Thời gian ghi từng lô ChromaDB của lô SQL này
+                "chromaChunks": ((stats or {}).get("chromaWrite") or {}).get("chunks", []),
+                "elapsedMs": round((time.perf_counter() - started) * 1000, 1),
+            }
+
+        # Xây dựng lại toàn bộ thành công -> các lần đồng bộ tăng dần sau chỉ cần đọc phần thay đổi
+        if not limit and not errors and max_version_id is not None:
+            IndexStateRepository().set(WATERMARK_KEY, max_version_id)
+
+        summary = {
+            "type": "summary",
+            "indexed": totals["upserted"],
+            "embedded": totals["embedded"],
+            "skipped": totals["skipped"],
+            "total_topics": processed,
+            "batches": batches,
+            "errors": errors,
+            "timings": {
+                "fetchMs": round(fetch_seconds * 1000, 1),
+                "writeMs": round(write_seconds * 1000, 1),
+                "totalMs": round((time.perf_counter() - started) * 1000, 1),
+                **chroma,
+            },
+        }
+        if include_topics:
+            summary["topics"] = topics
+        yield summary
+
+    def build_from_sql(self, limit: Optional[int] = None, batch_size: Optional[int] = None,
+                       include_topics: bool = False, force: bool = False) -> Dict[str, Any]:
         # Xây dựng lại chỉ mục vector từ dữ liệu SQL Server
         # Hữu ích cho thiết lập ban đầu hoặc đồng bộ hóa dữ liệu
-        
-        # Lấy dữ liệu từ SQL Server
-        repo = MsSqlTopicRepository()
-        rows = repo.fetch_latest(limit=limit)
-        
-        # Chuyển đổi sang format phù hợp cho vector database
+        # Mặc định chỉ trả về bản tóm tắt (số lượng, thời gian, lỗi); include_topics=True để kèm danh sách đề tài
+        summary: Dict[str, Any] = {}
+        for event in self.iter_build_from_sql(limit=limit, batch_size=batch_size, include_topics=include_topics,
+                                              force=force):
+            summary = event
+        summary.pop("type", None)
+        return summary
+
+    def sync_incremental(self, batch_size: Optional[int] = None) -> Dict[str, Any]:
+        # Đồng bộ tăng dần: chỉ đọc và embed các phiên bản đề tài mới hơn watermark đã lưu
+        # Chi phí tỉ lệ với số thay đổi thay vì kích thước toàn bộ kho đề tài
+        # - Quét lại SYNC_SAFETY_WINDOW TopicVersionId dưới watermark: phiên bản commit muộn (Id nhỏ hơn
+        #   watermark) còn thiếu trong ChromaDB được ghi ("recovered"); phiên bản đã có thì bỏ qua
+        # - Phiên bản cũ của đề tài vừa đồng bộ bị xóa khỏi chỉ mục ("superseded")
+        # - Giữ khóa "sync" (liên process): poller và POST /index/sync không chạy chồng lên nhau
+        #   (TimeoutError nếu lượt khác giữ khóa quá STATE_LOCK_TIMEOUT_SECONDS)
+        batch_size = batch_size or settings.SYNC_BATCH_SIZE
+        repo = get_topic_repository()
+        state = IndexStateRepository()
         svc = TopicsService()
-        items = []
-        topics_added = []  # Danh sách topics được thêm vào
-        
-        for r in rows:
-            topic_info = {
-                "topicId": r["TopicId"],
-                "topicVersionId": r["TopicVersionId"],
-                "title": r.get("Title", ""),
-                "description": r.get("Description", ""),
-                "objectives": r.get("Objectives", ""),
-                "methodology": r.get("Methodology", ""),
-                "expectedOutcomes": r.get("ExpectedOutcomes", ""),
-                "requirements": r.get("Requirements", ""),
-            }
-            items.append(topic_info)
-            
-            # Thêm thông tin topic vào danh sách trả về
-            topics_added.append({
-                "topicId": r["TopicId"],
-                "topicVersionId": r["TopicVersionId"],
-                "title": r.get("Title", ""),
-                "description": r.get("Description", "")[:100] + "..." if len(r.get("Description", "")) > 100 else r.get("Description", ""),  # Cắt ngắn description
-            })
-            
-        # Thêm tất cả vào vector database
-        indexed_count = svc.upsert_many(items)
-        
+
+        with state_lock("sync"):
+            start_watermark = watermark = state.get(WATERMARK_KEY, 0)
+            cursor = max(0, watermark - settings.SYNC_SAFETY_WINDOW)
+            synced = 0
+            embedded = 0
+            recovered = 0
+            superseded = 0
+            batches = 0
+            chroma: Dict[str, Any] = {"chromaWriteMs": 0.0, "chromaChunks": 0, "slowestChunkMs": 0.0}
+
+            while True:
+                rows = repo.fetch_changed_since(cursor, limit=batch_size)
+                if not rows:
+                    break
+                # Kết quả đã sắp xếp theo TopicVersionId tăng dần
+                cursor = rows[-1].topic_version_id
+
+                changed = [r for r in rows if r.topic_version_id > start_watermark]
+                old = [r for r in rows if r.topic_version_id <= start_watermark]
+                if old:
+                    present = set(svc.repo.existing_ids([f"tv:{r.topic_version_id}" for r in old]))
+                    missing = [r for r in old if f"tv:{r.topic_version_id}" not in present]
+                    recovered += len(missing)
+                    changed = missing + changed
+                if changed:
+                    stats = svc.upsert_records(changed)
+                    embedded += stats["embedded"]
+                    _add_chroma_write(chroma, stats)
+                    superseded += svc.remove_superseded(changed)
+                    synced += len(changed)
+
+                # Lưu watermark sau mỗi lô đã ghi
+                if cursor > watermark:
+                    watermark = cursor
+                    state.set(WATERMARK_KEY, watermark)
+                batches += 1
+
+                if len(rows) < batch_size:
+                    break
+
         return {
-            "indexed": indexed_count,
-            "topics": topics_added,
-            "total_topics": len(topics_added)
+            "synced": synced,
+            "embedded": embedded,
+            "skipped": synced - embedded,
+            "recovered": recovered,
+            "superseded": superseded,
+            "batches": batches,
+            "fromWatermark": start_watermark,
+            "watermark": watermark,
+            **chroma,
         }
+
+    @staticmethod
+    def _with_percent(checkpoint: Dict[str, Any]) -> Dict[str, Any]:
+        total = checkpoint.get("total") or 0
+        percent = 100.0 if total == 0 else min(100.0, 100.0 * checkpoint.get("processed", 0) / total)
+        if checkpoint.get("status") != "completed":
+            percent = min(percent, 99.99)
+        return {**checkpoint, "percent": round(percent, 2)}
+
+    def reindex(self, page_size: Optional[int] = None, resume: bool = True, limit: Optional[int] = None,
+                checkpoint_key: str = REINDEX_CHECKPOINT_KEY,
+                on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+                should_cancel: Optional[Callable[[], bool]] = None, force: bool = False) -> Dict[str, Any]:
+        # Xây dựng lại toàn bộ chỉ mục theo từng trang keyset (TopicId tăng dần)
+        # Checkpoint được lưu sau mỗi trang đã ghi; nếu tiến trình bị dừng giữa chừng
+        # (OOM, deploy, SQL timeout) lần chạy sau sẽ tiếp tục từ TopicId cuối cùng đã ghi
+        # - limit: chỉ lập chỉ mục tối đa limit đề tài đầu tiên (không cập nhật watermark)
+        # - on_progress: được gọi với checkpoint sau mỗi trang (job chạy nền báo tiến độ)
+        # - should_cancel: được kiểm tra trước mỗi trang; True -> dừng, checkpoint "cancelled"
+        # - force: embed lại mọi đề tài (vd. sau khi đổi model embedding); lưu trong checkpoint nên
+        #   lần chạy tiếp tục cũng embed lại
+        page_size = page_size or settings.REINDEX_PAGE_SIZE
+        repo = get_topic_repository()
+        state = IndexStateRepository()
+        svc = TopicsService()
+
+        checkpoint = state.get(checkpoint_key) if resume else None
+        if not checkpoint or checkpoint.get("status") == "completed":
+            source = repo.source_stats()
+            total = source["topicCount"]
+            checkpoint = {
+                "runId": uuid.uuid4().hex,
+                "status": "running",
+                "lastTopicId": None,
+                "processed": 0,
+                "embedded": 0,
+                "chromaWriteMs": 0.0,
+                "chromaChunks": 0,
+                "slowestChunkMs": 0.0,
+                "total": min(total, limit) if limit else total,
+                # Watermark lấy tại thời điểm bắt đầu: các phiên bản tạo ra trong lúc
+                # chạy sẽ được lần đồng bộ tăng dần tiếp theo đọc lại
+                "startWatermark": source["maxTopicVersionId"],
+                "pageSize": page_size,
+                "force": force,
+                "startedAt": time.time(),
+                "resumedAt": None,
+            }
+        else:
+            checkpoint["status"] = "running"
+            checkpoint["resumedAt"] = time.time()
+            checkpoint["force"] = force = force or bool(checkpoint.get("force"))
+        state.set(checkpoint_key, checkpoint)
+
+        while True:
+            if should_cancel is not None and should_cancel():
+                checkpoint["status"] = "cancelled"
+                checkpoint["finishedAt"] = time.time()
+                state.set(checkpoint_key, checkpoint)
+                return self._with_percent(checkpoint)
+
+            size = page_size
+            if limit:
+                size = min(page_size, limit - checkpoint["processed"])
+                if size <= 0:
+                    break
+            rows = repo.fetch_page(checkpoint["lastTopicId"], size)
+            if not rows:
+                break
+
+            stats = svc.upsert_records(rows, force=force)
+
+            # Trang đã ghi xong -> lưu checkpoint trước khi đọc trang tiếp theo
+            checkpoint["lastTopicId"] = rows[-1].topic_id
+            checkpoint["processed"] += len(rows)
+            checkpoint["embedded"] += stats["embedded"]
+            _add_chroma_write(checkpoint, stats)
+            checkpoint["updatedAt"] = time.time()
+            state.set(checkpoint_key, checkpoint)
+            if on_progress is not None:
+                on_progress(checkpoint)
+
+            if len(rows) < size:
+                break
+
+        checkpoint["status"] = "completed"
+        checkpoint["finishedAt"] = time.time()
+        state.set(checkpoint_key, checkpoint)
+        # Lần chạy giới hạn số đề tài không được đẩy watermark (các đề tài còn lại chưa được ghi)
+        if not limit and checkpoint.get("startWatermark") is not None:
+            state.set(WATERMARK_KEY, checkpoint["startWatermark"])
+
+        return self._with_percent(checkpoint)
+
+    def reindex_progress(self) -> Dict[str, Any]:
+        # Tiến độ của lần xây dựng lại gần nhất (đọc từ checkpoint, dùng được khi đang chạy)
+        checkpoint = IndexStateRepository().get(REINDEX_CHECKPOINT_KEY)
+        if not checkpoint:
+            return {"status": "none", "percent": 0.0}
+        return self._with_percent(checkpoint)
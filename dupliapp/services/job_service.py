@@ -0,0 +1,228 @@
+﻿# -*- coding: utf-8 -*-
+# Service quản lý job lập chỉ mục chạy nền: xếp hàng, worker thread, tiến độ và hủy job
+from typing import Any, Dict, List, Optional
+import threading
+import time
+from dupliapp.config import settings
+from dupliapp.repositories.job_repository import (
+    JobRepository, COMPLETED, FAILED, CANCELLED,
+)
+
+# Các loại job được hỗ trợ
+JOB_KIND_REINDEX = "reindex"
+JOB_KIND_COMPACT = "compact"
+JOB_KIND_KNN = "knn-rebuild"
+JOB_KIND_KNN_UPDATE = "knn-update"
+JOB_KINDS = (JOB_KIND_REINDEX, JOB_KIND_COMPACT, JOB_KIND_KNN, JOB_KIND_KNN_UPDATE)
+
+def merge_knn_params(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    # Gộp hai lần cập nhật đồ thị kNN: thao tác sau cùng của mỗi ID thắng (upsert rồi xóa -> chỉ còn
+    # "remove", xóa rồi upsert lại -> chỉ còn "update") nên hai danh sách không giao nhau
+    update = dict.fromkeys(old.get("update") or [])
+    remove = dict.fromkeys(old.get("remove") or [])
+    for id_ in new.get("update") or []:
+        remove.pop(id_, None)
+        update[id_] = None
+    for id_ in new.get("remove") or []:
+        update.pop(id_, None)
+        remove[id_] = None
+    return {"update": list(update), "remove": list(remove)}
+
+def job_checkpoint_key(job_id: str) -> str:
+    # Mỗi job có checkpoint riêng trong IndexStateRepository để tiếp tục sau khi khởi động lại
+    return f"job:{job_id}:checkpoint"
+
+class JobService:
+    """
+    Xếp hàng và thực thi job xây dựng lại chỉ mục (và compaction) trong thread nền
+
+    - submit() chỉ ghi job vào bảng index_jobs và đánh thức worker, trả về ngay
+    - Worker nhận job (claim nguyên tử), chạy IndexService.reindex theo trang và
+      cập nhật processed/total sau mỗi trang; yêu cầu hủy được kiểm tra trước mỗi trang
+    - Job "running" mất heartbeat (tiến trình bị dừng) được đưa lại hàng đợi và
+      tiếp tục từ checkpoint của chính nó
+    """
+
+    def __init__(self, repo: Optional[JobRepository] = None,
+                 poll_interval: Optional[float] = None, stale_after: Optional[float] = None):
+        self.repo = repo or JobRepository()
+        self.poll_interval = settings.JOB_POLL_SECONDS if poll_interval is None else poll_interval
+        self.stale_after = settings.JOB_STALE_SECONDS if stale_after is None else stale_after
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    @staticmethod
+    def _view(job: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        # Chuyển bản ghi job sang dạng trả về cho API (camelCase, % và tốc độ xử lý)
+        if job is None:
+            return None
+        total = job["total"]
+        processed = job["processed"]
+        percent = round(100.0 * processed / total, 2) if total else (100.0 if job["status"] == COMPLETED else 0.0)
+
+        # Tốc độ chỉ tính phần xử lý trong lần chạy hiện tại (không tính phần đã có từ checkpoint)
+        throughput = None
+        if job["started_at"]:
+            end = job["finished_at"] or time.time()
+            elapsed = end - job["started_at"]
+            if elapsed > 0:
+                throughput = round((processed - job["base_processed"]) / elapsed, 2)
+
+        return {
+            "jobId": job["id"],
+            "kind": job["kind"],
+            "status": job["status"],
+            "params": job["params"],
+            "processed": processed,
+            "total": total,
+            "embedded": job["embedded"],
+            "percent": percent,
+            "throughput": throughput,
+            "error": job["error"],
+            "result": job["result"],
+            "cancelRequested": job["cancel_requested"],
+            "createdAt": job["created_at"],
+            "startedAt": job["started_at"],
+            "finishedAt": job["finished_at"],
+        }
+
+    def submit(self, kind: str = JOB_KIND_REINDEX, params: Optional[Dict[str, Any]] = None,
+               unique: bool = False) -> Dict[str, Any]:
+        # unique=True: trả về job cùng loại đang chờ/chạy nếu có (không xếp thêm job trùng)
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unsupported job kind: {kind}")
+        job = self.repo.create(kind, params or {}, unique=unique)
+        self._wake.set()
+        return self._view(job)
+
+    def submit_knn_update(self, update: List[str], remove: List[str]) -> Dict[str, Any]:
+        # Cập nhật đồ thị kNN sau upsert/xóa: gộp vào job knn-update đang chờ thay vì mỗi request một job
+        job = self.repo.merge_queued(JOB_KIND_KNN_UPDATE, merge_knn_params({}, {"update": update, "remove": remove}),
+                                     merge_knn_params)
+        self._wake.set()
+        return self._view(job)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self._view(self.repo.get(job_id))
+
+    def list(self, limit: int = 20) -> List[Dict[str, Any]]:
+        return [self._view(j) for j in self.repo.list(limit)]
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self._view(self.repo.request_cancel(job_id))
+
+    def _execute(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        # Import muộn để tránh vòng import khi khởi tạo ứng dụng
+        from dupliapp.services.index_service import IndexService
+        from dupliapp.services.compaction_service import CompactionService
+        from dupliapp.services.knn_service import KnnGraphService
+        job_id = job["id"]
+        params = job["params"]
+
+        if job["kind"] == JOB_KIND_COMPACT:
+            # Compaction không hủy được giữa chừng (collection chỉ được thay thế sau khi chép xong)
+            return CompactionService().compact(
+                force=bool(params.get("force")),
+                page_size=params.get("pageSize"),
+                on_progress=lambda copied, total: self.repo.update(
+                    job_id, processed=copied, total=total, heartbeat_at=time.time()),
+            )
+
+        if job["kind"] == JOB_KIND_KNN:
+            return KnnGraphService().rebuild(
+                page_size=params.get("pageSize"),
+                on_progress=lambda processed, total: self.repo.update(
+                    job_id, processed=processed, total=total, heartbeat_at=time.time()),
+            )
+
+        if job["kind"] == JOB_KIND_KNN_UPDATE:
+            # Cập nhật đồ thị kNN cho các ID vừa được embed lại ("update") hoặc vừa bị xóa ("remove")
+            graph = KnnGraphService()
+            update, remove = params.get("update") or [], params.get("remove") or []
+            result: Dict[str, Any] = {"status": "completed", "processed": len(update) + len(remove),
+                                      "total": len(update) + len(remove), "embedded": 0}
+            if update:
+                result["update"] = graph.update(update)
+            if remove:
+                result["remove"] = graph.remove(remove)
+            return result
+
+        def on_progress(checkpoint: Dict[str, Any]) -> None:
+            self.repo.update(job_id, processed=checkpoint["processed"], total=checkpoint["total"],
+                             embedded=checkpoint["embedded"], heartbeat_at=time.time())
+
+        return IndexService().reindex(
+            page_size=params.get("pageSize"),
+            limit=params.get("limit"),
+            resume=True,
+            checkpoint_key=job_checkpoint_key(job_id),
+            on_progress=on_progress,
+            should_cancel=lambda: self.repo.is_cancel_requested(job_id),
+            force=bool(params.get("force")),
+        )
+
+    def run_next(self) -> Optional[Dict[str, Any]]:
+        # Nhận và chạy hết một job đang chờ; trả về None nếu hàng đợi rỗng
+        job = self.repo.claim_next()
+        if job is None:
+            return None
+        try:
+            result = self._execute(job)
+            status = CANCELLED if result.get("status") == "cancelled" else COMPLETED
+            self.repo.update(job["id"], status=status, result=result, processed=result["processed"],
+                             total=result["total"], embedded=result["embedded"], finished_at=time.time())
+        except Exception as e:
+            print(f"⚠️ Warning: Index job {job['id']} failed: {e}")
+            self.repo.update(job["id"], status=FAILED, error=str(e), finished_at=time.time())
+        return self.get(job["id"])
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.repo.requeue_stale(self.stale_after)
+                if self.run_next() is not None:
+                    continue
+            except Exception as e:
+                print(f"⚠️ Warning: Index job worker error: {e}")
+            # Chờ job mới (submit đánh thức ngay) hoặc hết chu kỳ poll
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def start(self, workers: int = 1) -> None:
+        if any(t.is_alive() for t in self._threads):
+            return
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"index-job-worker-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for t in self._threads:
+            t.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        # Worker dừng sau job đang chạy; job dở dang sẽ được tiếp tục khi khởi động lại
+        self._stop.set()
+        self._wake.set()
+        for t in self._threads:
+            t.join(timeout)
+
+# Service dùng chung cho toàn bộ ứng dụng (singleton pattern)
+_job_service: Optional[JobService] = None
+_job_service_lock = threading.Lock()
+
+def get_job_service() -> JobService:
+    global _job_service
+    with _job_service_lock:
+        # Tạo lại khi STATE_DB_PATH thay đổi (vd: cấu hình khác giữa các app instance)
+        if _job_service is None or _job_service.repo.path != settings.STATE_DB_PATH:
+            _job_service = JobService()
+        return _job_service
+
+def start_job_worker() -> Optional[JobService]:
+    # Khởi động worker nếu JOB_WORKERS > 0
+    if settings.JOB_WORKERS <= 0:
+        return None
+    svc = get_job_service()
+    svc.start(settings.JOB_WORKERS)
+    return svc
@@ -0,0 +1,187 @@
+﻿# -*- coding: utf-8 -*-
+# Service duy trì đồ thị kNN đã tính sẵn: cập nhật khi upsert/xóa (qua job knn-update), tra cứu O(1) và xây dựng lại hàng loạt
+from typing import Any, Callable, Dict, List, Optional
+import time
+import numpy as np
+from dupliapp.config import settings
+from dupliapp.repositories.chroma_repository import ChromaTopicsRepository
+from dupliapp.repositories.knn_repository import KnnGraphRepository
+
+class KnnGraphService:
+    """
+    Đồ thị k láng giềng gần nhất của mọi đề tài trong chỉ mục
+
+    Láng giềng của một đề tài được tính một lần khi đề tài được embed (query bằng vector đã lưu,
+    loại chính nó và các phiên bản khác của cùng TopicId) rồi lưu vào KnnGraphRepository, nên
+    "đề tài gần nhất" của bất kỳ đề tài nào chỉ còn là một lần đọc SQLite. Khi có đề tài mới,
+    đề tài đó cũng được đề xuất vào danh sách của các láng giềng (láng giềng ngược); khi một đề tài
+    bị embed lại hoặc bị xóa, các node đang trỏ tới nó được tính lại.
+    """
+
+    def __init__(self, repo: Optional[ChromaTopicsRepository] = None,
+                 graph: Optional[KnnGraphRepository] = None, k: Optional[int] = None):
+        self.repo = repo or ChromaTopicsRepository()
+        self.graph = graph or KnnGraphRepository()
+        self.k = k or settings.KNN_K
+
+    def _neighbor_hits(self, node: str, topic_id: Any, res: Dict[str, Any]) -> List[Dict[str, Any]]:
+        # Hit của một query, bỏ chính node và các phiên bản cùng TopicId (so sánh dạng chuỗi
+        # vì TopicId có thể được lưu dạng số hoặc chuỗi)
+        hits = []
+        for id_, meta, dist in zip(res["ids"], res["metadatas"], res["distances"]):
+            m = meta or {}
+            if id_ == node or (topic_id is not None and str(m.get("TopicId")) == str(topic_id)):
+                continue
+            hits.append({
+                "id": id_,
+                "topicId": m.get("TopicId"),
+                "topicVersionId": m.get("TopicVersionId"),
+                "title": m.get("Title", ""),
+                "similarity": round(1.0 - (float(dist) / 2.0), 4),
+            })
+        return hits
+
+    def compute(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Tính láng giềng cho các ID bằng vector đã lưu (không chạy model embedding)
+
+        Các query được gửi theo lô, lấy dư KNN_OVERFETCH kết quả để bù cho các phiên bản cùng TopicId;
+        chỉ khi phần dư không đủ mới query lại riêng đề tài đó, loại TopicId ở cả dạng số và chuỗi.
+
+        Returns:
+            Dict ID -> {"topicId", "topicVersionId", "title", "hits", "candidates"}; ID không còn
+            trong chỉ mục bị bỏ qua
+        """
+        stored = self.repo.get_embeddings(ids)
+        nodes = [i for i in ids if i in stored]
+        if not nodes:
+            return {}
+        metas = self.repo.get_metadatas(nodes)
+        n_results = self.k + settings.KNN_OVERFETCH
+        results = self.repo.query_many(np.stack([stored[i] for i in nodes]), n_results=n_results)
+
+        out: Dict[str, Dict[str, Any]] = {}
+        for node, res in zip(nodes, results):
+            meta = metas.get(node) or {}
+            topic_id = meta.get("TopicId")
+            hits = self._neighbor_hits(node, topic_id, res)
+            if len(hits) < self.k and len(res["ids"]) == n_results and topic_id is not None:
+                res = self.repo.query_many(stored[node][None, :], n_results=self.k + 1,
+                                           where=self.repo.exclude_topic_where(topic_id))[0]
+                hits = self._neighbor_hits(node, topic_id, res)
+            out[node] = {
+                "topicId": topic_id,
+                "topicVersionId": meta.get("TopicVersionId"),
+                "title": meta.get("Title", ""),
+                "hits": hits[:self.k],
+                # Mọi ứng viên đã lấy về (kể cả phần dư) - dùng để đề xuất láng giềng ngược
+                "candidates": hits,
+            }
+        return out
+
+    def update(self, ids: List[str]) -> Dict[str, int]:
+        """
+        Cập nhật đồ thị sau khi các ID được embed (mới hoặc nội dung thay đổi)
+
+        - Tính láng giềng của chính các ID
+        - Đề xuất các ID vào danh sách của từng ứng viên đã lấy về (giữ nếu lọt top k của ứng viên)
+        - Tính lại các node đang trỏ tới ID (similarity đã lưu của chúng không còn đúng)
+
+        Quan hệ kNN không đối xứng: một node ở xa hơn k + KNN_OVERFETCH ứng viên của đề tài mới vẫn
+        có thể nhận đề tài mới vào top k của nó. Trường hợp hiếm này chỉ được sửa khi xây dựng lại
+        đồ thị (POST /index/knn) hoặc khi node đó được tính lại.
+        """
+        changed = set(ids)
+        stale = [n for n in self.graph.referrers(ids) if n not in changed]
+        fresh = self.compute(ids)
+        self.graph.set_neighbors(fresh)
+
+        # Cặp cùng được tính lại ở trên đã đúng, không cần đề xuất ngược
+        edges = [
+            {"node": h["id"], "id": node, "similarity": h["similarity"], "topicId": info["topicId"],
+             "topicVersionId": info["topicVersionId"], "title": info["title"]}
+            for node, info in fresh.items() for h in info["candidates"] if h["id"] not in fresh
+        ]
+        reverse = self.graph.offer(edges, self.k)
+
+        recomputed = self.compute(stale)
+        self.graph.set_neighbors(recomputed)
+        return {"nodes": len(fresh), "reverseUpdated": reverse, "recomputed": len(recomputed)}
+
+    def remove(self, ids: List[str]) -> Dict[str, int]:
+        # Gỡ các ID đã xóa khỏi đồ thị và tính lại các node từng có chúng trong danh sách láng giềng
+        removed = set(ids)
+        affected = [n for n in self.graph.referrers(ids) if n not in removed]
+        self.graph.remove(ids)
+        recomputed = self.compute(affected)
+        self.graph.set_neighbors(recomputed)
+        return {"removed": len(ids), "recomputed": len(recomputed)}
+
+    def rebuild(self, page_size: Optional[int] = None,
+                on_progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, Any]:
+        # Xây dựng lại toàn bộ đồ thị từ các vector trong chỉ mục (lần đầu bật KNN_GRAPH_ENABLED)
+        started = time.perf_counter()
+        total = self.repo.count()
+        self.graph.clear()
+
+        processed = 0
+        for page in self.repo.iter_ids(page_size or settings.KNN_PAGE_SIZE):
+            self.graph.set_neighbors(self.compute(page))
+            processed += len(page)
+            if on_progress is not None:
+                on_progress(processed, total)
+
+        return {
+            "status": "completed",
+            "processed": processed,
+            "total": total,
+            "embedded": 0,
+            "k": self.k,
+            "edges": self.graph.stats()["edges"],
+            "elapsedSeconds": round(time.perf_counter() - started, 3),
+        }
+
+    def neighbors(self, topic_version_ids: List[Any], top_k: int, threshold: float) -> Dict[str, Any]:
+        """
+        Láng giềng đã tính sẵn của nhiều đề tài (danh sách đề tài trên dashboard)
+
+        Đề tài có trong chỉ mục nhưng chưa có trong đồ thị (vd: trước lần xây dựng đầu tiên hoặc khi
+        job knn-update chưa chạy) được tính ngay từ vector đã lưu nhưng không ghi vào đồ thị - chỉ
+        đọc; đồ thị được điền bởi job knn-update/knn-rebuild. top_k không vượt quá KNN_K.
+
+        Returns:
+            {"items": [...], "notFound": [...]} - mỗi item cùng dạng với TopicsService.similar,
+            kèm "cached" = True nếu đọc từ đồ thị
+        """
+        ids = list(dict.fromkeys(f"tv:{v}" for v in topic_version_ids))
+        found = self.graph.neighbors(ids)
+        missing = [i for i in ids if i not in found]
+        computed = self.compute(missing) if missing else {}
+
+        items = []
+        for id_ in ids:
+            info = found.get(id_) or computed.get(id_)
+            if info is None:
+                continue
+            hits = info["hits"][:top_k]
+            items.append({
+                "topicId": info["topicId"],
+                "topicVersionId": info["topicVersionId"],
+                "title": info["title"],
+                "hits": hits,
+                "duplicates": [h for h in hits if h["similarity"] >= threshold],
+                "threshold": threshold,
+                "cached": id_ in found,
+            })
+        return {
+            "items": items,
+            "notFound": [i[len("tv:"):] for i in ids if i not in found and i not in computed],
+        }
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "enabled": settings.KNN_GRAPH_ENABLED,
+            "k": self.k,
+            "count": self.repo.count(),
+            **self.graph.stats(),
+        }
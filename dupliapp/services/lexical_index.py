@@ -0,0 +1,223 @@
+﻿# -*- coding: utf-8 -*-
+# Chỉ mục từ vựng trong bộ nhớ tiến trình: hash text chuẩn hóa (bản sao y hệt) + MinHash/LSH (gần y hệt)
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+import hashlib
+import threading
+import zlib
+import numpy as np
+from dupliapp.config import settings
+from dupliapp.services.index_changes import ChangeTrackedIndex
+from dupliapp.utils.text_normalize import normalize_text
+
+# Số nguyên tố Mersenne 2^31 - 1 cho họ hàm băm (a*x + b) mod p: tích < 2^62 nên không tràn uint64
+_PRIME = np.uint64((1 << 31) - 1)
+
+# Loại khớp của đường tắt
+MATCH_EXACT = "exact"
+MATCH_MINHASH = "minhash"
+
+class LexicalIndex(ChangeTrackedIndex):
+    """
+    Phát hiện bản sao y hệt / gần y hệt trước khi chạy model embedding
+
+    - Hash SHA-256 của text đã chuẩn hóa (normalize_text): hai đề tài chỉ khác hoa/thường, dấu câu,
+      khoảng trắng hoặc dạng Unicode có cùng hash -> cosine similarity của embedding bằng 1
+    - Chữ ký MinHash (LEXICAL_MINHASH_PERM hàm băm) trên tập shingle ký tự (LEXICAL_SHINGLE_SIZE ký tự)
+      chia thành LEXICAL_LSH_BANDS băng; đề tài chung ít nhất một băng là ứng viên và độ tương đồng
+      Jaccard ước lượng bằng tỉ lệ phần tử chữ ký trùng nhau
+    Chỉ mục được dựng một lần từ documents trong ChromaDB, được cập nhật khi đề tài được embed/xóa và
+    đọc bù thay đổi của process khác từ nhật ký thay đổi (ChangeTrackedIndex).
+    """
+
+    def __init__(self, num_perm: int, bands: int, shingle_size: int):
+        super().__init__()
+        if num_perm % bands:
+            raise ValueError("LEXICAL_MINHASH_PERM must be a multiple of LEXICAL_LSH_BANDS")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        # Hệ số cố định để chữ ký giống nhau giữa các tiến trình/lần khởi động
+        rng = np.random.default_rng(20240601)
+        self._a = rng.integers(1, int(_PRIME), size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, int(_PRIME), size=num_perm, dtype=np.uint64)
+        self.built = False
+        self._lock = threading.RLock()
+        self._reset()
+        # Số request tìm kiếm và số request được trả lời bằng đường tắt
+        self.counters = {"requests": 0, MATCH_EXACT: 0, MATCH_MINHASH: 0}
+
+    def _reset(self) -> None:
+        self._hash_of: Dict[str, str] = {}
+        self._by_hash: Dict[str, Set[str]] = {}
+        self._signatures: Dict[str, np.ndarray] = {}
+        self._buckets: Dict[Tuple[int, bytes], Set[str]] = {}
+
+    @staticmethod
+    def text_hash(normalized: str) -> str:
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    def signature(self, normalized: str) -> np.ndarray:
+        # Chữ ký MinHash của tập shingle ký tự (text ngắn hơn shingle được coi là một shingle)
+        n = self.shingle_size
+        shingles = {normalized[i:i + n] for i in range(max(len(normalized) - n + 1, 1))}
+        x = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+        x %= _PRIME
+        return ((np.outer(self._a, x) + self._b[:, None]) % _PRIME).min(axis=1)
+
+    def _band_keys(self, sig: np.ndarray) -> List[Tuple[int, bytes]]:
+        return [(b, sig[b * self.rows:(b + 1) * self.rows].tobytes()) for b in range(self.bands)]
+
+    def _unindex(self, id_: str) -> None:
+        h = self._hash_of.pop(id_, None)
+        if h is not None:
+            group = self._by_hash.get(h)
+            if group is not None:
+                group.discard(id_)
+                if not group:
+                    del self._by_hash[h]
+        sig = self._signatures.pop(id_, None)
+        if sig is not None:
+            for key in self._band_keys(sig):
+                bucket = self._buckets.get(key)
+                if bucket is not None:
+                    bucket.discard(id_)
+                    if not bucket:
+                        del self._buckets[key]
+
+    def add(self, ids: Iterable[str], texts: Iterable[str]) -> None:
+        # Thêm hoặc thay text của các ID
+        with self._lock:
+            for id_, text in zip(ids, texts):
+                self._unindex(id_)
+                normalized = normalize_text(text)
+                if not normalized:
+                    continue
+                h = self.text_hash(normalized)
+                self._hash_of[id_] = h
+                self._by_hash.setdefault(h, set()).add(id_)
+                sig = self.signature(normalized)
+                self._signatures[id_] = sig
+                for key in self._band_keys(sig):
+                    self._buckets.setdefault(key, set()).add(id_)
+
+    def remove(self, ids: Iterable[str]) -> None:
+        with self._lock:
+            for id_ in ids:
+                self._unindex(id_)
+
+    def match(self, text: str, min_jaccard: float) -> Optional[Tuple[str, List[Tuple[str, float]]]]:
+        """
+        Tìm bản sao của text trong chỉ mục
+
+        Returns:
+            (MATCH_EXACT, [(id, 1.0), ...]) nếu có đề tài cùng text chuẩn hóa, ngược lại
+            (MATCH_MINHASH, [(id, jaccard), ...]) với các ứng viên LSH có Jaccard ước lượng >= min_jaccard
+            (sắp xếp giảm dần), hoặc None nếu không có
+        """
+        normalized = normalize_text(text)
+        if not normalized:
+            return None
+        with self._lock:
+            exact = self._by_hash.get(self.text_hash(normalized))
+            if exact:
+                return MATCH_EXACT, [(i, 1.0) for i in sorted(exact)]
+
+            sig = self.signature(normalized)
+            candidates: Set[str] = set()
+            for key in self._band_keys(sig):
+                candidates |= self._buckets.get(key, set())
+            scored = [(i, float(np.mean(self._signatures[i] == sig))) for i in candidates]
+        near = sorted([(i, round(j, 4)) for i, j in scored if j >= min_jaccard], key=lambda t: (-t[1], t[0]))
+        return (MATCH_MINHASH, near) if near else None
+
+    def verify(self, text: str, documents: Dict[str, str],
+               min_jaccard: float) -> Optional[Tuple[str, List[Tuple[str, float]]]]:
+        """
+        Tính lại kết quả của match() trên documents hiện có trong ChromaDB của các ứng viên
+
+        Chỉ mục có thể chậm hơn ChromaDB (đề tài vừa bị sửa/xóa ở process khác, chưa đọc bù) nên ứng viên
+        được kiểm tra lại trước khi trả lời. Ứng viên không còn trong documents bị bỏ qua.
+        """
+        normalized = normalize_text(text)
+        if not normalized:
+            return None
+        stored = {i: normalize_text(d) for i, d in documents.items()}
+        exact = sorted(i for i, n in stored.items() if n == normalized)
+        if exact:
+            return MATCH_EXACT, [(i, 1.0) for i in exact]
+        sig = self.signature(normalized)
+        scored = [(i, float(np.mean(self.signature(n) == sig))) for i, n in stored.items() if n]
+        near = sorted([(i, round(j, 4)) for i, j in scored if j >= min_jaccard], key=lambda t: (-t[1], t[0]))
+        return (MATCH_MINHASH, near) if near else None
+
+    def record(self, answered: Optional[str]) -> None:
+        # Đếm một request tìm kiếm; answered = loại khớp nếu được trả lời bằng đường tắt
+        with self._lock:
+            self.counters["requests"] += 1
+            if answered:
+                self.counters[answered] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            requests = self.counters["requests"]
+            answered = self.counters[MATCH_EXACT] + self.counters[MATCH_MINHASH]
+            return {
+                "built": self.built,
+                "documents": len(self._signatures),
+                "generation": self.generation,
+                "distinctTexts": len(self._by_hash),
+                "requests": requests,
+                "answeredExact": self.counters[MATCH_EXACT],
+                "answeredMinhash": self.counters[MATCH_MINHASH],
+                "fastPathShare": round(answered / requests, 4) if requests else 0.0,
+                "jaccardThreshold": settings.LEXICAL_JACCARD_THRESHOLD,
+            }
+
+    def _load(self, repo: Any, page_size: int = 1000) -> None:
+        # Dựng lại toàn bộ từ documents (text đã ghép) đang có trong ChromaDB
+        with self._lock:
+            self._reset()
+            for ids, docs in repo.iter_documents(page_size):
+                self.add(ids, docs)
+            self.built = True
+
+    def _reload(self, repo: Any, ids: List[str]) -> None:
+        docs = repo.get_documents(ids)
+        with self._lock:
+            self.remove([i for i in ids if i not in docs])
+            self.add(list(docs), list(docs.values()))
+
+_index: Optional[LexicalIndex] = None
+_index_source: Optional[Tuple[Any, ...]] = None
+_index_lock = threading.Lock()
+
+def _source() -> Tuple[Any, ...]:
+    return (settings.LEXICAL_MINHASH_PERM, settings.LEXICAL_LSH_BANDS, settings.LEXICAL_SHINGLE_SIZE,
+            settings.CHROMA_MODE, settings.CHROMA_DIR, settings.CHROMA_CLOUD_HOST)
+
+def current_lexical_index() -> Optional[LexicalIndex]:
+    # Chỉ mục đã được dựng (không dựng mới) - dùng ở đường ghi
+    if not settings.LEXICAL_FAST_PATH:
+        return None
+    with _index_lock:
+        if _index is not None and _index_source == _source():
+            return _index
+    return None
+
+def get_lexical_index(repo: Any) -> Optional[LexicalIndex]:
+    # Chỉ mục của tiến trình, None nếu LEXICAL_FAST_PATH tắt; dựng từ ChromaDB ở lần gọi đầu và đọc bù
+    # các lần ghi của process khác
+    global _index, _index_source
+    if not settings.LEXICAL_FAST_PATH:
+        return None
+    source = _source()
+    with _index_lock:
+        if _index is None or _index_source != source:
+            index = LexicalIndex(settings.LEXICAL_MINHASH_PERM, settings.LEXICAL_LSH_BANDS,
+                                 settings.LEXICAL_SHINGLE_SIZE)
+            index.build(repo)
+            _index, _index_source = index, source
+        index = _index
+    index.sync(repo)
+    return index
@@ -0,0 +1,237 @@
+﻿# -*- coding: utf-8 -*-
+# Chỉ mục bitmap metadata trong bộ nhớ tiến trình: chọn trước ứng viên cho metadataFilter
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import threading
+from dupliapp.config import settings
+from dupliapp.services.index_changes import ChangeTrackedIndex
+
+# Giá trị metadata được chỉ mục (ChromaDB chỉ lưu các kiểu này)
+SCALAR_TYPES = (str, int, float, bool)
+
+class UnsupportedFilter(Exception):
+    """Điều kiện where không trả lời được bằng bitmap (toán tử khác, key không được chỉ mục)"""
+
+class MetadataBitmapIndex(ChangeTrackedIndex):
+    """
+    Posting list dạng bitmap cho các key metadata trong METADATA_INDEX_KEYS
+
+    Mỗi vector được gán một slot; với mỗi cặp (key, giá trị) lưu một bitmap (số nguyên Python,
+    bit i = slot i) nên điều kiện $eq/$in/$and/$or được tính bằng phép AND/OR trên bitmap và số ứng
+    viên bằng bit_count(). Slot của vector đã xóa được dùng lại. Chỉ mục được dựng một lần từ ChromaDB
+    khi dùng lần đầu, được cập nhật ở mọi đường ghi của TopicsService (upsert/metadata/delete)
+    trong tiến trình này và đọc bù thay đổi của process khác từ nhật ký thay đổi (ChangeTrackedIndex).
+    Giá trị được phân biệt theo kiểu (2023 khác "2023") giống như so sánh của ChromaDB.
+    """
+
+    def __init__(self, keys: Sequence[str]):
+        super().__init__()
+        self.keys = tuple(keys)
+        self.built = False
+        self._lock = threading.RLock()
+        self._reset()
+        # Số lần tìm kiếm theo từng chiến lược (exact / ann / empty)
+        self.counters = {"exact": 0, "ann": 0, "empty": 0}
+
+    def _reset(self) -> None:
+        self._slots: Dict[str, int] = {}
+        self._ids: List[Optional[str]] = []
+        self._values: List[Dict[str, Any]] = []
+        self._free: List[int] = []
+        self._postings: Dict[str, Dict[Tuple[str, Any], int]] = {k: {} for k in self.keys}
+
+    @staticmethod
+    def _value_key(value: Any) -> Tuple[str, Any]:
+        return (type(value).__name__, value)
+
+    def _index(self, slot: int, values: Dict[str, Any]) -> None:
+        bit = 1 << slot
+        for k, v in values.items():
+            vk = self._value_key(v)
+            postings = self._postings[k]
+            postings[vk] = postings.get(vk, 0) | bit
+        self._values[slot] = values
+
+    def _unindex(self, slot: int) -> None:
+        mask = ~(1 << slot)
+        for k, v in self._values[slot].items():
+            vk = self._value_key(v)
+            postings = self._postings[k]
+            bits = postings.get(vk, 0) & mask
+            if bits:
+                postings[vk] = bits
+            else:
+                postings.pop(vk, None)
+        self._values[slot] = {}
+
+    def _indexed_values(self, meta: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: meta[k] for k in self.keys if isinstance(meta.get(k), SCALAR_TYPES)}
+
+    def add(self, ids: Iterable[str], metadatas: Iterable[Dict[str, Any]]) -> None:
+        # Upsert: thay toàn bộ giá trị được chỉ mục của từng ID
+        with self._lock:
+            for id_, meta in zip(ids, metadatas):
+                slot = self._slots.get(id_)
+                if slot is None:
+                    if self._free:
+                        slot = self._free.pop()
+                        self._ids[slot] = id_
+                    else:
+                        slot = len(self._ids)
+                        self._ids.append(id_)
+                        self._values.append({})
+                    self._slots[id_] = slot
+                else:
+                    self._unindex(slot)
+                self._index(slot, self._indexed_values(meta or {}))
+
+    def patch(self, ids: Iterable[str], patches: Iterable[Dict[str, Any]]) -> None:
+        # Gộp metadata giống col.update: key có giá trị None bị xóa
+        with self._lock:
+            for id_, patch in zip(ids, patches):
+                slot = self._slots.get(id_)
+                touched = [k for k in self.keys if k in patch]
+                if slot is None or not touched:
+                    continue
+                values = dict(self._values[slot])
+                for k in touched:
+                    values.pop(k, None)
+                values.update(self._indexed_values({k: patch[k] for k in touched}))
+                self._unindex(slot)
+                self._index(slot, values)
+
+    def remove(self, ids: Iterable[str]) -> None:
+        with self._lock:
+            for id_ in ids:
+                slot = self._slots.pop(id_, None)
+                if slot is None:
+                    continue
+                self._unindex(slot)
+                self._ids[slot] = None
+                self._free.append(slot)
+
+    def _posting(self, key: str, value: Any) -> int:
+        if not isinstance(value, SCALAR_TYPES):
+            raise UnsupportedFilter(key)
+        return self._postings[key].get(self._value_key(value), 0)
+
+    def _evaluate(self, where: Dict[str, Any]) -> int:
+        if not isinstance(where, dict) or not where:
+            raise UnsupportedFilter(where)
+        result: Optional[int] = None
+        for key, cond in where.items():
+            if key in ("$and", "$or"):
+                if not isinstance(cond, list) or not cond:
+                    raise UnsupportedFilter(key)
+                subs = [self._evaluate(c) for c in cond]
+                bits = subs[0]
+                for s in subs[1:]:
+                    bits = bits & s if key == "$and" else bits | s
+            elif key not in self._postings:
+                raise UnsupportedFilter(key)
+            elif isinstance(cond, dict):
+                if len(cond) != 1:
+                    raise UnsupportedFilter(key)
+                op, value = next(iter(cond.items()))
+                if op == "$eq":
+                    bits = self._posting(key, value)
+                elif op == "$in" and isinstance(value, list):
+                    bits = 0
+                    for v in value:
+                        bits |= self._posting(key, v)
+                else:
+                    raise UnsupportedFilter(op)
+            else:
+                bits = self._posting(key, cond)
+            result = bits if result is None else result & bits
+        return result or 0
+
+    def candidates(self, where: Dict[str, Any]) -> Optional[int]:
+        """
+        Bitmap các vector khớp điều kiện where
+
+        Returns:
+            Bitmap (số nguyên), None nếu điều kiện có toán tử/key không được chỉ mục
+        """
+        with self._lock:
+            try:
+                return self._evaluate(where)
+            except UnsupportedFilter:
+                return None
+
+    def ids_of(self, bits: int) -> List[str]:
+        # Duyệt các bit đang bật (bit thấp nhất trước)
+        out: List[str] = []
+        with self._lock:
+            while bits:
+                low = bits & -bits
+                id_ = self._ids[low.bit_length() - 1]
+                if id_ is not None:
+                    out.append(id_)
+                bits ^= low
+        return out
+
+    def record(self, strategy: str) -> None:
+        with self._lock:
+            self.counters[strategy] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "keys": list(self.keys),
+                "built": self.built,
+                "documents": len(self._slots),
+                "generation": self.generation,
+                "values": {k: len(v) for k, v in self._postings.items()},
+                "searches": dict(self.counters),
+                "exactMaxCandidates": settings.METADATA_EXACT_MAX_CANDIDATES,
+            }
+
+    def _load(self, repo: Any, page_size: int = 1000) -> None:
+        # Dựng lại toàn bộ từ metadata đang có trong ChromaDB
+        with self._lock:
+            self._reset()
+            for ids, metas in repo.iter_metadatas(page_size):
+                self.add(ids, metas)
+            self.built = True
+
+    def _reload(self, repo: Any, ids: List[str]) -> None:
+        metas = repo.get_metadatas(ids)
+        with self._lock:
+            self.remove([i for i in ids if i not in metas])
+            self.add(list(metas), list(metas.values()))
+
+_index: Optional[MetadataBitmapIndex] = None
+_index_source: Optional[Tuple[Any, ...]] = None
+_index_lock = threading.Lock()
+
+def metadata_index_keys() -> List[str]:
+    return [k.strip() for k in settings.METADATA_INDEX_KEYS.split(",") if k.strip()]
+
+def _source(keys: List[str]) -> Tuple[Any, ...]:
+    return (tuple(keys), settings.CHROMA_MODE, settings.CHROMA_DIR, settings.CHROMA_CLOUD_HOST)
+
+def current_metadata_index() -> Optional[MetadataBitmapIndex]:
+    # Chỉ mục đã được dựng (không dựng mới) - dùng ở đường ghi: nếu chưa dựng thì lần dựng đầu tiên
+    # sẽ đọc trạng thái mới nhất từ ChromaDB nên không cần cập nhật
+    keys = metadata_index_keys()
+    with _index_lock:
+        if keys and _index is not None and _index_source == _source(keys):
+            return _index
+    return None
+
+def get_metadata_index(repo: Any) -> Optional[MetadataBitmapIndex]:
+    # Chỉ mục của tiến trình, None nếu METADATA_INDEX_KEYS rỗng; dựng từ ChromaDB ở lần gọi đầu,
+    # dựng lại khi cấu hình key hoặc vị trí ChromaDB thay đổi và đọc bù các lần ghi của process khác
+    global _index, _index_source
+    keys = metadata_index_keys()
+    if not keys:
+        return None
+    source = _source(keys)
+    with _index_lock:
+        if _index is None or _index_source != source:
+            index = MetadataBitmapIndex(keys)
+            index.build(repo)
+            _index, _index_source = index, source
+        index = _index
+    index.sync(repo)
+    return index
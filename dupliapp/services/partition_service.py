@@ -0,0 +1,198 @@
+﻿# -*- coding: utf-8 -*-
+# Service lập chỉ mục song song theo phân vùng TopicId (nhiều worker, nhiều tiến trình hoặc nhiều máy)
+from typing import Any, Callable, Dict, List, Optional
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+from dataclasses import asdict
+from dupliapp.config import settings
+from dupliapp.repositories.partition_repository import PartitionRepository, PENDING, LEASED, DONE, FAILED
+from dupliapp.repositories.state_repository import IndexStateRepository
+from dupliapp.repositories.topic_repository import get_topic_repository
+from dupliapp.services.index_service import WATERMARK_KEY
+from dupliapp.services.topic_service import TopicsService
+
+def _worker_owner() -> str:
+    # Định danh worker: máy + tiến trình + chuỗi ngẫu nhiên (phân biệt các thread)
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def _process_worker(run_id: str, overrides: Dict[str, Any]) -> None:
+    # Hàm chạy trong tiến trình con: dùng đúng cấu hình của tiến trình cha rồi nhận phân vùng tới khi hết
+    for key, value in overrides.items():
+        setattr(settings, key, value)
+    PartitionService().work(run_id)
+
+class PartitionService:
+    """
+    Lập chỉ mục lại toàn bộ đề tài bằng nhiều worker song song
+
+    - plan(): chia đề tài thành các khoảng TopicId có số lượng gần bằng nhau và ghi vào bảng lease;
+      force=True được lưu cùng lần chạy nên mọi worker (kể cả ở máy khác) đều embed lại đề tài không đổi
+    - work(): một worker nhận lần lượt từng phân vùng, đọc theo trang keyset, embed và ghi,
+      gia hạn lease sau mỗi trang; có thể chạy trên nhiều tiến trình hoặc nhiều máy dùng chung STATE_DB_PATH
+    - progress(): tổng hợp tiến độ của mọi phân vùng; khi tất cả hoàn thành thì cập nhật watermark đồng bộ
+    """
+
+    def __init__(self, repo: Optional[PartitionRepository] = None,
+                 lease_seconds: Optional[float] = None, max_attempts: Optional[int] = None):
+        self.repo = repo or PartitionRepository()
+        self.lease_seconds = settings.PARTITION_LEASE_SECONDS if lease_seconds is None else lease_seconds
+        self.max_attempts = settings.PARTITION_MAX_ATTEMPTS if max_attempts is None else max_attempts
+
+    def plan(self, partitions: Optional[int] = None, page_size: Optional[int] = None,
+             force: bool = False) -> Dict[str, Any]:
+        partitions = partitions or settings.PARTITION_COUNT
+        page_size = page_size or settings.REINDEX_PAGE_SIZE
+        source = get_topic_repository()
+        stats = source.source_stats()
+        bounds = source.partition_bounds(partitions)
+
+        run_id = uuid.uuid4().hex
+        # Watermark lấy tại thời điểm lập kế hoạch (giống reindex): phần thay đổi sau đó do sync đọc lại
+        self.repo.create_run(run_id, page_size, stats["maxTopicVersionId"], bounds, force=force)
+        return self.progress(run_id)
+
+    def progress(self, run_id: Optional[str] = None) -> Dict[str, Any]:
+        run_id = run_id or self.repo.latest_run_id()
+        run = self.repo.get_run(run_id) if run_id else None
+        if run is None:
+            return {"status": "none", "percent": 0.0}
+
+        parts = self.repo.partitions(run_id)
+        counts = {s: 0 for s in (PENDING, LEASED, DONE, FAILED)}
+        for p in parts:
+            counts[p["status"]] += 1
+
+        # Coordinator: khi mọi phân vùng đã kết thúc thì chốt trạng thái lần chạy (chỉ một lần)
+        if run["status"] == "running" and counts[PENDING] == 0 and counts[LEASED] == 0:
+            status = "failed" if counts[FAILED] else "completed"
+            if self.repo.finish_run(run_id, status) and status == "completed" and run["start_watermark"] is not None:
+                IndexStateRepository().set(WATERMARK_KEY, run["start_watermark"])
+            run = self.repo.get_run(run_id)
+
+        now = time.time()
+        processed = sum(p["processed"] for p in parts)
+        total = sum(p["topic_count"] for p in parts)
+        elapsed = (run["finished_at"] or now) - run["created_at"]
+        percent = 100.0 if total == 0 else min(100.0, 100.0 * processed / total)
+        if run["status"] != "completed":
+            percent = min(percent, 99.99)
+
+        return {
+            "runId": run_id,
+            "status": run["status"],
+            "force": bool(run["force"]),
+            "partitions": {"total": len(parts), **counts},
+            "processed": processed,
+            "embedded": sum(p["embedded"] for p in parts),
+            "total": total,
+            "percent": round(percent, 2),
+            "throughput": round(processed / elapsed, 2) if elapsed > 0 else None,
+            # Worker đang giữ lease còn hiệu lực
+            "workers": sorted({p["owner"] for p in parts
+                               if p["status"] == LEASED and (p["lease_expires_at"] or 0) >= now}),
+            "errors": [{"partition": p["partition_no"], "error": p["error"]} for p in parts if p["error"]],
+            "items": [{
+                "partition": p["partition_no"],
+                "fromTopicId": p["from_topic_id"],
+                "toTopicId": p["to_topic_id"],
+                "status": p["status"],
+                "processed": p["processed"],
+                "total": p["topic_count"],
+                "attempts": p["attempts"],
+            } for p in parts],
+            "createdAt": run["created_at"],
+            "finishedAt": run["finished_at"],
+        }
+
+    def _work_partition(self, run: Dict[str, Any], part: Dict[str, Any], owner: str,
+                        source, svc: TopicsService) -> bool:
+        # Xử lý một phân vùng từ last_topic_id đã lưu; False nếu lease bị worker khác nhận lại
+        page_size = run["page_size"]
+        last = part["last_topic_id"]
+        processed = part["processed"]
+        embedded = part["embedded"]
+        while True:
+            rows = source.fetch_page(last, page_size, min_topic_id=part["from_topic_id"],
+                                     max_topic_id=part["to_topic_id"])
+            if not rows:
+                return True
+
+            stats = svc.upsert_records(rows, force=bool(run["force"]))
+            last = rows[-1].topic_id
+            processed += len(rows)
+            embedded += stats["embedded"]
+            if not self.repo.renew(run["run_id"], part["partition_no"], owner, self.lease_seconds,
+                                   last, processed, embedded):
+                print(f"⚠️ Warning: Lease on partition {part['partition_no']} was lost; stopping this partition")
+                return False
+            if len(rows) < page_size:
+                return True
+
+    def work(self, run_id: str, owner: Optional[str] = None) -> Dict[str, Any]:
+        # Vòng lặp của một worker: nhận phân vùng cho tới khi không còn phân vùng nào
+        owner = owner or _worker_owner()
+        run = self.repo.get_run(run_id)
+        if run is None:
+            raise ValueError(f"Unknown partition run: {run_id}")
+        source = get_topic_repository()
+        svc = TopicsService()
+        completed = 0
+
+        while True:
+            part = self.repo.claim(run_id, owner, self.lease_seconds)
+            if part is None:
+                break
+            try:
+                if self._work_partition(run, part, owner, source, svc) and \
+                        self.repo.complete(run_id, part["partition_no"], owner):
+                    completed += 1
+            except Exception as e:
+                print(f"⚠️ Warning: Partition {part['partition_no']} failed: {e}")
+                self.repo.fail(run_id, part["partition_no"], owner, str(e), self.max_attempts)
+
+        self.progress(run_id)
+        return {"owner": owner, "partitionsCompleted": completed}
+
+    def start_workers(self, run_id: str, workers: int) -> List[Any]:
+        # Khởi động worker trên máy hiện tại
+        # - Chroma cloud: mỗi worker là một tiến trình riêng (model embedding riêng, không bị GIL)
+        # - Chroma local: PersistentClient không an toàn khi nhiều tiến trình cùng ghi một thư mục,
+        #   nên các worker là thread trong tiến trình hiện tại (dùng chung một client)
+        handles: List[Any] = []
+        if settings.CHROMA_MODE.lower() == "cloud":
+            ctx = multiprocessing.get_context("spawn")
+            overrides = asdict(settings)
+            for _ in range(workers):
+                proc = ctx.Process(target=_process_worker, args=(run_id, overrides), daemon=False)
+                proc.start()
+                handles.append(proc)
+        else:
+            for i in range(workers):
+                thread = threading.Thread(target=self._safe_work, args=(run_id,),
+                                          name=f"partition-worker-{i}", daemon=True)
+                thread.start()
+                handles.append(thread)
+        return handles
+
+    def _safe_work(self, run_id: str) -> None:
+        try:
+            PartitionService(lease_seconds=self.lease_seconds, max_attempts=self.max_attempts).work(run_id)
+        except Exception as e:
+            print(f"⚠️ Warning: Partition worker stopped: {e}")
+
+    def run(self, partitions: Optional[int] = None, workers: int = 2, page_size: Optional[int] = None,
+            poll_interval: float = 5.0,
+            on_progress: Optional[Callable[[Dict[str, Any]], None]] = None, force: bool = False) -> Dict[str, Any]:
+        # Coordinator chạy đồng bộ: lập kế hoạch, khởi động worker, báo tiến độ định kỳ và chờ kết thúc
+        run_id = self.plan(partitions, page_size, force=force)["runId"]
+        handles = self.start_workers(run_id, workers)
+        while any(h.is_alive() for h in handles):
+            for h in handles:
+                h.join(poll_interval / max(1, len(handles)))
+            if on_progress is not None:
+                on_progress(self.progress(run_id))
+        return self.progress(run_id)
@@ -0,0 +1,66 @@
+﻿# -*- coding: utf-8 -*-
+# Poller chạy nền trong tiến trình, định kỳ đồng bộ tăng dần đề tài từ SQL vào vector database
+from typing import Optional, Callable, Dict, Any
+import threading
+from dupliapp.config import settings
+
+class SyncPoller:
+    """
+    Thread nền gọi IndexService.sync_incremental theo chu kỳ cố định
+
+    Lỗi của một lượt đồng bộ không làm dừng poller; watermark chỉ tiến lên
+    sau khi lô đã được ghi nên lượt sau sẽ đọc lại phần còn thiếu.
+    """
+
+    def __init__(self, interval: float, sync_fn: Optional[Callable[[], Dict[str, Any]]] = None):
+        self.interval = interval
+        self._sync_fn = sync_fn
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.last_result: Optional[Dict[str, Any]] = None
+        self.last_error: Optional[str] = None
+
+    def _sync(self) -> Dict[str, Any]:
+        if self._sync_fn is not None:
+            return self._sync_fn()
+        # Import muộn để tránh vòng import khi khởi tạo ứng dụng
+        from dupliapp.services.index_service import IndexService
+        return IndexService().sync_incremental()
+
+    def run_once(self) -> None:
+        try:
+            self.last_result = self._sync()
+            self.last_error = None
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"⚠️ Warning: Incremental sync failed: {e}")
+
+    def _run(self) -> None:
+        # Event.wait trả về True khi stop() được gọi -> thoát vòng lặp
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sync-poller", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+# Poller dùng chung cho toàn bộ ứng dụng (singleton pattern)
+_poller: Optional[SyncPoller] = None
+
+def start_sync_poller() -> Optional[SyncPoller]:
+    # Khởi động poller nếu SYNC_INTERVAL_SECONDS > 0
+    global _poller
+    if settings.SYNC_INTERVAL_SECONDS <= 0:
+        return None
+    if _poller is None:
+        _poller = SyncPoller(settings.SYNC_INTERVAL_SECONDS)
+    _poller.start()
+    return _poller
@@ -1,13 +1,68 @@
 ﻿# -*- coding: utf-8 -*-
 # Service xử lý business logic cho đề tài - phát hiện trùng lặp và quản lý vector
-from typing import List, Dict, Any
-from dupliapp.utils.embeddings import embed_texts
+from typing import List, Dict, Any, Callable, Iterable, Optional, Sequence, Tuple
+import hashlib
+import threading
+import zlib
+import numpy as np
+from dupliapp.config import settings
+from dupliapp.utils.embeddings import embed_texts, embedding_model_id
+from dupliapp.utils.columnar import TopicColumns, compose_texts, column_length, to_pylist
+from dupliapp.utils.topic_record import TopicRecord
 from dupliapp.repositories.chroma_repository import ChromaTopicsRepository
+from dupliapp.repositories.state_lock import state_lock, index_write_lock
+from dupliapp.repositories.change_log import get_change_log
+from dupliapp.services.compaction_service import CompactionService
+from dupliapp.services.job_service import get_job_service
+from dupliapp.services.metadata_index import get_metadata_index, current_metadata_index, metadata_index_keys
+from dupliapp.services.lexical_index import get_lexical_index, current_lexical_index, MATCH_EXACT
+from dupliapp.services.bm25_index import get_bm25_index, current_bm25_index, bm25_text, term_cosine, Bm25Index
+from dupliapp.services.field_vector_service import FieldVectorService
+
+# Key metadata lưu hash SHA-256 của text đã ghép
+CONTENT_HASH_KEY = "ContentHash"
+
+# Key metadata lưu model embedding đã tạo vector và số chiều của vector
+# Đổi model (EMBEDDING_TYPE, MODEL_NAME, model Gemini) -> vector cũ được embed lại dù hash không đổi
+EMBEDDING_MODEL_KEY = "EmbeddingModel"
+EMBEDDING_DIM_KEY = "EmbeddingDim"
+
+# Key metadata lưu dấu cấu hình vector theo trường (FieldVectorService.marker) của đề tài đã có vector
+# theo trường; bật MULTI_VECTOR_ENABLED hoặc đổi cấu hình -> đề tài thiếu dấu/dấu khác được embed lại
+FIELD_VECTORS_KEY = "FieldVectors"
+
+# Các cột nội dung (tên cột SQL) theo thứ tự được ghép thành text
+TEXT_COLUMNS = ("Title", "Description", "Objectives", "Methodology", "ExpectedOutcomes", "Requirements")
+
+# Key metadata không được sửa qua update_metadata (định danh và nội dung đã được embed)
+PROTECTED_META_KEYS = frozenset(("TopicId", "TopicVersionId", CONTENT_HASH_KEY, EMBEDDING_MODEL_KEY,
+                                 EMBEDDING_DIM_KEY, FIELD_VECTORS_KEY) + TEXT_COLUMNS)
+
+# Số chiều vector mà mỗi model đã tạo trong tiến trình này (theo embedding_model_id)
+_embedding_dims: Dict[str, int] = {}
+
+# Giới hạn số lời gọi embedding truy vấn chạy đồng thời (EMBED_MAX_CONCURRENCY)
+_embed_slots: Optional[threading.BoundedSemaphore] = None
+_embed_slots_size = 0
+_embed_slots_lock = threading.Lock()
+
+def _query_embed_slots(limit: int) -> threading.BoundedSemaphore:
+    global _embed_slots, _embed_slots_size
+    with _embed_slots_lock:
+        if _embed_slots is None or _embed_slots_size != limit:
+            _embed_slots, _embed_slots_size = threading.BoundedSemaphore(limit), limit
+        return _embed_slots
+
+def _registration_lock():
+    # Khóa độc quyền cho kiểm tra + ghi của check_and_upsert, dùng chung giữa các thread và các process
+    # trên cùng máy (xem state_lock)
+    return state_lock("register", timeout=settings.CHECK_AND_UPSERT_LOCK_TIMEOUT_SECONDS)
 
 class TopicsService:
     def __init__(self):
         # Khởi tạo repository để tương tác với ChromaDB
         self.repo = ChromaTopicsRepository()
+        self._fields: Optional[FieldVectorService] = None
 
     @staticmethod
     def compose_topic_text(row: Dict[str, Any]) -> str:
@@ -23,82 +78,377 @@ class TopicsService:
         ]
         return "\n\n".join([p for p in parts if p and p.strip()])
 
-    def upsert_one(self, data: Dict[str, Any]) -> None:
-        # Thêm hoặc cập nhật một đề tài với vector embedding
+    @staticmethod
+    def compose_topic_texts(columns: TopicColumns) -> List[str]:
+        # Phiên bản theo cột của compose_topic_text cho cả một lô đề tài
+        return compose_texts([columns.get(c) for c in TEXT_COLUMNS], column_length(columns))
+
+    @staticmethod
+    def content_hash(text: str) -> str:
+        # Hash nội dung text đã ghép - dùng để phát hiện đề tài không thay đổi
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _build_meta(data: Dict[str, Any], text: str) -> Dict[str, Any]:
+        # Chuẩn bị metadata cho ChromaDB (kèm metadata bổ sung nếu có)
+        meta = TopicRecord.from_item(data).to_meta()
+        # Lưu hash của text để lần ghi sau so sánh mà không cần embed lại
+        meta[CONTENT_HASH_KEY] = TopicsService.content_hash(text)
+        return meta
+
+    def _write(self, ids: List[str], texts: List[str], metas: List[Dict[str, Any]],
+               known: Optional[Dict[str, np.ndarray]] = None, force: bool = False) -> Dict[str, int]:
+        # Ghi vào ChromaDB, bỏ qua embedding cho các đề tài có hash nội dung không đổi
+        # known: embedding đã tính sẵn theo text (text ghép, hoặc đoạn trường ở chế độ đa vector)
+        # - Hash khác (hoặc chưa có), model/số chiều embedding khác, hoặc force: embed lại và ghi
+        # - MULTI_VECTOR_ENABLED và dấu vector theo trường thiếu/khác (đề tài ghi khi tắt đa vector hoặc
+        #   trước khi đổi trọng số/độ dài đoạn): embed lại để bổ sung vector theo trường
+        # - Hash giống, metadata khác: dùng lại vector đã lưu, chỉ ghi metadata mới
+        # - Hash giống, metadata giống: bỏ qua hoàn toàn
+        existing = self.repo.get_metadatas(ids)
+        model = embedding_model_id()
+        dim = _embedding_dims.get(model)
+        # Tắt đa vector: đề tài embed lại không cập nhật vector theo trường -> xóa dấu (None = xóa key)
+        marker = self._field_vectors().marker if settings.MULTI_VECTOR_ENABLED else None
+
+        embed_idx, reuse_idx = [], []
+        for i, (id_, meta) in enumerate(zip(ids, metas)):
+            old = existing.get(id_)
+            meta[EMBEDDING_MODEL_KEY] = model
+            meta[FIELD_VECTORS_KEY] = marker
+            if (force or not old or old.get(CONTENT_HASH_KEY) != meta[CONTENT_HASH_KEY]
+                    or old.get(EMBEDDING_MODEL_KEY) != model
+                    or (dim is not None and old.get(EMBEDDING_DIM_KEY) != dim)
+                    or (marker is not None and old.get(FIELD_VECTORS_KEY) != marker)):
+                embed_idx.append(i)
+                continue
+            meta[EMBEDDING_DIM_KEY] = old.get(EMBEDDING_DIM_KEY)
+            if marker is None:
+                # Nội dung không đổi: vector theo trường đã lưu (nếu có) vẫn đúng
+                meta[FIELD_VECTORS_KEY] = old.get(FIELD_VECTORS_KEY)
+            if old != {k: v for k, v in meta.items() if v is not None}:
+                # ChromaDB không lưu giá trị None nên bỏ chúng trước khi so sánh
+                reuse_idx.append(i)
+
+        write_idx = embed_idx + reuse_idx
+        chunks_embedded = None
+        timings = None
+        if write_idx:
+            # Giữ vector ở dạng mảng NumPy float32 liền khối tới tận repository
+            # (không .tolist() - tránh tạo hàng triệu đối tượng float Python khi rebuild lớn)
+            parts: List[np.ndarray] = []
+            if embed_idx and settings.MULTI_VECTOR_ENABLED:
+                # Đa vector: chỉ embed các đoạn trường có nội dung đổi, vector đề tài được gộp từ chúng
+                embs, chunks_embedded = self._field_vectors().sync(
+                    [ids[i] for i in embed_idx], [metas[i] for i in embed_idx], [texts[i] for i in embed_idx],
+                    known=known, force=force)
+                parts.append(embs)
+            elif embed_idx and known:
+                missing = [texts[i] for i in embed_idx if texts[i] not in known]
+                if missing:
+                    known = {**known, **dict(zip(missing, embed_texts(missing)))}
+                parts.append(np.stack([known[texts[i]] for i in embed_idx]).astype(np.float32))
+            elif embed_idx:
+                # Tạo embeddings cho tất cả texts cần embed cùng lúc
+                parts.append(embed_texts([texts[i] for i in embed_idx]))
+            if embed_idx:
+                _embedding_dims[model] = int(parts[0].shape[1])
+                for i in embed_idx:
+                    metas[i][EMBEDDING_DIM_KEY] = _embedding_dims[model]
+            if reuse_idx:
+                stored = self.repo.get_embeddings([ids[i] for i in reuse_idx])
+                parts.append(np.stack([stored[ids[i]] for i in reuse_idx]))
+            embs = parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+            timings = self._guarded_write(lambda: self.repo.upsert(
+                ids=[ids[i] for i in write_idx],
+                embeddings=embs,
+                metadatas=[metas[i] for i in write_idx],
+                documents=[texts[i] for i in write_idx],
+            ))
+
+        index = current_metadata_index()
+        if index is not None and write_idx:
+            index.add([ids[i] for i in write_idx], [metas[i] for i in write_idx])
+        lexical = current_lexical_index()
+        if lexical is not None and embed_idx:
+            lexical.add([ids[i] for i in embed_idx], [texts[i] for i in embed_idx])
+        # Title/Description thuộc nội dung đã hash nên chỉ đề tài được embed lại mới cần chỉ mục lại
+        bm25 = current_bm25_index()
+        if bm25 is not None and embed_idx:
+            bm25.add([ids[i] for i in embed_idx], [bm25_text(metas[i]) for i in embed_idx])
+        self._record_changes([ids[i] for i in write_idx])
+
+        # Chỉ đề tài được embed lại mới đổi vector -> chỉ chúng cần tính lại láng giềng
+        if settings.KNN_GRAPH_ENABLED and embed_idx:
+            self._sync_knn(update=[ids[i] for i in embed_idx])
+
+        result = {
+            "upserted": len(ids),
+            "embedded": len(embed_idx),
+            "skipped": len(ids) - len(embed_idx),
+        }
+        if chunks_embedded is not None:
+            result["embeddedChunks"] = chunks_embedded
+        if timings is not None:
+            # Thời gian ghi từng lô ChromaDB (chunks), tổng (totalMs) và maxBatchSize - xem ChromaRepository.upsert
+            result["chromaWrite"] = timings
+        return result
+
+    def _field_vectors(self) -> FieldVectorService:
+        # Tạo một lần cho mỗi TopicsService (mở collection vector theo trường)
+        # embed_texts được tra cứu lúc gọi (không giữ tham chiếu cố định tới hàm của model)
+        if self._fields is None:
+            self._fields = FieldVectorService(embed=lambda texts: embed_texts(texts))
+        return self._fields
+
+    def _guarded_write(self, write: Callable[[], Any]) -> Any:
+        # Khóa ghi chung chỉ khi compaction đang chép collection: compaction không đổi collection giữa
+        # chừng lần ghi. Compaction bắt đầu trong lúc ghi không khóa -> ghi lại dưới khóa (upsert/cập nhật
+        # metadata/xóa đều lặp lại được) để lần ghi chắc chắn có trong collection mới; giữ kết quả lần đầu
+        if not self.repo.rebuild_active():
+            result = write()
+            if not self.repo.rebuild_active():
+                return result
+            with index_write_lock():
+                write()
+            return result
+        with index_write_lock():
+            return write()
+
+    def _sync_knn(self, update: Optional[List[str]] = None, remove: Optional[List[str]] = None) -> None:
+        # Xếp hàng cập nhật đồ thị kNN sau khi ghi/xóa thay vì tính láng giềng ngay trong request (gộp vào
+        # job knn-update đang chờ nếu có); lỗi ở đây không làm hỏng thao tác đã ghi vào ChromaDB (đồ thị có thể được xây dựng lại bằng POST /index/knn)
+        try:
+            get_job_service().submit_knn_update(update or [], remove or [])
+        except Exception as e:
+            print(f"⚠️ Warning: kNN graph update could not be queued: {e}")
+
+    def _record_changes(self, ids: List[str]) -> None:
+        # Ghi ID vừa đổi vào nhật ký thay đổi dùng chung để chỉ mục trong bộ nhớ của process khác đọc lại
+        # chúng; chỉ mục của process này đã được cập nhật trực tiếp nên chỉ cần tiến thế hệ
+        # Không có chỉ mục nào trong bộ nhớ (đã dựng hoặc được bật) thì bỏ qua: tránh một lần ghi SQLite
+        # mỗi request ở cấu hình mặc định. Chỉ mục được bật nhưng chưa dựng ở process này vẫn cần nhật ký
+        # vì process khác (vd: server khi ghi từ CLI) có thể đã dựng nó
+        indexes = [i for i in (current_metadata_index(), current_lexical_index(), current_bm25_index())
+                   if i is not None]
+        enabled = indexes or metadata_index_keys() or settings.LEXICAL_FAST_PATH or settings.BM25_ENABLED
+        if not ids or not enabled:
+            return
+        try:
+            generation = get_change_log().append(ids)
+        except Exception as e:
+            print(f"⚠️ Warning: index change log append failed: {e}")
+            return
+        for index in indexes:
+            index.applied(generation)
+
+    def remove_superseded(self, records: List[TopicRecord]) -> int:
+        # Xóa khỏi chỉ mục các phiên bản khác của cùng TopicId với records (đồng bộ từ SQL: records là
+        # phiên bản mới nhất nên các phiên bản còn lại đã bị thay thế); trả về số vector đã xóa
+        if not records:
+            return 0
+        current = {f"tv:{r.topic_version_id}" for r in records}
+        stale = sorted({i for f in self.repo.topic_id_filters([r.topic_id for r in records])
+                        for i in self.repo.ids_where(f)} - current)
+        if not stale:
+            return 0
+        return self.delete_topics(topic_version_ids=[i[len("tv:"):] for i in stale])["deleted"]
+
+    def update_metadata(self, updates: List[Dict[str, Any]]) -> Dict[str, Any]:
+        # Cập nhật chỉ metadata bổ sung (trạng thái, giảng viên hướng dẫn, khoa...) của một hoặc nhiều
+        # TopicVersionId bằng col.update - không ghép lại text, không embed lại, không ghi lại vector
+        # Mỗi phần tử: {"topicVersionId": ..., "metadata": {...}}; key có giá trị null sẽ bị xóa
+        if not isinstance(updates, list) or not updates:
+            raise ValueError("Provide a non-empty 'items' array")
+
+        patches: Dict[str, Dict[str, Any]] = {}
+        for u in updates:
+            if not isinstance(u, dict) or "topicVersionId" not in u:
+                raise ValueError("Each item must include topicVersionId")
+            meta = u.get("metadata")
+            if not isinstance(meta, dict) or not meta:
+                raise ValueError("Each item must include a non-empty 'metadata' object")
+            protected = sorted(set(meta) & PROTECTED_META_KEYS)
+            if protected:
+                # Các key này gắn với nội dung đã embed - phải cập nhật qua /topics/upsert
+                raise ValueError(f"Metadata keys cannot be patched: {protected}")
+            # Cùng TopicVersionId xuất hiện nhiều lần -> gộp theo thứ tự
+            patches.setdefault(f"tv:{u['topicVersionId']}", {}).update(meta)
+
+        ids = list(patches)
+        found = set(self.repo.existing_ids(ids))
+        update_ids = [i for i in ids if i in found]
+        if update_ids:
+            self._guarded_write(lambda: self.repo.update_metadatas(update_ids, [patches[i] for i in update_ids]))
+            index = current_metadata_index()
+            if index is not None:
+                index.patch(update_ids, [patches[i] for i in update_ids])
+            self._record_changes(update_ids)
+
+        return {
+            "updated": len(update_ids),
+            "notFound": [i[len("tv:"):] for i in ids if i not in found],
+        }
+
+    def delete_topics(self, topic_version_ids: Optional[List[Any]] = None,
+                      topic_ids: Optional[List[Any]] = None,
+                      where: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        # Xóa đề tài khỏi chỉ mục (đề tài bị rút/bị từ chối) theo đúng một trong ba cách:
+        # - topic_version_ids: xóa các phiên bản cụ thể
+        # - topic_ids: xóa mọi phiên bản của các đề tài
+        # - where: xóa theo điều kiện metadata (vd: {"status": "rejected"})
+        # Số vector đã xóa được cộng vào tombstone; vượt ngưỡng thì xếp job compaction
+        if sum(x is not None for x in (topic_version_ids, topic_ids, where)) != 1:
+            raise ValueError("Provide exactly one of 'topicVersionIds', 'topicIds' or 'where'")
+
+        if topic_version_ids is not None:
+            if not isinstance(topic_version_ids, list) or not topic_version_ids:
+                raise ValueError("Provide a non-empty 'topicVersionIds' array")
+            targets = self.repo.existing_ids([f"tv:{v}" for v in topic_version_ids])
+        elif topic_ids is not None:
+            if not isinstance(topic_ids, list) or not topic_ids:
+                raise ValueError("Provide a non-empty 'topicIds' array")
+            targets = sorted({i for f in self.repo.topic_id_filters(topic_ids) for i in self.repo.ids_where(f)})
+        else:
+            # where rỗng sẽ khớp toàn bộ collection -> không cho phép
+            if not isinstance(where, dict) or not where:
+                raise ValueError("Provide a non-empty 'where' filter")
+            targets = self.repo.ids_where(where)
+        # Xác định ID trước khi xóa để gỡ chúng khỏi đồ thị kNN
+        deleted = self._guarded_write(lambda: self.repo.delete(ids=targets))
+        index = current_metadata_index()
+        if index is not None:
+            index.remove(targets)
+        lexical = current_lexical_index()
+        if lexical is not None:
+            lexical.remove(targets)
+        bm25 = current_bm25_index()
+        if bm25 is not None:
+            bm25.remove(targets)
+        self._record_changes(targets)
+        if settings.MULTI_VECTOR_ENABLED and targets:
+            self._field_vectors().remove(targets)
+        if settings.KNN_GRAPH_ENABLED and targets:
+            self._sync_knn(remove=targets)
+
+        compaction = CompactionService(repo=self.repo)
+        compaction.record_deletes(deleted)
+        status = compaction.status()
+        return {
+            "deleted": deleted,
+            "count": status["count"],
+            "tombstoneRatio": status["tombstoneRatio"],
+            "compactionJobId": compaction.schedule_if_needed(status),
+        }
+
+    @staticmethod
+    def validate_item(data: Dict[str, Any]) -> None:
         # Kiểm tra các trường bắt buộc: topicId, topicVersionId
         required = ["topicId", "topicVersionId"]
         for k in required:
             if k not in data:
                 raise ValueError(f"Missing field: {k}")
-        
-        # Tạo text và embedding
-        text = self.compose_topic_text(data)
-        emb = embed_texts([text])[0].tolist()
-        
-        # Chuẩn bị metadata cho ChromaDB
-        meta = {
-            "TopicId": data.get("topicId"),
-            "TopicVersionId": data.get("topicVersionId"),
-            "Title": data.get("title", ""),
-            "Description": data.get("description", ""),
-            "Objectives": data.get("objectives", ""),
-            "Methodology": data.get("methodology", ""),
-            "ExpectedOutcomes": data.get("expectedOutcomes", ""),
-            "Requirements": data.get("requirements", ""),
-        }
-        # Thêm metadata bổ sung nếu có
-        extra = data.get("metadata") or {}
-        if isinstance(extra, dict):
-            meta.update(extra)
+
+    def upsert_one(self, data: Dict[str, Any], force: bool = False) -> Dict[str, int]:
+        # Thêm hoặc cập nhật một đề tài với vector embedding
+        self.validate_item(data)
             
-        # Lưu vào ChromaDB
-        self.repo.upsert(
-            ids=[f"tv:{meta['TopicVersionId']}"],
-            embeddings=[emb],
-            metadatas=[meta],
-            documents=[text],
-        )
-
-    def upsert_many(self, items: List[Dict[str, Any]]) -> int:
+        # Lưu vào ChromaDB (bỏ qua embedding nếu nội dung không đổi, trừ khi force)
+        return self.upsert_records([TopicRecord.from_item(data)], force=force)
+
+    def upsert_many(self, items: List[Dict[str, Any]], force: bool = False) -> Dict[str, int]:
         # Thêm hoặc cập nhật nhiều đề tài cùng lúc (hiệu quả hơn)
         if not isinstance(items, list) or not items:
             raise ValueError("Provide a non-empty 'items' array")
             
-        ids, texts, metas = [], [], []
+        records = []
         for it in items:
             # Kiểm tra trường bắt buộc cho mỗi item
             if "topicId" not in it or "topicVersionId" not in it:
                 raise ValueError("Each item must include topicId and topicVersionId")
-                
-            # Tạo text và metadata cho mỗi item
-            text = self.compose_topic_text(it)
-            meta = {
-                "TopicId": it.get("topicId"),
-                "TopicVersionId": it.get("topicVersionId"),
-                "Title": it.get("title", ""),
-                "Description": it.get("description", ""),
-                "Objectives": it.get("objectives", ""),
-                "Methodology": it.get("methodology", ""),
-                "ExpectedOutcomes": it.get("expectedOutcomes", ""),
-                "Requirements": it.get("requirements", ""),
-            }
-            extra = it.get("metadata") or {}
-            if isinstance(extra, dict):
-                meta.update(extra)
-                
-            ids.append(f"tv:{meta['TopicVersionId']}")
+            records.append(TopicRecord.from_item(it))
+            
+        return self.upsert_records(records, force=force)
+
+    def upsert_records(self, records: Sequence[TopicRecord],
+                       known: Optional[Dict[str, np.ndarray]] = None, force: bool = False) -> Dict[str, int]:
+        # Thêm hoặc cập nhật các đề tài đã ở dạng TopicRecord (đường lập chỉ mục từ SQL)
+        # Text và metadata dict chỉ được tạo tại đây, ngay trước khi ghi vào ChromaDB
+        # known: embedding đã tính sẵn theo text; force: embed lại cả đề tài không đổi (xem _write)
+        ids, texts, metas = [], [], []
+        for record in records:
+            text = record.text()
+            meta = record.to_meta()
+            meta[CONTENT_HASH_KEY] = self.content_hash(text)
+            ids.append(f"tv:{record.topic_version_id}")
             texts.append(text)
             metas.append(meta)
             
-        # Tạo embeddings cho tất cả texts cùng lúc
-        embs = embed_texts(texts).tolist()
-        self.repo.upsert(ids=ids, embeddings=embs, metadatas=metas, documents=texts)
-        return len(ids)
+        # So sánh hash theo lô rồi chỉ embed các đề tài đã thay đổi
+        return self._write(ids, texts, metas, known=known, force=force)
 
-    def search(self, data: Dict[str, Any], top_k: int, threshold: float) -> Dict[str, Any]:
-        # Tìm kiếm đề tài trùng lặp dựa trên độ tương tự ngữ nghĩa
+    def upsert_chunks(self, chunks: Iterable[List[Dict[str, Any]]]) -> Dict[str, Any]:
+        # Ghi lần lượt từng lô đề tài đọc dần từ luồng (NDJSON), mỗi lô được embed/ghi rồi giải phóng
+        # Bộ nhớ chỉ phụ thuộc kích thước lô, không phụ thuộc tổng số đề tài trong request
+        totals = {"upserted": 0, "embedded": 0, "skipped": 0}
+        results: List[Dict[str, Any]] = []
+        received = 0
+        source = iter(chunks)
+        while True:
+            chunk_no = len(results) + 1
+            try:
+                items = next(source, None)
+            except (ValueError, OSError, EOFError, zlib.error) as e:
+                # Dòng JSON lỗi hoặc luồng gzip hỏng/bị cắt (BadGzipFile, EOFError, zlib.error): không thể
+                # đọc tiếp luồng, dừng và báo lỗi tại lô hiện tại
+                results.append({"chunk": chunk_no, "items": 0, "error": str(e)})
+                break
+            if items is None:
+                break
+
+            received += len(items)
+            result: Dict[str, Any] = {"chunk": chunk_no, "items": len(items)}
+            try:
+                stats = self.upsert_many(items)
+                result.update(stats)
+                for k in totals:
+                    totals[k] += stats[k]
+                result["error"] = None
+            except Exception as e:
+                # Lô lỗi không làm dừng các lô sau
+                result["error"] = str(e)
+            results.append(result)
+
+        return {
+            **totals,
+            "received": received,
+            "chunks": results,
+            "failedChunks": sum(1 for r in results if r["error"]),
+        }
+
+    def upsert_columns(self, columns: TopicColumns, force: bool = False) -> Dict[str, int]:
+        # Thêm hoặc cập nhật một lô đề tài ở dạng cột (đọc từ fetch_latest_columns)
+        # Text được ghép theo cột; metadata dict chỉ được tạo ở bước ghi vào ChromaDB
+        n = column_length(columns)
+        if n == 0:
+            return {"upserted": 0, "embedded": 0, "skipped": 0}
+
+        texts = self.compose_topic_texts(columns)
+        keys = ("TopicId", "TopicVersionId") + TEXT_COLUMNS
+        values = [to_pylist(columns[k]) if k in columns else [""] * n for k in keys]
+
+        metas = [dict(zip(keys, row)) for row in zip(*values)]
+        for meta, text in zip(metas, texts):
+            meta[CONTENT_HASH_KEY] = self.content_hash(text)
+        ids = [f"tv:{v}" for v in values[1]]
+
+        return self._write(ids, texts, metas, force=force)
+
+    @staticmethod
+    def query_text(data: Dict[str, Any]) -> str:
         # Cho phép truyền 'text' trực tiếp hoặc ghép từ các field
-        text = data.get("text") or "\n\n".join([
+        return data.get("text") or "\n\n".join([
             data.get("title", ""),
             data.get("description", ""),
             data.get("objectives", ""),
@@ -106,20 +456,406 @@ class TopicsService:
             data.get("expectedOutcomes", ""),
             data.get("requirements", ""),
         ]).strip()
+
+    def search(self, data: Dict[str, Any], top_k: int, threshold: float) -> Dict[str, Any]:
+        # Tìm kiếm đề tài trùng lặp dựa trên độ tương tự ngữ nghĩa
+        # "gate": true -> chỉ trả về quyết định passed (xem gate_vector)
+        # BM25_ENABLED: "hybrid": true (mặc định HYBRID_SEARCH_DEFAULT) -> tìm kiếm lai BM25 + ANN
+        # (xem hybrid_vector); khi model embedding quá tải/lỗi hoặc "degraded": true -> chỉ dùng BM25
+        # (xem keyword_search)
+        text = self.query_text(data)
         
         if not text:
             return {"error": "Provide either 'text' or the content fields"}
             
-        # Tạo embedding cho query text
-        query_emb = embed_texts([text])[0].tolist()
-        
         # Lọc theo metadata nếu có
         where = data.get("metadataFilter") if isinstance(data.get("metadataFilter"), dict) else None
         
-        # Tìm kiếm trong ChromaDB
-        res = self.repo.query(query_emb, n_results=top_k, where=where)
+        # Bản sao (gần) y hệt được trả lời mà không chạy model embedding
+        fast = self._lexical_fast_path(text, top_k, threshold, where, data)
+        if fast is not None:
+            return fast
+            
+        # Chỉ mục BM25 không có metadata và không liệt kê được mọi hit >= threshold
+        # -> không dùng cho metadataFilter và range
+        bm25 = get_bm25_index(self.repo) if where is None and not data.get("range") else None
+        if bm25 is not None and data.get("degraded"):
+            return self.keyword_search(bm25, text, top_k, threshold, data, reason="requested")
+            
+        # Đa vector: embed từng đoạn của từng trường query thay vì text ghép
+        fields = None
+        if (settings.MULTI_VECTOR_ENABLED and where is None and not data.get("gate")
+                and not data.get("range") and data.get("multiVector", True)):
+            fields = self._field_vectors()
+            parts = fields.query_parts(data)
+            if not parts:
+                fields = None
+            
+        # Tạo embedding cho query text (đa vector: các đoạn trường, text ghép ở cuối cho đề tài chưa có
+        # vector theo trường - xem multi_vector_search)
+        try:
+            embs = self._embed_queries([t for _, t in parts] + [text] if fields else [text],
+                                       limited=bm25 is not None)
+        except Exception as e:
+            if bm25 is None:
+                raise
+            print(f"⚠️ Warning: query embedding unavailable, falling back to BM25: {e}")
+            return self.keyword_search(bm25, text, top_k, threshold, data, reason=str(e))
+        
+        if fields is not None:
+            return self.multi_vector_search(fields, parts, embs[:-1], top_k, threshold, query_emb=embs[-1])
+        query_emb = embs[0]
+        if data.get("gate"):
+            return self.gate_vector(query_emb, threshold, where=where)
+        if data.get("range"):
+            return self.range_vector(query_emb, threshold, where=where, max_results=data.get("maxResults"))
+        if bm25 is not None and data.get("hybrid", settings.HYBRID_SEARCH_DEFAULT):
+            return self.hybrid_vector(query_emb, text, bm25, top_k, threshold)
+        return self.search_vector(query_emb, top_k, threshold, where=where)
+
+    @staticmethod
+    def _embed_queries(texts: List[str], limited: bool = False) -> np.ndarray:
+        # Embedding của các text truy vấn; limited=True (có đường dự phòng BM25) -> chờ tối đa
+        # EMBED_QUEUE_TIMEOUT_MS để có lượt trong EMBED_MAX_CONCURRENCY, quá hạn thì TimeoutError
+        limit = settings.EMBED_MAX_CONCURRENCY
+        if not limited or limit <= 0:
+            return embed_texts(texts)
+        slots = _query_embed_slots(limit)
+        if not slots.acquire(timeout=settings.EMBED_QUEUE_TIMEOUT_MS / 1000.0):
+            raise TimeoutError(f"embedding model busy ({limit} concurrent queries)")
+        try:
+            return embed_texts(texts)
+        finally:
+            slots.release()
+
+    def multi_vector_search(self, fields: FieldVectorService, parts: List[Tuple[str, str]],
+                            embs: np.ndarray, top_k: int, threshold: float, exclude_topic_id: Any = None,
+                            query_emb: Optional[np.ndarray] = None) -> Dict[str, Any]:
+        # Tìm kiếm đa vector (MULTI_VECTOR_ENABLED): similarity là trung bình có trọng số của similarity
+        # từng trường (xem FieldVectorService.score); mỗi hit kèm similarity theo trường
+        # query_emb: embedding của text ghép - đề tài chưa có vector theo trường với cấu hình hiện tại
+        # (ghi khi tắt đa vector, chưa được embed lại) được tìm bằng vector đề tài như chế độ một vector
+        ranked = fields.score(parts, embs, top_k, exclude_topic_id=exclude_topic_id)
+        metas = self.repo.get_metadatas([parent for parent, _, _ in ranked])
+        hits = []
+        for parent, sim, per_field in ranked:
+            m = metas.get(parent) or {}
+            hits.append({
+                "topicId": m.get("TopicId"),
+                "topicVersionId": m.get("TopicVersionId"),
+                "title": m.get("Title", ""),
+                "similarity": sim,
+                "fields": per_field,
+            })
+        if query_emb is not None:
+            # $ne của Chroma khớp cả đề tài không có key dấu
+            where: Dict[str, Any] = {FIELD_VECTORS_KEY: {"$ne": fields.marker}}
+            if exclude_topic_id is not None:
+                where = {"$and": [where, self.repo.exclude_topic_where(exclude_topic_id)]}
+            fallback = [h for h in self._to_hits(self.repo.query(query_emb, n_results=top_k, where=where))
+                        if exclude_topic_id is None or str(h["topicId"]) != str(exclude_topic_id)]
+            # Vector theo trường cũ của đề tài chưa có dấu có thể lệch -> dùng kết quả một vector
+            seen = {h["topicVersionId"] for h in fallback}
+            hits = [h for h in hits if h["topicVersionId"] not in seen] + fallback
+            hits.sort(key=lambda h: h["similarity"], reverse=True)
+            hits = hits[:top_k]
+        passed = all(h["similarity"] < threshold for h in hits)
+        return {"passed": passed, "hits": hits, "suggestions": hits[:3], "threshold": threshold}
+
+    def check_and_upsert(self, data: Dict[str, Any], top_k: int, threshold: float) -> Dict[str, Any]:
+        """
+        Kiểm tra trùng lặp rồi ghi đề tài nếu không trùng, trong cùng một request
+
+        Text (hoặc các đoạn trường ở chế độ đa vector) chỉ được embed một lần: vector dùng cho kiểm tra
+        cũng là vector được ghi. Kiểm tra + ghi chạy trong _registration_lock nên hai đề tài tương tự
+        gửi đồng thời không thể cùng được ghi - đề tài sau luôn thấy đề tài trước. Các phiên bản khác
+        của cùng TopicId không bị tính là trùng lặp. Luôn ghi trực tiếp vào ChromaDB (không qua bộ đệm
+        ghi trễ) để lần kiểm tra kế tiếp thấy ngay đề tài vừa ghi.
+
+        Returns:
+            Kết quả kiểm tra (passed, hits, suggestions, threshold) kèm "write": kết quả ghi
+            (upserted/embedded/skipped) nếu passed, None nếu trùng lặp
+        """
+        self.validate_item(data)
+        record = TopicRecord.from_item(data)
+        text = record.text()
+        if not text:
+            raise ValueError("Provide the content fields")
+        topic_id = record.topic_id
+
+        fields = self._field_vectors() if settings.MULTI_VECTOR_ENABLED else None
+        parts = fields.query_parts({k: v for k, v in data.items() if k != "text"}) if fields else []
+        if not parts:
+            fields = None
+        # Embed ngoài khóa: phần tốn thời gian nhất không chặn các request khác
+        # (đa vector: kèm text ghép cho đề tài chưa có vector theo trường - xem multi_vector_search)
+        queries = [t for _, t in parts] + [text] if fields else [text]
+        embs = embed_texts(queries)
+
+        with _registration_lock():
+            if fields is not None:
+                check = self.multi_vector_search(fields, parts, embs[:-1], top_k, threshold,
+                                                 exclude_topic_id=topic_id, query_emb=embs[-1])
+            else:
+                # Bỏ các phiên bản cùng TopicId bất kể được lưu dạng số hay chuỗi (xem _hits_excluding_topic)
+                hits = self._hits_excluding_topic(embs[0], top_k, topic_id)
+                check = {"passed": all(h["similarity"] < threshold for h in hits), "hits": hits,
+                         "suggestions": hits[:3], "threshold": threshold}
+            write = None
+            if check["passed"]:
+                write = self.upsert_records([record], known=dict(zip(queries, embs)))
+        return {**check, "write": write}
+
+    def hybrid_vector(self, query_emb: np.ndarray, text: str, bm25: Bm25Index,
+                      top_k: int, threshold: float) -> Dict[str, Any]:
+        # Tìm kiếm lai: hợp ứng viên ANN (HYBRID_ANN_CANDIDATES) và BM25 (BM25_CANDIDATES), rồi chấm lại
+        # toàn bộ bằng cosine chính xác trên vector đã lưu. Đề tài nhiều từ khóa trùng nhưng bị HNSW
+        # bỏ sót vẫn được xếp hạng theo similarity thật; kết quả có cùng dạng với search_vector.
+        ann_ids, _ = self.repo.query_distances(query_emb, max(top_k, settings.HYBRID_ANN_CANDIDATES))
+        keyword_ids = [id_ for id_, _ in bm25.search(text, settings.BM25_CANDIDATES)]
+        candidates = list(dict.fromkeys(ann_ids + keyword_ids))
+        bm25.record("hybrid")
+
+        ids, dists = self._rescore(query_emb, candidates, top_k)
+        metas = self.repo.get_metadatas(ids)
+        hits = self._to_hits({"metadatas": [metas.get(i) for i in ids], "distances": dists})
+        passed = all(h["similarity"] < threshold for h in hits)
+        return {"passed": passed, "hits": hits, "suggestions": hits[:3], "threshold": threshold,
+                "candidates": len(candidates)}
+
+    def keyword_search(self, bm25: Bm25Index, text: str, top_k: int, threshold: float,
+                       data: Dict[str, Any], reason: str) -> Dict[str, Any]:
+        # Tìm kiếm dự phòng chỉ bằng BM25 (không có embedding truy vấn): ứng viên xếp hạng theo điểm
+        # BM25, đọc lại metadata hiện có trong ChromaDB (bỏ đề tài đã xóa) và chấm bằng cosine tần suất
+        # term của title/description ("lexical"). passed so lexical với threshold: chỉ bắt được bản sao
+        # gần về từ ngữ, không bắt được diễn đạt lại - "degraded": true để client biết kết quả kém tin
+        # cậy hơn và có thể thử lại sau
+        bm25.record("degraded")
+        scored = bm25.search(text, max(top_k, settings.BM25_CANDIDATES))
+        query = bm25_text({"Title": data.get("title"), "Description": data.get("description")}).strip() or text
+        metas = self.repo.get_metadatas([id_ for id_, _ in scored])
+        hits = []
+        for id_, score in scored:
+            m = metas.get(id_)
+            if m is None:
+                continue
+            hits.append({
+                "topicId": m.get("TopicId"),
+                "topicVersionId": m.get("TopicVersionId"),
+                "title": m.get("Title", ""),
+                "similarity": None,
+                "lexical": round(term_cosine(query, bm25_text(m)), 4),
+                "bm25": round(score, 4),
+            })
+        passed = all(h["lexical"] < threshold for h in hits)
+        if data.get("gate"):
+            return {"passed": passed, "similarity": None,
+                    "lexical": max((h["lexical"] for h in hits), default=None),
+                    "threshold": threshold, "degraded": True, "reason": reason}
+        hits = hits[:top_k]
+        return {"passed": passed, "hits": hits, "suggestions": hits[:3], "threshold": threshold,
+                "degraded": True, "reason": reason}
+
+    def _lexical_fast_path(self, text: str, top_k: int, threshold: float,
+                           where: Optional[Dict[str, Any]], data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        # Đường tắt từ vựng (LEXICAL_FAST_PATH): trả lời "trùng lặp" mà không query ANN nếu
+        # - text chuẩn hóa trùng hẳn một đề tài đã lưu: similarity là cosine thật (1.0 khi text giống hệt
+        #   document đã lưu; chỉ giống sau chuẩn hóa - khác hoa/thường, dấu câu - thì embed query một lần
+        #   và so với vector đã lưu của vài ứng viên), hoặc
+        # - Jaccard MinHash với một đề tài >= LEXICAL_JACCARD_THRESHOLD (similarity của hit là null,
+        #   Jaccard nằm ở "jaccard")
+        # và điểm đó >= threshold của request; ngược lại đi tiếp đường embedding như bình thường.
+        # Ứng viên được kiểm tra lại với document hiện có trong ChromaDB trước khi trả lời.
+        # Không áp dụng cho range (cần mọi hit, không chỉ bản sao) và metadataFilter (chỉ mục không có
+        # metadata); các request này vẫn được tính vào tỉ lệ request trả lời bằng đường tắt
+        index = get_lexical_index(self.repo)
+        if index is None:
+            return None
+        match = None
+        similarity: Dict[str, float] = {}
+        if where is None and not data.get("range"):
+            match = index.match(text, min_jaccard=settings.LEXICAL_JACCARD_THRESHOLD)
+            if match is not None:
+                docs = self.repo.get_documents([i for i, _ in match[1]])
+                match = index.verify(text, docs, min_jaccard=settings.LEXICAL_JACCARD_THRESHOLD)
+            if match is not None and match[0] == MATCH_EXACT:
+                similarity = self._lexical_similarity(text, docs, [i for i, _ in match[1]])
+                ranked = sorted(match[1], key=lambda t: (-similarity.get(t[0], 0.0), t[0]))
+                match = (MATCH_EXACT, ranked) if similarity and max(similarity.values()) >= threshold else None
+            elif match is not None and match[1][0][1] < threshold:
+                match = None
+        index.record(match[0] if match else None)
+        if match is None:
+            return None
+
+        kind, scored = match
+        metas = self.repo.get_metadatas([i for i, _ in scored[:top_k]])
+        hits = []
+        for id_, score in scored[:top_k]:
+            m = metas.get(id_) or {}
+            hits.append({
+                "topicId": m.get("TopicId"),
+                "topicVersionId": m.get("TopicVersionId"),
+                "title": m.get("Title", ""),
+                "similarity": similarity.get(id_) if kind == MATCH_EXACT else None,
+                "jaccard": score,
+            })
+        if data.get("gate"):
+            return {"passed": False, "similarity": hits[0]["similarity"], "jaccard": hits[0]["jaccard"],
+                    "threshold": threshold, "fastPath": kind}
+        return {"passed": False, "hits": hits, "suggestions": hits[:3], "threshold": threshold, "fastPath": kind}
+
+    def _lexical_similarity(self, text: str, docs: Dict[str, str], ids: List[str]) -> Dict[str, float]:
+        # Similarity (cùng thang với _to_hits) của text với các bản sao khớp sau chuẩn hóa: document giống hệt
+        # -> cùng embedding -> 1.0; còn lại embed text một lần và tính cosine với vector đã lưu
+        out = {i: 1.0 for i in ids if docs.get(i) == text}
+        rest = [i for i in ids if i not in out]
+        if rest:
+            found, dists = self._rescore(embed_texts([text])[0], rest, len(rest))
+            out.update((i, round(1.0 - d / 2.0, 4)) for i, d in zip(found, dists))
+        return out
+
+    def search_vector(self, query_emb: np.ndarray, top_k: int, threshold: float,
+                      where: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        # Tìm kiếm trong ChromaDB với vector query đã có (hoặc chấm điểm chính xác tập ứng viên nhỏ)
+        exact = self._exact_candidates(query_emb, where, top_k)
+        if exact is not None:
+            ids, dists = exact
+            metas = self.repo.get_metadatas(ids)
+            res = {"metadatas": [metas.get(i) for i in ids], "distances": dists}
+        else:
+            res = self.repo.query(query_emb, n_results=top_k, where=where)
+        hits = self._to_hits(res)
+        
+        # Kiểm tra xem có trùng lặp không (passed = True nếu không có hit >= threshold)
+        passed = all(h["similarity"] < threshold for h in hits)
+        suggestions = hits[:3]  # Top 3 gợi ý
         
-        # Xử lý kết quả và tính similarity score
+        return {"passed": passed, "hits": hits, "suggestions": suggestions, "threshold": threshold}
+
+    def gate_vector(self, query_emb: np.ndarray, threshold: float,
+                    where: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        # Chế độ cổng: chỉ cần biết có đề tài nào >= threshold hay không
+        # Đề tài gần nhất quyết định kết quả nên chỉ query 1 kết quả và chỉ lấy distance
+        # (không đọc metadata/document, không tạo và sắp xếp danh sách hit)
+        exact = self._exact_candidates(query_emb, where, 1)
+        if exact is not None:
+            dist = exact[1][0] if exact[1] else None
+        else:
+            dist = self.repo.nearest_distance(query_emb, where=where)
+        similarity = None if dist is None else round(1.0 - (dist / 2.0), 4)
+        return {
+            "passed": similarity is None or similarity < threshold,
+            "similarity": similarity,
+            "threshold": threshold,
+        }
+
+    def range_vector(self, query_emb: np.ndarray, threshold: float,
+                     where: Optional[Dict[str, Any]] = None,
+                     max_results: Optional[int] = None) -> Dict[str, Any]:
+        # Tìm kiếm theo khoảng: trả về mọi đề tài có similarity >= threshold thay vì topK cố định
+        # Số ứng viên bắt đầu từ RANGE_SEARCH_INITIAL_K và nhân đôi khi ứng viên xa nhất vẫn còn
+        # >= threshold, tới khi similarity rơi xuống dưới ngưỡng, hết vector hoặc chạm trần
+        # RANGE_SEARCH_MAX_K (truncated=true). Các vòng chỉ lấy ID + distance; metadata chỉ được đọc
+        # một lần cho các hit cuối cùng.
+        cap = settings.RANGE_SEARCH_MAX_K
+        if max_results:
+            cap = min(int(max_results), cap)
+        cap = max(cap, 1)
+        n = min(max(settings.RANGE_SEARCH_INITIAL_K, 1), cap)
+
+        rounds = 0
+        exact = self._exact_candidates(query_emb, where, cap)
+        if exact is not None:
+            # Đã chấm điểm toàn bộ tập ứng viên đã lọc: không cần các vòng query
+            ids, dists = exact
+            n = cap
+        else:
+            while True:
+                ids, dists = self.repo.query_distances(query_emb, n, where=where)
+                rounds += 1
+                if len(ids) < n or not dists or 1.0 - (dists[-1] / 2.0) < threshold or n >= cap:
+                    break
+                n = min(n * 2, cap)
+        exhausted = len(ids) < n
+        deepest = 1.0 - (dists[-1] / 2.0) if dists else None
+
+        qualifying = sum(1 for d in dists if 1.0 - (d / 2.0) >= threshold)
+        # Luôn trả về ít nhất 3 gợi ý như tìm kiếm thường
+        shown = ids[:max(qualifying, 3)]
+        metas = self.repo.get_metadatas(shown)
+        hits = self._to_hits({"metadatas": [metas.get(i) for i in shown], "distances": dists[:len(shown)]})
+        duplicates = [h for h in hits if h["similarity"] >= threshold]
+
+        return {
+            "passed": not duplicates,
+            "hits": duplicates,
+            "suggestions": hits[:3],
+            "threshold": threshold,
+            "truncated": not exhausted and deepest is not None and deepest >= threshold,
+            "rounds": rounds,
+        }
+
+    def _exact_candidates(self, query_emb: np.ndarray, where: Optional[Dict[str, Any]],
+                          n: int) -> Optional[Tuple[List[str], List[float]]]:
+        # Lọc trước bằng chỉ mục bitmap metadata (METADATA_INDEX_KEYS)
+        # Tập ứng viên nhỏ (<= METADATA_EXACT_MAX_CANDIDATES): đọc vector đã lưu và tính cosine distance
+        # chính xác - query HNSW có điều kiện lọc chọn lọc cao vừa chậm vừa có thể thiếu kết quả.
+        # Trả về (ids, distances) của n ứng viên gần nhất, hoặc None để dùng query HNSW với where
+        if not where:
+            return None
+        index = get_metadata_index(self.repo)
+        if index is None:
+            return None
+        bits = index.candidates(where)
+        if bits is None or bits.bit_count() > settings.METADATA_EXACT_MAX_CANDIDATES:
+            index.record("ann")
+            return None
+        if not bits:
+            index.record("empty")
+            return [], []
+
+        index.record("exact")
+        return self._rescore(query_emb, index.ids_of(bits), n)
+
+    def _rescore(self, query_emb: np.ndarray, candidates: List[str], n: int) -> Tuple[List[str], List[float]]:
+        # Cosine distance chính xác giữa query và vector đã lưu của các ứng viên; n ứng viên gần nhất
+        stored = self.repo.get_embeddings(candidates)
+        if not stored:
+            return [], []
+        ids = list(stored)
+        mat = np.stack([stored[i] for i in ids])
+        q = np.asarray(query_emb, dtype=np.float32)
+        norms = np.linalg.norm(mat, axis=1) * np.linalg.norm(q)
+        norms[norms == 0] = 1.0
+        dists = 1.0 - (mat @ q) / norms
+        order = np.argsort(dists, kind="stable")[:n]
+        return [ids[i] for i in order], [float(dists[i]) for i in order]
+
+    def metadata_index_stats(self) -> Dict[str, Any]:
+        # Thống kê chỉ mục bitmap metadata (dựng từ ChromaDB nếu chưa có)
+        index = get_metadata_index(self.repo)
+        if index is None:
+            return {"enabled": False}
+        return {"enabled": True, **index.stats()}
+
+    def bm25_index_stats(self) -> Dict[str, Any]:
+        # Thống kê chỉ mục BM25 và số lần tìm kiếm lai / dự phòng
+        index = get_bm25_index(self.repo)
+        if index is None:
+            return {"enabled": False}
+        return {"enabled": True, **index.stats()}
+
+    def lexical_index_stats(self) -> Dict[str, Any]:
+        # Thống kê đường tắt từ vựng, gồm tỉ lệ request được trả lời không cần embedding
+        index = get_lexical_index(self.repo)
+        if index is None:
+            return {"enabled": False}
+        return {"enabled": True, **index.stats()}
+
+    @staticmethod
+    def _to_hits(res: Dict[str, Any]) -> List[Dict[str, Any]]:
+        # Xử lý kết quả query và tính similarity score, sắp xếp theo similarity giảm dần
         hits = []
         for meta, dist in zip(res.get("metadatas", []), res.get("distances", [])):
             m = meta or {}
@@ -131,15 +867,49 @@ class TopicsService:
                 "title": m.get("Title", ""),
                 "similarity": round(sim, 4)
             })
-            
-        # Sắp xếp theo similarity giảm dần
         hits.sort(key=lambda h: h.get("similarity", 0), reverse=True)
-        
-        # Kiểm tra xem có trùng lặp không (passed = True nếu không có hit >= threshold)
-        passed = all(h["similarity"] < threshold for h in hits)
-        suggestions = hits[:3]  # Top 3 gợi ý
-        
-        return {"passed": passed, "hits": hits, "suggestions": suggestions, "threshold": threshold}
+        return hits
+
+    def _hits_excluding_topic(self, query_emb: np.ndarray, n: int, topic_id: Any,
+                              exclude_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        # n hit gần nhất không thuộc topic_id (và khác exclude_id)
+        # $ne của Chroma phân biệt kiểu (TopicId 5 từ SQL khác "5" từ API) nên lấy dư KNN_OVERFETCH kết
+        # quả rồi lọc bằng str(TopicId) như KnnGraphService._neighbor_hits; phần dư không đủ thì query lại
+        # với $nin theo mọi dạng của TopicId (vẫn lọc lại bằng chuỗi)
+        def keep(res: Dict[str, Any]) -> List[Dict[str, Any]]:
+            return [h for h in self._to_hits(res)
+                    if f"tv:{h['topicVersionId']}" != exclude_id
+                    and (topic_id is None or str(h["topicId"]) != str(topic_id))]
+
+        n_results = n + settings.KNN_OVERFETCH
+        res = self.repo.query(query_emb, n_results=n_results)
+        hits = keep(res)
+        if len(hits) < n and len(res.get("metadatas") or []) == n_results and topic_id is not None:
+            hits = keep(self.repo.query(query_emb, n_results=n + 1, where=self.repo.exclude_topic_where(topic_id)))
+        return hits[:n]
+
+    def similar(self, topic_version_id: Any, top_k: int, threshold: float) -> Optional[Dict[str, Any]]:
+        # Tìm đề tài tương tự một đề tài đã có trong chỉ mục bằng chính vector đã lưu
+        # Không ghép text, không chạy model embedding: một lần đọc vector + một lần query
+        # Loại bỏ chính đề tài đó và các phiên bản khác của cùng TopicId (xem _hits_excluding_topic)
+        # Trả về None nếu TopicVersionId không có trong chỉ mục
+        id_ = f"tv:{topic_version_id}"
+        stored = self.repo.get_embeddings([id_])
+        if id_ not in stored:
+            return None
+        meta = self.repo.get_metadatas([id_]).get(id_) or {}
+        topic_id = meta.get("TopicId")
+
+        hits = self._hits_excluding_topic(stored[id_], top_k, topic_id, exclude_id=id_)
+
+        return {
+            "topicId": topic_id,
+            "topicVersionId": meta.get("TopicVersionId", topic_version_id),
+            "title": meta.get("Title", ""),
+            "hits": hits,
+            "duplicates": [h for h in hits if h["similarity"] >= threshold],
+            "threshold": threshold,
+        }
 
     @staticmethod
     def count_vectors() -> int:
@@ -0,0 +1,317 @@
+﻿# -*- coding: utf-8 -*-
+# Bộ đệm ghi trễ (write-behind) cho upsert từng đề tài: ghi log bền vững rồi gom nhóm ghi vào ChromaDB
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from dupliapp.config import settings
+
+# Số log tối đa cạnh WRITE_BEHIND_LOG_PATH (<path>, <path>.1, ...): mỗi process giữ riêng một log
+MAX_LOG_SLOTS = 32
+
+def _claim_log(log_path: str) -> Tuple[str, sqlite3.Connection]:
+    # Giữ khóa EXCLUSIVE của file "<log>.lock" (SQLite, như state_lock) suốt đời bộ đệm: hai process
+    # không bao giờ cùng ghi/cắt một log hay một file .committed. Log đầu tiên chưa ai giữ được chọn,
+    # nên khi khởi động lại, các process lần lượt nhận lại và ghi tiếp log của lần chạy trước.
+    for slot in range(MAX_LOG_SLOTS):
+        path = log_path if slot == 0 else f"{log_path}.{slot}"
+        conn = sqlite3.connect(path + ".lock", timeout=0, isolation_level=None, check_same_thread=False)
+        try:
+            conn.execute("BEGIN EXCLUSIVE")
+            return path, conn
+        except sqlite3.OperationalError:
+            conn.close()
+    raise RuntimeError(f"All {MAX_LOG_SLOTS} write-behind logs at {log_path} are held by other processes")
+
+class WriteBehindBuffer:
+    """
+    Gom các upsert đơn lẻ thành lô (group commit)
+
+    - enqueue(): ghi đề tài vào log append-only (fsync) rồi trả về số thứ tự (seq) ngay,
+      không chờ embedding/ChromaDB
+    - Thread nền ghi lô khi đủ max_batch đề tài hoặc đề tài cũ nhất đã chờ quá max_delay giây
+    - Lô ghi lỗi được ghi lại từng đề tài một: một đề tài hỏng không chặn cả lô. Đề tài vẫn lỗi được
+      giữ lại và thử lại; sau max_attempts lần được chuyển vào file dead-letter ("<log>.dead", mỗi
+      dòng một JSON kèm lỗi) và bỏ khỏi hàng đợi
+    - seq đã commit là mốc mà mọi bản ghi <= nó đã ghi xong (hoặc vào dead-letter); log chỉ được cắt
+      khi không còn bản ghi nào đang chờ
+    - Khởi động lại: các bản ghi trong log chưa được commit (trừ dead-letter) được nạp lại và ghi tiếp
+    - Mỗi process giữ khóa riêng một log (xem _claim_log), log_path thực tế có thể có hậu tố .1, .2, ...
+    - wait_visible(seq): chờ tới khi đề tài đã ghi vào ChromaDB (đọc được qua search)
+    - close(): ghi hết phần còn lại (được gọi khi tắt ứng dụng)
+    """
+
+    def __init__(self, log_path: Optional[str] = None, max_batch: Optional[int] = None,
+                 max_delay: Optional[float] = None,
+                 write_fn: Optional[Callable[[List[Dict[str, Any]]], Dict[str, int]]] = None,
+                 max_attempts: Optional[int] = None):
+        self.max_batch = max(1, max_batch or settings.WRITE_BEHIND_MAX_BATCH)
+        self.max_delay = (settings.WRITE_BEHIND_MAX_DELAY_MS / 1000.0) if max_delay is None else max_delay
+        self.max_attempts = max(1, max_attempts or settings.WRITE_BEHIND_MAX_ATTEMPTS)
+        self._write_fn = write_fn
+
+        self._cond = threading.Condition()
+        # Mỗi phần tử: (seq, thời điểm enqueue, đề tài)
+        self._pending: List[Tuple[int, float, Dict[str, Any]]] = []
+        self._last_seq = 0
+        self._committed_seq = 0
+        # Số lần ghi lỗi của từng seq và các seq đã chuyển vào dead-letter
+        self._attempts: Dict[int, int] = {}
+        self._dead: set = set()
+        self._flush_requested = False
+        self._closed = False
+        self.flushes = 0
+        self.flushed_items = 0
+        self.dead_lettered = 0
+        self.last_error: Optional[str] = None
+
+        base = log_path or settings.WRITE_BEHIND_LOG_PATH
+        folder = os.path.dirname(os.path.abspath(base))
+        os.makedirs(folder, exist_ok=True)
+        self.log_path, self._lock_conn = _claim_log(base)
+        self._recover()
+        self._log = open(self.log_path, "a", encoding="utf-8")
+        self._thread = threading.Thread(target=self._run, name="write-behind-flusher", daemon=True)
+        self._thread.start()
+
+    @property
+    def _commit_path(self) -> str:
+        return self.log_path + ".committed"
+
+    @property
+    def dead_letter_path(self) -> str:
+        return self.log_path + ".dead"
+
+    def _recover(self) -> None:
+        # Nạp lại các bản ghi chưa commit từ lần chạy trước
+        committed = 0
+        if os.path.exists(self._commit_path):
+            with open(self._commit_path, "r", encoding="utf-8") as f:
+                committed = int(f.read().strip() or 0)
+        self._committed_seq = self._last_seq = committed
+        if os.path.exists(self.dead_letter_path):
+            with open(self.dead_letter_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self._dead.add(json.loads(line)["seq"])
+                    except (json.JSONDecodeError, KeyError):
+                        continue
+        if not os.path.exists(self.log_path):
+            return
+        now = time.monotonic()
+        with open(self.log_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Dòng cuối bị ghi dở khi tiến trình dừng đột ngột -> chưa từng được xác nhận
+                    break
+                self._last_seq = max(self._last_seq, record["seq"])
+                if record["seq"] > committed and record["seq"] not in self._dead:
+                    self._pending.append((record["seq"], now, record["item"]))
+
+    def _write(self, items: List[Dict[str, Any]]) -> Dict[str, int]:
+        if self._write_fn is not None:
+            return self._write_fn(items)
+        # Import muộn để tránh vòng import khi khởi tạo ứng dụng
+        from dupliapp.services.topic_service import TopicsService
+        return TopicsService().upsert_many(items)
+
+    def enqueue(self, item: Dict[str, Any]) -> int:
+        # Ghi bền vững vào log rồi xác nhận; việc embed và ghi ChromaDB diễn ra sau
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Write-behind buffer is closed")
+            self._last_seq += 1
+            seq = self._last_seq
+            self._log.write(json.dumps({"seq": seq, "item": item}, ensure_ascii=False) + "\n")
+            self._log.flush()
+            os.fsync(self._log.fileno())
+            self._pending.append((seq, time.monotonic(), item))
+            # Bản ghi đầu tiên: thread nền bắt đầu đếm max_delay; đủ lô: ghi ngay
+            if len(self._pending) == 1 or len(self._pending) >= self.max_batch:
+                self._cond.notify_all()
+        return seq
+
+    def _due(self) -> bool:
+        if not self._pending:
+            return False
+        if self._flush_requested or self._closed or len(self._pending) >= self.max_batch:
+            return True
+        return time.monotonic() - self._pending[0][1] >= self.max_delay
+
+    def _commit(self) -> None:
+        # Ghi nguyên tử mốc commit (mọi seq nhỏ hơn bản ghi đang chờ đầu tiên); log được cắt khi không
+        # còn bản ghi nào đang chờ
+        seq = self._pending[0][0] - 1 if self._pending else self._last_seq
+        if seq > self._committed_seq:
+            tmp = self._commit_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(str(seq))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self._commit_path)
+            self._committed_seq = seq
+        if not self._pending:
+            self._log.truncate(0)
+            self._log.seek(0)
+
+    def _dead_letter(self, seq: int, item: Dict[str, Any], error: str) -> None:
+        with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"seq": seq, "item": item, "error": error,
+                                "attempts": self._attempts.pop(seq, 0)}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._dead.add(seq)
+        self.dead_lettered += 1
+
+    def _flush_once(self) -> bool:
+        # Ghi một lô (tối đa max_batch đề tài); phiên bản mới hơn của cùng TopicVersionId thắng.
+        # Lô lỗi -> ghi lại từng TopicVersionId một để chỉ giữ lại (hoặc đưa vào dead-letter) đề tài hỏng
+        with self._cond:
+            batch = self._pending[:self.max_batch]
+        if not batch:
+            return False
+
+        groups: Dict[Any, List[int]] = {}
+        latest: Dict[Any, Dict[str, Any]] = {}
+        for seq, _, item in batch:
+            key = item.get("topicVersionId")
+            groups.setdefault(key, []).append(seq)
+            latest[key] = item
+        failed: Dict[int, str] = {}
+        try:
+            self._write(list(latest.values()))
+        except Exception as e:
+            print(f"⚠️ Warning: Write-behind flush failed, retrying items one by one: {e}")
+            for key, item in latest.items():
+                try:
+                    self._write([item])
+                except Exception as item_error:
+                    for seq in groups[key]:
+                        failed[seq] = str(item_error)
+
+        with self._cond:
+            for seq, _, item in batch:
+                if seq not in failed:
+                    self._attempts.pop(seq, None)
+                    continue
+                self._attempts[seq] = self._attempts.get(seq, 0) + 1
+                if self._attempts[seq] >= self.max_attempts:
+                    print(f"⚠️ Warning: Write-behind item {seq} failed {self._attempts[seq]} times, "
+                          f"moved to {self.dead_letter_path}: {failed[seq]}")
+                    self._dead_letter(seq, item, failed[seq])
+            settled = {seq for seq, _, _ in batch if seq not in failed or seq in self._dead}
+            self._pending = [p for p in self._pending if p[0] not in settled]
+            if settled:
+                self.flushes += 1
+            self.flushed_items += sum(1 for seq in settled if seq not in self._dead)
+            self.last_error = next(iter(failed.values()), None)
+            self._commit()
+            if not self._pending:
+                self._flush_requested = False
+            self._cond.notify_all()
+        return not failed
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._due():
+                    if self._closed:
+                        return
+                    timeout = None
+                    if self._pending:
+                        timeout = max(0.0, self.max_delay - (time.monotonic() - self._pending[0][1]))
+                    self._cond.wait(timeout)
+            if not self._flush_once():
+                # Lỗi ghi: chờ một chu kỳ trước khi thử lại
+                with self._cond:
+                    if self._closed and self.last_error:
+                        return
+                    self._cond.wait(max(self.max_delay, 0.5))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        # Yêu cầu ghi ngay mọi bản ghi đang chờ và chờ tới khi xong (ghi được hoặc vào dead-letter)
+        with self._cond:
+            seq = self._last_seq
+        return self._wait(lambda: self._committed_seq >= seq, timeout)
+
+    def wait_visible(self, seq: int, timeout: Optional[float] = None) -> bool:
+        # Chờ tới khi bản ghi seq đã được ghi vào ChromaDB; False nếu hết thời gian chờ hoặc bản ghi
+        # đã vào dead-letter
+        def settled() -> bool:
+            return seq <= self._committed_seq or all(p[0] != seq for p in self._pending)
+        if not self._wait(settled, timeout):
+            return False
+        with self._cond:
+            return seq not in self._dead
+
+    def _wait(self, done: Callable[[], bool], timeout: Optional[float]) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            while not done():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "pending": len(self._pending),
+                "lastSeq": self._last_seq,
+                "committedSeq": self._committed_seq,
+                "flushes": self.flushes,
+                "flushedItems": self.flushed_items,
+                "retrying": len(self._attempts),
+                "deadLettered": self.dead_lettered,
+                "logPath": self.log_path,
+                "lastError": self.last_error,
+            }
+
+    def close(self, timeout: Optional[float] = 30.0) -> None:
+        # Ghi hết phần còn lại rồi dừng thread nền
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            # Thread nền vẫn đang ghi: giữ file nhật ký và khóa slot để process khác không nhận slot
+            # giữa chừng; phần chưa ghi được phục hồi từ nhật ký ở lần khởi động sau
+            print(f"⚠️ Warning: write-behind flusher still running after {timeout}s; keeping {self.log_path} open")
+            return
+        self._log.close()
+        self._lock_conn.execute("COMMIT")
+        self._lock_conn.close()
+
+# Bộ đệm dùng chung cho toàn bộ ứng dụng (singleton pattern)
+_buffer: Optional[WriteBehindBuffer] = None
+_buffer_lock = threading.Lock()
+
+def get_write_behind() -> Optional[WriteBehindBuffer]:
+    # Trả về bộ đệm nếu WRITE_BEHIND_ENABLED, ngược lại None (ghi trực tiếp)
+    global _buffer
+    if not settings.WRITE_BEHIND_ENABLED:
+        return None
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = WriteBehindBuffer()
+        return _buffer
+
+def close_write_behind() -> None:
+    # Flush khi tắt ứng dụng: không mất các upsert đã được xác nhận
+    global _buffer
+    with _buffer_lock:
+        buffer, _buffer = _buffer, None
+    if buffer is not None:
+        buffer.close()
+
+atexit.register(close_write_behind)
@@ -0,0 +1,63 @@
+﻿# -*- coding: utf-8 -*-
+# Tiện ích xử lý lô đề tài ở dạng cột (list Python hoặc mảng Arrow nếu có pyarrow)
+from typing import Any, Dict, List, Optional, Sequence
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    # pyarrow là tùy chọn - khi không có, các cột là list Python
+    pa = None
+    pc = None
+
+# Lô đề tài dạng cột: tên cột SQL -> list giá trị (hoặc pyarrow.Array)
+TopicColumns = Dict[str, Any]
+
+# Dấu phân cách giữa các trường khi ghép text (giống TopicsService.compose_topic_text)
+TEXT_SEPARATOR = "\n\n"
+
+def is_arrow(col: Any) -> bool:
+    return pa is not None and isinstance(col, (pa.Array, pa.ChunkedArray))
+
+def to_pylist(col: Any) -> List[Any]:
+    # Chuyển một cột sang list Python (mảng Arrow được chuyển trong C, không qua từng dòng)
+    if col is None:
+        return []
+    if is_arrow(col):
+        return col.to_pylist()
+    return list(col)
+
+def column_length(columns: TopicColumns) -> int:
+    for col in columns.values():
+        return len(col)
+    return 0
+
+def _compose_arrow(cols: Sequence[Any]) -> List[str]:
+    # Ghép text bằng các kernel của pyarrow.compute trên toàn bộ cột
+    acc = None
+    for col in cols:
+        col = col.cast(pa.string())
+        # Trường rỗng hoặc chỉ có khoảng trắng -> null để bị bỏ qua khi ghép
+        blank = pc.equal(pc.utf8_trim_whitespace(col), "")
+        col = pc.if_else(blank, pa.scalar(None, pa.string()), col)
+        if acc is None:
+            acc = col
+            continue
+        # join chỉ có giá trị khi cả hai phía khác null; ngược lại giữ phía khác null
+        joined = pc.binary_join_element_wise(acc, col, TEXT_SEPARATOR)
+        acc = pc.coalesce(joined, acc, col)
+    return pc.fill_null(acc, "").to_pylist()
+
+def compose_texts(cols: Sequence[Optional[Any]], length: int) -> List[str]:
+    # Ghép các cột nội dung thành text theo từng đề tài, không tạo dict cho mỗi dòng
+    # Kết quả giống hệt việc gọi compose_topic_text cho từng dòng
+    if pa is not None and any(is_arrow(c) for c in cols if c is not None):
+        arrays = [c if is_arrow(c) else pa.array(to_pylist(c) if c is not None else [None] * length, pa.string())
+                  for c in cols]
+        return _compose_arrow(arrays)
+
+    padded = [c if c is not None else [None] * length for c in cols]
+    return [
+        TEXT_SEPARATOR.join([p for p in (str(v or "") for v in parts) if p and p.strip()])
+        for parts in zip(*padded)
+    ]
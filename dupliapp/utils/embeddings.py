@@ -42,6 +42,14 @@ def _resolve_gemini_model_name() -> str:
     return name
 
 
+def embedding_model_id() -> str:
+    # Định danh model embedding đang dùng ("<loại>:<tên model>") - lưu kèm vector để phát hiện đổi model
+    embedding_type = (settings.EMBEDDING_TYPE or "sentence_transformers").strip().lower()
+    if embedding_type in ("gemini", "google", "google_gemini"):
+        return f"gemini:{_resolve_gemini_model_name()}"
+    return f"{embedding_type}:{settings.MODEL_NAME}"
+
+
 def embed_texts(texts: List[str]) -> np.ndarray:
     # Chuyển đổi danh sách text thành vector embeddings
     embedding_type = (settings.EMBEDDING_TYPE or "sentence_transformers").strip().lower()
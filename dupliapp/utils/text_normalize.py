@@ -0,0 +1,38 @@
+﻿# -*- coding: utf-8 -*-
+# Chuẩn hóa text tiếng Việt cho các chỉ mục từ vựng (hash nội dung, MinHash)
+from typing import List
+import re
+import unicodedata
+
+# Mọi ký tự không phải chữ/số (dấu câu, ký hiệu, khoảng trắng) được coi là ranh giới từ
+_NON_WORD = re.compile(r"[\W_]+", re.UNICODE)
+
+def normalize_text(text: str) -> str:
+    """
+    Dạng chuẩn của text để so khớp từ vựng
+
+    - Unicode NFC: cùng một chữ có dấu gõ bằng dựng sẵn hoặc tổ hợp (vd: "ệ") cho cùng chuỗi
+    - Chữ thường, bỏ dấu câu/ký hiệu, gộp khoảng trắng và xuống dòng
+    """
+    text = unicodedata.normalize("NFC", text or "").lower()
+    return _NON_WORD.sub(" ", text).strip()
+
+def fold_diacritics(text: str) -> str:
+    # Bỏ dấu tiếng Việt ("học máy" -> "hoc may", "đ" -> "d") để khớp cả truy vấn gõ không dấu
+    decomposed = unicodedata.normalize("NFD", text).replace("đ", "d").replace("Đ", "D")
+    return unicodedata.normalize("NFC", "".join(c for c in decomposed if not unicodedata.combining(c)))
+
+def tokenize(text: str, fold: bool = False) -> List[str]:
+    # Các từ (âm tiết) của text đã chuẩn hóa; fold=True để bỏ dấu
+    normalized = normalize_text(text)
+    return (fold_diacritics(normalized) if fold else normalized).split()
+
+def search_terms(text: str) -> List[str]:
+    """
+    Term cho chỉ mục từ khóa: âm tiết đã bỏ dấu và các cặp âm tiết liền nhau
+
+    Từ tiếng Việt thường gồm nhiều âm tiết ("học máy", "quản lý") nên cặp âm tiết ("hoc_may")
+    giữ được nghĩa của từ ghép mà không cần bộ tách từ.
+    """
+    syllables = tokenize(text, fold=True)
+    return syllables + [f"{a}_{b}" for a, b in zip(syllables, syllables[1:])]
@@ -0,0 +1,112 @@
+﻿# -*- coding: utf-8 -*-
+# Đọc đề tài từ file JSONL, CSV hoặc Parquet theo từng lô (dùng cho lập chỉ mục offline)
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional
+import csv
+import gzip
+import io
+import json
+import os
+from dupliapp.utils.columnar import to_pylist
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    # pyarrow là tùy chọn - chỉ cần khi đọc file Parquet
+    pq = None
+
+# Định dạng file được hỗ trợ
+FILE_FORMATS = ("jsonl", "csv", "parquet")
+
+# Tên cột SQL (PascalCase) -> tên trường của API (camelCase)
+_SQL_TO_API = {
+    "TopicId": "topicId",
+    "TopicVersionId": "topicVersionId",
+    "Title": "title",
+    "Description": "description",
+    "Objectives": "objectives",
+    "Methodology": "methodology",
+    "ExpectedOutcomes": "expectedOutcomes",
+    "Requirements": "requirements",
+}
+
+def detect_format(path: str) -> str:
+    # Xác định định dạng theo phần mở rộng (bỏ qua .gz)
+    name = path.lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    ext = os.path.splitext(name)[1].lstrip(".")
+    if ext in ("jsonl", "ndjson", "json"):
+        return "jsonl"
+    if ext in ("csv", "parquet"):
+        return ext
+    raise ValueError(f"Cannot detect file format of {path}; use one of {', '.join(FILE_FORMATS)}")
+
+def normalize_item(record: Dict[str, Any]) -> Dict[str, Any]:
+    # Chấp nhận cả tên trường của API lẫn tên cột SQL; chuỗi rỗng trong CSV được giữ nguyên
+    return {_SQL_TO_API.get(k, k): v for k, v in record.items()}
+
+def _open_text(path: str) -> io.TextIOBase:
+    if path.lower().endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8-sig", newline="")
+    return open(path, "r", encoding="utf-8-sig", newline="")
+
+def _batched(records: Iterator[Dict[str, Any]], batch_size: int) -> Iterator[List[Dict[str, Any]]]:
+    batch: List[Dict[str, Any]] = []
+    for record in records:
+        batch.append(normalize_item(record))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def iter_json_lines(lines: Iterable[Any], source: str = "line") -> Iterator[Dict[str, Any]]:
+    # Phân tích NDJSON từng dòng (str hoặc bytes), bỏ qua dòng trống
+    for line_no, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8-sig" if line_no == 1 else "utf-8")
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            raise ValueError(f"{source}:{line_no}: invalid JSON ({e})") from e
+        if not isinstance(record, dict):
+            raise ValueError(f"{source}:{line_no}: expected a JSON object")
+        yield record
+
+def iter_ndjson_batches(stream: BinaryIO, batch_size: int, compressed: bool = False) -> Iterator[List[Dict[str, Any]]]:
+    # Đọc NDJSON (có thể nén gzip) từ luồng nhị phân theo từng lô, không đọc toàn bộ nội dung vào bộ nhớ
+    if compressed:
+        stream = gzip.GzipFile(fileobj=stream, mode="rb")
+    yield from _batched(iter_json_lines(stream), batch_size)
+
+def _iter_jsonl(path: str) -> Iterator[Dict[str, Any]]:
+    with _open_text(path) as f:
+        yield from iter_json_lines(f, source=path)
+
+def _iter_csv(path: str) -> Iterator[Dict[str, Any]]:
+    with _open_text(path) as f:
+        yield from csv.DictReader(f)
+
+def _iter_parquet(path: str, batch_size: int) -> Iterator[List[Dict[str, Any]]]:
+    # Đọc từng record batch của Parquet, không nạp toàn bộ file vào bộ nhớ
+    if pq is None:
+        raise RuntimeError("pyarrow is required to read Parquet files; install pyarrow")
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+        columns = {name: to_pylist(batch.column(i)) for i, name in enumerate(batch.schema.names)}
+        names = list(columns)
+        yield [normalize_item(dict(zip(names, values))) for values in zip(*(columns[n] for n in names))]
+
+def iter_topic_batches(path: str, batch_size: int, fmt: Optional[str] = None) -> Iterator[List[Dict[str, Any]]]:
+    # Sinh các lô đề tài (list dict theo format của /topics/bulk-upsert) từ file
+    fmt = fmt or detect_format(path)
+    if fmt == "parquet":
+        yield from _iter_parquet(path, batch_size)
+    elif fmt == "jsonl":
+        yield from _batched(_iter_jsonl(path), batch_size)
+    elif fmt == "csv":
+        yield from _batched(_iter_csv(path), batch_size)
+    else:
+        raise ValueError(f"Unsupported file format: {fmt}")
@@ -0,0 +1,77 @@
+﻿# -*- coding: utf-8 -*-
+# Bản ghi đề tài gọn (dataclass dùng __slots__) đi xuyên suốt SQL repository -> IndexService -> TopicsService
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence
+from dupliapp.utils.columnar import TopicColumns, TEXT_SEPARATOR, column_length, to_pylist
+
+# Các cột SQL theo đúng thứ tự các trường của TopicRecord (cũng là tên key metadata trong ChromaDB)
+SQL_COLUMNS = ("TopicId", "TopicVersionId", "Title", "Description", "Objectives",
+               "Methodology", "ExpectedOutcomes", "Requirements")
+
+# Tên trường tương ứng trong JSON của API (camelCase)
+ITEM_KEYS = ("topicId", "topicVersionId", "title", "description", "objectives",
+             "methodology", "expectedOutcomes", "requirements")
+
+@dataclass(slots=True)
+class TopicRecord:
+    """
+    Một phiên bản đề tài cần lập chỉ mục
+
+    Dùng __slots__ thay cho dict theo dòng: không có __dict__ và không lặp lại các key
+    PascalCase/camelCase ở mỗi đề tài. Metadata dict cho ChromaDB chỉ được tạo bởi to_meta()
+    ngay trước khi ghi.
+    """
+    topic_id: Any
+    topic_version_id: Any
+    title: Optional[str] = ""
+    description: Optional[str] = ""
+    objectives: Optional[str] = ""
+    methodology: Optional[str] = ""
+    expected_outcomes: Optional[str] = ""
+    requirements: Optional[str] = ""
+    # Metadata bổ sung gửi kèm qua API (None nếu không có)
+    metadata: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def from_item(cls, data: Dict[str, Any]) -> "TopicRecord":
+        # Từ item của API (camelCase); trường không gửi lên được coi là chuỗi rỗng
+        extra = data.get("metadata")
+        return cls(
+            data.get("topicId"),
+            data.get("topicVersionId"),
+            *(data.get(k, "") for k in ITEM_KEYS[2:]),
+            metadata=extra if isinstance(extra, dict) and extra else None,
+        )
+
+    @classmethod
+    def from_columns(cls, columns: TopicColumns) -> List["TopicRecord"]:
+        # Từ một lô dạng cột (fetch_latest_columns); cột không có được coi là chuỗi rỗng
+        n = column_length(columns)
+        values = [to_pylist(columns[c]) if c in columns else [""] * n for c in SQL_COLUMNS]
+        return [cls(*row) for row in zip(*values)]
+
+    @property
+    def text_fields(self) -> Sequence[Optional[str]]:
+        return (self.title, self.description, self.objectives,
+                self.methodology, self.expected_outcomes, self.requirements)
+
+    def text(self) -> str:
+        # Ghép các trường nội dung giống TopicsService.compose_topic_text
+        return TEXT_SEPARATOR.join([p for p in (str(v or "") for v in self.text_fields) if p and p.strip()])
+
+    def to_meta(self) -> Dict[str, Any]:
+        # Metadata cho ChromaDB (key PascalCase) - chỉ tạo ở bước ghi vào vector store
+        meta = dict(zip(SQL_COLUMNS, (self.topic_id, self.topic_version_id, *self.text_fields)))
+        if self.metadata:
+            meta.update(self.metadata)
+        return meta
+
+    def summary(self) -> Dict[str, Any]:
+        # Thông tin rút gọn trả về cho client (includeTopics)
+        desc = self.description or ""
+        return {
+            "topicId": self.topic_id,
+            "topicVersionId": self.topic_version_id,
+            "title": self.title or "",
+            "description": desc[:100] + "..." if len(desc) > 100 else desc,  # Cắt ngắn description
+        }
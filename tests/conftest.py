@@ -3,6 +3,9 @@
 import pytest
 import tempfile
 import os
+import sqlite3
+import zlib
+import numpy as np
 from unittest.mock import patch, MagicMock
 from dupliapp.main import create_app
 from dupliapp.config import settings
@@ -18,7 +21,8 @@ def app():
             'MODEL_NAME': 'sentence-transformers/all-MiniLM-L6-v2',
             'THRESHOLD': '0.7',
             'TOPK': '3'
-        }):
+        }), patch.object(settings, 'JOB_WORKERS', 0), \
+             patch.object(settings, 'STATE_DB_PATH', os.path.join(temp_dir, 'index_state.db')):
             app = create_app()
             app.config['TESTING'] = True
             app.config['WTF_CSRF_ENABLED'] = False
@@ -46,7 +50,7 @@ def mock_topic_service():
 @pytest.fixture
 def mock_index_service():
     """Mock IndexService for testing."""
-    with patch('dupliapp.services.index_service.IndexService') as mock:
+    with patch('dupliapp.routes.index.IndexService') as mock:
         service_instance = MagicMock()
         mock.return_value = service_instance
         yield service_instance
@@ -94,4 +98,63 @@ def sample_bulk_data():
                 "description": "Mô tả đề tài 2"
             }
         ]
-    } 
\ No newline at end of file
+    } 
+
+# Lược đồ tối thiểu của nguồn SQL (topics/topic_versions) dùng cho bản thay thế SQLite
+TOPIC_SOURCE_SCHEMA = """
+CREATE TABLE topics (Id INTEGER PRIMARY KEY);
+CREATE TABLE topic_versions (
+    Id INTEGER PRIMARY KEY,
+    TopicId INTEGER NOT NULL,
+    VersionNumber INTEGER NOT NULL,
+    IsActive INTEGER NOT NULL DEFAULT 1,
+    Title TEXT, Description TEXT, Objectives TEXT,
+    Methodology TEXT, ExpectedOutcomes TEXT, Requirements TEXT
+);
+"""
+
+@pytest.fixture
+def sqlite_topic_source(tmp_path):
+    """SQLite stand-in for the SQL Server topic source with 5 topics (one version each)."""
+    db_path = tmp_path / "topics.db"
+    conn = sqlite3.connect(db_path)
+    conn.executescript(TOPIC_SOURCE_SCHEMA)
+    for topic_id in range(1, 6):
+        conn.execute("INSERT INTO topics (Id) VALUES (?)", (topic_id,))
+        conn.execute(
+            "INSERT INTO topic_versions (TopicId, VersionNumber, Title, Description) VALUES (?, 1, ?, ?)",
+            (topic_id, f"Đề tài {topic_id}", f"Mô tả đề tài {topic_id}"),
+        )
+    conn.commit()
+
+    with patch.object(settings, 'TOPIC_SOURCE', 'sqlite'), \
+         patch.object(settings, 'TOPIC_SQLITE_PATH', str(db_path)), \
+         patch.object(settings, 'STATE_DB_PATH', str(tmp_path / "state.db")):
+        yield conn
+
+    conn.close()
+
+
+def fake_embed_texts(texts):
+    """Deterministic bag-of-words hashing embedding: similar texts get similar unit vectors."""
+    out = np.zeros((len(texts), 64), dtype=np.float32)
+    for i, text in enumerate(texts):
+        for token in text.lower().split():
+            out[i, zlib.crc32(token.encode("utf-8")) % 64] += 1.0
+    norms = np.linalg.norm(out, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return out / norms
+
+@pytest.fixture
+def fake_embeddings():
+    """Replace the embedding model used by TopicsService; the mock records every call."""
+    with patch('dupliapp.services.topic_service.embed_texts', side_effect=fake_embed_texts) as mock:
+        yield mock
+
+@pytest.fixture
+def chroma_tmp(tmp_path):
+    """Point the Chroma repository (and its collection pointer and locks) at an empty local database."""
+    with patch.object(settings, 'CHROMA_MODE', 'local'), \
+         patch.object(settings, 'CHROMA_DIR', str(tmp_path / "chroma")), \
+         patch.object(settings, 'STATE_DB_PATH', str(tmp_path / "state.db")):
+        yield tmp_path / "chroma"
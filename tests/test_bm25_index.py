@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+# Unit tests for the BM25 inverted index, hybrid candidate generation and the degraded search path
+import pytest
+import json
+from unittest.mock import patch
+from dupliapp.config import settings
+from dupliapp.repositories.change_log import IndexChangeLog
+from dupliapp.services.bm25_index import Bm25Index, get_bm25_index
+from dupliapp.services.topic_service import TopicsService, _query_embed_slots
+
+TOPICS = [
+    ("TV1", "Chẩn đoán bệnh tim bằng học sâu", "Phân tích điện tâm đồ với mạng nơ-ron tích chập"),
+    ("TV2", "Quản lý thư viện số", "Ứng dụng web quản lý mượn trả sách"),
+    ("TV3", "Học máy dự báo thời tiết", "Dự báo lượng mưa từ dữ liệu trạm quan trắc"),
+    ("TV4", "Nhận dạng giọng nói tiếng Việt", "Mô hình học sâu cho nhận dạng tiếng nói"),
+    ("TV5", "Hệ thống đặt phòng khách sạn", "Website đặt phòng và thanh toán trực tuyến"),
+]
+
+@pytest.fixture
+def bm25(tmp_path):
+    """Enable the BM25 index with a temporary state database for deletes."""
+    with patch.object(settings, 'BM25_ENABLED', True), \
+         patch.object(settings, 'STATE_DB_PATH', str(tmp_path / "state.db")), \
+         patch.object(settings, 'COMPACTION_AUTO', False):
+        yield
+
+def seed(svc):
+    svc.upsert_many([{"topicId": tv.replace("TV", "T"), "topicVersionId": tv, "title": title,
+                      "description": desc} for tv, title, desc in TOPICS])
+
+class TestBm25Index:
+    """Test cases for the inverted index itself."""
+
+    def make(self):
+        index = Bm25Index(k1=1.2, b=0.75)
+        index.add([tv for tv, _, _ in TOPICS], [f"{t} {d}" for _, t, d in TOPICS])
+        return index
+
+    def test_keywords_rank_matching_topic_first(self):
+        """The topic sharing the rare keywords scores highest."""
+        hits = self.make().search("thư viện số", 3)
+
+        assert hits[0][0] == "TV2"
+        assert all(score > 0 for _, score in hits)
+
+    def test_unaccented_query_matches(self):
+        """Diacritics are folded on both sides."""
+        assert self.make().search("du bao thoi tiet", 1)[0][0] == "TV3"
+
+    def test_bigram_breaks_ties_between_shared_syllables(self):
+        """A compound word ("học sâu") outranks topics sharing only one syllable."""
+        ids = [i for i, _ in self.make().search("học sâu", 5)]
+
+        assert set(ids[:2]) == {"TV1", "TV4"}
+        assert ids.index("TV3") > 1
+
+    def test_remove_and_replace(self):
+        """Removed ids disappear; re-adding an id replaces its terms."""
+        index = self.make()
+        index.remove(["TV2"])
+        index.add(["TV5"], ["Quản lý thư viện"])
+
+        assert index.search("thư viện", 5)[0][0] == "TV5"
+        assert "TV2" not in [i for i, _ in index.search("thư viện", 5)]
+        assert index.stats()["documents"] == 4
+
+    def test_no_shared_terms(self):
+        """Queries without indexed terms return nothing."""
+        assert self.make().search("blockchain", 5) == []
+
+    def test_common_terms_are_not_scored(self):
+        """Terms present in more than max_df_ratio of a large index are skipped."""
+        index = Bm25Index(k1=1.2, b=0.75, max_df_ratio=0.2)
+        index.add([f"X{i}" for i in range(200)], [f"hệ thống số {i}" for i in range(200)])
+        index.add(["TV1"], ["hệ thống tưới cây"])
+
+        hits = index.search("hệ thống tưới cây", 10)
+
+        assert hits == [("TV1", hits[0][1])]
+        assert index.stats()["skippedTerms"] == 3
+
+class TestHybridSearch:
+    """Test cases for BM25 + ANN candidates rescored with stored vectors."""
+
+    def test_keyword_candidates_are_rescored_exactly(self, chroma_tmp, bm25, fake_embeddings):
+        """With a single ANN candidate, BM25 still supplies the other hits, ranked by similarity."""
+        svc = TopicsService()
+        seed(svc)
+        plain = svc.search({"text": "học sâu nhận dạng tiếng nói", "hybrid": False}, top_k=3, threshold=0.99)
+
+        with patch.object(settings, 'HYBRID_ANN_CANDIDATES', 1):
+            res = svc.search({"text": "học sâu nhận dạng tiếng nói", "hybrid": True}, top_k=3, threshold=0.99)
+
+        assert res["candidates"] > 1
+        assert len(res["hits"]) == 3
+        assert res["hits"][0] == plain["hits"][0]
+        sims = [h["similarity"] for h in res["hits"]]
+        assert sims == sorted(sims, reverse=True)
+        assert "candidates" not in plain
+
+    def test_hybrid_is_opt_in(self, chroma_tmp, bm25, fake_embeddings):
+        """Enabling BM25 alone keeps plain ANN search unless HYBRID_SEARCH_DEFAULT is set."""
+        svc = TopicsService()
+        seed(svc)
+
+        plain = svc.search({"text": "thư viện"}, top_k=3, threshold=0.8)
+        with patch.object(settings, 'HYBRID_SEARCH_DEFAULT', True):
+            hybrid = svc.search({"text": "thư viện"}, top_k=3, threshold=0.8)
+
+        assert "candidates" not in plain
+        assert "candidates" in hybrid
+
+    def test_new_topics_are_indexed_incrementally(self, chroma_tmp, bm25, fake_embeddings):
+        """Upserts and deletes after the index is built are reflected in BM25 results."""
+        svc = TopicsService()
+        seed(svc)
+        svc.bm25_index_stats()
+
+        svc.upsert_one({"topicId": "T6", "topicVersionId": "TV6", "title": "Phát hiện gian lận thẻ tín dụng"})
+        svc.delete_topics(topic_version_ids=["TV2"])
+
+        res = svc.search({"text": "gian lận thư viện", "degraded": True}, top_k=5, threshold=0.8)
+        ids = [h["topicVersionId"] for h in res["hits"]]
+        assert ids[0] == "TV6"
+        assert "TV2" not in ids
+        assert svc.bm25_index_stats()["documents"] == 5
+
+    def test_foreign_writes_are_reloaded(self, chroma_tmp, bm25, fake_embeddings):
+        """Writes logged by another process are re-read before the next search."""
+        svc = TopicsService()
+        seed(svc)
+        index = get_bm25_index(svc.repo)
+
+        # Another process changes a title and deletes a topic straight in Chroma
+        svc.repo.update_metadatas(["tv:TV5"], [{"Title": "Phát hiện gian lận thẻ tín dụng", "Description": ""}])
+        svc.repo.delete(ids=["tv:TV2"])
+        IndexChangeLog().append(["tv:TV5", "tv:TV2"])
+
+        res = svc.search({"text": "gian lận thư viện", "degraded": True}, top_k=5, threshold=0.8)
+
+        ids = [h["topicVersionId"] for h in res["hits"]]
+        assert ids[0] == "TV5"
+        assert "TV2" not in ids
+        assert index.generation == IndexChangeLog().latest()
+
+    def test_deleted_hits_are_dropped(self, chroma_tmp, bm25, fake_embeddings):
+        """Keyword hits no longer in Chroma are not reported even before the index catches up."""
+        svc = TopicsService()
+        seed(svc)
+        get_bm25_index(svc.repo)
+        svc.repo.delete(ids=["tv:TV2"])
+
+        res = svc.search({"text": "quản lý thư viện", "degraded": True}, top_k=5, threshold=0.8)
+
+        assert "TV2" not in [h["topicVersionId"] for h in res["hits"]]
+
+class TestDegradedSearch:
+    """Test cases for the BM25-only path used when the embedding model is unavailable."""
+
+    def test_requested_degraded_search_skips_embedding(self, chroma_tmp, bm25, fake_embeddings):
+        """"degraded": true answers from BM25 without embedding the query."""
+        svc = TopicsService()
+        seed(svc)
+        calls = fake_embeddings.call_count
+
+        res = svc.search({"text": "quản lý thư viện", "degraded": True}, top_k=2, threshold=0.8)
+
+        assert fake_embeddings.call_count == calls
+        assert res["degraded"] is True
+        assert res["passed"] is True
+        assert res["hits"][0]["topicVersionId"] == "TV2"
+        assert res["hits"][0]["similarity"] is None
+        assert 0 < res["hits"][0]["lexical"] < 0.8
+        assert res["hits"][0]["bm25"] > 0
+
+    def test_degraded_copy_does_not_pass(self, chroma_tmp, bm25, fake_embeddings):
+        """A near-verbatim title/description fails the degraded check on term overlap."""
+        svc = TopicsService()
+        seed(svc)
+
+        res = svc.search({"title": "Quản lý thư viện số", "description": "Ứng dụng web quản lý mượn trả sách",
+                          "degraded": True}, top_k=3, threshold=0.8)
+
+        assert res["passed"] is False
+        assert res["degraded"] is True
+        assert res["hits"][0]["lexical"] == 1.0
+
+    def test_embedding_failure_falls_back_to_bm25(self, chroma_tmp, bm25, fake_embeddings):
+        """An exception from the embedding model degrades instead of failing the request."""
+        svc = TopicsService()
+        seed(svc)
+        fake_embeddings.side_effect = RuntimeError("model overloaded")
+
+        res = svc.search({"text": "đặt phòng khách sạn", "gate": True}, top_k=3, threshold=0.8)
+
+        assert res["passed"] is True
+        assert res["similarity"] is None
+        assert 0 < res["lexical"] < 0.8
+        assert res["degraded"] is True
+        assert res["reason"] == "model overloaded"
+
+    def test_busy_model_times_out_to_bm25(self, chroma_tmp, bm25, fake_embeddings):
+        """Queries waiting longer than EMBED_QUEUE_TIMEOUT_MS for a model slot use BM25."""
+        svc = TopicsService()
+        seed(svc)
+        with patch.object(settings, 'EMBED_MAX_CONCURRENCY', 1), \
+             patch.object(settings, 'EMBED_QUEUE_TIMEOUT_MS', 10):
+            slots = _query_embed_slots(1)
+            slots.acquire()
+            try:
+                busy = svc.search({"text": "dự báo thời tiết"}, top_k=3, threshold=0.8)
+            finally:
+                slots.release()
+            free = svc.search({"text": "dự báo thời tiết"}, top_k=3, threshold=0.8)
+
+        assert busy["degraded"] is True
+        assert busy["hits"][0]["topicVersionId"] == "TV3"
+        assert "degraded" not in free
+
+    def test_without_bm25_errors_propagate(self, chroma_tmp, fake_embeddings):
+        """With BM25_ENABLED off there is no fallback."""
+        svc = TopicsService()
+        seed(svc)
+        fake_embeddings.side_effect = RuntimeError("model overloaded")
+
+        with pytest.raises(RuntimeError):
+            svc.search({"text": "dự báo thời tiết"}, top_k=3, threshold=0.8)
+
+class TestBm25Route:
+    """Test cases for the BM25 statistics endpoint."""
+
+    def test_stats_route(self, client, chroma_tmp, bm25, fake_embeddings):
+        """GET /chroma/bm25-index reports documents and search counters."""
+        svc = TopicsService()
+        seed(svc)
+        svc.search({"text": "thư viện", "hybrid": True}, top_k=3, threshold=0.8)
+
+        data = json.loads(client.get('/chroma/bm25-index').data)
+
+        assert data["enabled"] is True
+        assert data["documents"] == 5
+        assert data["searches"]["hybrid"] == 1
+
+    def test_disabled(self, client, chroma_tmp):
+        """The endpoint reports a disabled index."""
+        assert json.loads(client.get('/chroma/bm25-index').data) == {"enabled": False}
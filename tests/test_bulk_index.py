@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+# Unit tests for the offline bulk-indexing CLI and its file readers
+import pytest
+import csv
+import gzip
+import json
+from unittest.mock import patch, MagicMock
+from dupliapp.index import main
+from dupliapp.services.bulk_index_service import BulkIndexService
+from dupliapp.utils.topic_files import detect_format, iter_topic_batches
+
+TOPICS = [
+    {"topicId": i, "topicVersionId": 100 + i, "title": f"Đề tài {i}", "description": f"Mô tả {i}"}
+    for i in range(1, 6)
+]
+
+def stats_for(items, **kwargs):
+    return {"upserted": len(items), "embedded": len(items), "skipped": 0}
+
+@pytest.fixture
+def mock_topics_service():
+    """Replace the vector-store writer used by the bulk indexer."""
+    with patch('dupliapp.services.bulk_index_service.TopicsService') as mock:
+        service_instance = MagicMock()
+        service_instance.upsert_many.side_effect = stats_for
+        mock.return_value = service_instance
+        yield service_instance
+
+@pytest.fixture
+def jsonl_file(tmp_path):
+    path = tmp_path / "topics.jsonl"
+    path.write_text("\n".join(json.dumps(t, ensure_ascii=False) for t in TOPICS) + "\n", encoding="utf-8")
+    return str(path)
+
+class TestTopicFiles:
+    """Test cases for the JSONL/CSV/Parquet readers."""
+
+    def test_detect_format(self):
+        """The format follows the extension, ignoring .gz."""
+        assert detect_format("a.jsonl") == "jsonl"
+        assert detect_format("a.csv.gz") == "csv"
+        assert detect_format("a.parquet") == "parquet"
+        with pytest.raises(ValueError):
+            detect_format("a.txt")
+
+    def test_jsonl_batches(self, jsonl_file):
+        """Records are grouped into batches of the requested size."""
+        batches = list(iter_topic_batches(jsonl_file, 2))
+
+        assert [len(b) for b in batches] == [2, 2, 1]
+        assert batches[0][0]["title"] == "Đề tài 1"
+
+    def test_gzipped_csv_with_sql_column_names(self, tmp_path):
+        """CSV headers may use the SQL column names."""
+        path = tmp_path / "topics.csv.gz"
+        with gzip.open(path, "wt", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=["TopicId", "TopicVersionId", "Title"])
+            writer.writeheader()
+            writer.writerow({"TopicId": "1", "TopicVersionId": "11", "Title": "Đề tài 1"})
+
+        [[item]] = list(iter_topic_batches(str(path), 10))
+
+        assert item == {"topicId": "1", "topicVersionId": "11", "title": "Đề tài 1"}
+
+    def test_parquet_batches(self, tmp_path):
+        """Parquet files are read record batch by record batch."""
+        pa = pytest.importorskip("pyarrow")
+        pq = pytest.importorskip("pyarrow.parquet")
+        path = str(tmp_path / "topics.parquet")
+        pq.write_table(pa.Table.from_pylist(TOPICS), path)
+
+        batches = list(iter_topic_batches(path, 3))
+
+        assert [len(b) for b in batches] == [3, 2]
+        assert batches[1][-1]["topicVersionId"] == 105
+
+    def test_invalid_jsonl_line(self, tmp_path):
+        """A malformed line is reported with its line number."""
+        path = tmp_path / "bad.jsonl"
+        path.write_text('{"topicId": 1}\nnot json\n', encoding="utf-8")
+
+        with pytest.raises(ValueError, match="bad.jsonl:2"):
+            list(iter_topic_batches(str(path), 10))
+
+class TestBulkIndexService:
+    """Test cases for batched and parallel bulk loading."""
+
+    def test_index_file_report(self, jsonl_file, mock_topics_service):
+        """Every batch is upserted once and the report totals match."""
+        report = BulkIndexService(batch_size=2).index_file(jsonl_file)
+
+        assert mock_topics_service.upsert_many.call_count == 3
+        assert report["read"] == 5
+        assert report["upserted"] == 5
+        assert report["batches"] == 3
+        assert report["errors"] == []
+        assert report["throughput"] > 0
+
+    def test_parallel_workers(self, jsonl_file, mock_topics_service):
+        """Parallel batches produce the same totals."""
+        report = BulkIndexService(batch_size=1, workers=3).index_file(jsonl_file)
+
+        assert report["upserted"] == 5
+        assert sorted(it["topicVersionId"] for c in mock_topics_service.upsert_many.call_args_list
+                      for it in c.args[0]) == [101, 102, 103, 104, 105]
+
+    def test_failed_batch_does_not_stop_the_load(self, jsonl_file, mock_topics_service):
+        """A failing batch is reported and the rest are still written."""
+        def fail_second(items, **kwargs):
+            if items[0]["topicId"] == 3:
+                raise RuntimeError("embedding failed")
+            return stats_for(items)
+
+        mock_topics_service.upsert_many.side_effect = fail_second
+        report = BulkIndexService(batch_size=2).index_file(jsonl_file)
+
+        assert report["upserted"] == 3
+        assert report["errors"] == [{"batch": 2, "size": 2, "error": "embedding failed"}]
+
+    def test_malformed_source_returns_partial_report(self, tmp_path, mock_topics_service):
+        """A malformed line stops reading; batches read before it are still written and reported."""
+        path = tmp_path / "bad.jsonl"
+        lines = [json.dumps(t, ensure_ascii=False) for t in TOPICS[:2]] + ["not json"]
+        path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+        report = BulkIndexService(batch_size=1, workers=2).index_file(str(path))
+
+        assert report["upserted"] == 2
+        assert report["batches"] == 2
+        assert len(report["errors"]) == 1
+        assert report["errors"][0]["stage"] == "read"
+        assert "bad.jsonl:3" in report["errors"][0]["error"]
+
+    def test_index_sql(self, sqlite_topic_source):
+        """The SQL source reuses the batched build path."""
+        with patch('dupliapp.services.index_service.TopicsService') as mock:
+            mock.return_value.upsert_many.side_effect = stats_for
+            report = BulkIndexService(batch_size=2).index_sql()
+
+        assert report["source"] == "sql"
+        assert report["read"] == 5
+        assert report["batches"] == 3
+
+class TestIndexCli:
+    """Test cases for python -m dupliapp.index."""
+
+    def test_cli_prints_json_report(self, jsonl_file, mock_topics_service, capsys):
+        """--json prints the machine-readable report and exits 0."""
+        code = main([jsonl_file, "--batch-size", "2", "--json", "--quiet"])
+
+        report = json.loads(capsys.readouterr().out)
+        assert code == 0
+        assert report["upserted"] == 5
+
+    def test_cli_exit_code_on_errors(self, jsonl_file, mock_topics_service, capsys):
+        """Failed batches make the command exit non-zero."""
+        mock_topics_service.upsert_many.side_effect = RuntimeError("down")
+
+        code = main([jsonl_file, "--quiet"])
+
+        assert code == 1
+        assert "Errors       : 1" in capsys.readouterr().out
+
+    def test_cli_exit_code_on_malformed_source(self, tmp_path, mock_topics_service, capsys):
+        """A malformed source exits non-zero and still prints the partial report."""
+        path = tmp_path / "bad.jsonl"
+        path.write_text(json.dumps(TOPICS[0]) + "\n{broken\n", encoding="utf-8")
+
+        code = main([str(path), "--batch-size", "1", "--json", "--quiet"])
+
+        report = json.loads(capsys.readouterr().out)
+        assert code == 1
+        assert report["upserted"] == 1
+        assert report["errors"][0]["stage"] == "read"
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# Unit tests for the combined duplicate check and registration
+import pytest
+import json
+import threading
+from unittest.mock import patch
+from dupliapp.config import settings
+from dupliapp.services.topic_service import TopicsService, _registration_lock
+
+TOPIC = {
+    "topicId": "T1", "topicVersionId": "TV1",
+    "title": "Chẩn đoán bệnh tim bằng học sâu",
+    "description": "Phân tích điện tâm đồ bằng mạng nơ-ron tích chập",
+}
+
+OTHER = {
+    "topicId": "T2", "topicVersionId": "TV2",
+    "title": "Quản lý thư viện số",
+    "description": "Ứng dụng web quản lý mượn trả sách",
+}
+
+@pytest.fixture
+def state_db(tmp_path):
+    """Keep the registration lock file in a temporary directory."""
+    with patch.object(settings, 'STATE_DB_PATH', str(tmp_path / "state.db")):
+        yield
+
+class TestCheckAndUpsert:
+    """Test cases for TopicsService.check_and_upsert."""
+
+    def test_new_topic_is_checked_and_written_with_one_embedding(self, chroma_tmp, state_db, fake_embeddings):
+        """A unique topic is registered and its text is embedded only once."""
+        svc = TopicsService()
+        svc.upsert_one(OTHER)
+        fake_embeddings.reset_mock()
+
+        res = svc.check_and_upsert(TOPIC, top_k=3, threshold=0.9)
+
+        assert res["passed"] is True
+        assert {k: res["write"][k] for k in ("upserted", "embedded", "skipped")} == {"upserted": 1, "embedded": 1, "skipped": 0}
+        assert fake_embeddings.call_count == 1
+        assert svc.repo.count() == 2
+        assert svc.search(dict(TOPIC), top_k=1, threshold=0.9)["hits"][0]["similarity"] == 1.0
+
+    def test_duplicate_is_not_written(self, chroma_tmp, state_db, fake_embeddings):
+        """A near-identical topic from another TopicId is rejected and not stored."""
+        svc = TopicsService()
+        svc.upsert_one(TOPIC)
+
+        res = svc.check_and_upsert({**TOPIC, "topicId": "T9", "topicVersionId": "TV9"}, top_k=3, threshold=0.9)
+
+        assert res["passed"] is False
+        assert res["write"] is None
+        assert res["hits"][0]["topicVersionId"] == "TV1"
+        assert svc.repo.existing_ids(["tv:TV9"]) == []
+
+    def test_new_version_of_same_topic_is_not_a_duplicate(self, chroma_tmp, state_db, fake_embeddings):
+        """Earlier versions of the same TopicId are ignored by the check."""
+        svc = TopicsService()
+        svc.upsert_one(TOPIC)
+
+        res = svc.check_and_upsert({**TOPIC, "topicVersionId": "TV1b"}, top_k=3, threshold=0.9)
+
+        assert res["passed"] is True
+        assert svc.repo.existing_ids(["tv:TV1b"]) == ["tv:TV1b"]
+
+    def test_version_stored_with_int_topic_id_is_not_a_duplicate(self, chroma_tmp, state_db, fake_embeddings):
+        """A version synced from SQL (TopicId 7) does not block a new API version ("7")."""
+        svc = TopicsService()
+        svc.upsert_one({**TOPIC, "topicId": 7})
+        svc.upsert_one(OTHER)
+
+        res = svc.check_and_upsert({**TOPIC, "topicId": "7", "topicVersionId": "TV1b"}, top_k=3, threshold=0.9)
+
+        assert res["passed"] is True
+        assert [h["topicVersionId"] for h in res["hits"]] == ["TV2"]
+
+    def test_concurrent_similar_submissions_register_once(self, chroma_tmp, state_db, fake_embeddings):
+        """Of several similar topics submitted at the same time exactly one is registered."""
+        svc = TopicsService()
+        barrier = threading.Barrier(4)
+        results = []
+
+        def submit(i):
+            barrier.wait()
+            results.append(TopicsService().check_and_upsert(
+                {**TOPIC, "topicId": f"T{i}", "topicVersionId": f"TV{i}"}, top_k=3, threshold=0.9))
+
+        threads = [threading.Thread(target=submit, args=(i,)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert sorted(r["passed"] for r in results) == [False, False, False, True]
+        assert svc.repo.count() == 1
+
+    def test_lock_timeout(self, chroma_tmp, state_db, fake_embeddings):
+        """A request that cannot take the lock in time raises TimeoutError."""
+        held, release = threading.Event(), threading.Event()
+
+        def hold():
+            with _registration_lock():
+                held.set()
+                release.wait()
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        held.wait()
+        try:
+            with patch.object(settings, 'CHECK_AND_UPSERT_LOCK_TIMEOUT_SECONDS', 0.05):
+                with pytest.raises(TimeoutError):
+                    TopicsService().check_and_upsert(TOPIC, top_k=3, threshold=0.9)
+        finally:
+            release.set()
+            holder.join()
+
+    def test_multi_vector_mode_reuses_field_embeddings(self, chroma_tmp, state_db, fake_embeddings):
+        """In multi-vector mode the query chunks are the stored chunks: one embedding call in total."""
+        with patch.object(settings, 'MULTI_VECTOR_ENABLED', True):
+            svc = TopicsService()
+            svc.upsert_one(OTHER)
+            fake_embeddings.reset_mock()
+
+            res = svc.check_and_upsert(TOPIC, top_k=3, threshold=0.9)
+            dup = svc.check_and_upsert({**TOPIC, "topicId": "T9", "topicVersionId": "TV9"}, top_k=3, threshold=0.9)
+
+        assert res["passed"] is True
+        assert res["write"]["embeddedChunks"] == 2
+        assert fake_embeddings.call_count == 2
+        assert dup["passed"] is False
+        assert dup["hits"][0]["topicVersionId"] == "TV1"
+
+class TestCheckAndUpsertRoute:
+    """Test cases for POST /topics/check-and-upsert."""
+
+    def test_registered_then_conflict(self, client, chroma_tmp, fake_embeddings):
+        """The first submission is stored (200), a copy from another topic is a 409."""
+        first = client.post('/topics/check-and-upsert', data=json.dumps({**TOPIC, "threshold": 0.9}),
+                            content_type='application/json')
+        second = client.post('/topics/check-and-upsert',
+                             data=json.dumps({**TOPIC, "topicId": "T9", "topicVersionId": "TV9", "threshold": 0.9}),
+                             content_type='application/json')
+
+        assert first.status_code == 200
+        assert json.loads(first.data)["write"]["upserted"] == 1
+        assert second.status_code == 409
+        assert json.loads(second.data)["write"] is None
+
+    def test_missing_fields(self, client, chroma_tmp):
+        """Requests without topicId or content are a 400."""
+        no_id = client.post('/topics/check-and-upsert', data=json.dumps({"title": "x"}),
+                            content_type='application/json')
+        no_text = client.post('/topics/check-and-upsert', data=json.dumps({"topicId": 1, "topicVersionId": 1}),
+                              content_type='application/json')
+
+        assert no_id.status_code == 400
+        assert no_text.status_code == 400
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# Unit tests for chunked writes in the Chroma repository
+import pytest
+import numpy as np
+from unittest.mock import MagicMock, patch
+from dupliapp.config import settings
+from dupliapp.repositories.chroma_repository import ChromaTopicsRepository
+
+def rows(n, dim=4):
+    ids = [f"tv:{i}" for i in range(n)]
+    embeddings = np.array([[float(i), 1.0, 0.0, 0.0] for i in range(n)], dtype=np.float32).reshape(n, dim)
+    metadatas = [{"TopicId": f"T{i}", "TopicVersionId": str(i)} for i in range(n)]
+    documents = [f"Đề tài {i}" for i in range(n)]
+    return ids, embeddings, metadatas, documents
+
+class TestMaxBatchSize:
+    """The write batch size comes from the client and can be lowered by configuration."""
+
+    def test_discovered_from_client(self, chroma_tmp):
+        repo = ChromaTopicsRepository()
+        assert repo.max_batch_size() == repo.client.get_max_batch_size()
+
+    def test_configured_limit_caps_client_limit(self, chroma_tmp):
+        with patch.object(settings, 'CHROMA_MAX_BATCH_SIZE', 3):
+            repo = ChromaTopicsRepository()
+            assert repo.max_batch_size() == 3
+
+    def test_client_without_limit_uses_default(self, chroma_tmp):
+        repo = ChromaTopicsRepository()
+        repo.client = MagicMock()
+        repo.client.get_max_batch_size.side_effect = RuntimeError("unsupported")
+        repo._max_batch_size = None
+        assert repo.max_batch_size() > 0
+
+class TestChunkedUpsert:
+    """Upserts larger than the batch limit are split and timed per chunk."""
+
+    def test_splits_into_chunks(self, chroma_tmp):
+        with patch.object(settings, 'CHROMA_MAX_BATCH_SIZE', 3):
+            repo = ChromaTopicsRepository()
+            report = repo.upsert(*rows(8))
+
+        assert [c["size"] for c in report["chunks"]] == [3, 3, 2]
+        assert [c["chunk"] for c in report["chunks"]] == [1, 2, 3]
+        assert report["maxBatchSize"] == 3
+        assert report["totalMs"] >= 0
+        assert repo.count() == 8
+
+    def test_reads_are_chunked(self, chroma_tmp):
+        with patch.object(settings, 'CHROMA_MAX_BATCH_SIZE', 3):
+            repo = ChromaTopicsRepository()
+            ids, *_ = rows(7)
+            repo.upsert(*rows(7))
+            assert set(repo.get_metadatas(ids)) == set(ids)
+            assert repo.get_embeddings(ids)["tv:5"][0] == 5.0
+            assert repo.get_embeddings(ids)["tv:5"].dtype == np.float32
+
+    def test_cloud_mode_writes_chunks_concurrently(self, chroma_tmp):
+        with patch.object(settings, 'CHROMA_MAX_BATCH_SIZE', 2), \
+             patch.object(settings, 'CHROMA_UPSERT_CONCURRENCY', 3):
+            repo = ChromaTopicsRepository()
+            repo.mode = "cloud"
+            repo.col = MagicMock()
+            report = repo.upsert(*rows(5))
+
+        assert repo.col.upsert.call_count == 3
+        written = sorted(i for call in repo.col.upsert.call_args_list for i in call.kwargs["ids"])
+        assert written == sorted(rows(5)[0])
+        assert [c["chunk"] for c in report["chunks"]] == [1, 2, 3]
+
+    def test_empty_upsert_writes_nothing(self, chroma_tmp):
+        repo = ChromaTopicsRepository()
+        assert repo.upsert([], [], [], [])["chunks"] == []
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+# Unit tests for topic deletion and index compaction
+import pytest
+import json
+from unittest.mock import patch, MagicMock
+from dupliapp.config import settings
+from dupliapp.services.topic_service import TopicsService
+from dupliapp.services.compaction_service import CompactionService
+from dupliapp.repositories.chroma_repository import ChromaTopicsRepository
+
+@pytest.fixture
+def state_db(tmp_path):
+    """Keep tombstone counters in a temporary state database."""
+    with patch.object(settings, 'STATE_DB_PATH', str(tmp_path / "state.db")), \
+         patch.object(settings, 'COMPACTION_AUTO', False):
+        yield
+
+def seed(svc, n=10):
+    svc.upsert_many([{
+        "topicId": i // 2 if i % 4 else str(i // 2),
+        "topicVersionId": f"TV{i}",
+        "title": f"Đề tài {i}",
+        "metadata": {"status": "rejected" if i >= n - 2 else "approved"},
+    } for i in range(n)])
+
+class TestDeleteTopics:
+    """Test cases for deleting topics from the index."""
+
+    def test_delete_by_version_id(self, chroma_tmp, state_db, fake_embeddings):
+        """Only existing versions are counted as deleted."""
+        svc = TopicsService()
+        seed(svc)
+
+        res = svc.delete_topics(topic_version_ids=["TV0", "TV1", "TV404"])
+
+        assert res["deleted"] == 2
+        assert res["count"] == 8
+        assert res["tombstoneRatio"] == 0.2
+        assert res["compactionJobId"] is None
+
+    def test_delete_by_topic_id_matches_int_and_string_ids(self, chroma_tmp, state_db, fake_embeddings):
+        """TopicId stored as a number or a string is matched either way."""
+        svc = TopicsService()
+        seed(svc)
+
+        res = svc.delete_topics(topic_ids=["0", 1])
+
+        assert res["deleted"] == 4
+        assert svc.repo.existing_ids([f"tv:TV{i}" for i in range(4)]) == []
+
+    def test_delete_by_metadata_filter(self, chroma_tmp, state_db, fake_embeddings):
+        """A metadata filter removes every matching version."""
+        svc = TopicsService()
+        seed(svc)
+
+        assert svc.delete_topics(where={"status": "rejected"})["deleted"] == 2
+        assert svc.repo.count() == 8
+
+    def test_exactly_one_selector_is_required(self, chroma_tmp, state_db):
+        """Ambiguous or empty requests are rejected instead of deleting everything."""
+        svc = TopicsService()
+        with pytest.raises(ValueError):
+            svc.delete_topics()
+        with pytest.raises(ValueError):
+            svc.delete_topics(topic_ids=[1], where={"status": "rejected"})
+        with pytest.raises(ValueError):
+            svc.delete_topics(where={})
+
+    def test_threshold_schedules_compaction_job(self, chroma_tmp, state_db, fake_embeddings):
+        """Crossing the tombstone ratio queues a background compaction job."""
+        svc = TopicsService()
+        seed(svc)
+        jobs = MagicMock()
+        jobs.submit.return_value = {"jobId": "job-1"}
+
+        with patch.object(settings, 'COMPACTION_AUTO', True), \
+             patch.object(settings, 'JOB_WORKERS', 1), \
+             patch.object(settings, 'COMPACTION_TOMBSTONE_RATIO', 0.3), \
+             patch('dupliapp.services.compaction_service.get_job_service', return_value=jobs):
+            below = svc.delete_topics(topic_version_ids=["TV0", "TV1"])
+            above = svc.delete_topics(topic_version_ids=["TV2", "TV3"])
+
+        assert below["compactionJobId"] is None
+        assert above["compactionJobId"] == "job-1"
+        jobs.submit.assert_called_once_with("compact", {}, unique=True)
+
+    def test_pending_compaction_is_not_scheduled_twice(self, chroma_tmp, state_db, fake_embeddings):
+        """A queued compaction is found by kind and status even when many newer jobs exist."""
+        from dupliapp.services.job_service import get_job_service
+        svc = TopicsService()
+        seed(svc)
+
+        with patch.object(settings, 'COMPACTION_AUTO', True), \
+             patch.object(settings, 'JOB_WORKERS', 1), \
+             patch.object(settings, 'COMPACTION_TOMBSTONE_RATIO', 0.1):
+            first = svc.delete_topics(topic_version_ids=["TV0", "TV1"])["compactionJobId"]
+            for _ in range(25):
+                get_job_service().submit("knn-update", {"update": ["tv:TV2"], "remove": []})
+            second = svc.delete_topics(topic_version_ids=["TV2"])["compactionJobId"]
+
+        assert first is not None
+        assert second == first
+        assert sum(j["kind"] == "compact" for j in get_job_service().list(limit=100)) == 1
+
+    def test_tombstone_counter_is_shared(self, chroma_tmp, state_db):
+        """Deletes recorded through separate state connections add up."""
+        CompactionService().record_deletes(2)
+        CompactionService().record_deletes(3)
+
+        assert CompactionService().status()["deletedSinceCompaction"] == 5
+
+class TestCompaction:
+    """Test cases for rebuilding the collection after deletes."""
+
+    def test_compaction_keeps_live_vectors_and_resets_tombstones(self, chroma_tmp, state_db, fake_embeddings):
+        """The rebuilt collection has the same live records and a zero tombstone ratio."""
+        svc = TopicsService()
+        seed(svc, 12)
+        svc.delete_topics(where={"status": "rejected"})
+        live = svc.repo.get_metadatas([f"tv:TV{i}" for i in range(12)])
+
+        result = CompactionService().compact(force=True, page_size=5)
+
+        assert result["status"] == "completed"
+        assert result["processed"] == 10
+        assert result["before"]["deletedSinceCompaction"] == 2
+        assert result["after"]["deletedSinceCompaction"] == 0
+        assert result["after"]["tombstoneRatio"] == 0.0
+        assert "reclaimedBytes" in result
+        repo = TopicsService().repo
+        assert repo.get_metadatas([f"tv:TV{i}" for i in range(12)]) == live
+        assert repo.col.metadata["hnsw:space"] == "cosine"
+
+    def test_search_still_works_after_compaction(self, chroma_tmp, state_db, fake_embeddings):
+        """Vectors are copied unchanged, so search results are the same."""
+        svc = TopicsService()
+        seed(svc)
+        before = svc.search({"text": "Đề tài 3"}, top_k=3, threshold=0.9)
+
+        CompactionService().compact(force=True)
+
+        after = TopicsService().search({"text": "Đề tài 3"}, top_k=3, threshold=0.9)
+        # Hits with equal similarity may come back in a different order
+        assert after["hits"][0] == before["hits"][0]
+        assert [h["similarity"] for h in after["hits"]] == [h["similarity"] for h in before["hits"]]
+
+    def test_collection_pointer_flips_for_existing_instances(self, chroma_tmp, state_db, fake_embeddings):
+        """Other repository instances follow the pointer to the new collection; the old one is dropped last."""
+        svc = TopicsService()
+        seed(svc)
+        stale = ChromaTopicsRepository()
+
+        CompactionService().compact(force=True)
+
+        assert stale.active_collection() == "topics_v1__g1"
+        assert stale.count() == 10
+        assert [c.name for c in stale.client.list_collections()] == ["topics_v1__g1"]
+        CompactionService().compact(force=True)
+        assert ChromaTopicsRepository().active_collection() == "topics_v1__g2"
+
+    def test_interrupted_copy_is_resumed(self, chroma_tmp, state_db, fake_embeddings):
+        """An existing next-generation collection is completed instead of deleted."""
+        svc = TopicsService()
+        seed(svc)
+        repo = svc.repo
+        partial = repo.client.create_collection("topics_v1__g1", metadata={"hnsw:space": "cosine"})
+        repo._copy(repo.col, partial, ["tv:TV0", "tv:TV1"])
+
+        result = CompactionService().compact(force=True, page_size=3)
+
+        assert result["processed"] == 10
+        assert ChromaTopicsRepository().get_metadatas(["tv:TV0"])["tv:TV0"]["TopicVersionId"] == "TV0"
+
+    def test_writes_during_copy_are_caught_up(self, chroma_tmp, state_db, fake_embeddings):
+        """Deletes, metadata patches and upserts made while pages are copied reach the new collection."""
+        svc = TopicsService()
+        seed(svc)
+        done = []
+
+        def write_once(copied, total):
+            if done:
+                return
+            done.append(copied)
+            svc.delete_topics(topic_version_ids=["TV0"])
+            svc.update_metadata([{"topicVersionId": "TV1", "metadata": {"status": "archived"}}])
+            svc.upsert_one({"topicId": 99, "topicVersionId": "TV99", "title": "Đề tài mới"})
+
+        result = CompactionService().compact(force=True, page_size=3, on_progress=write_once)
+
+        # The delete made during the copy leaves a tombstone in the new collection and stays counted
+        assert result["after"]["deletedSinceCompaction"] == 1
+        repo = ChromaTopicsRepository()
+        assert repo.active_collection() == "topics_v1__g1"
+        assert repo.existing_ids(["tv:TV0", "tv:TV99"]) == ["tv:TV99"]
+        assert repo.get_metadatas(["tv:TV1"])["tv:TV1"]["status"] == "archived"
+        assert repo.count() == 10
+
+    def test_writes_skip_the_lock_without_compaction(self, chroma_tmp, state_db, fake_embeddings):
+        """Upserts, metadata patches and deletes take no cross-process lock when no copy is running."""
+        svc = TopicsService()
+        with patch('dupliapp.services.topic_service.index_write_lock') as lock:
+            seed(svc)
+            svc.update_metadata([{"topicVersionId": "TV1", "metadata": {"status": "archived"}}])
+            svc.delete_topics(topic_version_ids=["TV0"])
+
+        lock.assert_not_called()
+
+    def test_write_overlapping_copy_start_is_repeated_under_lock(self, chroma_tmp, state_db, fake_embeddings):
+        """A write that began before the copy started is written again while holding the lock."""
+        svc = TopicsService()
+        with patch.object(svc.repo, 'rebuild_active', side_effect=[False, True]), \
+             patch.object(svc.repo, 'upsert', wraps=svc.repo.upsert) as upsert, \
+             patch('dupliapp.services.topic_service.index_write_lock') as lock:
+            svc.upsert_one({"topicId": 1, "topicVersionId": "TV1", "title": "Đề tài 1"})
+
+        assert upsert.call_count == 2
+        lock.assert_called_once_with()
+
+    def test_rebuild_flag_is_set_only_while_copying(self, chroma_tmp, state_db, fake_embeddings):
+        """Writers see an active rebuild during the copy and none afterwards."""
+        svc = TopicsService()
+        seed(svc)
+        seen = []
+
+        CompactionService().compact(force=True, page_size=3,
+                                    on_progress=lambda copied, total: seen.append(svc.repo.rebuild_active()))
+
+        assert seen and all(seen)
+        assert svc.repo.rebuild_active() is False
+
+    def test_below_threshold_is_skipped(self, chroma_tmp, state_db, fake_embeddings):
+        """Without force, compaction only runs past the tombstone ratio."""
+        svc = TopicsService()
+        seed(svc)
+        svc.delete_topics(topic_version_ids=["TV0"])
+
+        assert CompactionService().compact()["status"] == "skipped"
+
+class TestDeleteRoutes:
+    """Test cases for the delete and compaction endpoints."""
+
+    def test_bulk_delete_route(self, client, chroma_tmp, fake_embeddings):
+        """POST /topics/delete removes versions by TopicId."""
+        seed(TopicsService())
+
+        response = client.post('/topics/delete', data=json.dumps({"topicIds": [1]}),
+                               content_type='application/json')
+
+        assert response.status_code == 200
+        assert json.loads(response.data)["deleted"] == 2
+
+    def test_bulk_delete_route_rejects_empty_body(self, client, chroma_tmp):
+        """A request without a selector is a 400."""
+        response = client.post('/topics/delete', data=json.dumps({}), content_type='application/json')
+
+        assert response.status_code == 400
+
+    def test_delete_single_version_route(self, client, chroma_tmp, fake_embeddings):
+        """DELETE /topics/{topicVersionId} is 404 for an unknown version."""
+        seed(TopicsService())
+
+        assert client.delete('/topics/TV1').status_code == 200
+        assert client.delete('/topics/TV1').status_code == 404
+
+    def test_compact_route_waits_for_result(self, client, chroma_tmp, fake_embeddings):
+        """"wait": true runs compaction synchronously and reports before/after stats."""
+        seed(TopicsService())
+
+        response = client.post('/index/compact', data=json.dumps({"wait": True, "force": True}),
+                               content_type='application/json')
+
+        data = json.loads(response.data)
+        assert response.status_code == 200
+        assert data["status"] == "completed"
+        assert data["after"]["count"] == 10
+
+    def test_compact_route_submits_job(self, client):
+        """By default compaction runs as a background job."""
+        with patch('dupliapp.routes.index.get_job_service') as mock:
+            mock.return_value.submit.return_value = {"jobId": "j1", "kind": "compact", "status": "queued"}
+
+            response = client.post('/index/compact', data=json.dumps({"force": True}),
+                                   content_type='application/json')
+
+        assert response.status_code == 202
+        mock.return_value.submit.assert_called_once_with("compact", {"force": True})
+
+    def test_compact_job_runs_in_job_worker(self, chroma_tmp, state_db, fake_embeddings):
+        """A queued compaction job completes with the copied record count."""
+        from dupliapp.services.job_service import JobService
+        seed(TopicsService())
+        jobs = JobService()
+        job = jobs.submit("compact", {"force": True})
+
+        done = jobs.run_next()
+
+        assert done["jobId"] == job["jobId"]
+        assert done["status"] == "completed"
+        assert done["processed"] == 10
+        assert done["result"]["after"]["count"] == 10
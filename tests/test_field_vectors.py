@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+# Unit tests for per-field multi-vector embeddings and incremental field re-embedding
+import pytest
+import json
+from unittest.mock import patch
+from dupliapp.config import settings
+from dupliapp.services.field_vector_service import FieldVectorService, chunk_text, field_weights
+from dupliapp.services.topic_service import TopicsService
+from dupliapp.repositories.chroma_repository import ChromaFieldVectorsRepository
+
+TOPIC = {
+    "topicId": "T1", "topicVersionId": "TV1",
+    "title": "Chẩn đoán bệnh tim bằng học sâu",
+    "description": "Phân tích điện tâm đồ thu thập tại bệnh viện tuyến tỉnh bằng mạng nơ-ron tích chập",
+    "objectives": "Xây dựng mô hình phát hiện rối loạn nhịp tim",
+}
+
+OTHER = {
+    "topicId": "T2", "topicVersionId": "TV2",
+    "title": "Quản lý thư viện số",
+    "description": "Ứng dụng web quản lý mượn trả sách cho thư viện trường",
+}
+
+@pytest.fixture
+def multi_vector(tmp_path):
+    """Enable multi-vector mode with small chunks and a temporary state database."""
+    with patch.object(settings, 'MULTI_VECTOR_ENABLED', True), \
+         patch.object(settings, 'MULTI_VECTOR_CHUNK_WORDS', 6), \
+         patch.object(settings, 'STATE_DB_PATH', str(tmp_path / "state.db")), \
+         patch.object(settings, 'COMPACTION_AUTO', False):
+        yield
+
+def field_records():
+    repo = ChromaFieldVectorsRepository()
+    return repo.get_metadatas(repo.ids_where({"ParentId": {"$in": ["tv:TV1", "tv:TV2"]}}))
+
+class TestFieldHelpers:
+    """Test cases for chunking and weight parsing."""
+
+    def test_chunk_text(self):
+        """Long fields are split into word windows; empty fields have no chunks."""
+        assert chunk_text("a b c d e", 2) == ["a b", "c d", "e"]
+        assert chunk_text("", 2) == []
+        assert chunk_text(None, 2) == []
+
+    def test_field_weights(self):
+        """Unlisted fields default to 1, zero weights drop the field, bad entries are ignored."""
+        with patch.object(settings, 'MULTI_VECTOR_WEIGHTS', "Title:3,Requirements:0,Methodology:x,Bogus:2"):
+            weights = field_weights()
+
+        assert weights["Title"] == 3.0
+        assert weights["Methodology"] == 1.0
+        assert "Requirements" not in weights
+        assert "Bogus" not in weights
+
+class TestFieldVectorWrites:
+    """Test cases for storing and incrementally updating field vectors."""
+
+    def test_upsert_embeds_each_field_chunk(self, chroma_tmp, multi_vector, fake_embeddings):
+        """Every chunk of every non-empty field gets its own vector linked to the topic."""
+        svc = TopicsService()
+
+        res = svc.upsert_one(TOPIC)
+
+        records = field_records()
+        assert res["embedded"] == 1
+        assert res["embeddedChunks"] == len(records) == 2 + 3 + 2
+        assert {m["Field"] for m in records.values()} == {"Title", "Description", "Objectives"}
+        assert svc.repo.get_embeddings(["tv:TV1"])["tv:TV1"].shape == (64,)
+
+    def test_edit_reembeds_only_changed_field(self, chroma_tmp, multi_vector, fake_embeddings):
+        """Changing the objectives re-embeds only its chunk, not the title or description."""
+        svc = TopicsService()
+        svc.upsert_one(TOPIC)
+        before = svc.repo.get_embeddings(["tv:TV1"])["tv:TV1"].copy()
+        fake_embeddings.reset_mock()
+
+        res = svc.upsert_one({**TOPIC, "objectives": "Đánh giá độ chính xác"})
+
+        assert res["embeddedChunks"] == 1
+        fake_embeddings.assert_called_once_with(["Đánh giá độ chính xác"])
+        assert not (svc.repo.get_embeddings(["tv:TV1"])["tv:TV1"] == before).all()
+
+    def test_shrinking_field_removes_stale_chunks(self, chroma_tmp, multi_vector, fake_embeddings):
+        """Chunks of a shortened or cleared field are deleted."""
+        svc = TopicsService()
+        svc.upsert_one(TOPIC)
+
+        svc.upsert_one({**TOPIC, "description": "Điện tâm đồ", "objectives": ""})
+
+        fields = sorted(m["Field"] for m in field_records().values())
+        assert fields == ["Description", "Title", "Title"]
+
+    def test_delete_removes_field_vectors(self, chroma_tmp, multi_vector, fake_embeddings):
+        """Deleting a topic deletes its field vectors."""
+        svc = TopicsService()
+        svc.upsert_many([TOPIC, OTHER])
+
+        svc.delete_topics(topic_version_ids=["TV1"])
+
+        assert {m["ParentId"] for m in field_records().values()} == {"tv:TV2"}
+
+class TestMultiVectorSearch:
+    """Test cases for weighted per-field aggregation at query time."""
+
+    def test_field_query_matches_same_fields(self, chroma_tmp, multi_vector, fake_embeddings):
+        """Querying with the stored fields scores 1.0 and reports per-field similarity."""
+        svc = TopicsService()
+        svc.upsert_many([TOPIC, OTHER])
+
+        res = svc.search({k: TOPIC[k] for k in ("title", "description", "objectives")}, top_k=2, threshold=0.9)
+
+        top = res["hits"][0]
+        assert res["passed"] is False
+        assert top["topicVersionId"] == "TV1"
+        assert top["similarity"] == 1.0
+        assert set(top["fields"]) == {"Title", "Description", "Objectives"}
+
+    def test_weights_favor_title(self, chroma_tmp, multi_vector, fake_embeddings):
+        """The aggregate is the weighted mean of the per-field similarities."""
+        svc = TopicsService()
+        svc.upsert_many([TOPIC, OTHER])
+
+        res = svc.search({"title": TOPIC["title"], "description": OTHER["description"]}, top_k=2, threshold=0.9)
+
+        hits = {h["topicVersionId"]: h for h in res["hits"]}
+        for hit in hits.values():
+            f = hit["fields"]
+            expected = (2 * f["Title"] + 1.5 * f["Description"]) / 3.5
+            assert hit["similarity"] == pytest.approx(expected, abs=1e-3)
+        assert hits["TV1"]["fields"]["Title"] == 1.0
+
+    def test_missing_metadata_is_skipped_when_excluding(self, chroma_tmp, multi_vector, fake_embeddings):
+        """A chunk without metadata does not break scoring with exclude_topic_id."""
+        svc = TopicsService()
+        svc.upsert_many([TOPIC, OTHER])
+        fields = svc._field_vectors()
+        parts = fields.query_parts({"title": OTHER["title"]})
+        embs = fake_embeddings([t for _, t in parts])
+        real = fields.repo.query_many
+
+        def with_orphan(*args, **kwargs):
+            results = real(*args, **kwargs)
+            for res in results:
+                res["metadatas"] = [None] + list(res["metadatas"])
+                res["distances"] = [0.0] + list(res["distances"])
+            return results
+
+        with patch.object(fields.repo, 'query_many', side_effect=with_orphan):
+            ranked = fields.score(parts, embs, top_k=2, exclude_topic_id="T1")
+
+        assert [parent for parent, _, _ in ranked] == ["tv:TV2"]
+
+    def test_opt_out_uses_topic_vector(self, chroma_tmp, multi_vector, fake_embeddings):
+        """"multiVector": false searches the aggregated topic vectors instead."""
+        svc = TopicsService()
+        svc.upsert_many([TOPIC, OTHER])
+
+        res = svc.search({"text": TOPIC["title"], "multiVector": False}, top_k=2, threshold=0.9)
+
+        assert "fields" not in res["hits"][0]
+        assert res["hits"][0]["topicVersionId"] == "TV1"
+
+    def test_search_route(self, client, chroma_tmp, multi_vector, fake_embeddings):
+        """POST /topics/search returns per-field similarities in multi-vector mode."""
+        TopicsService().upsert_many([TOPIC, OTHER])
+
+        response = client.post('/topics/search', data=json.dumps({"text": OTHER["title"], "topK": 1}),
+                               content_type='application/json')
+
+        data = json.loads(response.data)
+        assert response.status_code == 200
+        assert data["hits"][0]["topicVersionId"] == "TV2"
+        assert "Title" in data["hits"][0]["fields"]
+
+class TestEnablingMultiVector:
+    """Test cases for topics indexed before multi-vector mode was turned on."""
+
+    @pytest.fixture
+    def indexed_single_vector(self, chroma_tmp, fake_embeddings, tmp_path):
+        with patch.object(settings, 'STATE_DB_PATH', str(tmp_path / "state.db")), \
+             patch.object(settings, 'COMPACTION_AUTO', False):
+            TopicsService().upsert_many([TOPIC, OTHER])
+
+    def test_duplicate_is_still_caught(self, indexed_single_vector, multi_vector, fake_embeddings):
+        """Topics without field vectors are searched by their topic vector, in line with gate mode."""
+        svc = TopicsService()
+        query = {k: TOPIC[k] for k in ("title", "description", "objectives")}
+
+        res = svc.search(query, top_k=2, threshold=0.9)
+        gate = svc.search({**query, "gate": True}, top_k=2, threshold=0.9)
+
+        assert gate["passed"] is False
+        assert res["passed"] is False
+        assert res["hits"][0]["topicVersionId"] == "TV1"
+        assert res["hits"][0]["similarity"] == 1.0
+
+    def test_check_and_upsert_rejects_duplicate(self, indexed_single_vector, multi_vector, fake_embeddings):
+        """Registering a copy under a new TopicId is rejected before any backfill."""
+        res = TopicsService().check_and_upsert({**TOPIC, "topicId": "T9", "topicVersionId": "TV9"},
+                                               top_k=2, threshold=0.9)
+
+        assert res["passed"] is False
+        assert res["write"] is None
+
+    def test_reupsert_backfills_field_vectors(self, indexed_single_vector, multi_vector, fake_embeddings):
+        """An unchanged topic without the field-vector marker is re-embedded once, then skipped."""
+        svc = TopicsService()
+
+        first = svc.upsert_many([TOPIC])
+        second = svc.upsert_many([TOPIC])
+
+        assert first["embedded"] == 1
+        assert second["embedded"] == 0
+        assert {m["ParentId"] for m in field_records().values()} == {"tv:TV1"}
+        assert "fields" in svc.search({"title": TOPIC["title"]}, top_k=1, threshold=0.9)["hits"][0]
+
+    def test_weight_change_reembeds(self, chroma_tmp, multi_vector, fake_embeddings):
+        """Changing MULTI_VECTOR_WEIGHTS invalidates the stored marker."""
+        TopicsService().upsert_many([TOPIC])
+
+        with patch.object(settings, 'MULTI_VECTOR_WEIGHTS', "Title:5"):
+            res = TopicsService().upsert_many([TOPIC])
+
+        assert res["embedded"] == 1
+        assert res["embeddedChunks"] == 0
+
+    def test_single_vector_write_clears_marker(self, chroma_tmp, multi_vector, fake_embeddings):
+        """Editing a topic with multi-vector off drops the marker so re-enabling re-embeds it."""
+        TopicsService().upsert_many([TOPIC])
+
+        with patch.object(settings, 'MULTI_VECTOR_ENABLED', False):
+            TopicsService().upsert_many([{**TOPIC, "title": "Tiêu đề mới"}])
+        meta = TopicsService().repo.get_metadatas(["tv:TV1"])["tv:TV1"]
+
+        assert "FieldVectors" not in meta
+        assert TopicsService().upsert_many([{**TOPIC, "title": "Tiêu đề mới"}])["embedded"] == 1
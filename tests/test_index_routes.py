@@ -4,14 +4,19 @@ import pytest
 import json
 from unittest.mock import patch, MagicMock
 
+def summary(indexed):
+    """Build summary as returned by IndexService.build_from_sql."""
+    return {"indexed": indexed, "embedded": indexed, "skipped": 0, "total_topics": indexed,
+            "batches": 1, "errors": [], "timings": {}}
+
 class TestIndexRoutes:
     """Test cases for index management endpoints."""
     
     def test_index_topics_success(self, client, mock_index_service):
         """Test successful topic indexing."""
-        mock_index_service.build_from_sql.return_value = 1500
+        mock_index_service.build_from_sql.return_value = summary(1500)
         
-        request_data = {"limit": 1000}
+        request_data = {"limit": 1000, "wait": True}
         
         response = client.post('/index/topics',
                              data=json.dumps(request_data),
@@ -21,35 +26,34 @@ class TestIndexRoutes:
         data = json.loads(response.data)
         
         assert data['indexed'] == 1500
-        mock_index_service.build_from_sql.assert_called_once_with(limit=1000)
+        mock_index_service.build_from_sql.assert_called_once_with(limit=1000, batch_size=None, include_topics=False, force=False)
     
     def test_index_topics_no_limit(self, client, mock_index_service):
         """Test topic indexing without limit parameter."""
-        mock_index_service.build_from_sql.return_value = 2000
+        mock_index_service.build_from_sql.return_value = summary(2000)
         
         response = client.post('/index/topics',
-                             data=json.dumps({}),
+                             data=json.dumps({"wait": True}),
                              content_type='application/json')
         
         assert response.status_code == 200
         data = json.loads(response.data)
         
         assert data['indexed'] == 2000
-        mock_index_service.build_from_sql.assert_called_once_with(limit=None)
+        mock_index_service.build_from_sql.assert_called_once_with(limit=None, batch_size=None, include_topics=False, force=False)
     
     def test_index_topics_empty_request(self, client, mock_index_service):
-        """Test topic indexing with empty request body."""
-        mock_index_service.build_from_sql.return_value = 500
-        
+        """Test topic indexing with empty request body enqueues a background job."""
         response = client.post('/index/topics',
                              data='',
                              content_type='application/json')
         
-        assert response.status_code == 200
+        assert response.status_code == 202
         data = json.loads(response.data)
         
-        assert data['indexed'] == 500
-        mock_index_service.build_from_sql.assert_called_once_with(limit=None)
+        assert data['status'] == 'queued'
+        assert data['params']['limit'] is None
+        mock_index_service.build_from_sql.assert_not_called()
     
     def test_index_topics_invalid_json(self, client):
         """Test topic indexing with invalid JSON."""
@@ -61,10 +65,10 @@ class TestIndexRoutes:
     
     def test_index_topics_zero_indexed(self, client, mock_index_service):
         """Test topic indexing when no topics are indexed."""
-        mock_index_service.build_from_sql.return_value = 0
+        mock_index_service.build_from_sql.return_value = summary(0)
         
         response = client.post('/index/topics',
-                             data=json.dumps({"limit": 100}),
+                             data=json.dumps({"limit": 100, "wait": True}),
                              content_type='application/json')
         
         assert response.status_code == 200
@@ -74,9 +78,9 @@ class TestIndexRoutes:
     
     def test_index_topics_large_limit(self, client, mock_index_service):
         """Test topic indexing with large limit."""
-        mock_index_service.build_from_sql.return_value = 10000
+        mock_index_service.build_from_sql.return_value = summary(10000)
         
-        request_data = {"limit": 10000}
+        request_data = {"limit": 10000, "wait": True}
         
         response = client.post('/index/topics',
                              data=json.dumps(request_data),
@@ -86,14 +90,15 @@ class TestIndexRoutes:
         data = json.loads(response.data)
         
         assert data['indexed'] == 10000
-        mock_index_service.build_from_sql.assert_called_once_with(limit=10000)
+        mock_index_service.build_from_sql.assert_called_once_with(limit=10000, batch_size=None, include_topics=False, force=False)
     
     def test_index_topics_with_additional_fields(self, client, mock_index_service):
         """Test topic indexing with additional fields in request (should be ignored)."""
-        mock_index_service.build_from_sql.return_value = 100
+        mock_index_service.build_from_sql.return_value = summary(100)
         
         request_data = {
             "limit": 100,
+            "wait": True,
             "additional_field": "should_be_ignored",
             "another_field": 123
         }
@@ -106,5 +111,53 @@ class TestIndexRoutes:
         data = json.loads(response.data)
         
         assert data['indexed'] == 100
-        # Only limit should be passed to the service
-        mock_index_service.build_from_sql.assert_called_once_with(limit=100) 
\ No newline at end of file
+        # Unknown fields are not passed to the service
+        mock_index_service.build_from_sql.assert_called_once_with(limit=100, batch_size=None, include_topics=False, force=False) 
+    def test_index_topics_returns_summary_options(self, client, mock_index_service):
+        """batchSize, includeTopics and force are passed through and the summary is returned as-is."""
+        mock_index_service.build_from_sql.return_value = {**summary(2), "topics": [{"topicId": "T1"}, {"topicId": "T2"}]}
+
+        response = client.post('/index/topics',
+                             data=json.dumps({"wait": True, "batchSize": 50, "includeTopics": True, "force": True}),
+                             content_type='application/json')
+
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data['total_topics'] == 2
+        assert [t['topicId'] for t in data['topics']] == ["T1", "T2"]
+        mock_index_service.build_from_sql.assert_called_once_with(limit=None, batch_size=50, include_topics=True, force=True)
+
+    def test_index_topics_streams_ndjson_progress(self, client, mock_index_service):
+        """"stream": true sends one NDJSON line per batch followed by the summary."""
+        mock_index_service.iter_build_from_sql.return_value = iter([
+            {"type": "batch", "batch": 1, "processed": 2, "indexed": 2},
+            {"type": "batch", "batch": 2, "processed": 3, "indexed": 3},
+            {"type": "summary", **summary(3)},
+        ])
+
+        response = client.post('/index/topics',
+                             data=json.dumps({"stream": True, "limit": 3}),
+                             content_type='application/json')
+
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert [line['type'] for line in lines] == ["batch", "batch", "summary"]
+        assert lines[-1]['indexed'] == 3
+        mock_index_service.iter_build_from_sql.assert_called_once_with(limit=3, batch_size=None, include_topics=False, force=False)
+        mock_index_service.build_from_sql.assert_not_called()
+
+    def test_index_topics_stream_reports_failure_as_last_line(self, client, mock_index_service):
+        """An error after streaming has started is sent as a final "error" line."""
+        def events(**kwargs):
+            yield {"type": "batch", "batch": 1, "processed": 2, "indexed": 2}
+            raise RuntimeError("SQL connection lost")
+        mock_index_service.iter_build_from_sql.side_effect = events
+
+        response = client.post('/index/topics',
+                             data=json.dumps({"stream": True}),
+                             content_type='application/json')
+
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert lines[0]['type'] == "batch"
+        assert lines[-1] == {"type": "error", "error": "SQL connection lost"}
@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+# Unit tests for IndexService against the SQLite topic source stand-in
+import pytest
+import json
+from unittest.mock import patch, MagicMock
+from dupliapp.repositories.topic_repository import get_topic_repository, SqliteTopicRepository, MsSqlTopicRepository
+from dupliapp.repositories.state_repository import IndexStateRepository
+from dupliapp.repositories.state_lock import state_lock
+from dupliapp.services.topic_service import TopicsService
+from dupliapp.services.index_service import IndexService, WATERMARK_KEY, REINDEX_CHECKPOINT_KEY
+from dupliapp.services.sync_poller import SyncPoller
+from dupliapp.config import settings
+
+@pytest.fixture
+def mock_topics_service():
+    """Replace the vector-store writer used by IndexService."""
+    with patch('dupliapp.services.index_service.TopicsService') as mock:
+        service_instance = MagicMock()
+        service_instance.upsert_records.side_effect = lambda records, **kwargs: {"upserted": len(records), "embedded": len(records), "skipped": 0}
+        # Mọi phiên bản đã đồng bộ đều có trong ChromaDB; không có phiên bản cũ để xóa
+        service_instance.repo.existing_ids.side_effect = lambda ids: ids
+        service_instance.remove_superseded.return_value = 0
+        mock.return_value = service_instance
+        yield service_instance
+
+def upserted_version_ids(service):
+    return [it.topic_version_id for call in service.upsert_records.call_args_list for it in call.args[0]]
+
+class TestSqliteTopicRepository:
+    """Test cases for the SQL topic repository using SQLite."""
+
+    def test_factory_returns_sqlite_repository(self, sqlite_topic_source):
+        """TOPIC_SOURCE=sqlite selects the SQLite stand-in."""
+        assert isinstance(get_topic_repository(), SqliteTopicRepository)
+
+    def test_fetch_latest_returns_latest_active_version(self, sqlite_topic_source):
+        """Only the newest active version of each topic is returned."""
+        sqlite_topic_source.execute(
+            "INSERT INTO topic_versions (Id, TopicId, VersionNumber, Title) VALUES (6, 1, 2, 'Đề tài 1 v2')")
+        sqlite_topic_source.execute(
+            "INSERT INTO topic_versions (Id, TopicId, VersionNumber, IsActive, Title) VALUES (7, 2, 2, 0, 'Nháp')")
+        sqlite_topic_source.commit()
+
+        rows = get_topic_repository().fetch_latest()
+
+        assert [r.topic_id for r in rows] == [1, 2, 3, 4, 5]
+        assert rows[0].topic_version_id == 6
+        assert rows[0].title == "Đề tài 1 v2"
+        assert rows[1].topic_version_id == 2
+
+    def test_fetch_latest_with_limit(self, sqlite_topic_source):
+        """The limit is applied after ordering by TopicId."""
+        rows = get_topic_repository().fetch_latest(limit=2)
+
+        assert [r.topic_id for r in rows] == [1, 2]
+
+    def test_fetch_changed_since(self, sqlite_topic_source):
+        """Only latest versions above the watermark are returned, ordered by version id."""
+        rows = get_topic_repository().fetch_changed_since(3)
+
+        assert [r.topic_version_id for r in rows] == [4, 5]
+
+    def test_sync_query_does_not_use_nolock(self):
+        """SQL Server reads changed versions without dirty reads; other queries keep NOLOCK."""
+        repo = object.__new__(MsSqlTopicRepository)
+
+        assert "NOLOCK" not in repo._render("WHERE l.Id > ?", "l.Id ASC", True, nolock=False)
+        assert "NOLOCK" in repo._render("", "t.Id ASC", True)
+
+    def test_fetch_page_uses_keyset(self, sqlite_topic_source):
+        """Pages continue after the last TopicId of the previous page."""
+        repo = get_topic_repository()
+
+        assert [r.topic_id for r in repo.fetch_page(None, 2)] == [1, 2]
+        assert [r.topic_id for r in repo.fetch_page(2, 2)] == [3, 4]
+        assert [r.topic_id for r in repo.fetch_page(4, 2)] == [5]
+
+    def test_fetch_latest_columns(self, sqlite_topic_source):
+        """Column batches hold the same data as fetch_latest, without per-row dicts."""
+        repo = get_topic_repository()
+        batches = list(repo.fetch_latest_columns(batch_size=2))
+
+        assert [len(b["TopicId"]) for b in batches] == [2, 2, 1]
+        assert [v for b in batches for v in b["Title"]] == [r.title for r in repo.fetch_latest()]
+
+    def test_source_stats(self, sqlite_topic_source):
+        """Topic count and highest version id are read in one query."""
+        assert get_topic_repository().source_stats() == {"topicCount": 5, "maxTopicVersionId": 5}
+
+class TestIncrementalSync:
+    """Test cases for watermark-based incremental sync."""
+
+    def test_first_sync_indexes_everything(self, sqlite_topic_source, mock_topics_service):
+        """Without a stored watermark every latest version is synced."""
+        result = IndexService().sync_incremental()
+
+        assert result["synced"] == 5
+        assert result["fromWatermark"] == 0
+        assert result["watermark"] == 5
+        assert IndexStateRepository().get(WATERMARK_KEY) == 5
+
+    def test_second_sync_only_reads_changes(self, sqlite_topic_source, mock_topics_service):
+        """A new version after the last run is the only item re-embedded."""
+        IndexService().sync_incremental()
+        mock_topics_service.upsert_records.reset_mock()
+
+        sqlite_topic_source.execute(
+            "INSERT INTO topic_versions (Id, TopicId, VersionNumber, Title) VALUES (6, 3, 2, 'Đề tài 3 v2')")
+        sqlite_topic_source.commit()
+
+        result = IndexService().sync_incremental()
+
+        assert result["synced"] == 1
+        assert upserted_version_ids(mock_topics_service) == [6]
+        assert IndexService().sync_incremental()["synced"] == 0
+
+    def test_sync_in_batches_advances_watermark(self, sqlite_topic_source, mock_topics_service):
+        """Each batch is written and checkpointed before the next one is read."""
+        result = IndexService().sync_incremental(batch_size=2)
+
+        assert result["batches"] == 3
+        assert mock_topics_service.upsert_records.call_count == 3
+        assert upserted_version_ids(mock_topics_service) == [1, 2, 3, 4, 5]
+
+    def test_late_commit_below_watermark_is_recovered(self, sqlite_topic_source, mock_topics_service):
+        """A version committed after the watermark passed its Id is picked up by the safety window."""
+        IndexService().sync_incremental()
+        mock_topics_service.upsert_records.reset_mock()
+        # TV4 never reached Chroma (its transaction committed after TV5 was synced)
+        mock_topics_service.repo.existing_ids.side_effect = lambda ids: [i for i in ids if i != "tv:4"]
+
+        result = IndexService().sync_incremental()
+
+        assert result["recovered"] == 1
+        assert result["synced"] == 1
+        assert upserted_version_ids(mock_topics_service) == [4]
+        assert result["watermark"] == 5
+
+    def test_safety_window_is_bounded(self, sqlite_topic_source, mock_topics_service):
+        """Only SYNC_SAFETY_WINDOW version ids below the watermark are re-read."""
+        IndexService().sync_incremental()
+        mock_topics_service.repo.existing_ids.side_effect = lambda ids: []
+
+        with patch.object(settings, 'SYNC_SAFETY_WINDOW', 2):
+            result = IndexService().sync_incremental()
+
+        assert result["recovered"] == 2
+
+    def test_sync_holds_the_sync_lock(self, sqlite_topic_source, mock_topics_service):
+        """A sync waiting on another run's lock gives up with TimeoutError."""
+        with patch.object(settings, 'STATE_LOCK_TIMEOUT_SECONDS', 0.1):
+            with state_lock("sync"):
+                with pytest.raises(TimeoutError):
+                    IndexService().sync_incremental()
+
+    def test_full_build_sets_watermark(self, sqlite_topic_source, mock_topics_service):
+        """A full rebuild lets the next incremental sync start from its high-water mark."""
+        IndexService().build_from_sql()
+
+        assert IndexStateRepository().get(WATERMARK_KEY) == 5
+        assert IndexService().sync_incremental()["synced"] == 0
+
+    def test_columnar_build_matches_row_build(self, sqlite_topic_source, mock_topics_service):
+        """SQL_COLUMNAR_FETCH streams column batches into upsert_columns."""
+        mock_topics_service.upsert_columns.side_effect = lambda cols, **kwargs: {
+            "upserted": len(cols["TopicId"]), "embedded": len(cols["TopicId"]), "skipped": 0}
+        with patch.object(settings, 'SQL_FETCH_BATCH_SIZE', 2):
+            expected = IndexService().build_from_sql()
+            with patch.object(settings, 'SQL_COLUMNAR_FETCH', True):
+                result = IndexService().build_from_sql()
+
+        assert mock_topics_service.upsert_columns.call_count == 3
+        assert result.pop("timings") and expected.pop("timings")
+        assert result == expected
+
+    def test_limited_build_keeps_watermark(self, sqlite_topic_source, mock_topics_service):
+        """A partial rebuild must not skip topics that were never indexed."""
+        IndexService().build_from_sql(limit=2)
+
+        assert IndexStateRepository().get(WATERMARK_KEY) is None
+
+class TestBuildSummary:
+    """Test cases for the summary-only and streamed full build."""
+
+    def test_summary_omits_topic_listing(self, sqlite_topic_source, mock_topics_service):
+        """By default only counts, timings and errors are returned."""
+        result = IndexService().build_from_sql()
+
+        assert "topics" not in result
+        assert result["indexed"] == 5
+        assert result["total_topics"] == 5
+        assert result["errors"] == []
+        assert set(result["timings"]) == {"fetchMs", "writeMs", "totalMs",
+                                          "chromaWriteMs", "chromaChunks", "slowestChunkMs"}
+
+    def test_include_topics(self, sqlite_topic_source, mock_topics_service):
+        """include_topics keeps the old per-topic listing."""
+        result = IndexService().build_from_sql(include_topics=True)
+
+        assert [t["topicVersionId"] for t in result["topics"]] == [1, 2, 3, 4, 5]
+
+    def test_events_per_batch(self, sqlite_topic_source, mock_topics_service):
+        """One batch event is produced per fetched batch, then a summary."""
+        events = list(IndexService().iter_build_from_sql(batch_size=2))
+
+        assert [e["type"] for e in events] == ["batch", "batch", "batch", "summary"]
+        assert [e["processed"] for e in events[:-1]] == [2, 4, 5]
+        assert mock_topics_service.upsert_records.call_count == 3
+
+    def test_chroma_chunk_timings_are_reported(self, sqlite_topic_source, mock_topics_service):
+        """Per-chunk Chroma write timings appear on batch events and are totalled in the summary."""
+        mock_topics_service.upsert_records.side_effect = lambda records, **kwargs: {
+            "upserted": len(records), "embedded": len(records), "skipped": 0,
+            "chromaWrite": {"chunks": [{"chunk": 1, "size": 1, "ms": 2.0}, {"chunk": 2, "size": 1, "ms": 5.0}],
+                            "totalMs": 7.5, "maxBatchSize": 1}}
+
+        events = list(IndexService().iter_build_from_sql(batch_size=2))
+
+        assert events[0]["chromaChunks"] == [{"chunk": 1, "size": 1, "ms": 2.0}, {"chunk": 2, "size": 1, "ms": 5.0}]
+        timings = events[-1]["timings"]
+        assert timings["chromaWriteMs"] == 22.5
+        assert timings["chromaChunks"] == 6
+        assert timings["slowestChunkMs"] == 5.0
+
+    def test_failed_batch_is_reported(self, sqlite_topic_source, mock_topics_service):
+        """A failing batch is listed in errors, later batches still run, and the watermark is kept."""
+        ok = mock_topics_service.upsert_records.side_effect
+
+        def fail_second_batch(items, **kwargs):
+            if mock_topics_service.upsert_records.call_count == 2:
+                raise RuntimeError("embedding failed")
+            return ok(items, **kwargs)
+
+        mock_topics_service.upsert_records.side_effect = fail_second_batch
+        result = IndexService().build_from_sql(batch_size=2)
+
+        assert result["indexed"] == 3
+        assert result["errors"] == [{"batch": 2, "firstTopicId": 3, "lastTopicId": 4, "error": "embedding failed"}]
+        assert IndexStateRepository().get(WATERMARK_KEY) is None
+
+    def test_stream_route(self, client, sqlite_topic_source, mock_topics_service):
+        """stream=true returns NDJSON progress lines ending with the summary."""
+        response = client.post('/index/topics',
+                               data=json.dumps({"stream": True, "batchSize": 2}),
+                               content_type='application/json')
+
+        lines = [json.loads(l) for l in response.get_data(as_text=True).splitlines()]
+        assert response.status_code == 200
+        assert response.mimetype == "application/x-ndjson"
+        assert [l["type"] for l in lines] == ["batch", "batch", "batch", "summary"]
+        assert lines[-1]["indexed"] == 5
+
+class TestResumableReindex:
+    """Test cases for checkpointed, keyset-paginated full reindex."""
+
+    def test_reindex_walks_pages(self, sqlite_topic_source, mock_topics_service):
+        """Every page is written and the run completes at 100%."""
+        result = IndexService().reindex(page_size=2)
+
+        assert mock_topics_service.upsert_records.call_count == 3
+        assert result["status"] == "completed"
+        assert result["processed"] == 5
+        assert result["percent"] == 100.0
+        assert IndexStateRepository().get(WATERMARK_KEY) == 5
+
+    def test_reindex_totals_chroma_write_timings(self, sqlite_topic_source, mock_topics_service):
+        """The checkpoint accumulates Chroma write time, chunk count and the slowest chunk."""
+        mock_topics_service.upsert_records.side_effect = lambda records, **kwargs: {
+            "upserted": len(records), "embedded": len(records), "skipped": 0,
+            "chromaWrite": {"chunks": [{"chunk": 1, "size": len(records), "ms": float(len(records))}],
+                            "totalMs": 3.0, "maxBatchSize": 2}}
+
+        result = IndexService().reindex(page_size=2)
+
+        assert result["chromaWriteMs"] == 9.0
+        assert result["chromaChunks"] == 3
+        assert result["slowestChunkMs"] == 2.0
+
+    def test_reindex_resumes_from_checkpoint(self, sqlite_topic_source, mock_topics_service):
+        """A run that dies mid-way continues after the last committed page."""
+        ok = mock_topics_service.upsert_records.side_effect
+        calls = []
+
+        def crash_on_second_page(items, **kwargs):
+            calls.append(items)
+            if len(calls) == 2:
+                raise RuntimeError("SQL timeout")
+            return ok(items, **kwargs)
+
+        mock_topics_service.upsert_records.side_effect = crash_on_second_page
+        with pytest.raises(RuntimeError):
+            IndexService().reindex(page_size=2)
+
+        progress = IndexService().reindex_progress()
+        assert progress["status"] == "running"
+        assert progress["lastTopicId"] == 2
+        assert progress["percent"] == 40.0
+
+        mock_topics_service.upsert_records.reset_mock()
+        mock_topics_service.upsert_records.side_effect = ok
+        result = IndexService().reindex(page_size=2)
+
+        assert upserted_version_ids(mock_topics_service) == [3, 4, 5]
+        assert result["runId"] == progress["runId"]
+        assert result["processed"] == 5
+
+    def test_reindex_without_resume_restarts(self, sqlite_topic_source, mock_topics_service):
+        """resume=False ignores an unfinished checkpoint."""
+        IndexStateRepository().set(REINDEX_CHECKPOINT_KEY, {
+            "runId": "old", "status": "running", "lastTopicId": 4, "processed": 4, "embedded": 4, "total": 5})
+
+        result = IndexService().reindex(page_size=10, resume=False)
+
+        assert upserted_version_ids(mock_topics_service) == [1, 2, 3, 4, 5]
+        assert result["runId"] != "old"
+
+    def test_force_is_kept_across_resume(self, sqlite_topic_source, mock_topics_service):
+        """A forced run that is resumed keeps re-embedding unchanged topics."""
+        ok = mock_topics_service.upsert_records.side_effect
+        calls = []
+
+        def crash_on_second_page(items, **kwargs):
+            calls.append(items)
+            if len(calls) == 2:
+                raise RuntimeError("SQL timeout")
+            return ok(items, **kwargs)
+
+        mock_topics_service.upsert_records.side_effect = crash_on_second_page
+        with pytest.raises(RuntimeError):
+            IndexService().reindex(page_size=2, force=True)
+
+        mock_topics_service.upsert_records.reset_mock()
+        mock_topics_service.upsert_records.side_effect = ok
+        IndexService().reindex(page_size=2)
+
+        assert all(call.kwargs["force"] for call in mock_topics_service.upsert_records.call_args_list)
+
+    def test_progress_without_run(self, sqlite_topic_source):
+        """Progress is reported even before the first reindex."""
+        assert IndexService().reindex_progress() == {"status": "none", "percent": 0.0}
+
+class TestSyncRoute:
+    """Test cases for the /index/sync endpoint."""
+
+    def test_sync_route(self, client):
+        """The endpoint passes batchSize to the service and returns its result."""
+        with patch('dupliapp.routes.index.IndexService') as mock:
+            mock.return_value.sync_incremental.return_value = {
+                "synced": 2, "batches": 1, "fromWatermark": 5, "watermark": 7}
+
+            response = client.post('/index/sync',
+                                   data=json.dumps({"batchSize": 100}),
+                                   content_type='application/json')
+
+        assert response.status_code == 200
+        assert json.loads(response.data)["synced"] == 2
+        mock.return_value.sync_incremental.assert_called_once_with(batch_size=100)
+
+    def test_concurrent_sync_is_rejected(self, client):
+        """A sync that cannot get the lock returns 409."""
+        with patch('dupliapp.routes.index.IndexService') as mock:
+            mock.return_value.sync_incremental.side_effect = TimeoutError("Lock 'sync' busy")
+
+            response = client.post('/index/sync', data=json.dumps({}), content_type='application/json')
+
+        assert response.status_code == 409
+
+class TestSupersededVersions:
+    """Test cases for removing older versions of synced topics from the index."""
+
+    def test_new_version_replaces_old_one(self, sqlite_topic_source, chroma_tmp, fake_embeddings):
+        """After a topic gets a new version only the latest version stays in Chroma."""
+        IndexService().sync_incremental()
+        sqlite_topic_source.execute(
+            "INSERT INTO topic_versions (Id, TopicId, VersionNumber, Title) VALUES (6, 3, 2, 'Đề tài 3 v2')")
+        sqlite_topic_source.commit()
+
+        result = IndexService().sync_incremental()
+
+        repo = TopicsService().repo
+        assert result["superseded"] == 1
+        assert repo.existing_ids(["tv:3", "tv:6"]) == ["tv:6"]
+        assert repo.count() == 5
+
+class TestSyncPoller:
+    """Test cases for the in-process sync poller."""
+
+    def test_run_once_records_result(self):
+        """A successful run stores the sync result."""
+        poller = SyncPoller(60, sync_fn=lambda: {"synced": 3})
+        poller.run_once()
+
+        assert poller.last_result == {"synced": 3}
+        assert poller.last_error is None
+
+    def test_run_once_survives_errors(self):
+        """A failing sync is recorded instead of killing the poller thread."""
+        def failing_sync():
+            raise RuntimeError("SQL timeout")
+
+        poller = SyncPoller(60, sync_fn=failing_sync)
+        poller.run_once()
+
+        assert poller.last_error == "SQL timeout"
@@ -10,16 +10,18 @@ class TestAPIIntegration:
     def test_complete_topic_workflow(self, client, mock_topic_service, mock_index_service):
         """Test complete workflow: index -> upsert -> search."""
         # Step 1: Index topics
-        mock_index_service.build_from_sql.return_value = 100
+        mock_index_service.build_from_sql.return_value = {"indexed": 100, "embedded": 100, "skipped": 0}
         
         index_response = client.post('/index/topics',
-                                   data=json.dumps({"limit": 100}),
+                                   data=json.dumps({"limit": 100, "wait": True}),
                                    content_type='application/json')
         
         assert index_response.status_code == 200
         assert json.loads(index_response.data)['indexed'] == 100
         
         # Step 2: Upsert a new topic
+        mock_topic_service.upsert_one.return_value = {"upserted": 1, "embedded": 1, "skipped": 0}
+        
         topic_data = {
             "topicId": "T001",
             "topicVersionId": "TV001",
@@ -110,7 +112,7 @@ class TestAPIIntegration:
             ]
         }
         
-        mock_topic_service.upsert_many.return_value = 3
+        mock_topic_service.upsert_many.return_value = {"upserted": 3, "embedded": 3, "skipped": 0}
         
         bulk_response = client.post('/topics/bulk-upsert',
                                   data=json.dumps(bulk_data),
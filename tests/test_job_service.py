@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# Unit tests for background index jobs
+import pytest
+import json
+import time
+from unittest.mock import patch, MagicMock
+from dupliapp.repositories.job_repository import JobRepository, QUEUED, RUNNING
+from dupliapp.repositories.state_repository import IndexStateRepository
+from dupliapp.services.index_service import WATERMARK_KEY
+from dupliapp.services.job_service import JobService, job_checkpoint_key
+
+@pytest.fixture
+def mock_topics_service():
+    """Replace the vector-store writer used by IndexService."""
+    with patch('dupliapp.services.index_service.TopicsService') as mock:
+        service_instance = MagicMock()
+        service_instance.upsert_records.side_effect = lambda records, **kwargs: {"upserted": len(records), "embedded": len(records), "skipped": 0}
+        mock.return_value = service_instance
+        yield service_instance
+
+class TestJobService:
+    """Test cases for queueing and running reindex jobs."""
+
+    def test_submit_returns_queued_job(self, sqlite_topic_source):
+        """Submitting only records the job; nothing is indexed yet."""
+        job = JobService().submit(params={"limit": None})
+
+        assert job["status"] == "queued"
+        assert job["processed"] == 0
+        assert JobService().get(job["jobId"])["status"] == "queued"
+
+    def test_run_next_completes_job(self, sqlite_topic_source, mock_topics_service):
+        """The worker pages through every topic and records progress and throughput."""
+        svc = JobService()
+        job = svc.submit(params={"pageSize": 2})
+
+        done = svc.run_next()
+
+        assert done["jobId"] == job["jobId"]
+        assert done["status"] == "completed"
+        assert done["processed"] == 5
+        assert done["total"] == 5
+        assert done["percent"] == 100.0
+        assert done["throughput"] is not None
+        assert mock_topics_service.upsert_records.call_count == 3
+        assert IndexStateRepository().get(WATERMARK_KEY) == 5
+        assert svc.run_next() is None
+
+    def test_limited_job(self, sqlite_topic_source, mock_topics_service):
+        """limit caps the pages read and leaves the sync watermark alone."""
+        svc = JobService()
+        svc.submit(params={"limit": 3, "pageSize": 2})
+
+        done = svc.run_next()
+
+        assert done["processed"] == 3
+        assert done["total"] == 3
+        assert IndexStateRepository().get(WATERMARK_KEY) is None
+
+    def test_failed_job_records_error(self, sqlite_topic_source, mock_topics_service):
+        """An exception marks the job failed with its message."""
+        mock_topics_service.upsert_records.side_effect = RuntimeError("SQL timeout")
+        svc = JobService()
+        svc.submit()
+
+        done = svc.run_next()
+
+        assert done["status"] == "failed"
+        assert done["error"] == "SQL timeout"
+
+    def test_cancel_queued_job(self, sqlite_topic_source, mock_topics_service):
+        """A queued job is cancelled immediately and never runs."""
+        svc = JobService()
+        job = svc.submit()
+
+        assert svc.cancel(job["jobId"])["status"] == "cancelled"
+        assert svc.run_next() is None
+        mock_topics_service.upsert_records.assert_not_called()
+
+    def test_cancel_running_job_stops_after_page(self, sqlite_topic_source, mock_topics_service):
+        """A running job stops at the next page boundary and keeps its progress."""
+        svc = JobService()
+        job = svc.submit(params={"pageSize": 2})
+
+        def cancel_after_first_page(items, **kwargs):
+            svc.cancel(job["jobId"])
+            return {"upserted": len(items), "embedded": len(items), "skipped": 0}
+
+        mock_topics_service.upsert_records.side_effect = cancel_after_first_page
+        done = svc.run_next()
+
+        assert done["status"] == "cancelled"
+        assert done["processed"] == 2
+        assert mock_topics_service.upsert_records.call_count == 1
+
+    def test_stale_job_resumes_after_restart(self, sqlite_topic_source, mock_topics_service):
+        """A job left running by a dead process is requeued and resumes from its checkpoint."""
+        svc = JobService()
+        job = svc.submit(params={"pageSize": 2})
+        ok = mock_topics_service.upsert_records.side_effect
+
+        def crash_on_second_page(items, **kwargs):
+            if mock_topics_service.upsert_records.call_count == 2:
+                raise KeyboardInterrupt
+            return ok(items, **kwargs)
+
+        mock_topics_service.upsert_records.side_effect = crash_on_second_page
+        with pytest.raises(KeyboardInterrupt):
+            svc.run_next()
+        assert JobRepository().get(job["jobId"])["status"] == RUNNING
+
+        # New process: state comes from the SQLite file only
+        mock_topics_service.upsert_records.reset_mock()
+        mock_topics_service.upsert_records.side_effect = ok
+        restarted = JobService(stale_after=0)
+        assert restarted.repo.requeue_stale(0) == 1
+
+        done = restarted.run_next()
+
+        assert done["status"] == "completed"
+        assert done["processed"] == 5
+        assert [it.topic_version_id for c in mock_topics_service.upsert_records.call_args_list for it in c.args[0]] == [3, 4, 5]
+        assert IndexStateRepository().get(job_checkpoint_key(job["jobId"]))["status"] == "completed"
+
+    def test_worker_thread_runs_submitted_job(self, sqlite_topic_source, mock_topics_service):
+        """The background worker picks up a job as soon as it is submitted."""
+        svc = JobService(poll_interval=5)
+        svc.start()
+        try:
+            job = svc.submit()
+            deadline = time.time() + 5
+            while svc.get(job["jobId"])["status"] in (QUEUED, RUNNING) and time.time() < deadline:
+                time.sleep(0.02)
+        finally:
+            svc.stop(timeout=5)
+
+        assert svc.get(job["jobId"])["status"] == "completed"
+
+class TestJobRoutes:
+    """Test cases for the /index/jobs endpoints."""
+
+    def test_index_topics_enqueues_job(self, client):
+        """POST /index/topics returns 202 with a job id by default."""
+        with patch('dupliapp.routes.index.get_job_service') as mock:
+            mock.return_value.submit.return_value = {"jobId": "abc", "status": "queued"}
+
+            response = client.post('/index/topics',
+                                   data=json.dumps({"limit": 10}),
+                                   content_type='application/json')
+
+        assert response.status_code == 202
+        assert json.loads(response.data)["jobId"] == "abc"
+        mock.return_value.submit.assert_called_once_with(params={"limit": 10, "pageSize": None, "force": False})
+
+    def test_get_job(self, client):
+        """GET /index/jobs/<id> returns the job view."""
+        with patch('dupliapp.routes.index.get_job_service') as mock:
+            mock.return_value.get.return_value = {"jobId": "abc", "status": "running", "processed": 10}
+
+            response = client.get('/index/jobs/abc')
+
+        assert response.status_code == 200
+        assert json.loads(response.data)["processed"] == 10
+
+    def test_get_unknown_job(self, client):
+        """Unknown job ids are reported as 404."""
+        response = client.get('/index/jobs/missing')
+
+        assert response.status_code == 404
+
+    def test_cancel_job(self, client):
+        """DELETE /index/jobs/<id> requests cancellation."""
+        with patch('dupliapp.routes.index.get_job_service') as mock:
+            mock.return_value.cancel.return_value = {"jobId": "abc", "status": "cancelled"}
+
+            response = client.delete('/index/jobs/abc')
+
+        assert response.status_code == 200
+        mock.return_value.cancel.assert_called_once_with("abc")
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+# Unit tests for the precomputed nearest-neighbor graph
+import pytest
+import json
+from unittest.mock import patch
+from dupliapp.config import settings
+from dupliapp.services.topic_service import TopicsService
+from dupliapp.services.knn_service import KnnGraphService
+from dupliapp.services.job_service import get_job_service
+
+TITLES = [
+    "Học máy trong y tế",
+    "Học máy trong y tế cộng đồng",
+    "Quản lý thư viện số",
+    "Quản lý thư viện trường học",
+    "Nhận dạng giọng nói tiếng Việt",
+    "Nhận dạng chữ viết tay tiếng Việt",
+    "Hệ thống gợi ý sản phẩm",
+]
+
+@pytest.fixture
+def knn(tmp_path):
+    """Enable graph maintenance with a small k and a temporary state database."""
+    with patch.object(settings, 'STATE_DB_PATH', str(tmp_path / "state.db")), \
+         patch.object(settings, 'COMPACTION_AUTO', False), \
+         patch.object(settings, 'KNN_GRAPH_ENABLED', True), \
+         patch.object(settings, 'KNN_K', 2):
+        yield
+
+def item(i, title=None, topic_id=None):
+    return {"topicId": topic_id or f"T{i}", "topicVersionId": f"TV{i}", "title": title or TITLES[i]}
+
+def run_knn_jobs():
+    """Run the knn-update jobs queued by upserts and deletes."""
+    jobs = get_job_service()
+    while jobs.run_next() is not None:
+        pass
+
+def similarities(graph, n):
+    nodes = graph.neighbors([f"tv:TV{i}" for i in range(n)])
+    return {node: [h["similarity"] for h in info["hits"]] for node, info in nodes.items()}
+
+class TestKnnGraphMaintenance:
+    """Test cases for keeping the graph in sync with upserts and deletes."""
+
+    def test_incremental_upserts_match_full_rebuild(self, chroma_tmp, knn, fake_embeddings):
+        """Reverse-neighbor updates keep one-by-one inserts equal to a bulk rebuild."""
+        svc = TopicsService()
+        for i in range(len(TITLES)):
+            svc.upsert_one(item(i))
+            run_knn_jobs()
+        graph = KnnGraphService()
+        incremental = similarities(graph.graph, len(TITLES))
+
+        graph.rebuild()
+
+        assert len(incremental) == len(TITLES)
+        assert similarities(graph.graph, len(TITLES)) == incremental
+
+    def test_siblings_and_self_are_excluded(self, chroma_tmp, knn, fake_embeddings):
+        """Other versions of the same TopicId never appear as neighbors."""
+        svc = TopicsService()
+        svc.upsert_many([item(0), item(1, title=TITLES[0], topic_id="T0"), item(2), item(3)])
+        run_knn_jobs()
+
+        hits = KnnGraphService().graph.neighbors(["tv:TV0"])["tv:TV0"]["hits"]
+
+        assert len(hits) == 2
+        assert all(h["topicId"] != "T0" for h in hits)
+
+    def test_reembedded_topic_refreshes_referrers(self, chroma_tmp, knn, fake_embeddings):
+        """Changing a topic's content recomputes the lists that pointed to it."""
+        svc = TopicsService()
+        svc.upsert_many([item(i) for i in range(len(TITLES))])
+        run_knn_jobs()
+        svc.upsert_one(item(1, title="Hệ thống gợi ý sản phẩm trực tuyến"))
+        run_knn_jobs()
+        graph = KnnGraphService()
+        incremental = similarities(graph.graph, len(TITLES))
+
+        graph.rebuild()
+
+        assert similarities(graph.graph, len(TITLES)) == incremental
+
+    def test_metadata_only_upsert_skips_graph(self, chroma_tmp, knn, fake_embeddings):
+        """A write that reuses the stored vector does not touch the graph."""
+        svc = TopicsService()
+        svc.upsert_many([item(i) for i in range(4)])
+        run_knn_jobs()
+
+        with patch.object(KnnGraphService, 'update') as update:
+            svc.upsert_one({**item(0), "metadata": {"status": "approved"}})
+            run_knn_jobs()
+
+        update.assert_not_called()
+
+    def test_delete_removes_node_and_backfills_referrers(self, chroma_tmp, knn, fake_embeddings):
+        """Deleted topics disappear from every neighbor list."""
+        svc = TopicsService()
+        svc.upsert_many([item(i) for i in range(len(TITLES))])
+        run_knn_jobs()
+
+        svc.delete_topics(topic_version_ids=["TV1"])
+        run_knn_jobs()
+
+        nodes = KnnGraphService().graph.neighbors([f"tv:TV{i}" for i in range(len(TITLES))])
+        assert "tv:TV1" not in nodes
+        assert all(h["topicVersionId"] != "TV1" for info in nodes.values() for h in info["hits"])
+        assert all(len(info["hits"]) == 2 for info in nodes.values())
+
+    def test_disabled_graph_is_not_maintained(self, chroma_tmp, knn, fake_embeddings):
+        """With KNN_GRAPH_ENABLED off, upserts leave the graph empty."""
+        with patch.object(settings, 'KNN_GRAPH_ENABLED', False):
+            TopicsService().upsert_many([item(i) for i in range(3)])
+        run_knn_jobs()
+
+        assert KnnGraphService().graph.stats()["nodes"] == 0
+
+    def test_upsert_queues_graph_update(self, chroma_tmp, knn, fake_embeddings):
+        """Upserts only queue a knn-update job; the graph changes when the job runs."""
+        TopicsService().upsert_many([item(i) for i in range(3)])
+        graph = KnnGraphService().graph
+
+        queued = get_job_service().list()
+        assert [j["kind"] for j in queued] == ["knn-update"]
+        assert graph.stats()["nodes"] == 0
+
+        run_knn_jobs()
+
+        assert get_job_service().get(queued[0]["jobId"])["status"] == "completed"
+        assert graph.stats()["nodes"] == 3
+
+    def test_pending_updates_are_coalesced(self, chroma_tmp, knn, fake_embeddings):
+        """Upserts and deletes made before the worker runs share one queued job; the last action wins."""
+        svc = TopicsService()
+        for i in range(4):
+            svc.upsert_one(item(i))
+        svc.delete_topics(topic_version_ids=["TV1"])
+
+        queued = get_job_service().list()
+        assert len(queued) == 1
+        assert queued[0]["params"] == {"update": ["tv:TV0", "tv:TV2", "tv:TV3"], "remove": ["tv:TV1"]}
+
+        run_knn_jobs()
+        nodes = KnnGraphService().graph.neighbors([f"tv:TV{i}" for i in range(4)])
+        assert sorted(nodes) == ["tv:TV0", "tv:TV2", "tv:TV3"]
+
+    def test_siblings_stored_with_another_type_are_excluded(self, chroma_tmp, knn, fake_embeddings):
+        """The fallback query drops every version of the TopicId, stored as a number or a string."""
+        TopicsService().upsert_many([
+            item(0, topic_id=5), item(1, title=TITLES[0], topic_id="5"), item(2, title=TITLES[0], topic_id="5"),
+            item(3), item(4), item(5),
+        ])
+
+        with patch.object(settings, 'KNN_OVERFETCH', 0):
+            hits = KnnGraphService().compute(["tv:TV0"])["tv:TV0"]["hits"]
+
+        assert len(hits) == 2
+        assert all(str(h["topicId"]) != "5" for h in hits)
+
+class TestKnnGraphLookup:
+    """Test cases for reading neighbors from the graph."""
+
+    def test_lookup_does_not_query_chroma(self, chroma_tmp, knn, fake_embeddings):
+        """Stored topics are answered from the graph alone."""
+        TopicsService().upsert_many([item(i) for i in range(4)])
+        run_knn_jobs()
+        svc = KnnGraphService()
+
+        with patch.object(svc.repo, 'query_many') as query:
+            res = svc.neighbors(["TV0", "TV404"], top_k=1, threshold=0.5)
+
+        query.assert_not_called()
+        assert res["notFound"] == ["TV404"]
+        assert res["items"][0]["cached"] is True
+        assert len(res["items"][0]["hits"]) == 1
+
+    def test_missing_node_is_computed_without_writing(self, chroma_tmp, knn, fake_embeddings):
+        """Topics missing from the graph are computed on lookup but the graph is left untouched."""
+        with patch.object(settings, 'KNN_GRAPH_ENABLED', False):
+            TopicsService().upsert_many([item(i) for i in range(4)])
+        svc = KnnGraphService()
+
+        first = svc.neighbors(["TV2"], top_k=2, threshold=0.7)["items"][0]
+        second = svc.neighbors(["TV2"], top_k=2, threshold=0.7)["items"][0]
+
+        assert first["cached"] is False
+        assert second["cached"] is False
+        assert second["hits"] == first["hits"]
+        assert len(first["hits"]) == 2
+        assert svc.graph.stats()["nodes"] == 0
+
+    def test_neighbor_routes(self, client, chroma_tmp, fake_embeddings):
+        """GET and POST neighbor lookups, with 404 and 400 for bad requests."""
+        TopicsService().upsert_many([item(i) for i in range(4)])
+
+        single = client.get('/topics/TV0/neighbors?topK=2')
+        batch = client.post('/topics/neighbors', data=json.dumps({"topicVersionIds": ["TV0", "TV9"]}),
+                            content_type='application/json')
+
+        assert single.status_code == 200
+        assert len(json.loads(single.data)["hits"]) == 2
+        assert json.loads(batch.data)["notFound"] == ["TV9"]
+        assert client.get('/topics/TV9/neighbors').status_code == 404
+        assert client.post('/topics/neighbors', data=json.dumps({}),
+                           content_type='application/json').status_code == 400
+
+class TestKnnGraphRebuild:
+    """Test cases for the bulk rebuild command."""
+
+    def test_rebuild_route_waits_for_result(self, client, chroma_tmp, fake_embeddings):
+        """"wait": true rebuilds synchronously and reports the edge count."""
+        TopicsService().upsert_many([item(i) for i in range(5)])
+
+        with patch.object(settings, 'KNN_K', 2):
+            data = json.loads(client.post('/index/knn', data=json.dumps({"wait": True, "pageSize": 2}),
+                                          content_type='application/json').data)
+            status = json.loads(client.get('/index/knn').data)
+
+        assert data["processed"] == 5
+        assert data["edges"] == 10
+        assert status["nodes"] == 5
+
+    def test_rebuild_job_runs_in_job_worker(self, chroma_tmp, knn, fake_embeddings):
+        """A queued knn-rebuild job completes with the processed topic count."""
+        from dupliapp.services.job_service import JobService
+        TopicsService().upsert_many([item(i) for i in range(3)])
+        jobs = JobService()
+        jobs.submit("knn-rebuild", {"pageSize": 2})
+
+        done = jobs.run_next()
+
+        assert done["status"] == "completed"
+        assert done["processed"] == 3
+
+    def test_cli_knn_source(self, chroma_tmp, knn, fake_embeddings, capsys):
+        """python -m dupliapp.index knn rebuilds the graph without reading a source."""
+        from dupliapp.index import main
+        TopicsService().upsert_many([item(i) for i in range(3)])
+
+        code = main(["knn", "--json", "--quiet"])
+
+        assert code == 0
+        assert json.loads(capsys.readouterr().out)["edges"] == 6
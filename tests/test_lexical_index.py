@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+# Unit tests for the exact-hash and MinHash-LSH lexical fast path
+import pytest
+import json
+from unittest.mock import patch
+from dupliapp.config import settings
+from dupliapp.services.lexical_index import LexicalIndex, MATCH_EXACT, MATCH_MINHASH
+from dupliapp.services.topic_service import TopicsService
+
+LONG = ("Xây dựng hệ thống hỗ trợ chẩn đoán bệnh tim mạch dựa trên học sâu từ dữ liệu điện tâm đồ "
+        "thu thập tại các bệnh viện tuyến tỉnh, đánh giá độ chính xác và khả năng triển khai thực tế")
+
+@pytest.fixture
+def lexical(tmp_path):
+    """Enable the lexical fast path with a temporary state database for deletes."""
+    with patch.object(settings, 'LEXICAL_FAST_PATH', True), \
+         patch.object(settings, 'STATE_DB_PATH', str(tmp_path / "state.db")), \
+         patch.object(settings, 'COMPACTION_AUTO', False):
+        yield
+
+def seed(svc):
+    svc.upsert_many([
+        {"topicId": "T1", "topicVersionId": "TV1", "title": "Chẩn đoán bệnh tim", "description": LONG},
+        {"topicId": "T2", "topicVersionId": "TV2", "title": "Quản lý thư viện số",
+         "description": "Ứng dụng web quản lý mượn trả sách cho thư viện trường đại học"},
+    ])
+
+class TestLexicalIndex:
+    """Test cases for the hash and MinHash structures."""
+
+    def make(self):
+        index = LexicalIndex(num_perm=64, bands=16, shingle_size=5)
+        index.add(["a", "b"], [LONG, "Quản lý thư viện số"])
+        return index
+
+    def test_exact_match_ignores_case_and_punctuation(self):
+        """Normalized copies hit the hash index."""
+        assert self.make().match(LONG.upper() + "!!", 0.9) == (MATCH_EXACT, [("a", 1.0)])
+
+    def test_near_copy_found_by_minhash(self):
+        """Changing one word keeps the estimated Jaccard high."""
+        kind, hits = self.make().match(LONG.replace("tuyến tỉnh", "tuyến huyện"), 0.8)
+
+        assert kind == MATCH_MINHASH
+        assert [i for i, _ in hits] == ["a"]
+        assert 0.8 <= hits[0][1] < 1.0
+
+    def test_unrelated_text_has_no_match(self):
+        """Different topics fall through to the embedding path."""
+        assert self.make().match("Nhận dạng giọng nói tiếng Việt", 0.9) is None
+
+    def test_remove(self):
+        """Removed ids are no longer matched."""
+        index = self.make()
+        index.remove(["a"])
+
+        assert index.match(LONG, 0.5) is None
+        assert index.stats()["documents"] == 1
+
+class TestSearchFastPath:
+    """Test cases for answering searches before embedding."""
+
+    def test_exact_copy_skips_embedding(self, chroma_tmp, lexical, fake_embeddings):
+        """A verbatim copy is a duplicate with similarity 1.0 without calling the model."""
+        svc = TopicsService()
+        seed(svc)
+        fake_embeddings.reset_mock()
+
+        res = svc.search({"title": "Chẩn đoán bệnh tim", "description": LONG}, top_k=3, threshold=0.7)
+
+        fake_embeddings.assert_not_called()
+        assert res["passed"] is False
+        assert res["fastPath"] == "exact"
+        assert res["hits"] == [{"topicId": "T1", "topicVersionId": "TV1", "title": "Chẩn đoán bệnh tim",
+                                "similarity": 1.0, "jaccard": 1.0}]
+
+    def test_reformatted_copy_reports_real_similarity(self, chroma_tmp, lexical, fake_embeddings):
+        """A copy equal only after normalization gets the same cosine score as the vector search."""
+        svc = TopicsService()
+        seed(svc)
+        query = {"title": "CHẨN ĐOÁN BỆNH TIM.", "description": LONG + " "}
+        with patch.object(settings, 'LEXICAL_FAST_PATH', False):
+            expected = svc.search(query, top_k=1, threshold=0.7)["hits"][0]["similarity"]
+        fake_embeddings.reset_mock()
+
+        res = svc.search(query, top_k=3, threshold=0.7)
+
+        assert fake_embeddings.call_count == 1
+        assert res["fastPath"] == "exact"
+        assert res["hits"][0]["similarity"] == expected < 1.0
+
+    def test_reformatted_copy_below_threshold_falls_through(self, chroma_tmp, lexical, fake_embeddings):
+        """A normalized match whose cosine is under the request threshold is not short-circuited."""
+        svc = TopicsService()
+        seed(svc)
+
+        res = svc.search({"title": "CHẨN ĐOÁN BỆNH TIM.", "description": LONG + " "}, top_k=3, threshold=0.9999)
+
+        assert "fastPath" not in res
+        assert res["passed"] is True
+
+    def test_near_copy_in_gate_mode(self, chroma_tmp, lexical, fake_embeddings):
+        """Gate mode returns the MinHash decision."""
+        svc = TopicsService()
+        seed(svc)
+        fake_embeddings.reset_mock()
+
+        with patch.object(settings, 'LEXICAL_JACCARD_THRESHOLD', 0.8):
+            res = svc.search({"title": "Chẩn đoán bệnh tim", "description": LONG.replace("tỉnh", "huyện"),
+                              "gate": True}, top_k=3, threshold=0.7)
+
+        fake_embeddings.assert_not_called()
+        assert res["passed"] is False
+        assert res["fastPath"] == "minhash"
+        assert res["similarity"] is None
+        assert 0.8 <= res["jaccard"] < 1.0
+
+    def test_near_copy_respects_request_threshold(self, chroma_tmp, lexical, fake_embeddings):
+        """A MinHash match only short-circuits when its score reaches the requested threshold."""
+        svc = TopicsService()
+        seed(svc)
+        query = {"title": "Chẩn đoán bệnh tim", "description": LONG.replace("tỉnh", "huyện")}
+
+        with patch.object(settings, 'LEXICAL_JACCARD_THRESHOLD', 0.8):
+            loose = svc.search(query, top_k=3, threshold=0.8)
+            strict = svc.search(query, top_k=3, threshold=0.99)
+
+        assert loose["fastPath"] == "minhash"
+        assert loose["hits"][0]["similarity"] is None
+        assert loose["hits"][0]["jaccard"] >= 0.8
+        assert "fastPath" not in strict
+        assert strict["hits"][0]["topicVersionId"] == "TV1"
+
+    def test_stale_match_is_verified_against_chroma(self, chroma_tmp, lexical, fake_embeddings):
+        """A topic removed behind the index's back is not reported as a duplicate."""
+        svc = TopicsService()
+        seed(svc)
+        svc.lexical_index_stats()  # build from Chroma documents
+        svc.repo.delete(ids=["tv:TV1"])  # not logged: the index still holds TV1
+
+        res = svc.search({"title": "Chẩn đoán bệnh tim", "description": LONG}, top_k=3, threshold=0.7)
+
+        assert "fastPath" not in res
+        assert res["passed"] is True
+
+    def test_foreign_writes_are_reloaded(self, chroma_tmp, lexical, fake_embeddings):
+        """Changes logged by another process are picked up before matching."""
+        svc = TopicsService()
+        seed(svc)
+        svc.lexical_index_stats()
+
+        other = TopicsService()
+        with patch('dupliapp.services.topic_service.current_lexical_index', return_value=None):
+            other.upsert_one({"topicId": "T3", "topicVersionId": "TV3", "title": "Quản lý ký túc xá"})
+
+        assert svc.search({"text": "quản lý ký túc xá"}, top_k=3, threshold=0.7)["fastPath"] == "exact"
+
+    def test_other_requests_use_embeddings(self, chroma_tmp, lexical, fake_embeddings):
+        """New topics, range queries and filtered queries are not short-circuited."""
+        svc = TopicsService()
+        seed(svc)
+        copy = {"title": "Chẩn đoán bệnh tim", "description": LONG}
+
+        assert "fastPath" not in svc.search({"text": "Nhận dạng giọng nói"}, top_k=3, threshold=0.7)
+        assert "fastPath" not in svc.search({**copy, "range": True}, top_k=3, threshold=0.7)
+        assert "fastPath" not in svc.search({**copy, "metadataFilter": {"status": "x"}}, top_k=3, threshold=0.7)
+
+    def test_index_follows_upserts_and_deletes(self, chroma_tmp, lexical, fake_embeddings):
+        """Edited and deleted topics stop matching their old text."""
+        svc = TopicsService()
+        seed(svc)
+        svc.lexical_index_stats()  # build from Chroma documents
+
+        svc.upsert_one({"topicId": "T2", "topicVersionId": "TV2", "title": "Quản lý ký túc xá"})
+        svc.delete_topics(topic_version_ids=["TV1"])
+
+        assert "fastPath" not in svc.search({"title": "Chẩn đoán bệnh tim", "description": LONG},
+                                            top_k=3, threshold=0.7)
+        assert svc.search({"text": "quản lý ký túc xá"}, top_k=3, threshold=0.7)["fastPath"] == "exact"
+
+    def test_share_is_reported(self, client, chroma_tmp, fake_embeddings):
+        """GET /chroma/lexical-index reports the share of searches answered lexically."""
+        with patch.object(settings, 'LEXICAL_FAST_PATH', True):
+            seed(TopicsService())
+            for text in ("Quản lý thư viện số\n\nỨng dụng web quản lý mượn trả sách cho thư viện trường đại học",
+                         "Nhận dạng giọng nói"):
+                client.post('/topics/search', data=json.dumps({"text": text}), content_type='application/json')
+
+            data = json.loads(client.get('/chroma/lexical-index').data)
+
+        assert data["requests"] == 2
+        assert data["answeredExact"] == 1
+        assert data["fastPathShare"] == 0.5
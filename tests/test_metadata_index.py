@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+# Unit tests for the in-process metadata bitmap index
+import pytest
+import json
+from unittest.mock import patch
+from dupliapp.config import settings
+from dupliapp.repositories.change_log import IndexChangeLog
+from dupliapp.services.metadata_index import MetadataBitmapIndex, get_metadata_index
+from dupliapp.services.topic_service import TopicsService
+
+@pytest.fixture
+def indexed(tmp_path):
+    """Index faculty/year and keep deletes away from the shared state database."""
+    with patch.object(settings, 'METADATA_INDEX_KEYS', 'faculty, year'), \
+         patch.object(settings, 'STATE_DB_PATH', str(tmp_path / "state.db")), \
+         patch.object(settings, 'COMPACTION_AUTO', False):
+        yield
+
+def seed(svc):
+    svc.upsert_many([{
+        "topicId": f"T{i}",
+        "topicVersionId": f"TV{i}",
+        "title": f"Học máy ứng dụng {i}" if i % 2 else f"Quản lý dữ liệu {i}",
+        "metadata": {"faculty": "CNTT" if i < 6 else "KT", "year": 2023 + i % 3},
+    } for i in range(12)])
+
+class TestMetadataBitmapIndex:
+    """Test cases for the bitmap posting lists."""
+
+    def make(self):
+        index = MetadataBitmapIndex(["faculty", "year"])
+        index.add(["a", "b", "c"], [{"faculty": "CNTT", "year": 2023},
+                                    {"faculty": "CNTT", "year": 2024},
+                                    {"faculty": "KT", "year": "2024"}])
+        return index
+
+    def test_eq_in_and_or(self):
+        """Equality, $in, $and and $or are answered from the bitmaps."""
+        index = self.make()
+
+        assert index.ids_of(index.candidates({"faculty": "CNTT"})) == ["a", "b"]
+        assert index.ids_of(index.candidates({"year": {"$in": [2023, 2024]}})) == ["a", "b"]
+        assert index.ids_of(index.candidates({"$and": [{"faculty": "CNTT"}, {"year": {"$eq": 2024}}]})) == ["b"]
+        assert index.ids_of(index.candidates({"$or": [{"faculty": "KT"}, {"year": 2023}]})) == ["a", "c"]
+
+    def test_values_are_typed(self):
+        """2024 and "2024" are different values, as in Chroma."""
+        index = self.make()
+
+        assert index.ids_of(index.candidates({"year": "2024"})) == ["c"]
+
+    def test_unsupported_filters_fall_back(self):
+        """Unindexed keys and other operators return None."""
+        index = self.make()
+
+        assert index.candidates({"status": "approved"}) is None
+        assert index.candidates({"year": {"$gt": 2023}}) is None
+        assert index.candidates({"$and": [{"faculty": "KT"}, {"status": "approved"}]}) is None
+
+    def test_patch_and_remove(self):
+        """Patches merge like col.update and removed slots are reused."""
+        index = self.make()
+
+        index.patch(["a"], [{"faculty": "KT", "year": None}])
+        index.remove(["b"])
+        index.add(["d"], [{"faculty": "CNTT"}])
+
+        assert index.ids_of(index.candidates({"faculty": "KT"})) == ["a", "c"]
+        assert index.candidates({"year": 2023}) == 0
+        assert index.ids_of(index.candidates({"faculty": "CNTT"})) == ["d"]
+        assert index.stats()["documents"] == 3
+
+class TestFilteredSearch:
+    """Test cases for switching between exact scoring and filtered ANN."""
+
+    QUERY = {"text": "Học máy ứng dụng 3", "metadataFilter": {"$and": [{"faculty": "CNTT"}, {"year": 2024}]}}
+
+    def test_exact_scoring_matches_filtered_ann(self, chroma_tmp, indexed, fake_embeddings):
+        """Selective filters are scored exactly with the same hits as the Chroma query."""
+        svc = TopicsService()
+        seed(svc)
+        with patch.object(settings, 'METADATA_INDEX_KEYS', ''):
+            ann = svc.search(self.QUERY, top_k=3, threshold=0.7)
+
+        with patch.object(svc.repo, 'query') as query:
+            exact = svc.search(self.QUERY, top_k=3, threshold=0.7)
+
+        query.assert_not_called()
+        assert exact == ann
+        assert svc.metadata_index_stats()["searches"]["exact"] == 1
+
+    def test_large_candidate_set_uses_filtered_ann(self, chroma_tmp, indexed, fake_embeddings):
+        """Above METADATA_EXACT_MAX_CANDIDATES the where clause goes to Chroma."""
+        svc = TopicsService()
+        seed(svc)
+
+        with patch.object(settings, 'METADATA_EXACT_MAX_CANDIDATES', 1), \
+             patch.object(svc.repo, 'query', wraps=svc.repo.query) as query:
+            svc.search(self.QUERY, top_k=3, threshold=0.7)
+
+        assert query.call_args.kwargs["where"] == self.QUERY["metadataFilter"]
+
+    def test_gate_and_range_use_candidates(self, chroma_tmp, indexed, fake_embeddings):
+        """Gate and range modes agree with the full search under a filter."""
+        svc = TopicsService()
+        seed(svc)
+
+        full = svc.search(self.QUERY, top_k=3, threshold=0.5)
+        gate = svc.search({**self.QUERY, "gate": True}, top_k=3, threshold=0.5)
+        ranged = svc.search({**self.QUERY, "range": True}, top_k=3, threshold=0.5)
+
+        assert gate["similarity"] == full["hits"][0]["similarity"]
+        assert ranged["hits"] == [h for h in full["hits"] if h["similarity"] >= 0.5]
+        assert ranged["rounds"] == 0
+
+    def test_index_follows_writes(self, chroma_tmp, indexed, fake_embeddings):
+        """Upserts, metadata patches and deletes keep the candidates current."""
+        svc = TopicsService()
+        seed(svc)
+        svc.metadata_index_stats()  # build from Chroma
+
+        svc.update_metadata([{"topicVersionId": "TV1", "metadata": {"faculty": "Luật"}}])
+        svc.delete_topics(topic_version_ids=["TV3"])
+        svc.upsert_one({"topicId": "T99", "topicVersionId": "TV99", "title": "Luật đất đai",
+                        "metadata": {"faculty": "Luật"}})
+
+        res = svc.search({"text": "Luật", "metadataFilter": {"faculty": "Luật"}}, top_k=5, threshold=0.7)
+        assert sorted(h["topicVersionId"] for h in res["hits"]) == ["TV1", "TV99"]
+        empty = svc.search({"text": "Luật", "metadataFilter": {"faculty": "Y"}}, top_k=5, threshold=0.7)
+        assert empty["hits"] == [] and empty["passed"] is True
+
+    def test_stats_route(self, client, chroma_tmp, fake_embeddings):
+        """GET /chroma/metadata-index reports whether the index is enabled."""
+        assert json.loads(client.get('/chroma/metadata-index').data) == {"enabled": False}
+
+        with patch.object(settings, 'METADATA_INDEX_KEYS', 'faculty'):
+            data = json.loads(client.get('/chroma/metadata-index').data)
+
+        assert data["enabled"] is True
+        assert data["keys"] == ["faculty"]
+
+class TestChangesFromOtherProcesses:
+    """Test cases for catching up with writes recorded by other processes."""
+
+    def test_own_writes_do_not_trigger_a_reload(self, chroma_tmp, indexed, fake_embeddings):
+        """Writes applied in this process advance the index generation directly."""
+        svc = TopicsService()
+        seed(svc)
+        index = get_metadata_index(svc.repo)
+
+        svc.update_metadata([{"topicVersionId": "TV1", "metadata": {"faculty": "Luật"}}])
+
+        assert index.generation == IndexChangeLog().latest()
+
+    def test_foreign_writes_are_reloaded(self, chroma_tmp, indexed, fake_embeddings):
+        """Only the logged IDs are re-read from Chroma, including deletes."""
+        svc = TopicsService()
+        seed(svc)
+        index = get_metadata_index(svc.repo)
+
+        # Another process writes straight to Chroma and records the change
+        svc.repo.update_metadatas(["tv:TV2"], [{"faculty": "Luật"}])
+        svc.repo.delete(ids=["tv:TV4"])
+        IndexChangeLog().append(["tv:TV2", "tv:TV4"])
+
+        with patch.object(svc.repo, 'iter_metadatas', side_effect=AssertionError("full rebuild")):
+            index = get_metadata_index(svc.repo)
+
+        assert index.ids_of(index.candidates({"faculty": "Luật"})) == ["tv:TV2"]
+        assert "tv:TV4" not in index.ids_of(index.candidates({"faculty": "CNTT"}))
+        assert index.generation == IndexChangeLog().latest()
+
+    def test_pruned_log_rebuilds(self, chroma_tmp, indexed, fake_embeddings):
+        """An index older than the retained log is rebuilt from Chroma."""
+        svc = TopicsService()
+        seed(svc)
+        index = get_metadata_index(svc.repo)
+
+        svc.repo.update_metadatas(["tv:TV2"], [{"faculty": "Luật"}])
+        with patch.object(settings, 'INDEX_CHANGE_LOG_RETENTION', 1):
+            log = IndexChangeLog()
+            log.append(["tv:TV2"])
+            log.append(["tv:TV5"])
+
+        index = get_metadata_index(svc.repo)
+
+        assert index.ids_of(index.candidates({"faculty": "Luật"})) == ["tv:TV2"]
+
+    def test_no_log_writes_without_in_memory_indexes(self, chroma_tmp, tmp_path, fake_embeddings):
+        """With every in-memory index disabled, writes do not touch the change log."""
+        with patch.object(settings, 'STATE_DB_PATH', str(tmp_path / "state.db")), \
+             patch.object(settings, 'COMPACTION_AUTO', False), \
+             patch.object(settings, 'METADATA_INDEX_KEYS', ''), \
+             patch.object(settings, 'LEXICAL_FAST_PATH', False), \
+             patch.object(settings, 'BM25_ENABLED', False):
+            svc = TopicsService()
+            seed(svc)
+            svc.update_metadata([{"topicVersionId": "TV1", "metadata": {"faculty": "Luật"}}])
+
+            assert IndexChangeLog().latest() == 0
+
+    def test_enabled_index_logs_writes_before_it_is_built(self, chroma_tmp, indexed, fake_embeddings):
+        """A process that has not built its index yet still records writes for the others."""
+        seed(TopicsService())
+
+        assert IndexChangeLog().latest() > 0
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# Unit tests for partitioned parallel indexing with a lease table
+import pytest
+import json
+from unittest.mock import patch, MagicMock
+from dupliapp.repositories.partition_repository import PartitionRepository
+from dupliapp.repositories.state_repository import IndexStateRepository
+from dupliapp.repositories.topic_repository import get_topic_repository
+from dupliapp.services.index_service import WATERMARK_KEY
+from dupliapp.services.partition_service import PartitionService
+
+@pytest.fixture
+def mock_topics_service():
+    """Replace the vector-store writer used by partition workers."""
+    with patch('dupliapp.services.partition_service.TopicsService') as mock:
+        service_instance = MagicMock()
+        service_instance.upsert_records.side_effect = lambda records, **kwargs: {"upserted": len(records), "embedded": len(records), "skipped": 0}
+        mock.return_value = service_instance
+        yield service_instance
+
+def upserted_version_ids(service):
+    return sorted(it.topic_version_id for call in service.upsert_records.call_args_list for it in call.args[0])
+
+class TestPartitionBounds:
+    """Test cases for splitting the topic space."""
+
+    def test_bounds_are_balanced(self, sqlite_topic_source):
+        """NTILE splits topics into contiguous ranges of near-equal size."""
+        bounds = get_topic_repository().partition_bounds(2)
+
+        assert bounds == [{"fromTopicId": 1, "toTopicId": 3, "topicCount": 3},
+                          {"fromTopicId": 4, "toTopicId": 5, "topicCount": 2}]
+
+    def test_fetch_page_within_range(self, sqlite_topic_source):
+        """Pages stay inside the partition's TopicId range."""
+        repo = get_topic_repository()
+
+        assert [r.topic_id for r in repo.fetch_page(None, 10, min_topic_id=2, max_topic_id=4)] == [2, 3, 4]
+        assert [r.topic_id for r in repo.fetch_page(2, 10, min_topic_id=2, max_topic_id=4)] == [3, 4]
+
+class TestPartitionService:
+    """Test cases for planning, leasing and coordinating partitions."""
+
+    def test_single_worker_completes_run(self, sqlite_topic_source, mock_topics_service):
+        """One worker drains every partition and the coordinator sets the watermark."""
+        svc = PartitionService()
+        run_id = svc.plan(partitions=3, page_size=1)["runId"]
+
+        result = svc.work(run_id)
+        progress = svc.progress(run_id)
+
+        assert result["partitionsCompleted"] == 3
+        assert progress["status"] == "completed"
+        assert progress["processed"] == 5
+        assert progress["percent"] == 100.0
+        assert upserted_version_ids(mock_topics_service) == [1, 2, 3, 4, 5]
+        assert IndexStateRepository().get(WATERMARK_KEY) == 5
+
+    def test_parallel_workers_split_the_work(self, sqlite_topic_source, mock_topics_service):
+        """Concurrent workers never index the same partition twice."""
+        svc = PartitionService()
+        run_id = svc.plan(partitions=4, page_size=2)["runId"]
+
+        for handle in svc.start_workers(run_id, 3):
+            handle.join(10)
+
+        assert svc.progress(run_id)["status"] == "completed"
+        assert upserted_version_ids(mock_topics_service) == [1, 2, 3, 4, 5]
+
+    def test_expired_lease_is_reclaimed(self, sqlite_topic_source, mock_topics_service):
+        """A crashed worker's partition is picked up where it stopped."""
+        svc = PartitionService(lease_seconds=-1)
+        run_id = svc.plan(partitions=1, page_size=2)["runId"]
+
+        # Worker "dead" claims the partition, writes one page and then stops renewing
+        repo = PartitionRepository()
+        part = repo.claim(run_id, "dead", lease_seconds=-1)
+        assert repo.renew(run_id, part["partition_no"], "dead", -1, last_topic_id=2, processed=2, embedded=2)
+
+        svc.work(run_id, owner="alive")
+
+        assert upserted_version_ids(mock_topics_service) == [3, 4, 5]
+        assert svc.progress(run_id)["processed"] == 5
+        assert not repo.renew(run_id, part["partition_no"], "dead", 60, 2, 2, 2)
+
+    def test_failing_partition_is_retried_then_failed(self, sqlite_topic_source, mock_topics_service):
+        """Errors release the partition for retry until max attempts are used up."""
+        mock_topics_service.upsert_records.side_effect = RuntimeError("embedding failed")
+        svc = PartitionService(max_attempts=2)
+        run_id = svc.plan(partitions=1)["runId"]
+
+        svc.work(run_id)
+        progress = svc.progress(run_id)
+
+        assert mock_topics_service.upsert_records.call_count == 2
+        assert progress["status"] == "failed"
+        assert progress["errors"] == [{"partition": 0, "error": "embedding failed"}]
+        assert IndexStateRepository().get(WATERMARK_KEY) is None
+
+    def test_force_reaches_every_worker(self, sqlite_topic_source, mock_topics_service):
+        """A forced run makes workers bypass the unchanged-content skip."""
+        svc = PartitionService()
+        run_id = svc.plan(partitions=2, page_size=2, force=True)["runId"]
+
+        svc.work(run_id)
+
+        assert svc.progress(run_id)["force"] is True
+        calls = mock_topics_service.upsert_records.call_args_list
+        assert calls and all(call.kwargs["force"] is True for call in calls)
+
+    def test_runs_default_to_skipping_unchanged(self, sqlite_topic_source, mock_topics_service):
+        """Without force workers keep the content-hash skip."""
+        svc = PartitionService()
+        svc.work(svc.plan(partitions=1)["runId"])
+
+        assert all(call.kwargs["force"] is False for call in mock_topics_service.upsert_records.call_args_list)
+
+    def test_progress_without_run(self, sqlite_topic_source):
+        """Progress is reported before any partitioned run exists."""
+        assert PartitionService().progress() == {"status": "none", "percent": 0.0}
+
+class TestPartitionRoutes:
+    """Test cases for the /index/partitions endpoints."""
+
+    def test_start_partitioned_reindex(self, client):
+        """The endpoint plans a run and starts local workers."""
+        with patch('dupliapp.routes.index.PartitionService') as mock:
+            mock.return_value.plan.return_value = {"runId": "r1", "status": "running"}
+
+            response = client.post('/index/partitions',
+                                   data=json.dumps({"partitions": 4, "workers": 2}),
+                                   content_type='application/json')
+
+        assert response.status_code == 202
+        mock.return_value.plan.assert_called_once_with(partitions=4, page_size=None, force=False)
+        mock.return_value.start_workers.assert_called_once_with("r1", 2)
+
+    def test_add_workers_to_unknown_run(self, client):
+        """Joining a run that does not exist is a 404."""
+        response = client.post('/index/partitions/missing/workers',
+                               data=json.dumps({"workers": 1}),
+                               content_type='application/json')
+
+        assert response.status_code == 404
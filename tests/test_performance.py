@@ -64,7 +64,7 @@ class TestAPIPerformance:
             ]
         }
         
-        mock_topic_service.upsert_many.return_value = 100
+        mock_topic_service.upsert_many.return_value = {"upserted": 100, "embedded": 100, "skipped": 0}
         
         start_time = time.time()
         response = client.post('/topics/bulk-upsert',
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# Unit tests for the shared SQL connection pool (SQLite stand-in)
+import pytest
+import sqlite3
+import threading
+import time
+from dupliapp.repositories.sql_pool import ConnectionPool, PoolTimeoutError
+from dupliapp.repositories.topic_repository import get_topic_repository
+
+@pytest.fixture
+def sqlite_pool(tmp_path):
+    """Pool of SQLite connections that counts how many were opened."""
+    path = str(tmp_path / "pool.db")
+
+    def connect():
+        return sqlite3.connect(path, check_same_thread=False)
+
+    pool = ConnectionPool(connect, max_size=2, max_lifetime=60, acquire_timeout=0.2, health_check_after=0)
+    yield pool
+    pool.close()
+
+class TestConnectionPool:
+    """Test cases for ConnectionPool."""
+
+    def test_connection_is_reused(self, sqlite_pool):
+        """Releasing and acquiring again hands back the same connection."""
+        with sqlite_pool.connection() as first:
+            pass
+        with sqlite_pool.connection() as second:
+            pass
+
+        assert first is second
+        assert sqlite_pool.stats()["created"] == 1
+
+    def test_pool_is_bounded(self, sqlite_pool):
+        """A third concurrent acquire times out instead of opening a new connection."""
+        a = sqlite_pool.acquire()
+        b = sqlite_pool.acquire()
+
+        with pytest.raises(PoolTimeoutError):
+            sqlite_pool.acquire()
+
+        sqlite_pool.release(a)
+        sqlite_pool.release(b)
+        assert sqlite_pool.stats()["size"] == 2
+
+    def test_waiter_gets_released_connection(self, sqlite_pool):
+        """A blocked acquire is woken up when another thread releases."""
+        a = sqlite_pool.acquire()
+        b = sqlite_pool.acquire()
+        got = []
+
+        waiter = threading.Thread(target=lambda: got.append(sqlite_pool.acquire(timeout=2)))
+        waiter.start()
+        sqlite_pool.release(a)
+        waiter.join(2)
+
+        assert got == [a]
+        sqlite_pool.release(b)
+        sqlite_pool.release(a)
+
+    def test_broken_connection_is_replaced(self, sqlite_pool):
+        """An idle connection failing the health check is discarded."""
+        with sqlite_pool.connection() as conn:
+            pass
+        conn.close()
+
+        with sqlite_pool.connection() as fresh:
+            assert fresh.execute("SELECT 1").fetchone() == (1,)
+
+        assert fresh is not conn
+        assert sqlite_pool.stats()["discarded"] == 1
+
+    def test_expired_connection_is_replaced(self, sqlite_pool):
+        """Connections older than max_lifetime are closed instead of reused."""
+        sqlite_pool.max_lifetime = 0.001
+        with sqlite_pool.connection() as first:
+            pass
+        time.sleep(0.01)
+        with sqlite_pool.connection() as second:
+            pass
+
+        assert first is not second
+        assert sqlite_pool.stats()["created"] == 2
+
+    def test_connection_released_on_error(self, sqlite_pool):
+        """A failing query still returns the connection to the pool."""
+        with pytest.raises(sqlite3.OperationalError):
+            with sqlite_pool.connection() as conn:
+                conn.execute("SELECT * FROM missing_table")
+
+        assert sqlite_pool.stats()["inUse"] == 0
+
+class TestRepositoryUsesPool:
+    """Test cases for the topic repository sharing pooled connections."""
+
+    def test_repositories_share_one_connection(self, sqlite_topic_source):
+        """Separate repository instances reuse the pooled connection."""
+        first = get_topic_repository()
+        first.fetch_latest()
+        second = get_topic_repository()
+        second.fetch_page(None, 2)
+        second.source_stats()
+
+        assert first.pool is second.pool
+        assert second.pool.stats()["created"] == 1
+        assert second.pool.stats()["inUse"] == 0
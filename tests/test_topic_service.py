@@ -0,0 +1,481 @@
+# -*- coding: utf-8 -*-
+# Unit tests for TopicsService write paths against a temporary local Chroma
+import pytest
+import gzip
+import io
+import json
+from unittest.mock import patch
+from dupliapp.config import settings
+from dupliapp.services.topic_service import TopicsService, CONTENT_HASH_KEY, EMBEDDING_MODEL_KEY, EMBEDDING_DIM_KEY
+from dupliapp.utils.topic_files import iter_ndjson_batches
+
+def make_item(i, **overrides):
+    item = {
+        "topicId": f"T{i:03d}",
+        "topicVersionId": f"TV{i:03d}",
+        "title": f"Đề tài số {i}",
+        "description": f"Mô tả chi tiết cho đề tài số {i}",
+    }
+    item.update(overrides)
+    return item
+
+def counts(res):
+    return {k: res[k] for k in ("upserted", "embedded", "skipped")}
+
+def embedded_texts(mock):
+    return [t for call in mock.call_args_list for t in call.args[0]]
+
+class TestContentHashSkipping:
+    """Test cases for skipping re-embedding of unchanged topics."""
+
+    def test_first_upsert_embeds_everything(self, chroma_tmp, fake_embeddings):
+        """New topics are embedded and store a content hash."""
+        svc = TopicsService()
+        res = svc.upsert_many([make_item(1), make_item(2)])
+
+        assert counts(res) == {"upserted": 2, "embedded": 2, "skipped": 0}
+        meta = svc.repo.get_metadatas(["tv:TV001"])["tv:TV001"]
+        assert meta[CONTENT_HASH_KEY] == TopicsService.content_hash(TopicsService.compose_topic_text(make_item(1)))
+
+    def test_chroma_write_timings_are_reported(self, chroma_tmp, fake_embeddings):
+        """Writes report per-chunk Chroma timings; a fully skipped upsert writes nothing."""
+        svc = TopicsService()
+        with patch.object(settings, 'CHROMA_MAX_BATCH_SIZE', 2):
+            res = svc.upsert_many([make_item(i) for i in range(1, 4)])
+            again = svc.upsert_many([make_item(i) for i in range(1, 4)])
+
+        assert [c["size"] for c in res["chromaWrite"]["chunks"]] == [2, 1]
+        assert res["chromaWrite"]["maxBatchSize"] == 2
+        assert "chromaWrite" not in again
+
+    def test_identical_reupsert_is_skipped(self, chroma_tmp, fake_embeddings):
+        """Re-sending identical items does not call the model."""
+        svc = TopicsService()
+        svc.upsert_many([make_item(1), make_item(2)])
+        fake_embeddings.reset_mock()
+
+        res = svc.upsert_many([make_item(1), make_item(2)])
+
+        assert res == {"upserted": 2, "embedded": 0, "skipped": 2}
+        fake_embeddings.assert_not_called()
+
+    def test_only_changed_items_are_embedded(self, chroma_tmp, fake_embeddings):
+        """A changed text is embedded while unchanged siblings are skipped."""
+        svc = TopicsService()
+        svc.upsert_many([make_item(1), make_item(2)])
+        fake_embeddings.reset_mock()
+
+        changed = make_item(2, title="Tiêu đề mới")
+        res = svc.upsert_many([make_item(1), changed])
+
+        assert counts(res) == {"upserted": 2, "embedded": 1, "skipped": 1}
+        assert embedded_texts(fake_embeddings) == [TopicsService.compose_topic_text(changed)]
+
+    def test_metadata_change_reuses_stored_vector(self, chroma_tmp, fake_embeddings):
+        """Changed extra metadata with identical text is written without embedding."""
+        svc = TopicsService()
+        svc.upsert_one(make_item(1, metadata={"status": "draft"}))
+        fake_embeddings.reset_mock()
+
+        res = svc.upsert_one(make_item(1, metadata={"status": "approved"}))
+
+        assert counts(res) == {"upserted": 1, "embedded": 0, "skipped": 1}
+        fake_embeddings.assert_not_called()
+        assert svc.repo.get_metadatas(["tv:TV001"])["tv:TV001"]["status"] == "approved"
+        assert svc.repo.count() == 1
+
+    def test_model_identity_is_stored(self, chroma_tmp, fake_embeddings):
+        """Each vector records the embedding model and its dimension."""
+        svc = TopicsService()
+        svc.upsert_one(make_item(1))
+
+        meta = svc.repo.get_metadatas(["tv:TV001"])["tv:TV001"]
+        assert meta[EMBEDDING_MODEL_KEY] == f"{settings.EMBEDDING_TYPE}:{settings.MODEL_NAME}"
+        assert meta[EMBEDDING_DIM_KEY] == 64
+
+    def test_model_change_reembeds_unchanged_text(self, chroma_tmp, fake_embeddings):
+        """Switching MODEL_NAME re-embeds topics whose content hash did not change."""
+        svc = TopicsService()
+        svc.upsert_many([make_item(1), make_item(2)])
+        fake_embeddings.reset_mock()
+
+        with patch.object(settings, "MODEL_NAME", "other-model"):
+            res = svc.upsert_many([make_item(1), make_item(2)])
+            again = svc.upsert_many([make_item(1), make_item(2)])
+
+        assert counts(res) == {"upserted": 2, "embedded": 2, "skipped": 0}
+        assert again["embedded"] == 0
+        assert svc.repo.get_metadatas(["tv:TV001"])["tv:TV001"][EMBEDDING_MODEL_KEY].endswith(":other-model")
+
+    def test_legacy_vector_without_model_is_reembedded(self, chroma_tmp, fake_embeddings):
+        """Vectors written before the model was recorded are not trusted."""
+        svc = TopicsService()
+        svc.upsert_one(make_item(1))
+        meta = svc.repo.get_metadatas(["tv:TV001"])["tv:TV001"]
+        svc.repo.col.update(ids=["tv:TV001"], metadatas=[{**meta, EMBEDDING_MODEL_KEY: None}])
+        fake_embeddings.reset_mock()
+
+        assert svc.upsert_one(make_item(1))["embedded"] == 1
+
+    def test_force_reembeds_everything(self, chroma_tmp, fake_embeddings):
+        """force bypasses the content-hash skip."""
+        svc = TopicsService()
+        svc.upsert_many([make_item(1), make_item(2)])
+        fake_embeddings.reset_mock()
+
+        res = svc.upsert_many([make_item(1), make_item(2)], force=True)
+
+        assert counts(res) == {"upserted": 2, "embedded": 2, "skipped": 0}
+        assert len(embedded_texts(fake_embeddings)) == 2
+
+    def test_upsert_one_requires_ids(self, chroma_tmp, fake_embeddings):
+        """Validation still happens before any store access."""
+        with pytest.raises(ValueError):
+            TopicsService().upsert_one({"title": "Thiếu id"})
+
+class TestColumnarUpsert:
+    """Test cases for upserting column batches."""
+
+    def test_upsert_columns_matches_row_upsert(self, chroma_tmp, fake_embeddings):
+        """Column batches store the same ids, documents and hashes as upsert_many."""
+        svc = TopicsService()
+        columns = {
+            "TopicId": [1, 2],
+            "TopicVersionId": [11, 12],
+            "Title": ["Đề tài 1", "Đề tài 2"],
+            "Description": ["Mô tả 1", None],
+        }
+
+        res = svc.upsert_columns(columns)
+
+        assert counts(res) == {"upserted": 2, "embedded": 2, "skipped": 0}
+        meta = svc.repo.get_metadatas(["tv:12"])["tv:12"]
+        assert meta["Title"] == "Đề tài 2"
+        assert meta[CONTENT_HASH_KEY] == TopicsService.content_hash("Đề tài 2")
+
+        again = svc.upsert_many([{"topicId": 1, "topicVersionId": 11, "title": "Đề tài 1", "description": "Mô tả 1"}])
+        assert again["embedded"] == 0
+
+def ndjson(items):
+    return "".join(json.dumps(it, ensure_ascii=False) + "\n" for it in items).encode("utf-8")
+
+class TestStreamedBulkUpsert:
+    """Test cases for chunked NDJSON bulk upserts."""
+
+    def test_chunks_are_written_one_by_one(self, chroma_tmp, fake_embeddings):
+        """Each chunk is embedded separately and reported."""
+        body = io.BytesIO(ndjson([make_item(i) for i in range(5)]))
+
+        res = TopicsService().upsert_chunks(iter_ndjson_batches(body, 2))
+
+        assert fake_embeddings.call_count == 3
+        assert res["upserted"] == 5
+        assert res["received"] == 5
+        assert [c["items"] for c in res["chunks"]] == [2, 2, 1]
+        assert res["failedChunks"] == 0
+
+    def test_invalid_chunk_does_not_stop_the_stream(self, chroma_tmp, fake_embeddings):
+        """A chunk with a missing id is reported and later chunks are still written."""
+        items = [make_item(0), make_item(1), {"title": "no ids"}, make_item(3), make_item(4)]
+
+        res = TopicsService().upsert_chunks(iter_ndjson_batches(io.BytesIO(ndjson(items)), 2))
+
+        assert res["upserted"] == 3
+        assert res["chunks"][1]["error"] == "Each item must include topicId and topicVersionId"
+        assert res["failedChunks"] == 1
+
+    def test_malformed_line_stops_reading(self, chroma_tmp, fake_embeddings):
+        """Unparseable input ends the stream with an error for the current chunk."""
+        body = io.BytesIO(ndjson([make_item(0), make_item(1)]) + b"{broken\n" + ndjson([make_item(3)]))
+
+        res = TopicsService().upsert_chunks(iter_ndjson_batches(body, 2))
+
+        assert res["upserted"] == 2
+        assert res["chunks"][-1] == {"chunk": 2, "items": 0, "error": res["chunks"][-1]["error"]}
+        assert "line:3" in res["chunks"][-1]["error"]
+
+    @pytest.mark.parametrize("body", [
+        b"not gzip at all",
+        gzip.compress(ndjson([make_item(i) for i in range(3)]))[:-12],
+        gzip.compress(ndjson([make_item(i) for i in range(3)]))[:10] + b"\xff" * 20,
+    ], ids=["bad-header", "truncated", "corrupt-deflate"])
+    def test_corrupt_gzip_is_reported_on_the_current_chunk(self, chroma_tmp, fake_embeddings, body):
+        """Bad headers, truncated streams and corrupt deflate data end the stream with an error."""
+        res = TopicsService().upsert_chunks(iter_ndjson_batches(io.BytesIO(body), 2, compressed=True))
+
+        assert res["failedChunks"] == 1
+        assert res["chunks"][-1]["items"] == 0
+        assert res["chunks"][-1]["error"]
+
+    def test_corrupt_gzip_route(self, client, chroma_tmp, fake_embeddings):
+        """The endpoint returns the partial report instead of a 500."""
+        body = gzip.compress(ndjson([make_item(i) for i in range(3)]))[:-12]
+        response = client.post('/topics/bulk-upsert?chunkSize=2', data=body,
+                               content_type='application/x-ndjson', headers={"Content-Encoding": "gzip"})
+
+        assert response.status_code == 200
+        assert json.loads(response.data)["failedChunks"] == 1
+
+    def test_ndjson_route(self, client, chroma_tmp, fake_embeddings):
+        """application/x-ndjson bodies are streamed in chunkSize batches."""
+        response = client.post('/topics/bulk-upsert?chunkSize=2',
+                               data=ndjson([make_item(i) for i in range(3)]),
+                               content_type='application/x-ndjson')
+
+        data = json.loads(response.data)
+        assert response.status_code == 200
+        assert data["upserted"] == 3
+        assert len(data["chunks"]) == 2
+
+    def test_gzip_ndjson_route(self, client, chroma_tmp, fake_embeddings):
+        """Content-Encoding: gzip bodies are decompressed while reading."""
+        response = client.post('/topics/bulk-upsert',
+                               data=gzip.compress(ndjson([make_item(i) for i in range(3)])),
+                               content_type='application/x-ndjson',
+                               headers={"Content-Encoding": "gzip"})
+
+        assert response.status_code == 200
+        assert json.loads(response.data)["upserted"] == 3
+
+class TestMetadataPatch:
+    """Test cases for metadata-only updates."""
+
+    def test_patch_does_not_embed(self, chroma_tmp, fake_embeddings):
+        """Metadata is merged in place and the stored vector is kept."""
+        svc = TopicsService()
+        svc.upsert_many([make_item(1, metadata={"status": "draft", "faculty": "CNTT"}), make_item(2)])
+        before = svc.repo.get_embeddings(["tv:TV001"])["tv:TV001"]
+        fake_embeddings.reset_mock()
+
+        res = svc.update_metadata([{"topicVersionId": "TV001", "metadata": {"status": "approved"}},
+                                   {"topicVersionId": "TV404", "metadata": {"status": "approved"}}])
+
+        fake_embeddings.assert_not_called()
+        assert res == {"updated": 1, "notFound": ["TV404"]}
+        meta = svc.repo.get_metadatas(["tv:TV001"])["tv:TV001"]
+        assert meta["status"] == "approved"
+        assert meta["faculty"] == "CNTT"
+        assert meta["Title"] == "Đề tài số 1"
+        assert (svc.repo.get_embeddings(["tv:TV001"])["tv:TV001"] == before).all()
+
+    def test_null_removes_key(self, chroma_tmp, fake_embeddings):
+        """A null value deletes the metadata key."""
+        svc = TopicsService()
+        svc.upsert_one(make_item(1, metadata={"supervisor": "TS. A"}))
+
+        svc.update_metadata([{"topicVersionId": "TV001", "metadata": {"supervisor": None}}])
+
+        assert "supervisor" not in svc.repo.get_metadatas(["tv:TV001"])["tv:TV001"]
+
+    def test_content_keys_are_rejected(self, chroma_tmp, fake_embeddings):
+        """Fields that were embedded cannot be changed without re-embedding."""
+        with pytest.raises(ValueError, match="cannot be patched"):
+            TopicsService().update_metadata([{"topicVersionId": "TV001", "metadata": {"Title": "Khác"}}])
+
+    def test_patch_route_applies_one_patch_to_many_ids(self, client, chroma_tmp, fake_embeddings):
+        """topicVersionIds + metadata updates every listed version."""
+        TopicsService().upsert_many([make_item(1), make_item(2)])
+
+        response = client.patch('/topics/metadata',
+                                 data=json.dumps({"topicVersionIds": ["TV001", "TV002"], "metadata": {"status": "rejected"}}),
+                                 content_type='application/json')
+
+        assert response.status_code == 200
+        assert json.loads(response.data) == {"updated": 2, "notFound": []}
+        metas = TopicsService().repo.get_metadatas(["tv:TV001", "tv:TV002"])
+        assert {m["status"] for m in metas.values()} == {"rejected"}
+
+    def test_patch_route_rejects_missing_metadata(self, client, chroma_tmp):
+        """An empty metadata object is a 400."""
+        response = client.patch('/topics/metadata',
+                                data=json.dumps({"topicVersionId": "TV001", "metadata": {}}),
+                                content_type='application/json')
+
+        assert response.status_code == 400
+
+    def test_patch_route_rejects_non_list_ids(self, client, chroma_tmp, fake_embeddings):
+        """A string topicVersionIds is a 400 instead of being patched character by character."""
+        TopicsService().upsert_many([make_item(1)])
+
+        response = client.patch('/topics/metadata',
+                                data=json.dumps({"topicVersionIds": "TV001", "metadata": {"status": "rejected"}}),
+                                content_type='application/json')
+
+        assert response.status_code == 400
+        assert json.loads(response.data) == {"error": "Provide a non-empty 'topicVersionIds' array"}
+        assert "status" not in TopicsService().repo.get_metadatas(["tv:TV001"])["tv:TV001"]
+
+class TestSimilarByStoredVector:
+    """Test cases for similar-topic lookups that reuse the stored embedding."""
+
+    def seed(self, svc):
+        svc.upsert_many([
+            make_item(1, topicId="T1", title="Học máy trong y tế", description="Dự đoán bệnh bằng học máy"),
+            make_item(2, topicId="T1", title="Học máy trong y tế bản 2", description="Dự đoán bệnh bằng học máy"),
+            make_item(3, topicId="T3", title="Học máy trong y tế", description="Dự đoán bệnh bằng học sâu"),
+            make_item(4, topicId="T4", title="Quản lý thư viện", description="Ứng dụng web cho thư viện"),
+        ])
+
+    def test_no_embedding_and_siblings_excluded(self, chroma_tmp, fake_embeddings):
+        """The topic and its other versions are excluded, and the model is not called."""
+        svc = TopicsService()
+        self.seed(svc)
+        fake_embeddings.reset_mock()
+
+        res = svc.similar("TV001", top_k=5, threshold=0.8)
+
+        fake_embeddings.assert_not_called()
+        assert res["topicId"] == "T1"
+        assert [h["topicVersionId"] for h in res["hits"]] == ["TV003", "TV004"]
+        assert [h["topicVersionId"] for h in res["duplicates"]] == ["TV003"]
+
+    def test_unknown_version(self, chroma_tmp, fake_embeddings):
+        """An id that is not indexed returns None."""
+        assert TopicsService().similar("TV999", top_k=3, threshold=0.7) is None
+
+    def test_siblings_excluded_across_topic_id_types(self, chroma_tmp, fake_embeddings):
+        """Versions stored with TopicId 7 (SQL) and "7" (API) are the same topic."""
+        svc = TopicsService()
+        self.seed(svc)
+        svc.upsert_many([make_item(5, topicId=7, title="Học máy trong y tế", description="Dự đoán bệnh bằng học máy"),
+                         make_item(6, topicId="7", title="Học máy trong y tế", description="Dự đoán bệnh bằng học máy")])
+
+        res = svc.similar("TV005", top_k=2, threshold=0.8)
+
+        ids = [h["topicVersionId"] for h in res["hits"]]
+        assert "TV006" not in ids and "TV005" not in ids
+        assert len(ids) == 2
+
+    def test_falls_back_when_siblings_fill_the_overfetch(self, chroma_tmp, fake_embeddings):
+        """When every over-fetched hit is a sibling, a filtered query still finds other topics."""
+        svc = TopicsService()
+        self.seed(svc)
+        svc.upsert_many([make_item(10 + i, topicId=7, title="Học máy trong y tế", description="Dự đoán bệnh bằng học máy")
+                         for i in range(3)] + [make_item(20, topicId="7", title="Học máy trong y tế",
+                                                         description="Dự đoán bệnh bằng học máy")])
+
+        with patch.object(settings, 'KNN_OVERFETCH', 1), \
+             patch.object(svc.repo, 'query', wraps=svc.repo.query) as query:
+            res = svc.similar("TV010", top_k=2, threshold=0.8)
+
+        ids = [h["topicVersionId"] for h in res["hits"]]
+        assert query.call_count == 2
+        assert len(ids) == 2
+        assert not {"TV011", "TV012", "TV020"} & set(ids)
+
+    def test_similar_route(self, client, chroma_tmp, fake_embeddings):
+        """GET /topics/{id}/similar returns hits, and 404 for unknown ids."""
+        self.seed(TopicsService())
+
+        response = client.get('/topics/TV004/similar?topK=2&threshold=0.99')
+
+        data = json.loads(response.data)
+        assert response.status_code == 200
+        assert len(data["hits"]) == 2
+        assert data["duplicates"] == []
+        assert client.get('/topics/TV999/similar').status_code == 404
+
+class TestSearchGate:
+    """Test cases for the threshold-gate search mode."""
+
+    def seed(self, svc):
+        svc.upsert_many([
+            make_item(1, title="Học máy trong y tế", description="Dự đoán bệnh bằng học máy"),
+            make_item(2, title="Quản lý thư viện", description="Ứng dụng web cho thư viện"),
+        ])
+
+    @pytest.mark.parametrize("threshold", [0.5, 0.9, 1.0])
+    def test_gate_agrees_with_full_search(self, chroma_tmp, fake_embeddings, threshold):
+        """The gate decision and nearest similarity match the full search."""
+        svc = TopicsService()
+        self.seed(svc)
+        query = {"title": "Học máy trong y tế", "description": "Dự đoán bệnh bằng học sâu"}
+
+        full = svc.search(query, top_k=3, threshold=threshold)
+        gate = svc.search({**query, "gate": True}, top_k=3, threshold=threshold)
+
+        assert gate == {"passed": full["passed"], "similarity": full["hits"][0]["similarity"],
+                        "threshold": threshold}
+
+    def test_gate_reads_distances_only(self, chroma_tmp, fake_embeddings):
+        """The gate asks Chroma for one result without metadata or documents."""
+        svc = TopicsService()
+        self.seed(svc)
+
+        with patch.object(svc.repo.col, 'query', wraps=svc.repo.col.query) as query:
+            svc.search({"text": "Quản lý thư viện", "gate": True}, top_k=3, threshold=0.7)
+
+        assert query.call_args.kwargs["n_results"] == 1
+        assert query.call_args.kwargs["include"] == ["distances"]
+
+    def test_gate_on_empty_index_passes(self, chroma_tmp, fake_embeddings):
+        """With nothing indexed there is no nearest topic and the check passes."""
+        res = TopicsService().search({"text": "Bất kỳ", "gate": True}, top_k=3, threshold=0.7)
+
+        assert res == {"passed": True, "similarity": None, "threshold": 0.7}
+
+    def test_gate_respects_metadata_filter(self, chroma_tmp, fake_embeddings):
+        """Filtered-out topics do not block the submission."""
+        svc = TopicsService()
+        svc.upsert_one(make_item(1, title="Học máy", metadata={"year": 2023}))
+
+        res = svc.search({"text": "Học máy", "gate": True, "metadataFilter": {"year": 2024}},
+                         top_k=3, threshold=0.7)
+
+        assert res["passed"] is True
+
+class TestRangeSearch:
+    """Test cases for returning every hit above the threshold."""
+
+    def seed(self, svc, copies=25):
+        svc.upsert_many([make_item(i, title="Học máy trong y tế", description="Dự đoán bệnh") for i in range(copies)]
+                        + [make_item(100 + i, title=f"Quản lý thư viện {i}", description="Ứng dụng web")
+                           for i in range(5)])
+
+    def test_returns_all_hits_above_threshold(self, chroma_tmp, fake_embeddings):
+        """Candidates are deepened until the similarity drops below the threshold."""
+        svc = TopicsService()
+        self.seed(svc)
+
+        with patch.object(settings, 'RANGE_SEARCH_INITIAL_K', 4):
+            res = svc.search({"text": "Học máy trong y tế\n\nDự đoán bệnh", "range": True}, top_k=3, threshold=0.9)
+
+        assert len(res["hits"]) == 25
+        assert res["passed"] is False
+        assert res["truncated"] is False
+        assert res["rounds"] == 4  # 4 -> 8 -> 16 -> 32 candidates
+        assert res["suggestions"] == res["hits"][:3]
+
+    def test_cap_marks_result_truncated(self, chroma_tmp, fake_embeddings):
+        """maxResults bounds the work and is reported as truncated."""
+        svc = TopicsService()
+        self.seed(svc)
+
+        res = svc.search({"text": "Học máy trong y tế\n\nDự đoán bệnh", "range": True, "maxResults": 10},
+                         top_k=3, threshold=0.9)
+
+        assert len(res["hits"]) == 10
+        assert res["truncated"] is True
+
+    def test_no_duplicates_still_returns_suggestions(self, chroma_tmp, fake_embeddings):
+        """Below-threshold neighbours are offered as suggestions only."""
+        svc = TopicsService()
+        self.seed(svc, copies=2)
+
+        res = svc.search({"text": "Quản lý thư viện 1\n\nỨng dụng web", "range": True}, top_k=3, threshold=1.01)
+
+        assert res["passed"] is True
+        assert res["hits"] == []
+        assert len(res["suggestions"]) == 3
+        assert res["rounds"] == 1
+
+    def test_stops_when_collection_is_exhausted(self, chroma_tmp, fake_embeddings):
+        """A collection smaller than the candidate count needs a single round."""
+        svc = TopicsService()
+        self.seed(svc, copies=3)
+
+        res = svc.search({"text": "Học máy trong y tế\n\nDự đoán bệnh", "range": True}, top_k=3, threshold=0.0)
+
+        assert len(res["hits"]) == 8
+        assert res["rounds"] == 1
+        assert res["truncated"] is False
@@ -9,6 +9,8 @@ class TestTopicsRoutes:
     
     def test_upsert_single_topic_success(self, client, mock_topic_service, sample_topic_data):
         """Test successful upsert of a single topic."""
+        mock_topic_service.upsert_one.return_value = {"upserted": 1, "embedded": 1, "skipped": 0}
+        
         response = client.post('/topics/upsert', 
                              data=json.dumps(sample_topic_data),
                              content_type='application/json')
@@ -47,7 +49,7 @@ class TestTopicsRoutes:
     
     def test_bulk_upsert_success(self, client, mock_topic_service, sample_bulk_data):
         """Test successful bulk upsert of multiple topics."""
-        mock_topic_service.upsert_many.return_value = 2
+        mock_topic_service.upsert_many.return_value = {"upserted": 2, "embedded": 2, "skipped": 0}
         
         response = client.post('/topics/bulk-upsert',
                              data=json.dumps(sample_bulk_data),
@@ -79,7 +81,7 @@ class TestTopicsRoutes:
                 "title": "Đề tài 1"
             }
         ]
-        mock_topic_service.upsert_many.return_value = 1
+        mock_topic_service.upsert_many.return_value = {"upserted": 1, "embedded": 1, "skipped": 0}
         
         response = client.post('/topics/bulk-upsert',
                              data=json.dumps(direct_array),
@@ -3,6 +3,8 @@
 import pytest
 from unittest.mock import patch, MagicMock
 from dupliapp.services.topic_service import TopicsService
+from dupliapp.utils.topic_record import TopicRecord
+from dupliapp.utils.text_normalize import normalize_text, tokenize, fold_diacritics, search_terms
 
 class TestTopicServiceUtils:
     """Test cases for utility functions in TopicService."""
@@ -83,4 +85,90 @@ class TestTopicServiceUtils:
         
         result = TopicsService.compose_topic_text(topic_data)
         
-        assert result == "" 
\ No newline at end of file
+        assert result == "" 
+class TestColumnarCompose:
+    """Test cases for column-wise topic text composition."""
+
+    ROWS = [
+        {"Title": "Đề tài A", "Description": "Mô tả A", "Objectives": None,
+         "Methodology": "   ", "ExpectedOutcomes": "Kết quả A", "Requirements": ""},
+        {"Title": "", "Description": None, "Objectives": None,
+         "Methodology": None, "ExpectedOutcomes": None, "Requirements": None},
+        {"Title": "Đề tài C", "Description": "Mô tả C", "Objectives": "Mục tiêu C",
+         "Methodology": "Phương pháp C", "ExpectedOutcomes": "Kết quả C", "Requirements": "Yêu cầu C"},
+    ]
+
+    def columns(self):
+        return {k: [r[k] for r in self.ROWS] for k in self.ROWS[0]}
+
+    def test_matches_row_wise_compose(self):
+        """Column-wise composition equals compose_topic_text per row."""
+        expected = [TopicsService.compose_topic_text(r) for r in self.ROWS]
+
+        assert TopicsService.compose_topic_texts(self.columns()) == expected
+
+    def test_arrow_columns_match_row_wise_compose(self):
+        """The pyarrow.compute path gives the same texts."""
+        pa = pytest.importorskip("pyarrow")
+        columns = {k: pa.array(v, pa.string()) for k, v in self.columns().items()}
+        expected = [TopicsService.compose_topic_text(r) for r in self.ROWS]
+
+        assert TopicsService.compose_topic_texts(columns) == expected
+
+class TestTopicRecord:
+    """Test cases for the compact topic record used on the indexing path."""
+
+    ITEM = {"topicId": 7, "topicVersionId": 70, "title": "Đề tài 7", "description": "Mô tả 7",
+            "requirements": "   ", "metadata": {"Faculty": "CNTT"}}
+
+    def test_record_has_no_instance_dict(self):
+        """Records are slot-based, so no per-row dict is allocated."""
+        record = TopicRecord.from_item(self.ITEM)
+
+        assert not hasattr(record, "__dict__")
+
+    def test_text_matches_compose_topic_text(self):
+        """The record composes the same text as the dict-based helper."""
+        assert TopicRecord.from_item(self.ITEM).text() == TopicsService.compose_topic_text(self.ITEM)
+
+    def test_meta_matches_build_meta(self):
+        """Metadata built at the store boundary equals the API item path."""
+        record = TopicRecord.from_item(self.ITEM)
+        expected = TopicsService._build_meta(self.ITEM, record.text())
+        expected.pop("ContentHash")
+
+        assert record.to_meta() == expected
+        assert record.to_meta()["Faculty"] == "CNTT"
+
+    def test_from_columns(self):
+        """Column batches become one record per row; missing columns are empty strings."""
+        records = TopicRecord.from_columns({"TopicId": [1, 2], "TopicVersionId": [10, 20], "Title": ["A", None]})
+
+        assert [(r.topic_id, r.topic_version_id, r.title, r.requirements) for r in records] == \
+            [(1, 10, "A", ""), (2, 20, None, "")]
+
+class TestTextNormalize:
+    """Test cases for the Vietnamese text normalization used by lexical indexes."""
+
+    def test_case_punctuation_and_whitespace(self):
+        """Case, punctuation and line breaks do not change the normalized form."""
+        assert normalize_text("Ứng Dụng  Machine-Learning,\n\nTrong Y Tế!") == "ứng dụng machine learning trong y tế"
+
+    def test_unicode_forms_are_unified(self):
+        """Precomposed and combining diacritics normalize to the same string."""
+        import unicodedata
+        assert normalize_text(unicodedata.normalize("NFD", "Quản lý")) == normalize_text("Quản lý")
+
+    def test_tokenize(self):
+        """Tokens are the normalized syllables."""
+        assert tokenize("Học máy; y tế") == ["học", "máy", "y", "tế"]
+
+    def test_fold_diacritics(self):
+        """Tone marks and đ are removed so unaccented queries match."""
+        assert fold_diacritics("Đánh giá học máy") == "Danh gia hoc may"
+        assert tokenize("Học máy", fold=True) == ["hoc", "may"]
+
+    def test_search_terms_include_syllable_bigrams(self):
+        """Adjacent syllables are kept as compound-word terms."""
+        assert search_terms("Học máy: Đánh giá") == [
+            "hoc", "may", "danh", "gia", "hoc_may", "may_danh", "danh_gia"]
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+# Unit tests for the write-behind group-commit buffer
+import pytest
+import json
+import os
+import threading
+import time
+from unittest.mock import patch
+from dupliapp.services.write_behind import WriteBehindBuffer
+
+def topic(i, title=None):
+    return {"topicId": f"T{i}", "topicVersionId": f"TV{i}", "title": title or f"Đề tài {i}"}
+
+class Recorder:
+    """Collects the batches written by the buffer."""
+
+    def __init__(self, fail=False, poison=None):
+        self.batches = []
+        self.fail = fail
+        self.poison = poison
+
+    def __call__(self, items):
+        if self.fail:
+            raise RuntimeError("chroma unavailable")
+        if any(it["topicVersionId"] == self.poison for it in items):
+            raise ValueError(f"bad item {self.poison}")
+        self.batches.append(items)
+        return {"upserted": len(items), "embedded": len(items), "skipped": 0}
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+@pytest.fixture
+def log_path(tmp_path):
+    return str(tmp_path / "wb.log")
+
+class TestWriteBehindBuffer:
+    """Test cases for durable enqueue and group commit."""
+
+    def test_flush_by_size(self, log_path):
+        """Reaching max_batch writes one grouped batch."""
+        rec = Recorder()
+        buf = WriteBehindBuffer(log_path, max_batch=3, max_delay=60, write_fn=rec)
+        try:
+            for i in range(3):
+                buf.enqueue(topic(i))
+
+            assert wait_until(lambda: buf.stats()["flushes"] == 1)
+            assert [len(b) for b in rec.batches] == [3]
+        finally:
+            buf.close()
+
+    def test_flush_by_time(self, log_path):
+        """A lone item is written once it has waited max_delay."""
+        rec = Recorder()
+        buf = WriteBehindBuffer(log_path, max_batch=100, max_delay=0.05, write_fn=rec)
+        try:
+            buf.enqueue(topic(1))
+
+            assert wait_until(lambda: len(rec.batches) == 1)
+        finally:
+            buf.close()
+
+    def test_wait_visible(self, log_path):
+        """wait_visible forces a flush and returns once the item is written."""
+        rec = Recorder()
+        buf = WriteBehindBuffer(log_path, max_batch=100, max_delay=60, write_fn=rec)
+        try:
+            seq = buf.enqueue(topic(1))
+
+            assert buf.wait_visible(seq, timeout=5)
+            assert rec.batches == [[topic(1)]]
+            assert buf.stats()["committedSeq"] == seq
+        finally:
+            buf.close()
+
+    def test_latest_version_wins_within_batch(self, log_path):
+        """Repeated saves of the same topic version are written once, with the last content."""
+        rec = Recorder()
+        buf = WriteBehindBuffer(log_path, max_batch=100, max_delay=60, write_fn=rec)
+        try:
+            buf.enqueue(topic(1, "v1"))
+            buf.enqueue(topic(1, "v2"))
+            buf.flush(timeout=5)
+
+            assert rec.batches == [[topic(1, "v2")]]
+        finally:
+            buf.close()
+
+    def test_log_is_truncated_after_commit(self, log_path):
+        """Once everything is written the append-only log is emptied."""
+        buf = WriteBehindBuffer(log_path, max_batch=100, max_delay=60, write_fn=Recorder())
+        try:
+            buf.enqueue(topic(1))
+            assert os.path.getsize(log_path) > 0
+            buf.flush(timeout=5)
+
+            assert os.path.getsize(log_path) == 0
+        finally:
+            buf.close()
+
+    def test_close_flushes_pending(self, log_path):
+        """Shutdown writes every acknowledged item."""
+        rec = Recorder()
+        buf = WriteBehindBuffer(log_path, max_batch=100, max_delay=60, write_fn=rec)
+        buf.enqueue(topic(1))
+        buf.enqueue(topic(2))
+
+        buf.close()
+
+        assert [it["topicId"] for b in rec.batches for it in b] == ["T1", "T2"]
+
+    def test_unwritten_items_are_replayed_after_restart(self, log_path):
+        """Items acknowledged but never written survive a restart."""
+        failing = WriteBehindBuffer(log_path, max_batch=100, max_delay=60, write_fn=Recorder(fail=True))
+        failing.enqueue(topic(1))
+        failing.enqueue(topic(2))
+        assert not failing.flush(timeout=0.2)
+        assert failing.stats()["lastError"] == "chroma unavailable"
+        failing.close(timeout=1)
+
+        rec = Recorder()
+        restarted = WriteBehindBuffer(log_path, max_batch=100, max_delay=60, write_fn=rec)
+        try:
+            assert restarted.stats()["pending"] == 2
+            assert restarted.flush(timeout=5)
+            assert [it["topicId"] for b in rec.batches for it in b] == ["T1", "T2"]
+            assert restarted.enqueue(topic(3)) == 3
+        finally:
+            restarted.close()
+
+class TestFailedItems:
+    """Test cases for per-item retries and the dead-letter file."""
+
+    def test_bad_item_does_not_block_the_batch(self, log_path):
+        """After a failed batch the other items are written one by one and become visible."""
+        rec = Recorder(poison="TV2")
+        buf = WriteBehindBuffer(log_path, max_batch=100, max_delay=60, write_fn=rec, max_attempts=100)
+        try:
+            seqs = [buf.enqueue(topic(i)) for i in range(1, 4)]
+
+            assert buf.wait_visible(seqs[2], timeout=5)
+            assert [b for b in rec.batches] == [[topic(1)], [topic(3)]]
+            stats = buf.stats()
+            assert stats["pending"] == 1
+            assert stats["retrying"] == 1
+            assert stats["committedSeq"] == seqs[0]
+            assert stats["lastError"] == "bad item TV2"
+        finally:
+            buf.close(timeout=1)
+
+    def test_item_is_dead_lettered_after_max_attempts(self, log_path):
+        """A persistently failing item is moved to <log>.dead and the log is released."""
+        buf = WriteBehindBuffer(log_path, max_batch=100, max_delay=0.01, write_fn=Recorder(poison="TV2"),
+                                max_attempts=2)
+        try:
+            buf.enqueue(topic(1))
+            seq = buf.enqueue(topic(2))
+
+            assert buf.flush(timeout=5)
+            assert not buf.wait_visible(seq, timeout=1)
+            stats = buf.stats()
+            assert stats["pending"] == 0
+            assert stats["deadLettered"] == 1
+            assert stats["committedSeq"] == seq
+            with open(buf.dead_letter_path, encoding="utf-8") as f:
+                dead = [json.loads(line) for line in f]
+            assert dead == [{"seq": seq, "item": topic(2), "error": "bad item TV2", "attempts": 2}]
+            assert os.path.getsize(log_path) == 0
+        finally:
+            buf.close()
+
+    def test_dead_letters_are_not_replayed(self, log_path):
+        """Items already in the dead-letter file are skipped when an uncommitted log is recovered."""
+        with open(log_path, "w", encoding="utf-8") as f:
+            for i in (1, 2):
+                f.write(json.dumps({"seq": i, "item": topic(i)}) + "\n")
+        with open(log_path + ".dead", "w", encoding="utf-8") as f:
+            f.write(json.dumps({"seq": 2, "item": topic(2), "error": "x", "attempts": 5}) + "\n")
+
+        buf = WriteBehindBuffer(log_path, max_batch=100, max_delay=60, write_fn=Recorder())
+        try:
+            assert buf.stats()["pending"] == 1
+        finally:
+            buf.close()
+
+class TestLogOwnership:
+    """Test cases for one log per process."""
+
+    def test_second_buffer_uses_its_own_log(self, log_path):
+        """A log held by a live buffer is never shared; the next free slot is used."""
+        first = WriteBehindBuffer(log_path, max_batch=100, max_delay=60, write_fn=Recorder())
+        second = WriteBehindBuffer(log_path, max_batch=100, max_delay=60, write_fn=Recorder())
+        try:
+            assert first.log_path == log_path
+            assert second.log_path == log_path + ".1"
+            first.enqueue(topic(1))
+            second.enqueue(topic(2))
+
+            assert first.stats()["lastSeq"] == second.stats()["lastSeq"] == 1
+        finally:
+            first.close()
+            second.close()
+
+    def test_released_log_is_reclaimed(self, log_path):
+        """After close the first slot is free again and its unwritten items are recovered."""
+        failing = WriteBehindBuffer(log_path, max_batch=100, max_delay=60, write_fn=Recorder(fail=True))
+        failing.enqueue(topic(1))
+        failing.close(timeout=1)
+
+        buf = WriteBehindBuffer(log_path, max_batch=100, max_delay=60, write_fn=Recorder())
+        try:
+            assert buf.log_path == log_path
+            assert buf.stats()["pending"] == 1
+        finally:
+            buf.close()
+
+    def test_slot_stays_held_while_flusher_is_running(self, log_path):
+        """close() that times out mid-flush keeps the log open and the slot locked."""
+        release = threading.Event()
+        def slow_write(items):
+            release.wait(5)
+            return {"upserted": len(items), "embedded": len(items), "skipped": 0}
+
+        buf = WriteBehindBuffer(log_path, max_batch=1, max_delay=60, write_fn=slow_write)
+        try:
+            buf.enqueue(topic(1))
+            buf.close(timeout=0.1)
+
+            assert not buf._log.closed
+            other = WriteBehindBuffer(log_path, max_batch=100, max_delay=60, write_fn=Recorder())
+            try:
+                assert other.log_path == log_path + ".1"
+            finally:
+                other.close()
+        finally:
+            release.set()
+            buf._thread.join(5)
+            buf._log.close()
+            buf._lock_conn.close()
+
+class TestWriteBehindRoute:
+    """Test cases for /topics/upsert in write-behind mode."""
+
+    def test_upsert_is_acknowledged_after_enqueue(self, client, log_path):
+        """The endpoint returns 202 with the log sequence number."""
+        buf = WriteBehindBuffer(log_path, max_batch=100, max_delay=60, write_fn=Recorder())
+        try:
+            with patch('dupliapp.routes.topics.get_write_behind', return_value=buf):
+                response = client.post('/topics/upsert', data=json.dumps(topic(1)),
+                                       content_type='application/json')
+
+            assert response.status_code == 202
+            assert json.loads(response.data) == {"queued": 1, "seq": 1, "visible": False}
+        finally:
+            buf.close()
+
+    def test_upsert_can_wait_for_visibility(self, client, log_path):
+        """?wait=true returns only after the item has been written."""
+        rec = Recorder()
+        buf = WriteBehindBuffer(log_path, max_batch=100, max_delay=60, write_fn=rec)
+        try:
+            with patch('dupliapp.routes.topics.get_write_behind', return_value=buf):
+                response = client.post('/topics/upsert?wait=true', data=json.dumps(topic(1)),
+                                       content_type='application/json')
+
+            assert response.status_code == 200
+            assert json.loads(response.data)["visible"] is True
+            assert rec.batches == [[topic(1)]]
+        finally:
+            buf.close()